@@ -3,6 +3,7 @@
 from .vast_manager import VastManager
 from .remote_executor import RemoteExecutor
 from .model_evaluator import ModelEvaluator
+from .model_client import ModelClient, ModelServerError, start_remote_server
 
-__all__ = ['VastManager', 'RemoteExecutor', 'ModelEvaluator']
+__all__ = ['VastManager', 'RemoteExecutor', 'ModelEvaluator', 'ModelClient', 'ModelServerError', 'start_remote_server']
 
@@ -0,0 +1,223 @@
+"""
+Client for the warm-model server (remote_scripts/model_server.py).
+
+The server listens on the remote instance's loopback interface only.
+With a RemoteExecutor, requests travel through its SSH connection as
+forwarded TCP channels, so no port has to be opened on the instance;
+without one, the client connects directly (e.g. to a server started
+locally, or through an ``ssh -L`` tunnel).
+"""
+import http.client
+import json
+import shlex
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+# Default port of the model server (see remote_scripts/model_server.py)
+DEFAULT_PORT = 8765
+
+
+class ModelServerError(RuntimeError):
+    """The model server rejected a request or could not be reached."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class ModelClient:
+    """Sends generate/score requests to a running model server."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        executor=None,
+        timeout: int = 600
+    ):
+        """
+        Initialize model client.
+
+        Args:
+            host: Server address (as seen from the remote instance when
+                `executor` is given)
+            port: Server port
+            executor: Connected RemoteExecutor to tunnel requests through
+                (None: connect directly)
+            timeout: Timeout in seconds for one request
+        """
+        self.host = host
+        self.port = port
+        self.executor = executor
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        if self.executor is not None:
+            # A preset socket makes HTTPConnection skip its own connect()
+            try:
+                channel = self.executor.open_channel(self.port, self.host)
+            except Exception as e:
+                raise ModelServerError(f"model server at {self.host}:{self.port} unreachable: {e}") from e
+            channel.settimeout(self.timeout)
+            connection.sock = channel
+        return connection
+
+    def request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Send one request and return the decoded JSON response.
+
+        Raises:
+            ModelServerError: If the server is unreachable or returns an error
+        """
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            connection = self._connection()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                status, data = response.status, response.read()
+            finally:
+                connection.close()
+        except (OSError, http.client.HTTPException) as e:
+            raise ModelServerError(f"model server at {self.host}:{self.port} unreachable: {e}") from e
+
+        try:
+            result = json.loads(data)
+        except json.JSONDecodeError:
+            raise ModelServerError(f"invalid response from model server (HTTP {status})", status)
+        if status != 200:
+            raise ModelServerError(result.get('error', f"HTTP {status}"), status)
+        return result
+
+    def health(self) -> Dict[str, Any]:
+        """Server status and loaded models."""
+        return self.request('GET', '/health')
+
+    def is_alive(self) -> bool:
+        """Whether the server answers health checks."""
+        try:
+            self.health()
+            return True
+        except ModelServerError:
+            return False
+
+    def wait_until_ready(self, timeout: float = 600, interval: float = 1.0) -> bool:
+        """
+        Poll the server until it answers (preloading models can take minutes).
+
+        Returns:
+            True if the server is up, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.is_alive():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def load(self, model: str, quantize: Optional[str] = None, device: Optional[str] = None) -> Dict[str, Any]:
+        """Load a model (a no-op if it is already resident)."""
+        payload = {'model': model}
+        if quantize:
+            payload['quantize'] = quantize
+        if device:
+            payload['device'] = device
+        return self.request('POST', '/load', payload)
+
+    def unload(self, model: str) -> bool:
+        """Free a model; returns whether it was loaded."""
+        return self.request('POST', '/unload', {'model': model})['unloaded']
+
+    def generate(
+        self,
+        model: str,
+        prompts: Union[str, Sequence[str]],
+        max_new_tokens: int = 64
+    ) -> Dict[str, Any]:
+        """
+        Greedy continuations of one prompt or a batch of prompts.
+
+        Returns:
+            Dict with texts (one continuation per prompt), output_tokens,
+            seconds and ttft_seconds
+        """
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        return self.request('POST', '/generate', {
+            'model': model, 'prompts': list(prompts), 'max_new_tokens': max_new_tokens,
+        })
+
+    def score(
+        self,
+        model: str,
+        texts: Union[str, Sequence[str]],
+        max_length: int = 512,
+        max_tokens: int = 2048
+    ) -> Dict[str, Any]:
+        """
+        Perplexity of one text or a list of texts.
+
+        Returns:
+            Dict with perplexity, total_tokens, texts (tokens, loss and
+            perplexity of each text) and seconds
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        return self.request('POST', '/score', {
+            'model': model, 'texts': list(texts), 'max_length': max_length, 'max_tokens': max_tokens,
+        })
+
+    def shutdown(self):
+        """Stop the server."""
+        self.request('POST', '/shutdown', {})
+
+
+def start_remote_server(
+    executor,
+    remote_scripts_dir: str,
+    port: int = DEFAULT_PORT,
+    preload: List[str] = (),
+    quantize: Optional[str] = None,
+    log_path: str = "/tmp/model_server.log",
+    timeout: float = 600
+) -> ModelClient:
+    """
+    Start model_server.py in the background on the remote instance, unless one is already running.
+
+    Args:
+        executor: Connected RemoteExecutor
+        remote_scripts_dir: Remote directory holding the uploaded remote_scripts
+        port: Port for the server
+        preload: Models to load before the server accepts requests
+        quantize: Quantization mode for the server's models
+        log_path: Remote file receiving the server's output
+        timeout: Seconds to wait for the server (including preloading)
+
+    Returns:
+        ModelClient for the server
+
+    Raises:
+        ModelServerError: If the server does not come up in time
+    """
+    client = ModelClient(port=port, executor=executor)
+    if client.is_alive():
+        print(f"[OK] Model server already running on port {port}")
+        return client
+
+    args = f"--port {port}"
+    if preload:
+        args += " --preload " + " ".join(shlex.quote(name) for name in preload)
+    if quantize:
+        args += f" --quantize {shlex.quote(quantize)}"
+    quoted_log = shlex.quote(log_path)
+    executor.execute_command(
+        f"cd {shlex.quote(remote_scripts_dir)} && nohup python3 model_server.py {args} > {quoted_log} 2>&1 &"
+    )
+    if not client.wait_until_ready(timeout=timeout):
+        log, _, _ = executor.execute_command(f"tail -n 20 {quoted_log}")
+        raise ModelServerError(f"model server did not start within {timeout:.0f}s:\n{log or ''}")
+    print(f"[OK] Model server running on port {port}")
+    return client
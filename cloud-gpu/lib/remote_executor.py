@@ -3,9 +3,10 @@ Remote execution utilities for SSH/SCP operations.
 
 Handles file upload and command execution on remote instances.
 """
+import json
 import os
 import stat
-from typing import Optional, Tuple, Dict
+from typing import Any, Callable, Optional, Tuple, Dict
 from pathlib import Path
 
 try:
@@ -13,6 +14,29 @@ try:
 except ImportError:
     raise ImportError("paramiko not installed. Install with: pip install paramiko")
 
+# Prefix of the JSON lines remote scripts print with --report (see remote_scripts/report.py)
+REPORT_PREFIX = "[REPORT] "
+
+
+def parse_report_line(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a [REPORT] line printed by a remote script.
+    
+    Args:
+        line: One line of the script's output
+        
+    Returns:
+        The report event ('progress' or 'summary') as a dict, or None if
+        the line is not a report line
+    """
+    line = line.strip()
+    if not line.startswith(REPORT_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(REPORT_PREFIX):])
+    except json.JSONDecodeError:
+        return None
+
 
 class RemoteExecutor:
     """Handles remote execution via SSH and file transfer via SCP."""
@@ -150,6 +174,69 @@ class RemoteExecutor:
         except Exception as e:
             return None, str(e), 1
     
+    def execute_command_streaming(
+        self,
+        command: str,
+        on_line: Callable[[str], None],
+        timeout: Optional[int] = None
+    ) -> Tuple[Optional[str], Optional[str], int]:
+        """
+        Execute a command on remote host, handing each output line to a callback as it arrives.
+        
+        Use parse_report_line in `on_line` to follow the progress of a
+        script run with --report.
+        
+        Args:
+            command: Command to execute
+            on_line: Called with every stdout line (without the newline)
+            timeout: Timeout in seconds for each read (uses connection timeout if None)
+            
+        Returns:
+            Tuple of (stdout, stderr, exit_status), as from execute_command
+        """
+        if not self._ssh_client:
+            if not self.connect():
+                return None, "Connection failed", 1
+        
+        try:
+            timeout_val = timeout if timeout is not None else self.timeout
+            # Unbuffered python, so lines arrive while the script runs
+            stdin, stdout, stderr = self._ssh_client.exec_command(
+                f"PYTHONUNBUFFERED=1 {command}", timeout=timeout_val
+            )
+            lines = []
+            for line in stdout:
+                line = line.rstrip('\r\n')
+                lines.append(line)
+                on_line(line)
+            exit_status = stdout.channel.recv_exit_status()
+            error = stderr.read().decode('utf-8', errors='ignore')
+            return '\n'.join(lines), error, exit_status
+            
+        except Exception as e:
+            return None, str(e), 1
+    
+    def open_channel(self, remote_port: int, remote_host: str = "127.0.0.1"):
+        """
+        Open a TCP connection from the remote host to one of its ports, through SSH.
+        
+        Used to reach services that listen on the instance's loopback
+        interface only (see model_client.py).
+        
+        Args:
+            remote_port: Port to connect to
+            remote_host: Host to connect to, as seen from the remote host
+            
+        Returns:
+            Socket-like paramiko channel
+        """
+        if not self._ssh_client:
+            if not self.connect():
+                raise ConnectionError(f"SSH connection to {self.host} failed")
+        return self._ssh_client.get_transport().open_channel(
+            'direct-tcpip', (remote_host, remote_port), ('127.0.0.1', 0)
+        )
+    
     def upload_file(
         self,
         local_path: str,
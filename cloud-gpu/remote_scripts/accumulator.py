@@ -0,0 +1,77 @@
+"""
+Running loss totals kept on the device.
+
+Reading a loss back with ``.item()`` after every batch forces the host to
+wait for the device, so the next batch cannot be queued while the current
+one runs. `LossAccumulator` keeps each batch's summed token NLL and the
+token counts as device tensors and only copies them to the host when
+`totals()` is called (at checkpoints and at the end of a run).
+
+Per-batch loss sums are kept individually and folded into the Python
+total in batch order, so the result is bit-identical to adding
+``loss.item()`` after every batch.
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+
+from checkpoint import TOTALS
+
+Count = Union[int, torch.Tensor]
+
+
+class LossAccumulator:
+    """Summed NLL and token counts of a scoring loop, synchronized lazily."""
+
+    def __init__(self, device: str, totals: Optional[Dict[str, Any]] = None):
+        """
+        Args:
+            device: Device the counters live on
+            totals: Totals to start from (e.g. restored from a checkpoint)
+        """
+        totals = totals or {}
+        self.device = device
+        self.total_loss = float(totals.get('total_loss', 0.0))
+        self._host_counts = [int(totals.get(key, 0)) for key in TOTALS[1:]]
+        self._device_counts = torch.zeros(len(TOTALS) - 1, dtype=torch.long, device=device)
+        self._pending_losses: List[torch.Tensor] = []
+        self._pending_indices: List[Any] = []
+        self.batch_losses: List[Tuple[Any, float]] = []
+
+    def _add_count(self, slot: int, value: Count):
+        if isinstance(value, torch.Tensor):
+            self._device_counts[slot] += value.to(self._device_counts.device)
+        else:
+            self._host_counts[slot] += int(value)
+
+    def add(self, index, loss: torch.Tensor, tokens: Count, real_tokens: Count, computed_tokens: Count):
+        """
+        Record one batch without synchronizing.
+
+        Args:
+            index: Global index of the batch (kept with its loss for exact reduction)
+            loss: 0-dim tensor, summed NLL of the batch
+            tokens: Number of scored tokens
+            real_tokens: Number of non-padding tokens
+            computed_tokens: Number of tokens run through the model
+        """
+        self._pending_losses.append(loss.detach().float())
+        self._pending_indices.append(index)
+        self._add_count(0, tokens)
+        self._add_count(1, real_tokens)
+        self._add_count(2, computed_tokens)
+
+    def totals(self) -> Dict[str, Any]:
+        """Synchronize and return the running totals as Python numbers."""
+        if self._pending_losses:
+            losses = torch.stack(self._pending_losses).tolist()
+            for index, loss in zip(self._pending_indices, losses):
+                self.batch_losses.append((index, loss))
+                self.total_loss += loss
+            self._pending_losses = []
+            self._pending_indices = []
+
+        device_counts = self._device_counts.tolist()
+        self._device_counts.zero_()
+        self._host_counts = [host + dev for host, dev in zip(self._host_counts, device_counts)]
+        return dict(zip(TOTALS, [self.total_loss] + self._host_counts))
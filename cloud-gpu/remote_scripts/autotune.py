@@ -0,0 +1,388 @@
+"""
+Automatic batch size discovery with out-of-memory backoff.
+
+The largest batch size (and, if even one sample does not fit, the
+largest sequence length) is found by running a probe step and
+binary-searching around the memory estimator's prediction. Out-of-memory
+errors are caught, cached allocator memory is released, and the search
+continues below the failing size. Results are persisted per (model,
+device type, dtype, sequence length) so later runs skip the search.
+
+On CPU the search runs against a RAM budget: a probe counts as out of
+memory when the memory it adds on top of what was resident before it ran,
+plus the footprint of the loaded model, exceeds the budget. Measuring the
+increase rather than absolute RSS matters because the allocator rarely
+returns freed pages to the OS, so a large failed probe would otherwise
+make every later probe look out of memory. This makes the tuner testable
+without a GPU.
+"""
+import gc
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# The estimator lives in model-library/, which is not always uploaded
+# alongside the remote scripts
+_MODEL_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model-library')
+if os.path.isdir(_MODEL_LIBRARY):
+    sys.path.insert(0, _MODEL_LIBRARY)
+try:
+    from perplexity_requirements import estimate_memory_requirements
+except ImportError:
+    estimate_memory_requirements = None
+
+DEFAULT_AUTOTUNE_PATH = os.environ.get(
+    "AUTOTUNE_CACHE", os.path.expanduser("~/.cache/transformer-questions/autotune.json")
+)
+
+
+class OutOfMemory(MemoryError):
+    """Raised when a probe exceeds the configured memory budget."""
+
+
+def is_oom_error(exc: BaseException) -> bool:
+    """Check whether an exception means the probe ran out of memory."""
+    if isinstance(exc, MemoryError):
+        return True
+    oom_type = getattr(torch.cuda, 'OutOfMemoryError', None)
+    if oom_type is not None and isinstance(exc, oom_type):
+        return True
+    return isinstance(exc, RuntimeError) and 'out of memory' in str(exc).lower()
+
+
+def free_memory():
+    """Release memory held by dead tensors and the CUDA caching allocator."""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def memory_in_use(device: str) -> int:
+    """Resident memory on CPU, or memory held by live tensors on CUDA."""
+    if device == 'cpu':
+        return _rss_bytes()
+    return torch.cuda.memory_allocated()
+
+
+class MemoryMonitor:
+    """
+    Track peak memory of a block of code and enforce a budget.
+
+    On CUDA the allocator's peak statistics are used. On CPU resident
+    memory is sampled from a background thread; call `sample()` at points
+    where large tensors are alive to make sure the peak is seen.
+
+    `peak_bytes` is the absolute peak and `increase_bytes` the growth over
+    the memory in use on entry. The budget is checked against
+    `resident_bytes + increase_bytes`, where `resident_bytes` is the
+    footprint the block is allowed to start from (typically taken once,
+    after the model is loaded). It defaults to the memory in use on entry,
+    which makes the check one on the absolute peak.
+    """
+
+    def __init__(
+        self,
+        device: str,
+        budget_bytes: Optional[int] = None,
+        interval: float = 0.001,
+        resident_bytes: Optional[int] = None,
+    ):
+        self.device = device
+        self.budget_bytes = budget_bytes
+        self.interval = interval
+        self.resident_bytes = resident_bytes
+        self.baseline_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Record current memory use."""
+        if self.device == 'cpu':
+            self.peak_bytes = max(self.peak_bytes, _rss_bytes())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            time.sleep(self.interval)
+
+    @property
+    def increase_bytes(self) -> int:
+        """Peak memory above what was in use when the block was entered."""
+        return max(0, self.peak_bytes - self.baseline_bytes)
+
+    def __enter__(self):
+        if self.device == 'cpu':
+            self.baseline_bytes = memory_in_use(self.device)
+            self.peak_bytes = self.baseline_bytes
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        else:
+            torch.cuda.reset_peak_memory_stats()
+            self.baseline_bytes = memory_in_use(self.device)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.device == 'cpu':
+            self._stop.set()
+            self._thread.join()
+            self.sample()
+        else:
+            self.peak_bytes = torch.cuda.max_memory_allocated()
+        if exc_type is None and self.budget_bytes is not None:
+            resident = self.baseline_bytes if self.resident_bytes is None else self.resident_bytes
+            if resident + self.increase_bytes > self.budget_bytes:
+                raise OutOfMemory(
+                    f"peak memory {(resident + self.increase_bytes) / 1e9:.2f}GB "
+                    f"exceeds budget {self.budget_bytes / 1e9:.2f}GB"
+                )
+
+
+def available_host_bytes() -> int:
+    """RAM that can be allocated without swapping (MemAvailable)."""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def default_memory_budget(device: str) -> int:
+    """Memory budget in bytes: 90% of device memory, or of total RAM on CPU."""
+    if device == 'cpu':
+        if psutil is not None:
+            total = psutil.virtual_memory().total
+        else:
+            total = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    else:
+        total = torch.cuda.get_device_properties(0).total_memory
+    return int(total * 0.9)
+
+
+def estimate_initial_batch_size(model_name: str, seq_len: int, budget_bytes: int, bytes_per_param: int = 2) -> int:
+    """
+    Starting batch size predicted by perplexity_requirements.
+
+    The estimator's per-sample activation and KV memory is divided into
+    the budget left after the weights. Falls back to 1 when the estimator
+    is unavailable or does not know the model size.
+    """
+    if estimate_memory_requirements is None:
+        return 1
+    estimate = estimate_memory_requirements(model_name, batch_size=1, seq_length=seq_len)
+    if 'note' in estimate:
+        return 1
+
+    weights_gb = estimate['model_memory_fp16_gb'] if bytes_per_param <= 2 else estimate['model_memory_fp32_gb']
+    per_sample_gb = estimate['activation_memory_gb'] + estimate['kv_cache_memory_gb']
+    free_gb = budget_bytes / 1e9 - weights_gb - 2  # the estimator's fixed overhead
+    if per_sample_gb <= 0 or free_gb <= 0:
+        return 1
+    return max(1, int(free_gb / per_sample_gb))
+
+
+def _fits(probe: Callable[[int, int], None], batch_size: int, seq_len: int) -> bool:
+    """Run one probe, turning out-of-memory errors into False."""
+    try:
+        probe(batch_size, seq_len)
+        return True
+    except Exception as e:
+        if not is_oom_error(e):
+            raise
+    # Outside the except block so the traceback no longer pins the probe's tensors
+    free_memory()
+    return False
+
+
+def find_max_batch_size(
+    probe: Callable[[int, int], None],
+    seq_len: int,
+    initial: int = 1,
+    max_batch_size: int = 1024,
+) -> int:
+    """
+    Largest batch size for which `probe(batch_size, seq_len)` fits.
+
+    Grows exponentially from `initial` while probes fit (or shrinks while
+    they fail), then binary-searches between the last fitting and first
+    failing size.
+
+    Returns:
+        Largest fitting batch size, or 0 if a single sample does not fit
+    """
+    initial = max(1, min(initial, max_batch_size))
+    if _fits(probe, initial, seq_len):
+        good, bad = initial, None
+        while bad is None and good < max_batch_size:
+            candidate = min(good * 2, max_batch_size)
+            if _fits(probe, candidate, seq_len):
+                good = candidate
+            else:
+                bad = candidate
+        if bad is None:
+            return good
+    else:
+        good, bad = 0, initial
+        while bad > 1:
+            candidate = bad // 2
+            if _fits(probe, candidate, seq_len):
+                good = candidate
+                break
+            bad = candidate
+        if good == 0:
+            return 0
+
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if _fits(probe, mid, seq_len):
+            good = mid
+        else:
+            bad = mid
+    return good
+
+
+def find_max_seq_len(probe: Callable[[int, int], None], max_seq_len: int, granularity: int = 64) -> int:
+    """
+    Largest sequence length (a multiple of `granularity`) that fits at batch size 1.
+
+    Returns:
+        Largest fitting sequence length, or 0 if none fits
+    """
+    good, bad = 0, max_seq_len // granularity + 1
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if _fits(probe, 1, mid * granularity):
+            good = mid
+        else:
+            bad = mid
+    return good * granularity
+
+
+class AutotuneCache:
+    """JSON file of tuned batch sizes keyed by (model, device type, dtype, seq_len)."""
+
+    def __init__(self, path: str = DEFAULT_AUTOTUNE_PATH):
+        self.path = path
+
+    @staticmethod
+    def key(model_name: str, device_type: str, dtype: str, seq_len: int, variant: str = None) -> str:
+        key = f"{model_name}|{device_type}|{dtype}|{seq_len}"
+        return f"{key}|{variant}" if variant else key
+
+    def _read(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._read().get(key)
+
+    def put(self, key: str, result: Dict[str, Any]):
+        entries = self._read()
+        entries[key] = result
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def device_type(device: str) -> str:
+    """Name identifying the hardware, e.g. the GPU model or 'cpu'."""
+    if device == 'cpu':
+        return 'cpu'
+    return torch.cuda.get_device_name(0)
+
+
+def autotune_batch_size(
+    probe: Callable[[int, int], None],
+    model_name: str,
+    device: str,
+    dtype: str,
+    seq_len: int,
+    memory_budget_bytes: Optional[int] = None,
+    max_batch_size: int = 1024,
+    cache_path: Optional[str] = DEFAULT_AUTOTUNE_PATH,
+    variant: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Find (or recall) the largest batch size and sequence length that fit.
+
+    Args:
+        probe: `probe(batch_size, seq_len)` runs one evaluation step; it
+            should raise on out-of-memory (see MemoryMonitor for budgets)
+        model_name: Model name, used for the estimator and the cache key
+        device: 'cuda' or 'cpu'
+        dtype: Model dtype name, part of the cache key
+        seq_len: Requested sequence length
+        memory_budget_bytes: Budget the probe enforces (stored with the result)
+        max_batch_size: Upper bound for the search
+        cache_path: JSON file of previous results, or None to always search
+        variant: Extra cache key part for settings that change memory use
+            (e.g. the loss path)
+
+    Returns:
+        Dict with batch_size, seq_len, max_tokens and cached (bool)
+    """
+    cache = AutotuneCache(cache_path) if cache_path else None
+    key = AutotuneCache.key(model_name, device_type(device), dtype, seq_len, variant)
+    if cache is not None:
+        previous = cache.get(key)
+        if previous and previous.get('memory_budget_bytes') == memory_budget_bytes:
+            print(f"  [OK] Using tuned batch size {previous['batch_size']} at seq_len {previous['seq_len']}")
+            return dict(previous, cached=True)
+
+    budget = memory_budget_bytes or default_memory_budget(device)
+    initial = estimate_initial_batch_size(
+        model_name, seq_len, budget, bytes_per_param=4 if dtype == 'float32' else 2
+    )
+    print(f"  Searching batch size from estimate {initial} (seq_len {seq_len})...")
+    start = time.time()
+
+    batch_size = find_max_batch_size(probe, seq_len, initial=initial, max_batch_size=max_batch_size)
+    tuned_seq_len = seq_len
+    if batch_size == 0:
+        tuned_seq_len = find_max_seq_len(probe, seq_len)
+        batch_size = 1 if tuned_seq_len else 0
+        print(f"  [WARNING] seq_len {seq_len} does not fit; largest fitting is {tuned_seq_len}")
+    if batch_size == 0:
+        raise OutOfMemory(f"{model_name}: not even a single short sequence fits in memory")
+
+    result = {
+        'batch_size': batch_size,
+        'seq_len': tuned_seq_len,
+        'max_tokens': batch_size * tuned_seq_len,
+        'memory_budget_bytes': memory_budget_bytes,
+        'search_seconds': round(time.time() - start, 2),
+        'timestamp': time.time(),
+    }
+    if cache is not None:
+        cache.put(key, result)
+    print(f"  [OK] Tuned batch size {batch_size} at seq_len {tuned_seq_len}")
+    return dict(result, cached=False)
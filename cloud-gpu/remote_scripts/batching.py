@@ -0,0 +1,154 @@
+"""
+Token-budget batching for evaluation loops.
+
+Samples are sorted by tokenized length and grouped so that every padded
+batch stays under a fixed token budget. On datasets that mix empty lines
+with long paragraphs (e.g. wikitext) this keeps almost all computed
+tokens real instead of padding.
+"""
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch
+
+
+def build_token_budget_batches(
+    lengths: Sequence[int],
+    max_tokens: int,
+    max_batch_size: Optional[int] = None,
+) -> List[List[int]]:
+    """
+    Group sample indices into batches under a padded-token budget.
+
+    Samples are sorted longest first, so the most memory-hungry batch runs
+    first and an out-of-memory error surfaces immediately. A batch costs
+    ``len(batch) * longest_sample`` tokens once padded. A sample longer
+    than the budget on its own still gets a batch of one.
+
+    Args:
+        lengths: Tokenized length of each sample
+        max_tokens: Maximum padded tokens per batch
+        max_batch_size: Optional cap on samples per batch
+
+    Returns:
+        List of batches, each a list of indices into `lengths`
+    """
+    if max_tokens <= 0:
+        raise ValueError(f"max_tokens must be positive, got {max_tokens}")
+
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+
+    batches = []
+    current = []
+    longest = 0
+    for index in order:
+        length = lengths[index]
+        # Sorted descending, so the first sample of a batch is its longest
+        padded_len = max(longest, length)
+        full = max_batch_size is not None and len(current) >= max_batch_size
+        if current and (full or padded_len * (len(current) + 1) > max_tokens):
+            batches.append(current)
+            current = []
+            padded_len = length
+        current.append(index)
+        longest = padded_len
+    if current:
+        batches.append(current)
+    return batches
+
+
+def pad_batch(sequences: Sequence[Sequence[int]], pad_token_id: int):
+    """
+    Right-pad token sequences into model inputs.
+
+    Padding positions get attention mask 0 and label -100, so they are
+    ignored by the loss and never counted as scored tokens.
+
+    Returns:
+        Tuple of (input_ids, attention_mask, labels) tensors
+    """
+    longest = max(len(seq) for seq in sequences)
+    input_ids = torch.full((len(sequences), longest), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), longest), dtype=torch.long)
+    for row, seq in enumerate(sequences):
+        input_ids[row, :len(seq)] = torch.from_numpy(np.asarray(seq, dtype=np.int64))
+        attention_mask[row, :len(seq)] = 1
+
+    labels = input_ids.masked_fill(attention_mask == 0, -100)
+    return input_ids, attention_mask, labels
+
+
+def padding_efficiency(real_tokens: int, computed_tokens: int) -> float:
+    """Fraction of computed tokens that are real (non-padding) tokens."""
+    return real_tokens / computed_tokens if computed_tokens else 1.0
+
+
+def pack_sequences(sequences: Sequence[Sequence[int]], separator_id: int, block_size: int):
+    """
+    Concatenate sequences into one stream and cut it into fixed-size blocks.
+
+    Every non-empty sequence is followed by `separator_id` (usually EOS).
+    Alongside the token blocks, parallel blocks record the index of the
+    sequence each token came from (its segment) and its position within
+    that sequence; separators get segment -1.
+
+    Returns:
+        Tuple of (token_blocks, segment_blocks, position_blocks), lists of
+        1D tensors. All blocks have `block_size` tokens except possibly
+        the last one.
+    """
+    if block_size < 2:
+        raise ValueError(f"block_size must be at least 2, got {block_size}")
+
+    tokens = []
+    segments = []
+    positions = []
+    for index, seq in enumerate(sequences):
+        if len(seq) == 0:
+            continue
+        tokens.append(np.asarray(seq, dtype=np.int64))
+        tokens.append(np.array([separator_id], dtype=np.int64))
+        segments.append(np.full(len(seq) + 1, index, dtype=np.int64))
+        segments[-1][-1] = -1
+        positions.append(np.arange(len(seq) + 1, dtype=np.int64))
+
+    streams = [
+        torch.from_numpy(np.concatenate(parts)) if parts else torch.empty(0, dtype=torch.long)
+        for parts in (tokens, segments, positions)
+    ]
+    return tuple(list(stream.split(block_size)) for stream in streams)
+
+
+def document_attention(segment_ids: torch.Tensor, attention_mask: torch.Tensor, dtype: torch.dtype):
+    """
+    Build per-document attention for packed blocks.
+
+    Tokens only attend to earlier tokens of the same segment, and position
+    ids restart at 0 at every segment boundary, so each document is scored
+    as if it had been run on its own.
+
+    Args:
+        segment_ids: [batch, seq] segment id of each token
+        attention_mask: [batch, seq] 1 for real tokens, 0 for padding
+        dtype: Model dtype for the additive mask
+
+    Returns:
+        Tuple of (additive 4D mask [batch, 1, seq, seq], position_ids [batch, seq])
+    """
+    batch_size, seq_len = segment_ids.shape
+    # Padding gets its own segment so it never mixes with real tokens
+    segment_ids = segment_ids.masked_fill(attention_mask == 0, -2)
+
+    index = torch.arange(seq_len, device=segment_ids.device)
+    is_start = torch.ones_like(segment_ids, dtype=torch.bool)
+    is_start[:, 1:] = segment_ids[:, 1:] != segment_ids[:, :-1]
+    starts = torch.where(is_start, index, torch.zeros_like(index)).cummax(dim=-1).values
+    position_ids = index - starts
+
+    same_segment = segment_ids.unsqueeze(-1) == segment_ids.unsqueeze(-2)
+    causal = torch.ones(seq_len, seq_len, dtype=torch.bool, device=segment_ids.device).tril()
+    allowed = (same_segment & causal).unsqueeze(1)
+
+    mask = torch.zeros(batch_size, 1, seq_len, seq_len, dtype=dtype, device=segment_ids.device)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask, position_ids
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-batch loss synchronization against on-device accumulation.
+
+Runs the same perplexity scoring step on identical batches twice: once
+reading the loss and token count back with ``.item()`` after every batch
+(the old loop), and once accumulating them on the device with
+LossAccumulator and reading them back only at the end. On small models
+the forward pass is short enough that the per-step sync, which keeps the
+host from queueing the next batch while the device is busy, is a large
+share of the step time.
+
+Usage: python benchmark_accumulation.py MODEL [--batch-size 8] [--seq-len 128] [--steps 200]
+"""
+import argparse
+import time
+
+import torch
+
+from accumulator import LossAccumulator
+from calculate_perplexity import _token_nll, load_model
+
+
+def _synchronize(device: str):
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def benchmark_accumulation(
+    model,
+    device: str,
+    batch_size: int = 8,
+    seq_len: int = 128,
+    steps: int = 200,
+    warmup: int = 10,
+    loss_chunk_size: int = 1024,
+):
+    """
+    Time scoring steps with per-batch `.item()` syncs and with on-device accumulation.
+
+    Returns:
+        Dict with ms_per_step for 'item' and 'device' modes, the speedup,
+        and the loss totals of both modes (which must agree exactly)
+    """
+    generator = torch.Generator().manual_seed(0)
+    batches = [
+        torch.randint(0, model.config.vocab_size, (batch_size, seq_len), generator=generator).to(device)
+        for _ in range(min(steps, 16))
+    ]
+
+    def _step(index):
+        input_ids = batches[index % len(batches)]
+        with torch.no_grad():
+            return _token_nll(model, input_ids, loss_chunk_size, input_ids=input_ids)
+
+    def _run_item(num_steps):
+        total_loss, total_tokens = 0.0, 0
+        for index in range(num_steps):
+            nll = _step(index)
+            total_loss += nll.sum().item()
+            total_tokens += nll.numel()
+        return total_loss, total_tokens
+
+    def _run_device(num_steps):
+        accumulator = LossAccumulator(device)
+        for index in range(num_steps):
+            nll = _step(index)
+            accumulator.add(index, nll.sum(), nll.numel(), 0, 0)
+        totals = accumulator.totals()
+        return totals['total_loss'], totals['total_tokens']
+
+    results = {}
+    for mode, run in (('item', _run_item), ('device', _run_device)):
+        run(warmup)
+        _synchronize(device)
+        start = time.perf_counter()
+        totals = run(steps)
+        _synchronize(device)
+        elapsed = time.perf_counter() - start
+        results[mode] = {'ms_per_step': elapsed / steps * 1000, 'total_loss': totals[0], 'total_tokens': totals[1]}
+
+    results['speedup'] = results['item']['ms_per_step'] / results['device']['ms_per_step']
+    return results
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark sync-free loss accumulation.")
+    parser.add_argument("model_name", help="HuggingFace model name (small models show the largest gain)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Sequences per step")
+    parser.add_argument("--seq-len", type=int, default=128, help="Tokens per sequence")
+    parser.add_argument("--steps", type=int, default=200, help="Timed steps per mode")
+    parser.add_argument("--loss-chunk-size", type=int, default=1024,
+                        help="Positions per LM head chunk (0: full logits)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model, _, device = load_model(args.model_name)
+
+    print(f"\nBenchmarking {args.steps} steps of {args.batch_size}x{args.seq_len} tokens on {device}...")
+    results = benchmark_accumulation(
+        model, device,
+        batch_size=args.batch_size,
+        seq_len=args.seq_len,
+        steps=args.steps,
+        loss_chunk_size=args.loss_chunk_size,
+    )
+
+    print("\n" + "=" * 60)
+    print("Results:")
+    print(f"  .item() every step:     {results['item']['ms_per_step']:.2f} ms/step")
+    print(f"  On-device accumulation: {results['device']['ms_per_step']:.2f} ms/step")
+    print(f"  Speedup: {results['speedup']:.2f}x")
+    same = results['item']['total_loss'] == results['device']['total_loss']
+    print(f"  Totals identical: {'yes' if same else 'NO'}")
+    print("=" * 60)
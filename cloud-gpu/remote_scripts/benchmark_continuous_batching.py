@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Compare continuous batching against static batching on a mixed-length workload.
+
+Requests with random prompt lengths and random output lengths are
+generated for greedily, all arriving at once, by:
+
+- static: ``model.generate`` on left-padded batches of ``batch_size``
+  requests in arrival order; each batch runs until its longest output is
+  done, and only the tokens each request asked for are counted
+- continuous: ContinuousBatchingEngine (see continuous_batching.py) with
+  at most ``batch_size`` running sequences, and by default the same KV
+  cache memory the static batches need in the worst case
+
+Reported per mode: output tokens/s, mean request latency, decoding steps
+and peak KV cache memory. For static batching that is the padded cache of
+the largest batch (batch size times longest prompt plus longest output);
+for continuous batching it is the pools as allocated plus the largest
+per-layer copy gathered for attention. On CUDA the peak allocator memory
+above the loaded model is reported as well, which also counts the
+concatenation copies ``generate`` makes while growing its cache.
+
+Usage: python benchmark_continuous_batching.py MODEL [--requests 64] [--batch-size 8]
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+import torch
+
+from calculate_perplexity import load_model
+from continuous_batching import ContinuousBatchingEngine, blocks_needed
+
+
+def kv_bytes_per_position(model) -> int:
+    """Keys and values of one cached position across all layers."""
+    config = model.config.get_text_config()
+    heads = getattr(config, 'num_key_value_heads', None) or config.num_attention_heads
+    head_dim = getattr(config, 'head_dim', None) or config.hidden_size // config.num_attention_heads
+    return 2 * config.num_hidden_layers * heads * head_dim * model.dtype.itemsize
+
+
+def _start_memory(device: str) -> int:
+    if not device.startswith("cuda"):
+        return 0
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    return torch.cuda.memory_allocated()
+
+
+def _peak_memory(device: str, baseline: int):
+    """Peak allocator memory above `baseline`, or None off CUDA."""
+    if not device.startswith("cuda"):
+        return None
+    return torch.cuda.max_memory_allocated() - baseline
+
+
+def mixed_workload(
+    tokenizer,
+    num_requests: int,
+    prompt_lengths: Tuple[int, int] = (16, 256),
+    new_tokens: Tuple[int, int] = (16, 256),
+    seed: int = 0,
+) -> List[Tuple[List[int], int]]:
+    """
+    Random requests: (prompt token ids, tokens to generate).
+
+    Prompts are random non-special tokens; both lengths are uniform in
+    their (inclusive) ranges.
+    """
+    rng = random.Random(seed)
+    special = set(tokenizer.all_special_ids)
+    vocabulary = [token for token in range(len(tokenizer)) if token not in special]
+    return [
+        (
+            [rng.choice(vocabulary) for _ in range(rng.randint(*prompt_lengths))],
+            rng.randint(*new_tokens),
+        )
+        for _ in range(num_requests)
+    ]
+
+
+def run_static(model, requests: Sequence[Tuple[List[int], int]], device: str, batch_size: int, pad_token_id: int):
+    """
+    Generate for the requests in left-padded batches with model.generate().
+
+    Returns:
+        Dict with seconds, output_tokens, latencies (seconds per request),
+        steps (decoding steps), peak_kv_bytes and peak_memory_bytes (CUDA
+        only, else None)
+    """
+    latencies = []
+    peak_kv_tokens = 0
+    output_tokens = 0
+    baseline = _start_memory(device)
+    start = time.perf_counter()
+    for first in range(0, len(requests), batch_size):
+        batch = requests[first:first + batch_size]
+        longest = max(len(prompt) for prompt, _ in batch)
+        new_tokens = max(count for _, count in batch)
+        input_ids = torch.tensor([[pad_token_id] * (longest - len(prompt)) + prompt for prompt, _ in batch])
+        attention_mask = torch.tensor([[0] * (longest - len(prompt)) + [1] * len(prompt) for prompt, _ in batch])
+        with torch.no_grad():
+            model.generate(
+                input_ids=input_ids.to(device),
+                attention_mask=attention_mask.to(device),
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                pad_token_id=pad_token_id,
+            )
+        # Each request only wanted its own number of tokens, but waited for the whole batch
+        output_tokens += sum(count for _, count in batch)
+        latencies += [time.perf_counter() - start] * len(batch)
+        peak_kv_tokens = max(peak_kv_tokens, len(batch) * (longest + new_tokens))
+    return {
+        'seconds': time.perf_counter() - start,
+        'output_tokens': output_tokens,
+        'latencies': latencies,
+        'steps': sum(max(count for _, count in requests[i:i + batch_size])
+                     for i in range(0, len(requests), batch_size)),
+        'peak_kv_bytes': peak_kv_tokens * kv_bytes_per_position(model),
+        'peak_memory_bytes': _peak_memory(device, baseline),
+    }
+
+
+def run_continuous(
+    model,
+    requests: Sequence[Tuple[List[int], int]],
+    device: str,
+    batch_size: int,
+    num_blocks: int,
+    block_size: int,
+):
+    """
+    Generate for the requests with the continuous batching engine.
+
+    Returns:
+        Dict as from run_static, plus peak_blocks, prefills and preemptions
+    """
+    engine = ContinuousBatchingEngine(
+        model, device, num_blocks=num_blocks, block_size=block_size, max_batch_size=batch_size
+    )
+    queued = [engine.add_request(prompt, count) for prompt, count in requests]
+    baseline = _start_memory(device)
+    start = time.perf_counter()
+    engine.run()
+    seconds = time.perf_counter() - start
+    return {
+        'seconds': seconds,
+        'output_tokens': sum(len(request.output_ids) for request in queued),
+        'latencies': [request.finish_time - start for request in queued],
+        'steps': engine.stats['steps'],
+        'peak_kv_bytes': engine.cache.pool_bytes() + engine.cache.peak_gather_bytes,
+        'peak_memory_bytes': _peak_memory(device, baseline),
+        'peak_blocks': engine.stats['peak_blocks'],
+        'prefills': engine.stats['prefills'],
+        'preemptions': engine.stats['preemptions'],
+    }
+
+
+def benchmark_continuous_batching(
+    model,
+    tokenizer,
+    device: str,
+    num_requests: int = 64,
+    batch_size: int = 8,
+    prompt_lengths: Tuple[int, int] = (16, 256),
+    new_tokens: Tuple[int, int] = (16, 256),
+    block_size: int = 16,
+    num_blocks: int = None,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Run the same mixed workload with static and continuous batching.
+
+    Args:
+        num_blocks: KV cache blocks for continuous batching (default: the
+            worst-case cache of one static batch)
+
+    Returns:
+        Dict with 'static' and 'continuous' results (seconds, output_tokens,
+        tokens_per_second, mean_latency_seconds, steps, peak_kv_bytes,
+        peak_memory_bytes)
+        and the speedup in tokens/s
+    """
+    if num_blocks is None:
+        num_blocks = blocks_needed(batch_size * (prompt_lengths[1] + new_tokens[1]), block_size)
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    requests = mixed_workload(tokenizer, num_requests, prompt_lengths, new_tokens, seed)
+
+    # Warm up both paths on a few short requests
+    warmup = [(prompt[:8], 2) for prompt, _ in requests[:2]]
+    run_static(model, warmup, device, batch_size, pad_token_id)
+    run_continuous(model, warmup, device, batch_size, num_blocks, block_size)
+
+    results = {
+        'static': run_static(model, requests, device, batch_size, pad_token_id),
+        'continuous': run_continuous(model, requests, device, batch_size, num_blocks, block_size),
+    }
+    for result in results.values():
+        latencies = result.pop('latencies')
+        result['tokens_per_second'] = result['output_tokens'] / result['seconds']
+        result['mean_latency_seconds'] = sum(latencies) / len(latencies)
+    results['speedup'] = results['continuous']['tokens_per_second'] / results['static']['tokens_per_second']
+    results['num_blocks'] = num_blocks
+    return results
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Compare continuous batching against static batching.")
+    parser.add_argument("model_name", help="HuggingFace model name")
+    parser.add_argument("--requests", type=int, default=64, help="Requests in the workload")
+    parser.add_argument("--batch-size", type=int, default=8, help="Static batch size / maximum running sequences")
+    parser.add_argument("--prompt-lengths", type=int, nargs=2, default=[16, 256], metavar=("MIN", "MAX"),
+                        help="Range of prompt lengths in tokens")
+    parser.add_argument("--new-tokens", type=int, nargs=2, default=[16, 256], metavar=("MIN", "MAX"),
+                        help="Range of tokens generated per request")
+    parser.add_argument("--block-size", type=int, default=16, help="Positions per KV cache block")
+    parser.add_argument("--num-blocks", type=int, default=None,
+                        help="KV cache blocks (default: worst-case cache of one static batch)")
+    parser.add_argument("--seed", type=int, default=0, help="Workload random seed")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model, tokenizer, device = load_model(args.model_name)
+
+    print(f"\nBenchmarking {args.requests} requests, batch size {args.batch_size}...")
+    results = benchmark_continuous_batching(
+        model, tokenizer, device,
+        num_requests=args.requests,
+        batch_size=args.batch_size,
+        prompt_lengths=tuple(args.prompt_lengths),
+        new_tokens=tuple(args.new_tokens),
+        block_size=args.block_size,
+        num_blocks=args.num_blocks,
+        seed=args.seed,
+    )
+
+    print("\n" + "=" * 60)
+    print(f"Results ({results['num_blocks']} blocks of {args.block_size} positions):")
+    print(f"  {'mode':<11} {'tokens/s':>9} {'latency':>9} {'steps':>6} {'peak KV':>9} {'peak mem':>9}")
+    for mode in ('static', 'continuous'):
+        result = results[mode]
+        memory = result['peak_memory_bytes']
+        memory = f"{memory / 1e6:>7.1f}MB" if memory is not None else f"{'-':>9}"
+        print(f"  {mode:<11} {result['tokens_per_second']:>9.1f} {result['mean_latency_seconds']:>8.2f}s "
+              f"{result['steps']:>6} {result['peak_kv_bytes'] / 1e6:>7.1f}MB {memory}")
+    print(f"  Preemptions: {results['continuous']['preemptions']}")
+    print(f"  Speedup: {results['speedup']:.2f}x")
+    print("=" * 60)
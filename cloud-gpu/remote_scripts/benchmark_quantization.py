@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Compare quantized CPU inference against the fp32 baseline.
+
+Scores the same tokenized dataset with the fp32 model and with each
+quantization mode (see quantization.py), and times greedy decoding of a
+short prompt. For every mode it reports the weight memory, scoring and
+decoding throughput, and the perplexity difference from fp32.
+
+Usage: python benchmark_quantization.py MODEL [dataset] [max_samples] [--modes int8 int4]
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import torch
+
+from calculate_perplexity import load_model, load_token_ids, score_dataset
+from quantization import QUANTIZATION_MODES, model_size_bytes, quantize_model
+from token_cache import DEFAULT_CACHE_DIR
+
+
+def _decode_throughput(model, tokenizer, prompt: str, new_tokens: int) -> float:
+    """Tokens per second of greedy generation."""
+    inputs = tokenizer(prompt, return_tensors="pt")
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    with torch.no_grad():
+        start = time.perf_counter()
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            do_sample=False,
+            pad_token_id=pad_token_id,
+        )
+        elapsed = time.perf_counter() - start
+    return (outputs.shape[1] - inputs['input_ids'].shape[1]) / elapsed
+
+
+def benchmark_quantization(
+    model,
+    tokenizer,
+    token_ids,
+    modes=QUANTIZATION_MODES,
+    max_length: int = 512,
+    max_tokens: int = 2048,
+    prompt: str = "The capital of France is",
+    new_tokens: int = 32,
+    group_size: int = 128,
+):
+    """
+    Score `token_ids` with the fp32 `model` and with quantized copies of it.
+
+    Returns:
+        Dict keyed by 'fp32' and each mode, with model_bytes, perplexity,
+        perplexity_delta (vs fp32), score_tokens_per_second and
+        decode_tokens_per_second
+    """
+    results = {}
+    for mode in ('fp32',) + tuple(modes):
+        if mode == 'fp32':
+            candidate = model
+        else:
+            candidate = quantize_model(copy.deepcopy(model), mode, group_size)
+
+        start = time.perf_counter()
+        stats = score_dataset(
+            candidate, tokenizer, token_ids, "cpu",
+            max_length=max_length, max_tokens=max_tokens, prefetch_workers=0,
+        )
+        elapsed = time.perf_counter() - start
+
+        perplexity = float(np.exp(stats['total_loss'] / stats['total_tokens']))
+        results[mode] = {
+            'model_bytes': model_size_bytes(candidate),
+            'perplexity': perplexity,
+            'perplexity_delta': perplexity - results['fp32']['perplexity'] if mode != 'fp32' else 0.0,
+            'score_tokens_per_second': stats['computed_tokens'] / elapsed,
+            'decode_tokens_per_second': _decode_throughput(candidate, tokenizer, prompt, new_tokens),
+        }
+    return results
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Compare quantized CPU inference against fp32.")
+    parser.add_argument("model_name", help="HuggingFace model name")
+    parser.add_argument("dataset_name", nargs="?", default="wikitext", help="HuggingFace dataset name")
+    parser.add_argument("max_samples", nargs="?", type=int, default=100, help="Maximum number of samples")
+    parser.add_argument("--dataset-config", default="wikitext-2-raw-v1", help="Dataset configuration")
+    parser.add_argument("--split", default="test", help="Dataset split")
+    parser.add_argument("--max-length", type=int, default=512, help="Context length in tokens")
+    parser.add_argument("--max-tokens", type=int, default=2048, help="Token budget per batch")
+    parser.add_argument("--modes", nargs="+", choices=QUANTIZATION_MODES, default=list(QUANTIZATION_MODES),
+                        help="Quantization modes to compare")
+    parser.add_argument("--group-size", type=int, default=128, help="Input channels per int4 scale")
+    parser.add_argument("--new-tokens", type=int, default=32, help="Tokens generated for the decode benchmark")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model, tokenizer, _ = load_model(args.model_name, "cpu")
+    token_ids = load_token_ids(
+        tokenizer, args.dataset_name, args.dataset_config, args.split, args.max_samples, DEFAULT_CACHE_DIR
+    )
+
+    print(f"\nBenchmarking {', '.join(['fp32'] + args.modes)} on CPU ({torch.get_num_threads()} threads)...")
+    results = benchmark_quantization(
+        model, tokenizer, token_ids,
+        modes=args.modes,
+        max_length=args.max_length,
+        max_tokens=args.max_tokens,
+        new_tokens=args.new_tokens,
+        group_size=args.group_size,
+    )
+
+    print("\n" + "=" * 60)
+    print("Results:")
+    print(f"  {'mode':<6} {'weights':>10} {'perplexity':>11} {'delta':>8} {'score tok/s':>12} {'decode tok/s':>13}")
+    for mode, result in results.items():
+        print(f"  {mode:<6} {result['model_bytes'] / 1e6:>7,.0f} MB {result['perplexity']:>11.4f} "
+              f"{result['perplexity_delta']:>+8.4f} {result['score_tokens_per_second']:>12,.0f} "
+              f"{result['decode_tokens_per_second']:>13.1f}")
+    print("=" * 60)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Measure perplexity-evaluation throughput and memory to calibrate the requirements estimator.
+
+``model-library/perplexity_requirements.py`` estimates time from fixed
+tokens/sec tiers and memory from sqrt-scaled guesses. This harness runs
+the scoring forward pass (chunked loss included, as in
+calculate_perplexity) over a matrix of batch size x sequence length x
+dtype and records, per point, the seconds per batch, tokens/s and peak
+memory (CUDA allocator peak, or process RSS on CPU). Points that run out
+of memory are recorded as such and larger batches at that length are
+skipped.
+
+Rows are appended to a JSONL results file, so several models measured on
+the same hardware accumulate. From all rows of this hardware and dtype,
+two least-squares fits are made and merged into the estimator's
+calibration file (``~/.cache/transformer-questions/calibration.json``, or
+``$PERPLEXITY_CALIBRATION``):
+
+- time: seconds per batch = forward_overhead_seconds
+  + seconds_per_token_per_b * batch * seq_len * billions of parameters
+- memory: peak GB = weights_scale * estimated weights
+  + activation_scale * estimated (activations + KV cache) + overhead_gb;
+  with a single model size the weights cannot be told apart from the
+  constant, so weights_scale is fixed at 1
+
+The estimator then loads the coefficients automatically (see
+perplexity_requirements.load_calibration).
+
+Usage: python benchmark_requirements.py MODEL [--batch-sizes 1 4 16] [--seq-lengths 128 512] [--dtypes float16]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM
+
+from autotune import MemoryMonitor, free_memory, is_oom_error
+from chunked_loss import forward_nll
+
+# The estimator lives in model-library/, which is not always uploaded
+# alongside the remote scripts
+_MODEL_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model-library')
+if os.path.isdir(_MODEL_LIBRARY):
+    sys.path.insert(0, _MODEL_LIBRARY)
+try:
+    from perplexity_requirements import DEFAULT_CALIBRATION_PATH, cpu_hardware_name, estimate_memory_requirements
+except ImportError:
+    DEFAULT_CALIBRATION_PATH = os.path.expanduser("~/.cache/transformer-questions/calibration.json")
+    estimate_memory_requirements = None
+
+    def cpu_hardware_name() -> str:
+        return f"CPU {platform.processor() or platform.machine()} x{os.cpu_count()}"
+
+DTYPES = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+}
+
+# A fit needs more points than coefficients
+MIN_FIT_POINTS = 4
+
+
+def hardware_name(device: str) -> str:
+    """Name calibrations are stored under: the GPU model, or the CPU model and core count."""
+    if device.startswith("cuda"):
+        return torch.cuda.get_device_name(torch.device(device))
+    return cpu_hardware_name()
+
+
+def measure_point(
+    model,
+    device: str,
+    batch_size: int,
+    seq_length: int,
+    repeats: int = 3,
+    loss_chunk_size: int = 1024,
+) -> Dict[str, Any]:
+    """
+    Time the scoring forward pass on one random batch and record its peak memory.
+
+    Returns:
+        Dict with seconds_per_batch, tokens_per_second and peak_bytes, or
+        oom=True if the batch did not fit
+    """
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(model.config.vocab_size, (batch_size, seq_length), generator=generator).to(device)
+    targets = torch.nn.functional.pad(input_ids[:, 1:], (0, 1), value=-100)
+
+    def _step():
+        with torch.no_grad():
+            nll, _ = forward_nll(model, targets, loss_chunk_size, input_ids=input_ids)
+            nll.sum().item()
+
+    try:
+        # Warm-up, so one-time initialization is not timed
+        _step()
+        with MemoryMonitor(device) as monitor:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                _step()
+                monitor.sample()
+            seconds = (time.perf_counter() - start) / repeats
+    except Exception as e:
+        if not is_oom_error(e):
+            raise
+        free_memory()
+        return {'oom': True}
+    return {
+        'seconds_per_batch': seconds,
+        'tokens_per_second': batch_size * seq_length / seconds,
+        'peak_bytes': monitor.peak_bytes,
+    }
+
+
+def benchmark_requirements(
+    model_name: str,
+    device: str,
+    batch_sizes: Sequence[int] = (1, 4, 16),
+    seq_lengths: Sequence[int] = (128, 512),
+    dtypes: Sequence[str] = ('float16',),
+    repeats: int = 3,
+    loss_chunk_size: int = 1024,
+) -> List[Dict[str, Any]]:
+    """
+    Measure every batch size x sequence length x dtype point for one model.
+
+    Returns:
+        One row per point: hardware, model, params, dtype, batch_size,
+        seq_length and the measurements of measure_point
+    """
+    hardware = hardware_name(device)
+    rows = []
+    for dtype in dtypes:
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=DTYPES[dtype]).to(device).eval()
+        params = sum(p.numel() for p in model.parameters())
+        for seq_length in seq_lengths:
+            for batch_size in sorted(batch_sizes):
+                point = measure_point(model, device, batch_size, seq_length, repeats, loss_chunk_size)
+                rows.append({
+                    'hardware': hardware,
+                    'model': model_name,
+                    'params': params,
+                    'dtype': dtype,
+                    'batch_size': batch_size,
+                    'seq_length': seq_length,
+                    **point,
+                })
+                if point.get('oom'):
+                    print(f"  {dtype} seq {seq_length} batch {batch_size}: out of memory")
+                    break
+                print(f"  {dtype} seq {seq_length} batch {batch_size}: "
+                      f"{point['tokens_per_second']:,.0f} tokens/s, peak {point['peak_bytes'] / 1e9:.2f} GB")
+        del model
+        free_memory()
+    return rows
+
+
+def _estimated_terms(row: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    """The estimator's weights and activation (+ KV cache) GB for a measured point."""
+    if estimate_memory_requirements is None:
+        return None
+    estimate = estimate_memory_requirements(
+        row['model'], batch_size=row['batch_size'], seq_length=row['seq_length'],
+        size_b=row['params'] / 1e9,
+    )
+    weights = estimate['model_memory_fp32_gb'] if row['dtype'] == 'float32' else estimate['model_memory_fp16_gb']
+    return {
+        'weights_gb': weights,
+        'activation_gb': estimate['activation_memory_gb'] + estimate['kv_cache_memory_gb'],
+    }
+
+
+def fit_calibration(rows: Sequence[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Fit time and memory coefficients per hardware and dtype.
+
+    Args:
+        rows: Measured points (out-of-memory points are ignored)
+
+    Returns:
+        {hardware: {dtype: coefficients}} for every group with at least
+        MIN_FIT_POINTS points; see perplexity_requirements.load_calibration
+    """
+    groups = {}
+    for row in rows:
+        if not row.get('oom'):
+            groups.setdefault((row['hardware'], row['dtype']), []).append(row)
+
+    calibration = {}
+    for (hardware, dtype), points in groups.items():
+        if len(points) < MIN_FIT_POINTS:
+            continue
+        size_b = np.array([p['params'] / 1e9 for p in points])
+        tokens = np.array([p['batch_size'] * p['seq_length'] for p in points], dtype=np.float64)
+        seconds = np.array([p['seconds_per_batch'] for p in points])
+        (overhead, rate), *_ = np.linalg.lstsq(np.stack([np.ones_like(tokens), tokens * size_b], 1), seconds, rcond=None)
+        predicted = max(overhead, 0.0) + max(rate, 0.0) * tokens * size_b
+        coefficients = {
+            'forward_overhead_seconds': max(float(overhead), 0.0),
+            'seconds_per_token_per_b': max(float(rate), 0.0),
+            'time_error': float(np.median(np.abs(predicted - seconds) / seconds)),
+        }
+
+        terms = [_estimated_terms(p) for p in points]
+        if terms[0] is not None:
+            weights = np.array([t['weights_gb'] for t in terms])
+            activation = np.array([t['activation_gb'] for t in terms])
+            peak = np.array([p['peak_bytes'] / 1e9 for p in points])
+            if len(set(size_b)) > 1:
+                (weights_scale, activation_scale, overhead_gb), *_ = np.linalg.lstsq(
+                    np.stack([weights, activation, np.ones_like(peak)], 1), peak, rcond=None
+                )
+            else:
+                weights_scale = 1.0
+                (activation_scale, overhead_gb), *_ = np.linalg.lstsq(
+                    np.stack([activation, np.ones_like(peak)], 1), peak - weights, rcond=None
+                )
+            predicted = weights * weights_scale + activation * activation_scale + overhead_gb
+            coefficients.update(
+                weights_scale=float(weights_scale),
+                activation_scale=float(activation_scale),
+                overhead_gb=float(overhead_gb),
+                memory_error=float(np.median(np.abs(predicted - peak) / peak)),
+            )
+        coefficients.update(
+            points=len(points),
+            models=sorted({p['model'] for p in points}),
+            updated=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        )
+        calibration.setdefault(hardware, {})[dtype] = coefficients
+    return calibration
+
+
+def append_results(path: str, rows: Sequence[Dict[str, Any]]):
+    """Append measured rows to a JSONL results file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    """All rows of a JSONL results file."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def update_calibration(path: str, calibration: Dict[str, Dict[str, Dict[str, Any]]]):
+    """Merge fitted coefficients into a calibration file, replacing those of the same hardware and dtype."""
+    existing = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            existing = json.load(f)
+    for hardware, dtypes in calibration.items():
+        existing.setdefault(hardware, {}).update(dtypes)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(existing, f, indent=2, sort_keys=True)
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Calibrate the perplexity requirements estimator.")
+    parser.add_argument("model_name", help="HuggingFace model name")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16], metavar="N",
+                        help="Batch sizes to measure (default: 1 4 16)")
+    parser.add_argument("--seq-lengths", type=int, nargs="+", default=[128, 512], metavar="N",
+                        help="Sequence lengths to measure (default: 128 512)")
+    parser.add_argument("--dtypes", nargs="+", choices=list(DTYPES), default=None,
+                        help="Dtypes to measure (default: float16 on GPU, float32 on CPU)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed forward passes per point")
+    parser.add_argument("--results", default="requirements_results.jsonl", metavar="PATH",
+                        help="JSONL file the measurements are appended to")
+    parser.add_argument("--calibration", default=DEFAULT_CALIBRATION_PATH, metavar="PATH",
+                        help=f"Calibration file to update (default: the estimator's, {DEFAULT_CALIBRATION_PATH})")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtypes = args.dtypes or (['float16'] if device == "cuda" else ['float32'])
+
+    print(f"Measuring {args.model_name} on {hardware_name(device)}")
+    print("=" * 60)
+    rows = benchmark_requirements(
+        args.model_name, device, args.batch_sizes, args.seq_lengths, dtypes, repeats=args.repeats
+    )
+    append_results(args.results, rows)
+    print(f"  [OK] {len(rows)} points appended to {args.results}")
+
+    if estimate_memory_requirements is None:
+        print("  [WARNING] model-library is not available; memory coefficients are not fitted")
+    calibration = fit_calibration(load_results(args.results))
+    if not calibration:
+        print(f"  [WARNING] Fewer than {MIN_FIT_POINTS} points per dtype; calibration not updated")
+        sys.exit(1)
+    update_calibration(args.calibration, calibration)
+
+    print("\n" + "=" * 60)
+    for hardware, by_dtype in calibration.items():
+        for dtype, coefficients in by_dtype.items():
+            print(f"{hardware} / {dtype} ({coefficients['points']} points):")
+            print(f"  Forward overhead: {coefficients['forward_overhead_seconds'] * 1e3:.2f} ms, "
+                  f"{coefficients['seconds_per_token_per_b'] * 1e6:.3f} us per token per B params "
+                  f"(median error {coefficients['time_error']:.1%})")
+            if 'overhead_gb' in coefficients:
+                print(f"  Memory: weights x{coefficients['weights_scale']:.2f}, "
+                      f"activations x{coefficients['activation_scale']:.3f}, +{coefficients['overhead_gb']:.2f} GB "
+                      f"(median error {coefficients['memory_error']:.1%})")
+    print(f"  [OK] Calibration written to {args.calibration}")
+    print("=" * 60)
@@ -3,119 +3,1343 @@
 Calculate perplexity for a model on a dataset.
 
 This script can be customized for specific perplexity evaluation tasks.
+
+Evaluation modes:
+- Batched (default): each sample is truncated to ``max_length`` tokens and
+  samples are bucketed by length into batches of at most ``max_tokens``
+  padded tokens.
+- Sliding window (``--stride``): every sample is scored in full using
+  windows of ``max_length`` tokens that advance by ``stride`` tokens.
+  Overlapping context tokens are masked out of the loss, and for models
+  with rotary position embeddings the keys/values of the overlap are
+  reused from the previous window instead of being recomputed.
+- Packed (``--pack``): samples are joined with EOS separators and cut into
+  dense blocks of ``max_length`` tokens, so no compute goes to padding.
+  ``--document-mask`` keeps attention within each sample.
+
+Tokenized datasets are cached on disk (see ``token_cache.py``), so models
+sharing a tokenizer only tokenize a dataset once. ``--token-losses``
+additionally streams the loss of every scored token to disk (see
+``token_losses.py``) for later per-document or per-position analysis.
+
+Batches are collated and copied to the device by a background pipeline
+(see ``prefetch.py``) a few batches ahead of the model; its stall counters
+are printed with the results. Running totals are checkpointed every
+``--checkpoint-every`` batches (see ``checkpoint.py``), and ``--resume``
+continues an interrupted run with an identical final result.
+``--data-parallel N`` scores shards in N processes, one per GPU or CPU
+socket (see ``data_parallel.py``), with the same result as one process.
+``--streaming`` (or ``--data-file``) reads, tokenizes and scores documents
+a chunk at a time (see ``streaming.py``), so memory stays flat however
+large the source is.
+``--target-ci`` scores documents in random order and stops as soon as the
+confidence interval of perplexity is narrower than the target (see
+``confidence.py``), so ``max_samples`` becomes an upper bound.
+``--quantize int8|int4`` runs the model with quantized linear layers on
+CPU (see ``quantization.py``); ``benchmark_quantization.py`` compares the
+modes against fp32.
+``--fast-load`` builds the model on the meta device and streams the
+safetensors shards into it (see ``fast_loader.py``), reporting the read,
+deserialize and device-copy time of the load and its peak RSS.
+
+Final results are cached by model revision, dataset, settings and script
+version (see ``result_cache.py``); a repeated run returns them before the
+model is loaded. With ``--autotune`` the lookup waits until tuning has
+fixed the batch and sequence length, since those change the result.
 """
+import argparse
 import sys
+import time
 import torch
+import torch.nn.functional as F
 import numpy as np
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from datasets import load_dataset
 
-def calculate_perplexity(model_name: str, dataset_name: str = "wikitext", dataset_config: str = "wikitext-2-raw-v1", split: str = "test", max_samples: int = 1000):
+from accumulator import LossAccumulator
+from autotune import (
+    MemoryMonitor,
+    autotune_batch_size,
+    default_memory_budget,
+    device_type,
+    free_memory,
+    is_oom_error,
+    memory_in_use,
+)
+from checkpoint import EvalCheckpoint, default_checkpoint_path
+from chunked_loss import forward_nll
+from fast_loader import load_model_fast_or_none
+from confidence import MIN_DOCUMENTS, DocumentStats, log_perplexity_ci, perplexity_ci
+from data_parallel import default_world_size, reduce_stats, run_workers, worker_device
+from data_parallel import shard as shard_indices
+from prefetch import Prefetcher, merge_pipeline_stats
+from quantization import QUANTIZATION_MODES, model_size_bytes, quantize_model
+from report import PerfReport
+from result_cache import DEFAULT_RESULT_CACHE_DIR, ResultCache, file_fingerprint, model_revision, source_fingerprint
+from streaming import iter_texts, iter_token_chunks
+from token_cache import DEFAULT_CACHE_DIR, TokenCache
+from token_losses import TokenLossWriter, offsets_from_lengths
+from batching import (
+    build_token_budget_batches,
+    document_attention,
+    pack_sequences,
+    pad_batch,
+    padding_efficiency,
+)
+
+
+def load_model(model_name: str, device: str = None, quantize: str = None, fast_load: bool = False, report=None):
     """
-    Calculate perplexity for a model on a dataset.
-    
+    Load a causal LM and its tokenizer.
+
     Args:
         model_name: HuggingFace model name
-        dataset_name: Dataset name from HuggingFace datasets
-        dataset_config: Dataset configuration
-        split: Dataset split to use
-        max_samples: Maximum number of samples to evaluate
+        device: Device to place the whole model on (e.g. 'cuda:1'); by
+            default the model is spread over all GPUs, or loaded on CPU
+        quantize: 'int8' or 'int4' to quantize the linear layers; the
+            model is then always loaded on CPU
+        fast_load: Stream safetensors shards into a meta-device model,
+            placed like from_pretrained would (see fast_loader.py),
+            falling back to from_pretrained where that is not possible
+        report: PerfReport receiving the fast-load stage times
+
+    Returns:
+        Tuple of (model, tokenizer, device)
     """
-    print(f"Calculating perplexity for {model_name}")
-    print("=" * 60)
-    
-    # Load model and tokenizer
     print("Loading model and tokenizer...")
     tokenizer = AutoTokenizer.from_pretrained(model_name)
-    
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-        device_map="auto" if torch.cuda.is_available() else None
-    )
-    
-    if torch.cuda.is_available():
-        device = "cuda"
-        print(f"  [OK] Model loaded on GPU: {torch.cuda.get_device_name(0)}")
+
+    if quantize and device is not None and device.startswith("cuda"):
+        raise ValueError("Quantized inference is CPU-only")
+    use_cuda = not quantize and torch.cuda.is_available() and (device is None or device.startswith("cuda"))
+    if device is None or not use_cuda:
+        device_map = "auto" if use_cuda else None
+    else:
+        device_map = {"": device}
+    dtype = torch.float16 if use_cuda else torch.float32
+
+    model = None
+    if fast_load:
+        model = load_model_fast_or_none(model_name, device, use_cuda, dtype, report)
+    if model is None:
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=dtype,
+            device_map=device_map
+        )
+
+    if use_cuda:
+        device = device or "cuda"
+        print(f"  [OK] Model loaded on GPU: {torch.cuda.get_device_name(device)}")
     else:
         device = "cpu"
         print(f"  [OK] Model loaded on CPU")
-    
+
+    if quantize:
+        fp32_bytes = model_size_bytes(model)
+        model = quantize_model(model, quantize)
+        print(f"  [OK] Quantized to {quantize}: {fp32_bytes / 1e6:,.0f} MB -> {model_size_bytes(model) / 1e6:,.0f} MB")
+
     model.eval()
-    
-    # Load dataset
+    return model, tokenizer, device
+
+
+def load_texts(dataset_name: str, dataset_config: str, split: str, max_samples: int):
+    """
+    Load the text column of a HuggingFace dataset.
+
+    Returns:
+        List of strings, or None if the dataset could not be loaded
+    """
     print(f"\nLoading dataset: {dataset_name}/{dataset_config}")
     try:
         dataset = load_dataset(dataset_name, dataset_config, split=split)
         if max_samples:
             dataset = dataset.select(range(min(max_samples, len(dataset))))
-        print(f"  [OK] Loaded {len(dataset)} samples")
+        column = 'text' if 'text' in dataset.column_names else 'content'
+        texts = list(dataset[column])
+        print(f"  [OK] Loaded {len(texts)} samples")
+        return texts
     except Exception as e:
         print(f"  [ERROR] Failed to load dataset: {e}")
         return None
-    
-    # Calculate perplexity
-    print("\nCalculating perplexity...")
-    total_loss = 0.0
-    total_tokens = 0
-    
+
+
+def load_token_ids(
+    tokenizer,
+    dataset_name: str,
+    dataset_config: str,
+    split: str,
+    max_samples: int,
+    token_cache_dir: str = DEFAULT_CACHE_DIR,
+):
+    """
+    Load a tokenized dataset, going through the on-disk token cache.
+
+    Args:
+        token_cache_dir: Token cache directory, or None to always tokenize
+
+    Returns:
+        Sequence of token id sequences, or None if the dataset could not be loaded
+    """
+    def _load():
+        return load_texts(dataset_name, dataset_config, split, max_samples)
+
+    if token_cache_dir is None:
+        texts = _load()
+        return tokenize_texts(tokenizer, texts) if texts is not None else None
+
+    identity = {
+        'dataset_name': dataset_name,
+        'dataset_config': dataset_config,
+        'split': split,
+        'max_samples': max_samples,
+    }
+    return TokenCache(token_cache_dir).get_or_create(tokenizer, identity, _load)
+
+
+def tokenize_texts(tokenizer, texts, batch_size: int = 1000):
+    """Tokenize texts without truncation, returning one id list per text."""
+    token_ids = []
+    for start in range(0, len(texts), batch_size):
+        token_ids.extend(tokenizer(list(texts[start:start + batch_size]))['input_ids'])
+    return token_ids
+
+
+def _as_tensor(ids) -> torch.Tensor:
+    """Convert a token id sequence (list or uint32 memmap slice) to a long tensor."""
+    return torch.as_tensor(np.asarray(ids, dtype=np.int64))
+
+
+def _token_nll(model, labels, loss_chunk_size=1024, **inputs):
+    """
+    Per-token negative log-likelihood of next-token predictions.
+
+    The loss is computed from hidden states `loss_chunk_size` positions at
+    a time (see chunked_loss.py), so full-vocabulary logits for the whole
+    batch are never materialized; 0 or None uses the model's logits.
+
+    Returns:
+        Tensor [batch, seq - 1], zero where the shifted label is -100
+    """
+    # Position i predicts label i + 1; the last position predicts nothing
+    targets = F.pad(labels[:, 1:], (0, 1), value=-100)
+    nll, _ = forward_nll(model, targets, loss_chunk_size, **inputs)
+    return nll[:, :-1]
+
+
+def _progress(step: int, num_batches: int, accumulator, unit: str = "batches", report=None):
+    """Print (and report) progress every 10 steps; this is the only per-interval device sync."""
+    if step % 10 == 0:
+        totals = accumulator.totals()
+        avg_loss = totals['total_loss'] / totals['total_tokens'] if totals['total_tokens'] else float('nan')
+        print(f"  Processed {step}/{num_batches} {unit} (running loss {avg_loss:.4f})...")
+        if report is not None:
+            report.progress(step, num_batches, totals['computed_tokens'], unit)
+
+
+def _record_losses(loss_writer, documents, positions, nll, valid):
+    """Send the losses of valid targets to a TokenLossWriter."""
+    valid = valid.cpu()
+    loss_writer.write(
+        documents.cpu()[valid].numpy(),
+        positions.cpu()[valid].numpy(),
+        nll.cpu()[valid].numpy(),
+    )
+
+
+def score_batched(
+    model,
+    tokenizer,
+    token_ids,
+    device: str,
+    max_tokens: int = 2048,
+    max_length: int = 512,
+    loss_writer=None,
+    prefetch_workers: int = 2,
+    prefetch_depth: int = 4,
+    checkpoint=None,
+    shard=(0, 1),
+    loss_chunk_size: int = 1024,
+    report=None,
+):
+    """
+    Score samples in length-bucketed batches, truncating each to max_length.
+
+    Batches are built under a padded-token budget rather than a fixed
+    sample count, and padding is masked out of both the loss and the
+    token count. If `loss_writer` (a TokenLossWriter) is given, the loss
+    of every scored token is streamed to it. Batches are prepared by a
+    Prefetcher with `prefetch_workers` threads, `prefetch_depth` ahead.
+    With `checkpoint` (an EvalCheckpoint), the running totals are saved
+    periodically and a resumed run skips the batches already committed.
+    With `shard=(rank, world_size)`, only every world_size-th batch
+    (starting at rank) is scored; see data_parallel.py. The LM head is
+    applied `loss_chunk_size` positions at a time (0 for full logits).
+    With `report` (a PerfReport), progress samples are recorded along
+    with the progress lines.
+
+    Returns:
+        Dict with total_loss, total_tokens, real_tokens, computed_tokens,
+        padding_efficiency, pipeline (prefetch stall counters) and
+        batch_losses ((global batch index, loss sum) in scoring order)
+    """
+    checkpoint = checkpoint or EvalCheckpoint(None)
+    start, totals = checkpoint.restore()
+    accumulator = LossAccumulator(device, totals)
+    if report is not None:
+        report.start_progress(start, totals['computed_tokens'])
+
     if tokenizer.pad_token_id is None:
         tokenizer.pad_token_id = tokenizer.eos_token_id
-    
-    batch_size = 4
-    for i in range(0, len(dataset), batch_size):
-        batch = dataset[i:i+batch_size]
-        texts = [item.get('text', item.get('content', '')) for item in batch]
-        
-        # Tokenize
-        encodings = tokenizer(
-            texts,
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-            max_length=512
-        )
-        
-        if device == "cuda":
-            encodings = {k: v.to(device) for k, v in encodings.items()}
-        
+
+    # Samples with fewer than two tokens have nothing to predict
+    documents = [i for i, ids in enumerate(token_ids) if len(ids) > 1]
+    samples = [token_ids[i][:max_length] for i in documents]
+    batches = build_token_budget_batches([len(ids) for ids in samples], max_tokens)
+    print(f"  {len(samples)} samples in {len(batches)} batches (max {max_tokens} tokens per batch)")
+
+    def _collate(batch):
+        input_ids, attention_mask, labels = pad_batch([samples[i] for i in batch], tokenizer.pad_token_id)
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'labels': labels,
+            'documents': torch.tensor([documents[i] for i in batch]),
+            # Counted on the host so the loop never waits for the device
+            'scored_tokens': int((labels[:, 1:] != -100).sum()),
+            'real_tokens': int(attention_mask.sum()),
+        }
+
+    order = shard_indices(batches, *shard)
+    prefetcher = Prefetcher(
+        [batches[i] for i in order[start:]], _collate, device,
+        num_workers=prefetch_workers, depth=prefetch_depth
+    )
+    for step, inputs in enumerate(prefetcher, start):
+        input_ids = inputs['input_ids']
+        attention_mask = inputs['attention_mask']
+        labels = inputs['labels']
+
         # Calculate loss
         with torch.no_grad():
-            outputs = model(**encodings, labels=encodings['input_ids'])
-            loss = outputs.loss
-        
-        # Accumulate
-        batch_tokens = encodings['input_ids'].numel()
-        total_loss += loss.item() * batch_tokens
-        total_tokens += batch_tokens
-        
-        if (i // batch_size + 1) % 10 == 0:
-            print(f"  Processed {i + len(batch)}/{len(dataset)} samples...")
-    
+            nll = _token_nll(
+                model, labels, loss_chunk_size, input_ids=input_ids, attention_mask=attention_mask
+            )
+            valid = labels[:, 1:] != -100
+
+        if loss_writer is not None:
+            batch_documents = inputs['documents'].unsqueeze(1).expand_as(valid)
+            positions = torch.arange(1, labels.size(1), device=valid.device).unsqueeze(0).expand_as(valid)
+            _record_losses(loss_writer, batch_documents, positions, nll, valid)
+
+        # Accumulate on the device; totals are only read back when needed
+        accumulator.add(
+            order[step], nll.sum(), inputs['scored_tokens'], inputs['real_tokens'], input_ids.numel()
+        )
+        checkpoint.step(step + 1, accumulator.totals)
+        _progress(step + 1, len(order), accumulator, report=report)
+
+    totals = accumulator.totals()
+    return dict(
+        totals,
+        padding_efficiency=padding_efficiency(totals['real_tokens'], totals['computed_tokens']),
+        pipeline=prefetcher.stats.as_dict(),
+        batch_losses=accumulator.batch_losses,
+    )
+
+
+def score_packed(
+    model,
+    tokenizer,
+    token_ids,
+    device: str,
+    max_tokens: int = 2048,
+    block_size: int = 512,
+    document_mask: bool = False,
+    loss_writer=None,
+    prefetch_workers: int = 2,
+    prefetch_depth: int = 4,
+    checkpoint=None,
+    shard=(0, 1),
+    loss_chunk_size: int = 1024,
+    report=None,
+):
+    """
+    Score samples packed into dense fixed-length blocks.
+
+    All samples are joined with EOS separators into one token stream, which
+    is cut into blocks of `block_size` tokens and run `max_tokens //
+    block_size` blocks at a time, so every forward pass is full.
+
+    Without `document_mask`, tokens attend across document boundaries and
+    every token except the first of each block is scored, separators
+    included. With `document_mask`, attention and position ids are
+    restricted to each document and only tokens predicted from their own
+    document are scored, which keeps results comparable with the
+    unpacked modes (a document split across two blocks restarts its
+    context in the second block). Separator losses are not sent to
+    `loss_writer`, since they have no place in the per-document layout.
+    Blocks, masks and position ids are built by a Prefetcher, and
+    `checkpoint`, `shard`, `loss_chunk_size` and `report` work as in
+    score_batched.
+
+    Returns:
+        Dict with total_loss, total_tokens, real_tokens, computed_tokens,
+        padding_efficiency, pipeline and batch_losses (as in score_batched)
+    """
+    if tokenizer.eos_token_id is None:
+        raise ValueError("Packing requires a tokenizer with an EOS token")
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+
+    blocks, segment_blocks, position_blocks = pack_sequences(token_ids, tokenizer.eos_token_id, block_size)
+    blocks_per_batch = max(1, max_tokens // block_size)
+    print(f"  Packed {len(token_ids)} samples into {len(blocks)} blocks of {block_size} tokens")
+
+    checkpoint = checkpoint or EvalCheckpoint(None)
+    first_batch, totals = checkpoint.restore()
+    accumulator = LossAccumulator(device, totals)
+    if report is not None:
+        report.start_progress(first_batch, totals['computed_tokens'])
+    starts = list(range(0, len(blocks), blocks_per_batch))
+    order = shard_indices(starts, *shard)
+
+    def _collate(start):
+        input_ids, attention_mask, labels = pad_batch(blocks[start:start + blocks_per_batch], tokenizer.pad_token_id)
+        segments, _, _ = pad_batch(segment_blocks[start:start + blocks_per_batch], -2)
+        batch = {'input_ids': input_ids, 'segments': segments}
+        if document_mask:
+            batch['attention_mask'], batch['position_ids'] = document_attention(segments, attention_mask, model.dtype)
+            # Only score tokens predicted from the same document
+            same_document = (segments[:, 1:] == segments[:, :-1]) & (segments[:, 1:] >= 0)
+            labels[:, 1:] = labels[:, 1:].masked_fill(~same_document, -100)
+        else:
+            batch['attention_mask'] = attention_mask
+        batch['labels'] = labels
+        batch['scored_tokens'] = int((labels[:, 1:] != -100).sum())
+        batch['real_tokens'] = int(attention_mask.sum())
+        if loss_writer is not None:
+            batch['positions'], _, _ = pad_batch(position_blocks[start:start + blocks_per_batch], 0)
+        return batch
+
+    prefetcher = Prefetcher(
+        [starts[i] for i in order[first_batch:]], _collate, device,
+        num_workers=prefetch_workers, depth=prefetch_depth
+    )
+    for step, batch in enumerate(prefetcher, first_batch):
+        inputs = {key: batch[key] for key in ('input_ids', 'attention_mask', 'position_ids') if key in batch}
+        labels = batch['labels']
+
+        with torch.no_grad():
+            nll = _token_nll(model, labels, loss_chunk_size, **inputs)
+            valid = labels[:, 1:] != -100
+
+        if loss_writer is not None:
+            segments = batch['segments']
+            # Separators (-1) and padding (-2) have no per-document slot
+            in_document = valid & (segments[:, 1:] >= 0)
+            _record_losses(loss_writer, segments[:, 1:], batch['positions'][:, 1:], nll, in_document)
+
+        accumulator.add(
+            order[step], nll.sum(), batch['scored_tokens'], batch['real_tokens'], batch['input_ids'].numel()
+        )
+        checkpoint.step(step + 1, accumulator.totals)
+        _progress(step + 1, len(order), accumulator, report=report)
+
+    totals = accumulator.totals()
+    return dict(
+        totals,
+        padding_efficiency=padding_efficiency(totals['real_tokens'], totals['computed_tokens']),
+        pipeline=prefetcher.stats.as_dict(),
+        batch_losses=accumulator.batch_losses,
+    )
+
+
+def make_probe(model, device: str, memory_budget_bytes: int = None, loss_chunk_size: int = 1024):
+    """
+    Build an autotune probe that runs one batched scoring step.
+
+    The probe scores a random [batch_size, seq_len] batch through the
+    same forward and loss path as score_batched, and raises OutOfMemory
+    if the memory a probe adds on top of the loaded model exceeds
+    `memory_budget_bytes`. The model's footprint is taken once, here, so
+    memory a failed probe leaves resident is not charged to later probes.
+    """
+    vocab_size = model.config.vocab_size
+    resident_bytes = memory_in_use(device)
+
+    def probe(batch_size: int, seq_len: int):
+        input_ids = torch.randint(0, vocab_size, (batch_size, seq_len), device=device)
+        attention_mask = torch.ones_like(input_ids)
+        with MemoryMonitor(device, memory_budget_bytes, resident_bytes=resident_bytes) as monitor, torch.no_grad():
+            nll = _token_nll(
+                model, input_ids, loss_chunk_size, input_ids=input_ids, attention_mask=attention_mask
+            )
+            monitor.sample()
+            del nll
+
+    return probe
+
+
+def supports_kv_reuse(model) -> bool:
+    """
+    Check whether cached keys/values can be carried across windows.
+
+    Reused keys keep the absolute positions they were computed at, which
+    is only consistent with the new window for relative (rotary) position
+    encodings. Models with learned absolute positions (e.g. GPT-2) must
+    recompute each window.
+    """
+    config = model.config
+    for attr in ('rope_theta', 'rope_scaling', 'rope_parameters', 'rotary_dim', 'rotary_emb_base'):
+        if getattr(config, attr, None) is not None:
+            return True
+    return getattr(config, 'position_embedding_type', None) == 'rotary'
+
+
+def trim_cache(cache, keep: int):
+    """
+    Drop all but the last `keep` positions from a KV cache.
+
+    Handles the layered `DynamicCache` of recent transformers releases,
+    the `key_cache`/`value_cache` lists of older ones and legacy tuples.
+
+    Returns:
+        The trimmed cache, or None if the cache format is not supported
+    """
+    def _last(tensor):
+        return tensor[..., tensor.shape[-2] - keep:, :]
+
+    if isinstance(cache, tuple):
+        return tuple((_last(k), _last(v)) + tuple(rest) for k, v, *rest in cache)
+
+    if hasattr(cache, 'layers'):
+        for layer in cache.layers:
+            if type(layer).__name__ != 'DynamicLayer':
+                return None
+            if getattr(layer, 'keys', None) is None or layer.keys.numel() == 0:
+                continue
+            layer.keys = _last(layer.keys)
+            layer.values = _last(layer.values)
+        return cache
+
+    if hasattr(cache, 'key_cache') and hasattr(cache, 'value_cache'):
+        cache.key_cache = [_last(k) for k in cache.key_cache]
+        cache.value_cache = [_last(v) for v in cache.value_cache]
+        if hasattr(cache, '_seen_tokens'):
+            cache._seen_tokens = keep
+        return cache
+
+    return None
+
+
+def _window_nll(model, input_ids, targets, position_ids=None, past_key_values=None, loss_chunk_size=1024):
+    """Run one window and return (per-target NLL, new cache)."""
+    nll, outputs = forward_nll(
+        model,
+        targets.unsqueeze(0),
+        loss_chunk_size,
+        input_ids=input_ids,
+        position_ids=position_ids,
+        past_key_values=past_key_values,
+        use_cache=past_key_values is not None or position_ids is not None,
+    )
+    return nll[0], getattr(outputs, 'past_key_values', None)
+
+
+def score_sliding_window(
+    model,
+    tokenizer,
+    token_ids,
+    device: str,
+    max_length: int = 512,
+    stride: int = 256,
+    reuse_kv: bool = True,
+    loss_writer=None,
+    prefetch_workers: int = 2,
+    prefetch_depth: int = 4,
+    checkpoint=None,
+    shard=(0, 1),
+    loss_chunk_size: int = 1024,
+    report=None,
+):
+    """
+    Score samples in full with overlapping windows.
+
+    Each window spans at most `max_length` tokens and advances by `stride`
+    tokens; only the tokens not already scored by the previous window
+    count towards the loss, so every token is predicted with at least
+    `max_length - stride` tokens of context (except at the start of a text).
+
+    With `reuse_kv`, the window's overlap is taken from the previous
+    window's KV cache and only the new tokens are run through the model.
+    The cached states of deeper layers were computed with context from
+    before the window, so the effective context is slightly longer than
+    `max_length` (as in Transformer-XL style evaluation) and the loss is
+    close to, but not bit-identical with, recomputing every window. It is
+    skipped automatically for models without rotary position embeddings.
+
+    If `loss_writer` (a TokenLossWriter) is given, the loss of every
+    scored token is streamed to it. Documents are copied to the device
+    by a Prefetcher ahead of the windows that score them. With
+    `checkpoint`, progress is committed one document at a time, and
+    `shard` deals out documents rather than batches. `loss_chunk_size`
+    and `report` work as in score_batched.
+
+    Returns:
+        Dict with total_loss, total_tokens, real_tokens, computed_tokens,
+        padding_efficiency, pipeline and batch_losses (the loss of every
+        window, indexed by document)
+    """
+    if not 0 < stride <= max_length:
+        raise ValueError(f"stride must be in (0, max_length], got {stride} with max_length={max_length}")
+
+    reuse_kv = reuse_kv and stride < max_length and supports_kv_reuse(model)
+    if reuse_kv:
+        print(f"  [OK] Reusing KV cache across windows (stride {stride}, context {max_length})")
+
+    checkpoint = checkpoint or EvalCheckpoint(None)
+    start, totals = checkpoint.restore()
+    accumulator = LossAccumulator(device, totals)
+    if report is not None:
+        report.start_progress(start, totals['computed_tokens'])
+
+    # Texts with fewer than two tokens have nothing to predict
+    documents = [i for i, doc_ids in enumerate(token_ids) if len(doc_ids) > 1]
+    documents = [documents[i] for i in shard_indices(documents, *shard)]
+    prefetcher = Prefetcher(
+        documents[start:], lambda i: _as_tensor(token_ids[i]), device,
+        num_workers=prefetch_workers, depth=prefetch_depth
+    )
+    for position, ids in enumerate(prefetcher, start):
+        doc_index = documents[position]
+        seq_len = ids.size(0)
+
+        cache = None
+        prev_end = 0
+        for begin in range(0, seq_len, stride):
+            end = min(begin + max_length, seq_len)
+            new_tokens = end - prev_end
+
+            with torch.no_grad():
+                if reuse_kv and cache is not None:
+                    # Inputs [prev_end-1, end-1) predict targets [prev_end, end);
+                    # the cache supplies the context back to the window start.
+                    cache = trim_cache(cache, max_length - 1 - new_tokens)
+                    if cache is None:
+                        raise RuntimeError("KV cache format does not support trimming; rerun with --no-kv-reuse")
+                    positions = torch.arange(prev_end - 1, end - 1, device=device).unsqueeze(0)
+                    loss, cache = _window_nll(
+                        model,
+                        ids[prev_end - 1:end - 1].unsqueeze(0),
+                        ids[prev_end:end],
+                        position_ids=positions,
+                        past_key_values=cache,
+                        loss_chunk_size=loss_chunk_size,
+                    )
+                elif reuse_kv:
+                    positions = torch.arange(0, end - 1, device=device).unsqueeze(0)
+                    loss, cache = _window_nll(
+                        model,
+                        ids[:end - 1].unsqueeze(0),
+                        ids[1:end],
+                        position_ids=positions,
+                        loss_chunk_size=loss_chunk_size,
+                    )
+                else:
+                    window = ids[begin:end]
+                    targets = window[1:].clone()
+                    # Overlapping context was already scored by the previous window
+                    targets[:-new_tokens] = -100
+                    loss, _ = _window_nll(
+                        model, window[:-1].unsqueeze(0), targets, loss_chunk_size=loss_chunk_size
+                    )
+
+            # The first token of a text has no prediction
+            scored = min(new_tokens, end - begin - 1)
+            if loss_writer is not None:
+                loss_writer.write_document(doc_index, end - scored, loss[-scored:].cpu().numpy())
+            computed = new_tokens if reuse_kv and begin else end - begin - 1
+            accumulator.add(doc_index, loss.sum(), scored, computed, computed)
+            prev_end = end
+            if end == seq_len:
+                break
+        checkpoint.step(position + 1, accumulator.totals)
+        _progress(position + 1, len(documents), accumulator, unit="samples", report=report)
+
+    # Windows run one at a time, so there is never any padding
+    return dict(
+        accumulator.totals(),
+        padding_efficiency=1.0,
+        pipeline=prefetcher.stats.as_dict(),
+        batch_losses=accumulator.batch_losses,
+    )
+
+
+def score_dataset(
+    model,
+    tokenizer,
+    token_ids,
+    device: str,
+    max_length: int = 512,
+    stride: int = None,
+    reuse_kv: bool = True,
+    max_tokens: int = 2048,
+    pack: bool = False,
+    document_mask: bool = False,
+    **options,
+):
+    """
+    Score a tokenized dataset in the mode selected by `pack` and `stride`.
+
+    `options` (loss_writer, prefetch settings, checkpoint, shard, report) are
+    passed on to score_packed, score_sliding_window or score_batched.
+    """
+    if pack:
+        return score_packed(
+            model, tokenizer, token_ids, device,
+            max_tokens=max_tokens, block_size=max_length, document_mask=document_mask, **options
+        )
+    if stride:
+        return score_sliding_window(
+            model, tokenizer, token_ids, device,
+            max_length=max_length, stride=stride, reuse_kv=reuse_kv, **options
+        )
+    return score_batched(
+        model, tokenizer, token_ids, device,
+        max_tokens=max_tokens, max_length=max_length, **options
+    )
+
+
+def score_stream(model, tokenizer, chunks, device: str, **score_args):
+    """
+    Score token id chunks one at a time, keeping only running totals.
+
+    Each chunk is scored with score_dataset (and batched within itself),
+    then released, so memory stays bounded whatever the stream length.
+
+    Returns:
+        Dict with total_loss, total_tokens, real_tokens, computed_tokens,
+        padding_efficiency, pipeline and samples
+    """
+    totals = {'total_loss': 0.0, 'total_tokens': 0, 'real_tokens': 0, 'computed_tokens': 0}
+    pipeline = merge_pipeline_stats([])
+    samples = 0
+    for chunk in chunks:
+        stats = score_dataset(model, tokenizer, chunk, device, **score_args)
+        for key in totals:
+            totals[key] += stats[key]
+        pipeline = merge_pipeline_stats([pipeline, stats['pipeline']])
+        samples += len(chunk)
+        print(f"  Streamed {samples:,} samples, {totals['total_tokens']:,} tokens scored")
+
+    return dict(
+        totals,
+        padding_efficiency=padding_efficiency(totals['real_tokens'], totals['computed_tokens']),
+        pipeline=pipeline,
+        samples=samples,
+    )
+
+
+def score_adaptive(
+    model,
+    tokenizer,
+    token_ids,
+    device: str,
+    target_ci: float,
+    confidence: float = 0.95,
+    round_size: int = 100,
+    seed: int = 0,
+    **score_args,
+):
+    """
+    Score documents in random order until the perplexity CI is narrow enough.
+
+    Documents are shuffled (with `seed`, so runs are repeatable) and scored
+    `round_size` at a time with score_dataset. After each round the
+    delta-method CI over the documents scored so far is computed (see
+    confidence.py); scoring stops once its relative half-width is at most
+    `target_ci` (e.g. 0.005 for +-0.5%), or when `token_ids` is exhausted.
+    Per-document sums are collected through the loss writer hook, so
+    `score_args` may not include a loss_writer.
+
+    Returns:
+        Dict with the totals, padding_efficiency and pipeline of
+        score_stream, the number of documents scored, whether the target
+        was reached (converged), and perplexity, ci_low, ci_high and
+        relative_half_width (see confidence.perplexity_ci)
+    """
+    eligible = [i for i, ids in enumerate(token_ids) if len(ids) > 1]
+    order = np.random.default_rng(seed).permutation(len(eligible))
+    documents = [eligible[i] for i in order]
+
+    totals = {'total_loss': 0.0, 'total_tokens': 0, 'real_tokens': 0, 'computed_tokens': 0}
+    pipeline = merge_pipeline_stats([])
+    losses, tokens = [], []
+    interval = perplexity_ci(float('nan'), float('inf'))
+    converged = False
+    for begin in range(0, len(documents), round_size):
+        subset = [token_ids[i] for i in documents[begin:begin + round_size]]
+        document_stats = DocumentStats(len(subset))
+        stats = score_dataset(model, tokenizer, subset, device, loss_writer=document_stats, **score_args)
+        for key in totals:
+            totals[key] += stats[key]
+        pipeline = merge_pipeline_stats([pipeline, stats['pipeline']])
+        losses.append(document_stats.losses)
+        tokens.append(document_stats.tokens)
+
+        _, half_width = log_perplexity_ci(np.concatenate(losses), np.concatenate(tokens), confidence)
+        interval = perplexity_ci(totals['total_loss'] / totals['total_tokens'], half_width)
+        scored = begin + len(subset)
+        print(f"  Scored {scored:,}/{len(documents):,} documents: perplexity {interval['perplexity']:.4f} "
+              f"+-{interval['relative_half_width']:.2%}")
+        if scored >= MIN_DOCUMENTS and interval['relative_half_width'] <= target_ci:
+            converged = True
+            break
+
+    return dict(
+        totals,
+        **interval,
+        padding_efficiency=padding_efficiency(totals['real_tokens'], totals['computed_tokens']),
+        pipeline=pipeline,
+        documents=sum(len(t) for t in tokens),
+        converged=converged,
+    )
+
+
+def _document_offsets(token_ids):
+    """Document offsets of a tokenized dataset (cached datasets carry their own)."""
+    offsets = getattr(token_ids, 'offsets', None)
+    if offsets is None:
+        offsets = offsets_from_lengths([len(ids) for ids in token_ids])
+    return offsets
+
+
+def _data_parallel_worker(
+    rank: int,
+    world_size: int,
+    model_name: str,
+    device: str,
+    dataset_args: dict,
+    token_ids,
+    score_args: dict,
+    token_losses_path: str = None,
+    quantize: str = None,
+    fast_load: bool = False,
+):
+    """
+    Score one shard of the dataset in a data-parallel worker process.
+
+    The tokenized dataset is read from the token cache (populated by the
+    parent process) unless the parent passed `token_ids` directly. Losses
+    go into the loss file the parent created; shards never share a token.
+    """
+    model, tokenizer, device = load_model(model_name, worker_device(rank, device), quantize, fast_load)
+    if token_ids is None:
+        token_ids = load_token_ids(tokenizer, **dataset_args)
+
+    loss_writer = None
+    if token_losses_path:
+        loss_writer = TokenLossWriter(token_losses_path, _document_offsets(token_ids), resume=True)
+
+    stats = score_dataset(
+        model, tokenizer, token_ids, device,
+        loss_writer=loss_writer, shard=(rank, world_size), **score_args
+    )
+    if loss_writer is not None:
+        loss_writer.flush()
+        stats['tokens_written'] = loss_writer.tokens_written
+    return stats
+
+
+def _load_cached_result(result_cache, cache_key, token_losses_path, confidence, report):
+    """
+    Print and report a cached result.
+
+    Returns:
+        The cached perplexity, or None on a cache miss
+    """
+    cached = result_cache.load(cache_key, token_losses_path)
+    if cached is None:
+        return None
+    metrics = cached['metrics']
+    print(f"\n  [OK] Result cache hit ({cache_key}), computed "
+          f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(cached['created']))} "
+          f"in {metrics['elapsed_seconds']:.1f}s")
+    if token_losses_path:
+        print(f"  [OK] Per-token losses restored to {token_losses_path}.f16")
+    print("\n" + "=" * 60)
+    print(f"Results:")
+    print(f"  Average loss: {metrics['avg_loss']:.4f}")
+    print(f"  Perplexity: {metrics['perplexity']:.4f}")
+    if 'ci_low' in metrics:
+        print(f"  {confidence:.0%} CI: [{metrics['ci_low']:.4f}, {metrics['ci_high']:.4f}]")
+    print(f"  Total tokens: {metrics['total_tokens']:,}")
+    print("=" * 60)
+    report.finish(**metrics, cached=True)
+    return metrics['perplexity']
+
+
+def calculate_perplexity(
+    model_name: str,
+    dataset_name: str = "wikitext",
+    dataset_config: str = "wikitext-2-raw-v1",
+    split: str = "test",
+    max_samples: int = 1000,
+    max_length: int = 512,
+    stride: int = None,
+    reuse_kv: bool = True,
+    max_tokens: int = 2048,
+    pack: bool = False,
+    document_mask: bool = False,
+    token_cache_dir: str = DEFAULT_CACHE_DIR,
+    token_losses_path: str = None,
+    autotune: bool = False,
+    memory_budget_gb: float = None,
+    prefetch_workers: int = 2,
+    prefetch_depth: int = 4,
+    resume: bool = False,
+    checkpoint_path: str = None,
+    checkpoint_every: int = 50,
+    data_parallel: int = 1,
+    streaming: bool = False,
+    data_file: str = None,
+    max_eval_tokens: int = None,
+    stream_chunk_size: int = 1000,
+    loss_chunk_size: int = 1024,
+    quantize: str = None,
+    fast_load: bool = False,
+    target_ci: float = None,
+    confidence: float = 0.95,
+    ci_round_size: int = 100,
+    result_cache_dir: str = DEFAULT_RESULT_CACHE_DIR,
+    report_path: str = None,
+):
+    """
+    Calculate perplexity for a model on a dataset.
+
+    Args:
+        model_name: HuggingFace model name
+        dataset_name: Dataset name from HuggingFace datasets
+        dataset_config: Dataset configuration
+        split: Dataset split to use
+        max_samples: Maximum number of samples to evaluate
+        max_length: Context length in tokens
+        stride: If set, score samples in full with a sliding window that
+            advances by this many tokens
+        reuse_kv: Reuse cached keys/values across sliding windows when the
+            model supports it
+        max_tokens: Token budget per batch in batched and packed modes
+        pack: Pack samples into dense blocks of max_length tokens
+        document_mask: In packed mode, keep attention within each sample
+        token_cache_dir: Directory of the pre-tokenized dataset cache, or
+            None to tokenize from scratch
+        token_losses_path: If set, stream per-token losses to a float16
+            memmap at this prefix (see token_losses.py)
+        autotune: Replace max_tokens with the largest batch that fits in
+            memory (and lower max_length if a single sample does not fit)
+        memory_budget_gb: Memory budget for autotuning; defaults to 90% of
+            RAM on CPU and to the device's real capacity on GPU
+        prefetch_workers: Threads collating batches in the background
+            (0 prepares each batch inline)
+        prefetch_depth: Batches prepared and copied ahead of the model
+        resume: Continue from the last checkpoint of an interrupted run
+            with the same configuration
+        checkpoint_path: Checkpoint file; defaults to one named after the
+            run configuration in checkpoint.DEFAULT_CHECKPOINT_DIR
+        checkpoint_every: Save a checkpoint every this many batches
+            (documents in sliding-window mode); 0 disables checkpointing
+        data_parallel: Number of worker processes, each scoring a shard on
+            its own GPU (or CPU socket); 0 uses every GPU or socket. The
+            reduced result is identical to a single-process run.
+            Autotuning and checkpointing are single-process only.
+        streaming: Read the dataset lazily instead of materializing it,
+            scoring `stream_chunk_size` documents at a time; bypasses the
+            token cache and does not support token losses, checkpoints or
+            data parallelism
+        data_file: Stream documents from a local .jsonl or text file (one
+            document per line) instead of a HuggingFace dataset
+        max_eval_tokens: In streaming mode, stop after this many tokens
+        stream_chunk_size: Documents tokenized and scored together when streaming
+        loss_chunk_size: Positions projected to the vocabulary at a time
+            when computing the loss; 0 materializes full logits
+        quantize: 'int8' or 'int4' to run the model on CPU with quantized
+            linear layers (see quantization.py)
+        fast_load: Load the model by streaming its safetensors shards into
+            a meta-device model (see fast_loader.py)
+        target_ci: If set, score documents in random order and stop once
+            the perplexity CI's relative half-width is at most this (e.g.
+            0.005 for +-0.5%); max_samples is then an upper bound.
+            Single-process only, without token losses or checkpoints.
+        confidence: Coverage of the reported confidence interval
+        ci_round_size: Documents scored between CI checks with target_ci
+        result_cache_dir: Directory of the result cache, or None to always
+            recompute (see result_cache.py)
+        report_path: If set, stream [REPORT] progress lines and write a
+            JSON performance report here (see report.py)
+    """
+    print(f"Calculating perplexity for {model_name}")
+    print("=" * 60)
+    report = PerfReport('calculate_perplexity', report_path)
+
+    default_device = "cuda" if torch.cuda.is_available() and not quantize else "cpu"
+    world_size = data_parallel or default_world_size(default_device)
+    if world_size > 1 and autotune:
+        raise ValueError("--autotune is single-process only; tune once without --data-parallel")
+    streaming = streaming or data_file is not None
+    if streaming and (world_size > 1 or token_losses_path or resume):
+        raise ValueError("Streaming does not support --data-parallel, --token-losses or --resume")
+    if target_ci and (world_size > 1 or streaming or token_losses_path or resume):
+        raise ValueError("--target-ci does not support --data-parallel, --streaming, --token-losses or --resume")
+
+    result_cache = None
+    if result_cache_dir:
+        revision = model_revision(model_name)
+        if revision is None:
+            print("  [WARNING] Could not resolve the model revision; result cache disabled")
+        else:
+            result_cache = ResultCache(result_cache_dir)
+            cache_inputs = {
+                'model': model_name,
+                'revision': revision,
+                'source': source_fingerprint(),
+                'device_type': device_type(default_device),
+                'dtype': quantize or str(torch.float16 if default_device == "cuda" else torch.float32),
+                'dataset_name': dataset_name,
+                'dataset_config': dataset_config,
+                'split': split,
+                'max_samples': max_samples,
+                'data_file': file_fingerprint(data_file) if data_file else None,
+                'streaming': streaming,
+                'max_eval_tokens': max_eval_tokens,
+                'max_length': max_length,
+                'stride': stride,
+                'reuse_kv': reuse_kv,
+                'max_tokens': max_tokens,
+                'pack': pack,
+                'document_mask': document_mask,
+                'loss_chunk_size': loss_chunk_size,
+                'target_ci': [target_ci, confidence, ci_round_size] if target_ci else None,
+            }
+            # Autotuned settings are only known once the model is loaded,
+            # so those runs look the cache up after tuning
+            if not autotune:
+                cache_key = result_cache.key(cache_inputs)
+                cached = _load_cached_result(result_cache, cache_key, token_losses_path, confidence, report)
+                if cached is not None:
+                    return cached
+
+    with report.stage('model_load'):
+        if world_size > 1:
+            # Workers load the model themselves; the parent only fills the token cache
+            model = None
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            device = default_device
+        else:
+            model, tokenizer, device = load_model(model_name, quantize=quantize, fast_load=fast_load, report=report)
+
+    dataset_args = {
+        'dataset_name': dataset_name,
+        'dataset_config': dataset_config,
+        'split': split,
+        'max_samples': max_samples,
+        'token_cache_dir': token_cache_dir,
+    }
+    if streaming:
+        token_ids = None
+        source = data_file or f"{dataset_name}/{dataset_config}"
+        print(f"\nStreaming dataset: {source}")
+    else:
+        with report.stage('tokenization'):
+            token_ids = load_token_ids(tokenizer, **dataset_args)
+        if token_ids is None:
+            report.finish(error="dataset could not be loaded")
+            return None
+
+    if autotune:
+        print("\nAutotuning batch size...")
+        if memory_budget_gb:
+            budget = int(memory_budget_gb * 1e9)
+        else:
+            # CPUs swap rather than fail, so they always need an explicit budget
+            budget = default_memory_budget(device) if device == "cpu" else None
+        with report.stage('autotune'):
+            tuned = autotune_batch_size(
+                make_probe(model, device, budget, loss_chunk_size),
+                model_name,
+                device,
+                quantize or str(model.dtype).replace('torch.', ''),
+                max_length,
+                memory_budget_bytes=budget,
+                variant=f"loss_chunk={loss_chunk_size or 0}",
+            )
+        max_tokens = tuned['max_tokens']
+        max_length = tuned['seq_len']
+        if result_cache is not None:
+            cache_inputs.update(max_length=max_length, max_tokens=max_tokens)
+            cache_key = result_cache.key(cache_inputs)
+            cached = _load_cached_result(result_cache, cache_key, token_losses_path, confidence, report)
+            if cached is not None:
+                return cached
+
+    run_config = {
+        'model': model_name,
+        'dataset_name': dataset_name,
+        'dataset_config': dataset_config,
+        'split': split,
+        'max_samples': max_samples,
+        'max_length': max_length,
+        'stride': stride,
+        'reuse_kv': reuse_kv,
+        'max_tokens': max_tokens,
+        'pack': pack,
+        'document_mask': document_mask,
+        'dtype': quantize or str(torch.float16 if device.startswith("cuda") else torch.float32),
+        'token_cache_key': getattr(token_ids, 'metadata', {}).get('key'),
+    }
+    score_args = {
+        'max_length': max_length,
+        'stride': stride,
+        'reuse_kv': reuse_kv,
+        'max_tokens': max_tokens,
+        'pack': pack,
+        'document_mask': document_mask,
+        'prefetch_workers': prefetch_workers,
+        'prefetch_depth': prefetch_depth,
+        'loss_chunk_size': loss_chunk_size,
+    }
+
+    loss_writer = None
+    if token_losses_path:
+        loss_writer = TokenLossWriter(
+            token_losses_path, _document_offsets(token_ids), metadata=run_config,
+            resume=resume and world_size == 1
+        )
+
+    # Calculate perplexity
+    print("\nCalculating perplexity...")
+    start = time.perf_counter()
+    checkpoint = None
+    if world_size > 1:
+        if resume:
+            print("  [WARNING] --resume is single-process only; starting from scratch")
+        if loss_writer is not None:
+            loss_writer.flush()
+        print(f"  Scoring with {world_size} data-parallel workers on {device}")
+        results = run_workers(
+            _data_parallel_worker,
+            world_size,
+            model_name=model_name,
+            device=device,
+            dataset_args=dataset_args,
+            # Cached datasets are reopened by the workers instead of being pickled
+            token_ids=None if token_cache_dir else token_ids,
+            score_args=score_args,
+            token_losses_path=token_losses_path,
+            quantize=quantize,
+            fast_load=fast_load,
+        )
+        stats = reduce_stats(results)
+        if loss_writer is not None:
+            loss_writer.tokens_written = sum(result['tokens_written'] for result in results)
+    elif streaming:
+        chunks = iter_token_chunks(
+            tokenizer,
+            iter_texts(dataset_name, dataset_config, split, data_file),
+            chunk_size=stream_chunk_size,
+            max_samples=max_samples,
+            max_tokens=max_eval_tokens,
+        )
+        stats = score_stream(model, tokenizer, chunks, device, report=report, **score_args)
+    elif target_ci:
+        stats = score_adaptive(
+            model, tokenizer, token_ids, device, target_ci,
+            confidence=confidence, round_size=ci_round_size, report=report, **score_args
+        )
+    else:
+        if checkpoint_every:
+            checkpoint_config = dict(run_config, token_losses_path=token_losses_path)
+            checkpoint = EvalCheckpoint(
+                checkpoint_path or default_checkpoint_path(checkpoint_config),
+                checkpoint_config,
+                every=checkpoint_every,
+                resume=resume,
+                loss_writer=loss_writer,
+            )
+        stats = score_dataset(
+            model, tokenizer, token_ids, device,
+            loss_writer=loss_writer, checkpoint=checkpoint, report=report, **score_args
+        )
+
+    elapsed = time.perf_counter() - start
+    # Streaming tokenizes as it goes, so its tokenization time is counted here
+    report.stages['forward'] = elapsed
+    if loss_writer is not None:
+        loss_writer.close()
+        print(f"  [OK] Per-token losses written to {token_losses_path}.f16")
+    if checkpoint is not None:
+        checkpoint.complete()
+    total_loss = stats['total_loss']
+    total_tokens = stats['total_tokens']
+
     # Calculate final perplexity
     avg_loss = total_loss / total_tokens if total_tokens > 0 else float('inf')
     perplexity = np.exp(avg_loss)
-    
+
     print("\n" + "=" * 60)
     print(f"Results:")
     print(f"  Average loss: {avg_loss:.4f}")
     print(f"  Perplexity: {perplexity:.4f}")
+    if target_ci:
+        print(f"  {confidence:.0%} CI: [{stats['ci_low']:.4f}, {stats['ci_high']:.4f}] "
+              f"(+-{stats['relative_half_width']:.2%} from {stats['documents']:,} documents, "
+              f"target {'reached' if stats['converged'] else 'NOT reached'})")
     print(f"  Total tokens: {total_tokens:,}")
+    print(f"  Throughput: {total_tokens / elapsed:,.0f} tokens/s")
+    print(f"  Padding efficiency: {stats['padding_efficiency']:.1%}")
+    pipeline = stats['pipeline']
+    print(f"  Prefetch: waited {pipeline['consumer_stall_seconds']:.2f}s for data, "
+          f"{pipeline['producer_stall_seconds']:.2f}s for the model "
+          f"(mean queue depth {pipeline['mean_queue_depth']:.1f}, bottleneck: {pipeline['bottleneck']})")
     print("=" * 60)
-    
+
+    if result_cache is not None:
+        metrics = {
+            'perplexity': float(perplexity),
+            'avg_loss': avg_loss,
+            'total_tokens': total_tokens,
+            'padding_efficiency': stats['padding_efficiency'],
+            'elapsed_seconds': elapsed,
+        }
+        if target_ci:
+            metrics.update({key: stats[key] for key in ('ci_low', 'ci_high', 'relative_half_width', 'documents')})
+        result_cache.store(cache_key, metrics, cache_inputs, token_losses_path)
+
+    report.finish(
+        perplexity=float(perplexity),
+        avg_loss=avg_loss,
+        total_tokens=total_tokens,
+        computed_tokens=stats['computed_tokens'],
+        tokens_per_second=stats['computed_tokens'] / elapsed,
+        padding_efficiency=stats['padding_efficiency'],
+        pipeline=stats['pipeline'],
+        world_size=world_size,
+        cached=False,
+    )
     return perplexity
 
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Calculate perplexity for a model on a dataset.",
+        epilog="Example: python calculate_perplexity.py gpt2 wikitext 1000 --max-length 4096 --stride 2048",
+    )
+    parser.add_argument("model_name", help="HuggingFace model name")
+    parser.add_argument("dataset_name", nargs="?", default="wikitext", help="HuggingFace dataset name")
+    parser.add_argument("max_samples", nargs="?", type=int, default=1000, help="Maximum number of samples")
+    parser.add_argument("--dataset-config", default="wikitext-2-raw-v1", help="Dataset configuration")
+    parser.add_argument("--split", default="test", help="Dataset split")
+    parser.add_argument("--max-length", type=int, default=512, help="Context length in tokens")
+    parser.add_argument("--max-tokens", type=int, default=2048,
+                        help="Token budget per batch in batched and packed modes")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Find the largest batch that fits in memory instead of using --max-tokens")
+    parser.add_argument("--memory-budget-gb", type=float, default=None,
+                        help="Memory budget for --autotune (default: 90%% of RAM on CPU, device capacity on GPU)")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default=None,
+                        help="Run on CPU with int8 (dynamic) or int4 (weight-only) linear layers")
+    parser.add_argument("--fast-load", action="store_true",
+                        help="Stream safetensors shards into a meta-device model and report the load breakdown")
+    parser.add_argument("--loss-chunk-size", type=int, default=1024,
+                        help="Positions per LM head chunk in the loss (0: materialize full logits)")
+    parser.add_argument("--pack", action="store_true",
+                        help="Pack samples with EOS separators into dense blocks of --max-length tokens")
+    parser.add_argument("--document-mask", action="store_true",
+                        help="With --pack, restrict attention to each sample")
+    parser.add_argument("--stride", type=int, default=None,
+                        help="Score full samples with a sliding window advancing by this many tokens")
+    parser.add_argument("--no-kv-reuse", action="store_true",
+                        help="Recompute every sliding window instead of reusing the KV cache")
+    parser.add_argument("--prefetch-workers", type=int, default=2,
+                        help="Threads collating batches ahead of the model (0 disables prefetching)")
+    parser.add_argument("--prefetch-depth", type=int, default=4,
+                        help="Batches prepared and copied to the device ahead of the model")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the last checkpoint of an interrupted run with the same settings")
+    parser.add_argument("--checkpoint", default=None, metavar="PATH",
+                        help="Checkpoint file (default: named after the run settings in ~/.cache)")
+    parser.add_argument("--checkpoint-every", type=int, default=50,
+                        help="Save a checkpoint every N batches (0 disables checkpointing)")
+    parser.add_argument("--data-parallel", type=int, default=1, metavar="N",
+                        help="Score shards in N worker processes, one per GPU or CPU socket (0: all of them)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Read, tokenize and score the dataset lazily with bounded memory")
+    parser.add_argument("--data-file", default=None, metavar="PATH",
+                        help="Stream documents from a local .jsonl or text file (implies --streaming)")
+    parser.add_argument("--max-eval-tokens", type=int, default=None,
+                        help="With --streaming, stop after this many tokens")
+    parser.add_argument("--stream-chunk-size", type=int, default=1000,
+                        help="Documents tokenized and scored together when streaming")
+    parser.add_argument("--target-ci", type=float, default=None, metavar="FRACTION",
+                        help="Stop once the perplexity CI is within +-FRACTION (e.g. 0.005); "
+                             "max_samples becomes an upper bound")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Coverage of the --target-ci interval")
+    parser.add_argument("--ci-round-size", type=int, default=100,
+                        help="Documents scored between confidence interval checks")
+    parser.add_argument("--token-cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory of the pre-tokenized dataset cache")
+    parser.add_argument("--no-token-cache", action="store_true",
+                        help="Tokenize from scratch without reading or writing the token cache")
+    parser.add_argument("--token-losses", default=None, metavar="PATH",
+                        help="Stream per-token losses to a float16 memmap at this path prefix")
+    parser.add_argument("--result-cache-dir", default=DEFAULT_RESULT_CACHE_DIR,
+                        help="Directory of cached final results")
+    parser.add_argument("--no-result-cache", action="store_true",
+                        help="Always recompute, without reading or writing the result cache")
+    parser.add_argument("--report", default=None, metavar="PATH",
+                        help="Print [REPORT] JSON progress lines and write a JSON performance report to PATH")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python calculate_perplexity.py <model_name> [dataset_name] [max_samples]")
-        print("  Example: python calculate_perplexity.py gpt2 wikitext 1000")
-        sys.exit(1)
-    
-    model_name = sys.argv[1]
-    dataset_name = sys.argv[2] if len(sys.argv) > 2 else "wikitext"
-    max_samples = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
-    
-    perplexity = calculate_perplexity(model_name, max_samples=max_samples)
+    args = parse_args()
+
+    perplexity = calculate_perplexity(
+        args.model_name,
+        dataset_name=args.dataset_name,
+        dataset_config=args.dataset_config,
+        split=args.split,
+        max_samples=args.max_samples,
+        max_length=args.max_length,
+        stride=args.stride,
+        reuse_kv=not args.no_kv_reuse,
+        max_tokens=args.max_tokens,
+        pack=args.pack,
+        document_mask=args.document_mask,
+        token_cache_dir=None if args.no_token_cache else args.token_cache_dir,
+        token_losses_path=args.token_losses,
+        autotune=args.autotune,
+        memory_budget_gb=args.memory_budget_gb,
+        prefetch_workers=args.prefetch_workers,
+        prefetch_depth=args.prefetch_depth,
+        resume=args.resume,
+        checkpoint_path=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        data_parallel=args.data_parallel,
+        streaming=args.streaming,
+        data_file=args.data_file,
+        max_eval_tokens=args.max_eval_tokens,
+        stream_chunk_size=args.stream_chunk_size,
+        loss_chunk_size=args.loss_chunk_size,
+        quantize=args.quantize,
+        fast_load=args.fast_load,
+        target_ci=args.target_ci,
+        confidence=args.confidence,
+        ci_round_size=args.ci_round_size,
+        result_cache_dir=None if args.no_result_cache else args.result_cache_dir,
+        report_path=args.report,
+    )
     if perplexity is None:
         sys.exit(1)
-
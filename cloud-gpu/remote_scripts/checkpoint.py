@@ -0,0 +1,166 @@
+"""
+Resumable evaluation checkpoints.
+
+The running loss and token counters of a scoring loop, its cursor (the
+number of batches or documents already committed) and the RNG state are
+saved to a small JSON file every few batches. A resumed run restores them
+and skips the committed work. Batches are built deterministically and the
+counters are stored exactly (JSON round-trips Python floats), so a resumed
+run reports the same result as an uninterrupted one.
+
+The checkpoint records the run's configuration and refuses to resume a
+run with a different one. It is removed once the run completes.
+"""
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import torch
+
+DEFAULT_CHECKPOINT_DIR = os.environ.get(
+    "CHECKPOINT_DIR", os.path.expanduser("~/.cache/transformer-questions/checkpoints")
+)
+
+TOTALS = ('total_loss', 'total_tokens', 'real_tokens', 'computed_tokens')
+
+
+def config_key(config: Dict[str, Any]) -> str:
+    """Short hash identifying a run configuration."""
+    payload = json.dumps(config, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def default_checkpoint_path(config: Dict[str, Any]) -> str:
+    """Checkpoint file for a configuration in DEFAULT_CHECKPOINT_DIR."""
+    return os.path.join(DEFAULT_CHECKPOINT_DIR, f"{config_key(config)}.json")
+
+
+def _encode_tensor(tensor: torch.Tensor) -> str:
+    return base64.b64encode(tensor.numpy().tobytes()).decode('ascii')
+
+
+def _decode_tensor(data: str) -> torch.Tensor:
+    return torch.from_numpy(np.frombuffer(base64.b64decode(data), dtype=np.uint8).copy())
+
+
+def get_rng_state() -> Dict[str, Any]:
+    """Capture the Python, numpy and torch RNG states as JSON-serializable data."""
+    version, internal, gauss = random.getstate()
+    name, keys, pos, has_gauss, cached = np.random.get_state()
+    state = {
+        'python': [version, list(internal), gauss],
+        'numpy': [name, keys.tolist(), pos, has_gauss, cached],
+        'torch': _encode_tensor(torch.get_rng_state()),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = [_encode_tensor(s) for s in torch.cuda.get_rng_state_all()]
+    return state
+
+
+def set_rng_state(state: Dict[str, Any]):
+    """Restore RNG states captured by get_rng_state."""
+    version, internal, gauss = state['python']
+    random.setstate((version, tuple(internal), gauss))
+    name, keys, pos, has_gauss, cached = state['numpy']
+    np.random.set_state((name, np.asarray(keys, dtype=np.uint32), pos, has_gauss, cached))
+    torch.set_rng_state(_decode_tensor(state['torch']))
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([_decode_tensor(s) for s in state['cuda']])
+
+
+class EvalCheckpoint:
+    """Periodic checkpoint of a scoring loop's running totals."""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        config: Optional[Dict[str, Any]] = None,
+        every: int = 50,
+        resume: bool = False,
+        loss_writer=None,
+    ):
+        """
+        Open (and, with `resume`, load) a checkpoint.
+
+        Args:
+            path: Checkpoint file, or None to disable checkpointing
+            config: JSON-serializable run configuration; resuming a
+                checkpoint written with a different one raises ValueError
+            every: Save after this many committed batches (0 disables saving)
+            resume: Restore the saved state if the file exists
+            loss_writer: TokenLossWriter flushed before every save, so the
+                loss file is never behind the checkpoint
+        """
+        self.path = path
+        self.config = config or {}
+        self.every = every
+        self.loss_writer = loss_writer
+        self.state = None
+        self._since_save = 0
+
+        if path and resume and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state['config'] != json.loads(json.dumps(self.config, default=str)):
+                raise ValueError(f"Checkpoint {path} was written by a run with a different configuration")
+            self.state = state
+
+    def restore(self) -> Tuple[int, Dict[str, Any]]:
+        """
+        Restore the saved state, if any.
+
+        Returns:
+            Tuple of (cursor, totals): the number of batches or documents
+            already committed and the running totals at that point
+        """
+        if self.state is None:
+            return 0, {'total_loss': 0.0, 'total_tokens': 0, 'real_tokens': 0, 'computed_tokens': 0}
+
+        set_rng_state(self.state['rng'])
+        if self.loss_writer is not None:
+            self.loss_writer.tokens_written = self.state['tokens_written']
+        print(f"  [OK] Resuming from checkpoint at {self.state['cursor']} "
+              f"({self.state['totals']['total_tokens']:,} tokens scored)")
+        return self.state['cursor'], dict(self.state['totals'])
+
+    def step(self, cursor: int, totals: Callable[[], Dict[str, Any]]):
+        """
+        Commit one batch; saves every `every` calls.
+
+        `totals` is only called when a save is due, so running totals kept
+        on the device (see LossAccumulator) are not synchronized every batch.
+        """
+        self._since_save += 1
+        if self.path and self.every and self._since_save >= self.every:
+            self.save(cursor, **totals())
+
+    def save(self, cursor: int, **totals):
+        """Write the checkpoint atomically."""
+        if self.loss_writer is not None:
+            self.loss_writer.flush()
+        state = {
+            'config': self.config,
+            'cursor': cursor,
+            'totals': {key: totals[key] for key in TOTALS},
+            'tokens_written': self.loss_writer.tokens_written if self.loss_writer is not None else 0,
+            'rng': get_rng_state(),
+            'timestamp': time.time(),
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, self.path)
+        self._since_save = 0
+
+    def complete(self):
+        """Remove the checkpoint after a finished run."""
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,103 @@
+"""
+Token losses computed from hidden states in chunks.
+
+Calling a causal LM materializes ``[batch, seq, vocab]`` logits, which
+``F.cross_entropy`` then upcasts to fp32. For large-vocabulary models
+(Qwen2.5 has 152k tokens) that tensor, not the weights, limits the batch
+size. Here the model's backbone is run without its LM head, and the head
+is applied to at most ``chunk_size`` positions at a time. Peak loss
+memory is ``chunk_size * vocab`` instead of ``batch * seq * vocab``.
+
+Every position is projected, including padding and unscored context, and
+the loss of those is zeroed afterwards. Selecting only the scored
+positions would need their count on the host, a device sync per batch;
+with fixed-shape chunks the whole loss is queued without one.
+
+Per-token losses are the same as from full logits: each position's
+log-softmax only depends on its own row of logits.
+"""
+from typing import Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+# Config attributes of heads that post-process logits beyond the LM head
+_LOGIT_TRANSFORMS = ('final_logit_softcapping', 'logit_scale', 'output_multiplier_scale', 'logits_scaling')
+
+
+def supports_chunked_loss(model) -> bool:
+    """
+    Check whether the model's logits are just its LM head applied to the backbone output.
+
+    Models that rescale or soft-cap logits after the head (e.g. Gemma 2,
+    Cohere) fall back to full logits.
+    """
+    if model.get_output_embeddings() is None or getattr(model, 'base_model', model) is model:
+        return False
+    return all(getattr(model.config, attr, None) in (None, 1, 1.0) for attr in _LOGIT_TRANSFORMS)
+
+
+def chunked_nll(hidden: torch.Tensor, lm_head, targets: torch.Tensor, chunk_size: int = 1024) -> torch.Tensor:
+    """
+    Negative log-likelihood of `targets` given hidden states, chunk by chunk.
+
+    Args:
+        hidden: [..., hidden_size] backbone output
+        lm_head: Module mapping hidden states to vocabulary logits
+        targets: [...] token id each position predicts, -100 for none
+        chunk_size: Positions projected to the vocabulary at a time
+
+    Returns:
+        Tensor shaped like `targets`, zero where the target is -100
+    """
+    nll = torch.empty(targets.shape, dtype=torch.float32, device=hidden.device)
+    flat_nll = nll.view(-1)
+    flat_targets = targets.reshape(-1)
+    valid = flat_targets != -100
+    # Any id will do for positions without a target; their loss is discarded
+    safe_targets = flat_targets.clamp(min=0)
+    flat_hidden = hidden.reshape(-1, hidden.size(-1))
+
+    for start in range(0, flat_targets.numel(), chunk_size):
+        end = start + chunk_size
+        logits = lm_head(flat_hidden[start:end]).float()
+        losses = F.cross_entropy(logits, safe_targets[start:end], reduction='none')
+        # where, not multiply: padding rows may hold non-finite values
+        flat_nll[start:end] = torch.where(valid[start:end], losses, 0.0)
+    return nll
+
+
+def forward_nll(
+    model,
+    targets: torch.Tensor,
+    chunk_size: Optional[int] = 1024,
+    **inputs,
+) -> Tuple[torch.Tensor, object]:
+    """
+    Run the model and return the per-position NLL of `targets`.
+
+    Args:
+        model: Causal LM
+        targets: [batch, seq] token id predicted at each input position
+            (-100 where nothing is scored)
+        chunk_size: Positions per LM head chunk; None or 0 (or a model
+            without a plain LM head) computes full logits instead
+        inputs: Model inputs (input_ids, attention_mask, past_key_values, ...)
+
+    Returns:
+        Tuple of (nll shaped like `targets`, model outputs)
+    """
+    if chunk_size and supports_chunked_loss(model):
+        outputs = model.base_model(**inputs)
+        nll = chunked_nll(outputs[0], model.get_output_embeddings(), targets, chunk_size)
+        return nll, outputs
+
+    outputs = model(**inputs)
+    logits = outputs.logits
+    nll = F.cross_entropy(
+        logits.float().reshape(-1, logits.size(-1)),
+        targets.reshape(-1),
+        ignore_index=-100,
+        reduction='none'
+    )
+    return nll.view(targets.shape), outputs
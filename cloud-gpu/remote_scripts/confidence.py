@@ -0,0 +1,98 @@
+"""
+Confidence intervals for perplexity, and early stopping on their width.
+
+Perplexity is ``exp(R)`` with ``R = sum(L_d) / sum(n_d)``, the ratio of
+the summed token losses ``L_d`` and token counts ``n_d`` of the scored
+documents. Treating documents as the sampling unit, the delta method gives
+the standard error of the ratio estimate
+
+    se(R) = sqrt(sum((L_d - R * n_d) ** 2) / (m * (m - 1))) / mean(n_d)
+
+over ``m`` documents, and an interval ``exp(R +- z * se)`` for perplexity.
+Tokens within a document are correlated, so per-token variance would be
+far too optimistic; per-document variance is not.
+
+`DocumentStats` collects the per-document sums during scoring. It has the
+interface of `TokenLossWriter`, so it plugs into the scoring loops as their
+`loss_writer` without changing them.
+"""
+import math
+from statistics import NormalDist
+from typing import Dict, Tuple
+
+import numpy as np
+
+# Below this many documents the variance estimate itself is too noisy to stop on
+MIN_DOCUMENTS = 30
+
+
+class DocumentStats:
+    """Summed loss and token count of every document, filled by a scoring loop."""
+
+    def __init__(self, num_documents: int):
+        self.losses = np.zeros(num_documents, dtype=np.float64)
+        self.tokens = np.zeros(num_documents, dtype=np.int64)
+        self.tokens_written = 0
+
+    def write(self, documents: np.ndarray, positions: np.ndarray, losses: np.ndarray):
+        """Record losses for individual tokens (as TokenLossWriter.write)."""
+        documents = np.asarray(documents, dtype=np.int64)
+        np.add.at(self.losses, documents, np.asarray(losses, dtype=np.float64))
+        np.add.at(self.tokens, documents, 1)
+        self.tokens_written += len(documents)
+
+    def write_document(self, document: int, start: int, losses: np.ndarray):
+        """Record losses for consecutive tokens of one document (as TokenLossWriter.write_document)."""
+        self.losses[document] += float(np.asarray(losses, dtype=np.float64).sum())
+        self.tokens[document] += len(losses)
+        self.tokens_written += len(losses)
+
+    def flush(self):
+        pass
+
+
+def log_perplexity_ci(losses: np.ndarray, tokens: np.ndarray, confidence: float = 0.95) -> Tuple[float, float]:
+    """
+    Delta-method confidence interval of the log-perplexity.
+
+    Args:
+        losses: Summed token loss of each document
+        tokens: Scored token count of each document
+        confidence: Coverage of the interval
+
+    Returns:
+        Tuple of (log-perplexity estimate, half-width of the interval);
+        the half-width is infinite with fewer than two scored documents
+    """
+    losses = np.asarray(losses, dtype=np.float64)
+    tokens = np.asarray(tokens, dtype=np.float64)
+    scored = tokens > 0
+    losses, tokens = losses[scored], tokens[scored]
+    m = len(tokens)
+    if m == 0:
+        return float('nan'), float('inf')
+
+    estimate = losses.sum() / tokens.sum()
+    if m < 2:
+        return float(estimate), float('inf')
+    residuals = losses - estimate * tokens
+    se = math.sqrt((residuals ** 2).sum() / (m * (m - 1))) / tokens.mean()
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return float(estimate), z * se
+
+
+def perplexity_ci(log_ppl: float, half_width: float) -> Dict[str, float]:
+    """
+    Perplexity interval for a log-perplexity estimate and CI half-width.
+
+    Returns:
+        Dict with perplexity, ci_low, ci_high and relative_half_width
+        (the interval's upper half-width as a fraction of perplexity, the
+        quantity compared against a --target-ci)
+    """
+    return {
+        'perplexity': math.exp(log_ppl),
+        'ci_low': math.exp(log_ppl - half_width),
+        'ci_high': math.exp(log_ppl + half_width),
+        'relative_half_width': math.expm1(half_width),
+    }
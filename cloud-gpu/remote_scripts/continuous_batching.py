@@ -0,0 +1,416 @@
+"""
+Continuous-batching greedy generation with a paged KV cache.
+
+Static batching (``model.generate`` on a padded batch) keeps every row
+until the longest one finishes and reserves cache for the longest prompt
+plus the longest continuation in every row. This engine instead schedules
+per decoding step:
+
+- Every step decodes one token for all running sequences at once.
+- Finished sequences leave the batch immediately, and waiting requests
+  are admitted (prefilled) as soon as a batch slot and enough cache
+  blocks are free.
+- Keys/values live in one pool per layer, split into blocks of
+  ``block_size`` positions. A sequence holds a list of blocks (its block
+  table) and takes a new one only when it crosses a block boundary, so at
+  most ``block_size - 1`` positions per sequence are unused and freed
+  blocks are reusable by any sequence, whatever its length.
+- When a sequence needs a block and none is free, the most recently
+  admitted sequence is preempted: its blocks are freed and it goes back to
+  the front of the queue, to be prefilled again (prompt plus the tokens it
+  already generated) once memory is available. Outputs are unaffected.
+
+Attention itself is computed by the unmodified HF model, through a
+``Cache`` over the block tables (PagedCache): when a layer's attention
+updates the cache, the step's new keys/values are written into the
+sequences' blocks and that layer's cached positions are gathered, left
+padded, for its attention call. Only one layer's gathered copy is alive at
+a time. A fused paged-attention kernel would read the blocks in place; the
+gather costs one extra read of the cache per step but works with any model
+using DynamicCache layers.
+
+The pools grow on demand: blocks are handed out lowest-numbered first and
+a layer's pool is extended (by at least a quarter, up to ``num_blocks``) only when a
+block beyond its end is written, so memory follows the peak number of
+blocks in use rather than the configured maximum.
+"""
+import heapq
+import time
+from collections import deque
+from typing import Iterable, List, Optional, Sequence
+
+import torch
+from transformers.cache_utils import Cache, DynamicLayer
+
+
+def blocks_needed(num_tokens: int, block_size: int) -> int:
+    """Cache blocks holding `num_tokens` positions."""
+    return -(-num_tokens // block_size)
+
+
+class BlockAllocator:
+    """Free list of fixed-size cache blocks, handing out the lowest-numbered first."""
+
+    def __init__(self, num_blocks: int):
+        if num_blocks < 1:
+            raise ValueError(f"num_blocks must be positive, got {num_blocks}")
+        self.num_blocks = num_blocks
+        # Already a valid heap
+        self._free = list(range(num_blocks))
+
+    @property
+    def num_free(self) -> int:
+        return len(self._free)
+
+    @property
+    def num_used(self) -> int:
+        return self.num_blocks - len(self._free)
+
+    def allocate(self, count: int) -> List[int]:
+        """Take `count` blocks; raises MemoryError if fewer are free."""
+        if count > len(self._free):
+            raise MemoryError(f"{count} cache blocks requested, {len(self._free)} free")
+        return [heapq.heappop(self._free) for _ in range(count)]
+
+    def free(self, blocks: Iterable[int]):
+        for block in blocks:
+            heapq.heappush(self._free, block)
+
+
+class PagedKVCache:
+    """Keys and values of all sequences, in one pool of blocks per layer."""
+
+    def __init__(self, num_layers: int, num_blocks: int, block_size: int, device: str):
+        """
+        Initialize paged KV cache.
+
+        The pools are allocated on the first write, with the head layout
+        and dtype of the keys the model produces, and grow as higher
+        blocks are written.
+
+        Args:
+            num_layers: Decoder layers of the model
+            num_blocks: Blocks in each layer's pool
+            block_size: Positions per block
+            device: Device holding the pools
+        """
+        self.num_layers = num_layers
+        self.block_size = block_size
+        self.device = device
+        self.allocator = BlockAllocator(num_blocks)
+        self.keys: List[Optional[torch.Tensor]] = [None] * num_layers
+        self.values: List[Optional[torch.Tensor]] = [None] * num_layers
+        # Largest keys+values copy gathered for one layer's attention
+        self.peak_gather_bytes = 0
+
+    def slots(self, block_table: Sequence[int], start: int, end: int) -> List[int]:
+        """Flat pool slots of positions [start, end) of a sequence."""
+        size = self.block_size
+        return [block_table[position // size] * size + position % size for position in range(start, end)]
+
+    def write(self, layer: int, slots: torch.Tensor, keys: torch.Tensor, values: torch.Tensor):
+        """
+        Store keys/values at pool slots.
+
+        Args:
+            slots: Slot of each position, shape (N,)
+            keys: Keys of each position, shape (N, heads, head_dim)
+            values: Values of each position, shape (N, heads, head_dim)
+        """
+        self._reserve(layer, int(slots.max()) + 1, keys, values)
+        self.keys[layer][slots] = keys
+        self.values[layer][slots] = values
+
+    def _reserve(self, layer: int, num_slots: int, keys: torch.Tensor, values: torch.Tensor):
+        """Grow a layer's pools to hold at least `num_slots` slots."""
+        current = 0 if self.keys[layer] is None else self.keys[layer].shape[0]
+        if num_slots <= current:
+            return
+        size = self.block_size
+        capacity = min(self.allocator.num_blocks * size, max(blocks_needed(num_slots, size), blocks_needed(current * 5 // 4, size)) * size)
+        grown = []
+        for pool, new in ((self.keys[layer], keys), (self.values[layer], values)):
+            # Unwritten slots are never read: padding points at a written slot of the same sequence
+            tensor = torch.empty((capacity,) + tuple(new.shape[1:]), dtype=new.dtype, device=self.device)
+            if pool is not None:
+                tensor[:current] = pool
+            grown.append(tensor)
+        self.keys[layer], self.values[layer] = grown
+
+    def gather(self, layer: int, slots: torch.Tensor):
+        """
+        Read keys/values at pool slots as a batch.
+
+        Args:
+            slots: Slot of every cached position of every sequence, shape
+                (batch, length); padding may point at any slot
+
+        Returns:
+            Tuple of keys and values, each (batch, heads, length, head_dim)
+        """
+        keys, values = self.keys[layer][slots].transpose(1, 2), self.values[layer][slots].transpose(1, 2)
+        gathered = keys.numel() * keys.element_size() + values.numel() * values.element_size()
+        self.peak_gather_bytes = max(self.peak_gather_bytes, gathered)
+        return keys, values
+
+    def pool_bytes(self) -> int:
+        """Memory currently allocated for the pools of all layers."""
+        return sum(pool.numel() * pool.element_size()
+                   for pool in self.keys + self.values if pool is not None)
+
+
+class PagedLayer(DynamicLayer):
+    """
+    One layer's view of the paged cache for a single forward pass.
+
+    `update` stores the step's keys/values at `write_slots` and returns,
+    for attention, either the step's own keys/values (prefill) or the
+    layer's cached positions gathered at `read_slots` (decode).
+    """
+
+    def __init__(self, paged: PagedKVCache, layer: int, write_slots: torch.Tensor,
+                 read_slots: Optional[torch.Tensor], past_length: int):
+        super().__init__()
+        self.paged = paged
+        self.layer = layer
+        self.write_slots = write_slots
+        self.read_slots = read_slots
+        self.past_length = past_length
+
+    def update(self, key_states: torch.Tensor, value_states: torch.Tensor, *args, **kwargs):
+        # (batch, heads, new, head_dim) -> one row per new position, in write_slots order
+        heads, head_dim = key_states.shape[1], key_states.shape[3]
+        keys = key_states.transpose(1, 2).reshape(-1, heads, head_dim)
+        values = value_states.transpose(1, 2).reshape(-1, heads, head_dim)
+        self.paged.write(self.layer, self.write_slots, keys, values)
+        if self.read_slots is None:
+            return key_states, value_states
+        return self.paged.gather(self.layer, self.read_slots)
+
+    def get_seq_length(self) -> int:
+        return self.past_length
+
+
+class PagedCache(Cache):
+    """Cache argument for one forward pass, reading and writing the paged pools layer by layer."""
+
+    def __init__(self, paged: PagedKVCache, write_slots: torch.Tensor,
+                 read_slots: Optional[torch.Tensor] = None, past_length: int = 0):
+        """
+        Initialize paged cache view.
+
+        Args:
+            paged: Pools holding the keys/values
+            write_slots: Slot of every new position, flattened in
+                (batch, position) order
+            read_slots: Slots of every cached position plus the new one per
+                sequence, (batch, length), or None when nothing is cached
+            past_length: Cached positions before this pass (padded)
+        """
+        super().__init__(layers=[
+            PagedLayer(paged, layer, write_slots, read_slots, past_length) for layer in range(paged.num_layers)
+        ])
+
+
+class GenerationRequest:
+    """One prompt being generated for, and its place in the cache."""
+
+    def __init__(self, request_id: int, prompt_ids: Sequence[int], max_new_tokens: int):
+        self.request_id = request_id
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.output_ids: List[int] = []
+        self.block_table: List[int] = []
+        # Positions of this sequence whose keys/values are in the cache
+        self.cached = 0
+        self.finished = False
+        self.arrival = time.perf_counter()
+        self.first_token_time = None
+        self.finish_time = None
+
+    @property
+    def length(self) -> int:
+        return len(self.prompt_ids) + len(self.output_ids)
+
+
+class ContinuousBatchingEngine:
+    """Greedy generation for a stream of requests, with per-step admission and a paged KV cache."""
+
+    def __init__(
+        self,
+        model,
+        device: str,
+        num_blocks: int,
+        block_size: int = 16,
+        max_batch_size: int = 16,
+        eos_token_ids: Iterable[int] = (),
+    ):
+        """
+        Initialize continuous batching engine.
+
+        Args:
+            model: HF causal LM whose attention layers go through Cache.update
+            device: Device the model runs on
+            num_blocks: Cache blocks available to all sequences together
+            block_size: Positions per cache block
+            max_batch_size: Maximum sequences decoded per step
+            eos_token_ids: Tokens that end a sequence early (empty: always
+                generate max_new_tokens)
+        """
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.eos_token_ids = set(eos_token_ids)
+        self.cache = PagedKVCache(model.config.get_text_config().num_hidden_layers, num_blocks, block_size, device)
+        self.waiting: deque = deque()
+        self.running: List[GenerationRequest] = []
+        self._next_id = 0
+        self.stats = {'steps': 0, 'prefills': 0, 'preemptions': 0, 'peak_running': 0, 'peak_blocks': 0}
+
+    def add_request(self, prompt_ids: Sequence[int], max_new_tokens: int) -> GenerationRequest:
+        """Queue a prompt; raises ValueError if it could never fit in the cache."""
+        if not prompt_ids:
+            raise ValueError("empty prompt")
+        if max_new_tokens < 1:
+            raise ValueError(f"max_new_tokens must be positive, got {max_new_tokens}")
+        # Admission reserves a slot beyond the cached tokens (see _admit)
+        needed = blocks_needed(len(prompt_ids) + max_new_tokens, self.cache.block_size)
+        if needed > self.cache.allocator.num_blocks:
+            raise ValueError(
+                f"request needs {needed} cache blocks, the cache has {self.cache.allocator.num_blocks}"
+            )
+        request = GenerationRequest(self._next_id, prompt_ids, max_new_tokens)
+        self._next_id += 1
+        self.waiting.append(request)
+        return request
+
+    def has_unfinished(self) -> bool:
+        return bool(self.waiting or self.running)
+
+    def _free(self, request: GenerationRequest):
+        self.cache.allocator.free(request.block_table)
+        request.block_table = []
+        request.cached = 0
+
+    def _finish_if_done(self, request: GenerationRequest) -> bool:
+        if len(request.output_ids) >= request.max_new_tokens or request.output_ids[-1] in self.eos_token_ids:
+            request.finished = True
+            request.finish_time = time.perf_counter()
+            self._free(request)
+            return True
+        return False
+
+    def _prefill(self, request: GenerationRequest):
+        """Run the prompt (and any tokens generated before a preemption) and cache its keys/values."""
+        tokens = request.prompt_ids + request.output_ids
+        input_ids = torch.tensor([tokens], device=self.device)
+        slots = torch.tensor(self.cache.slots(request.block_table, 0, len(tokens)), device=self.device)
+        outputs = self.model(input_ids=input_ids, past_key_values=PagedCache(self.cache, slots), use_cache=True)
+        request.cached = len(tokens)
+        self.stats['prefills'] += 1
+
+        if not request.output_ids:
+            request.first_token_time = time.perf_counter()
+        request.output_ids.append(int(outputs.logits[0, -1].argmax()))
+
+    def _admit(self) -> List[GenerationRequest]:
+        """Prefill waiting requests while batch slots and cache blocks allow."""
+        finished = []
+        while self.waiting and len(self.running) < self.max_batch_size:
+            request = self.waiting[0]
+            # Room for the cached tokens and the next decoding step's token
+            needed = blocks_needed(request.length + 1, self.cache.block_size)
+            if needed > self.cache.allocator.num_free:
+                break
+            self.waiting.popleft()
+            request.block_table = self.cache.allocator.allocate(needed)
+            self._prefill(request)
+            if self._finish_if_done(request):
+                finished.append(request)
+            else:
+                self.running.append(request)
+        return finished
+
+    def _preempt(self) -> GenerationRequest:
+        """Free the most recently admitted sequence and queue it for recomputation."""
+        victim = self.running.pop()
+        self._free(victim)
+        self.waiting.appendleft(victim)
+        self.stats['preemptions'] += 1
+        return victim
+
+    def _reserve_decode_slots(self):
+        """Give every running sequence a block for its next position, preempting if the pool is empty."""
+        index = 0
+        while index < len(self.running):
+            request = self.running[index]
+            if request.cached < len(request.block_table) * self.cache.block_size:
+                index += 1
+                continue
+            if self.cache.allocator.num_free == 0:
+                # The victim is the last running sequence, possibly this one
+                self._preempt()
+                continue
+            request.block_table.extend(self.cache.allocator.allocate(1))
+            index += 1
+
+    def _decode(self) -> List[GenerationRequest]:
+        """Generate one token for every running sequence."""
+        self._reserve_decode_slots()
+        if not self.running:
+            return []
+        batch = self.running
+        lengths = [request.cached for request in batch]
+        longest = max(lengths)
+
+        # Left-pad every sequence's positions (cached plus the new one) to the longest; padding
+        # reads the sequence's first slot and is masked
+        slot_rows = []
+        for request in batch:
+            row = self.cache.slots(request.block_table, 0, request.cached + 1)
+            slot_rows.append(row[:1] * (longest - request.cached) + row)
+        slots = torch.tensor(slot_rows, device=self.device)
+        attention_mask = torch.tensor(
+            [[0] * (longest - length) + [1] * (length + 1) for length in lengths], device=self.device
+        )
+
+        outputs = self.model(
+            input_ids=torch.tensor([[request.output_ids[-1]] for request in batch], device=self.device),
+            attention_mask=attention_mask,
+            position_ids=torch.tensor([[length] for length in lengths], device=self.device),
+            past_key_values=PagedCache(self.cache, slots[:, -1], slots, longest),
+            use_cache=True,
+        )
+        next_tokens = outputs.logits[:, -1].argmax(dim=-1).tolist()
+
+        finished = []
+        for request, token in zip(batch, next_tokens):
+            request.cached += 1
+            request.output_ids.append(token)
+            if self._finish_if_done(request):
+                finished.append(request)
+        self.running = [request for request in self.running if not request.finished]
+        return finished
+
+    def step(self) -> List[GenerationRequest]:
+        """
+        Run one scheduling step: admit what fits, then decode one token for every running sequence.
+
+        Returns:
+            Requests that finished during the step
+        """
+        with torch.no_grad():
+            finished = self._admit()
+            self.stats['peak_running'] = max(self.stats['peak_running'], len(self.running))
+            self.stats['peak_blocks'] = max(self.stats['peak_blocks'], self.cache.allocator.num_used)
+            finished += self._decode()
+        self.stats['steps'] += 1
+        return finished
+
+    def run(self) -> List[GenerationRequest]:
+        """Step until every queued request has finished; returns them in completion order."""
+        finished = []
+        while self.has_unfinished():
+            finished += self.step()
+        return finished
+
@@ -0,0 +1,163 @@
+"""
+Single-node data parallelism for evaluation scripts.
+
+One worker process is started per GPU, or per CPU socket on CPU-only
+machines (each pinned to its socket's cores). Every worker evaluates a
+deterministic round-robin shard of the same global batch list, and
+reports the loss of each batch together with its global index.
+
+The reduction sums those per-batch losses in global batch order, which is
+exactly the order a single process adds them in. The reduced loss is
+therefore bit-identical to a single-process run, not just close to it.
+Token counts are integers and reduce exactly in any order.
+"""
+import multiprocessing
+import os
+import queue
+import traceback
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import torch
+
+from batching import padding_efficiency
+from prefetch import merge_pipeline_stats
+
+
+def cpu_sockets() -> List[List[int]]:
+    """
+    CPU ids grouped by physical socket.
+
+    Falls back to a single group of all available CPUs when the topology
+    is not exposed (e.g. outside Linux or in some containers).
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        available = sorted(os.sched_getaffinity(0))
+    else:
+        available = list(range(os.cpu_count() or 1))
+    sockets = {}
+    for cpu in available:
+        path = f"/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id"
+        try:
+            with open(path) as f:
+                socket = int(f.read().strip())
+        except (OSError, ValueError):
+            return [available]
+        sockets.setdefault(socket, []).append(cpu)
+    return [sockets[s] for s in sorted(sockets)] or [available]
+
+
+def default_world_size(device: str) -> int:
+    """Number of workers: one per GPU, or one per CPU socket."""
+    if device.startswith('cuda'):
+        return torch.cuda.device_count()
+    return len(cpu_sockets())
+
+
+def worker_device(rank: int, device: str) -> str:
+    """
+    Set up the current process as worker `rank` and return its device.
+
+    GPU workers get `cuda:<rank>`. CPU workers are pinned to the cores of
+    one socket and use that many intra-op threads.
+    """
+    if device.startswith('cuda'):
+        torch.cuda.set_device(rank)
+        return f"cuda:{rank}"
+
+    sockets = cpu_sockets()
+    cpus = sockets[rank % len(sockets)]
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    return 'cpu'
+
+
+def shard(items: Sequence[Any], rank: int, world_size: int) -> List[int]:
+    """
+    Global indices of the items handled by worker `rank`.
+
+    Items are dealt round-robin. Batches are sorted longest first, so
+    every worker gets a similar mix of expensive and cheap batches.
+    """
+    return list(range(len(items)))[rank::world_size]
+
+
+def reduce_stats(results: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine the scoring stats of all workers.
+
+    `total_loss` is re-summed from the workers' `batch_losses` in global
+    batch order, reproducing the single-process sum exactly.
+    """
+    records = sorted(
+        (record for result in results for record in result['batch_losses']),
+        key=lambda record: record[0],
+    )
+    total_loss = 0.0
+    for _, loss in records:
+        total_loss += loss
+
+    reduced = {'total_loss': total_loss, 'batch_losses': records}
+    for key in ('total_tokens', 'real_tokens', 'computed_tokens'):
+        reduced[key] = sum(result[key] for result in results)
+    reduced['padding_efficiency'] = padding_efficiency(reduced['real_tokens'], reduced['computed_tokens'])
+
+    reduced['pipeline'] = merge_pipeline_stats([result['pipeline'] for result in results])
+    reduced['workers'] = len(results)
+    return reduced
+
+
+def _run_worker(worker: Callable[..., Dict[str, Any]], rank: int, world_size: int, kwargs, results):
+    try:
+        results.put((rank, worker(rank, world_size, **kwargs), None))
+    except BaseException:
+        results.put((rank, None, traceback.format_exc()))
+
+
+def run_workers(
+    worker: Callable[..., Dict[str, Any]],
+    world_size: int,
+    **kwargs,
+) -> List[Dict[str, Any]]:
+    """
+    Run `worker(rank, world_size, **kwargs)` in `world_size` processes.
+
+    Workers are started with the 'spawn' method (required for CUDA), so
+    `worker` must be an importable module-level function.
+
+    Returns:
+        Each worker's return value, ordered by rank
+
+    Raises:
+        RuntimeError: If any worker failed (with its traceback)
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [
+        context.Process(target=_run_worker, args=(worker, rank, world_size, kwargs, results))
+        for rank in range(world_size)
+    ]
+    for process in processes:
+        process.start()
+
+    outputs: Dict[int, Tuple[Any, Any]] = {}
+    try:
+        # Drain results before joining, so large payloads cannot block a worker's exit
+        while len(outputs) < world_size:
+            try:
+                rank, output, error = results.get(timeout=1.0)
+            except queue.Empty:
+                # A worker killed outright (e.g. by the OOM killer) never reports back
+                for rank, process in enumerate(processes):
+                    if rank not in outputs and not process.is_alive() and results.empty():
+                        outputs[rank] = (None, f"exited with code {process.exitcode}")
+                continue
+            outputs[rank] = (output, error)
+    finally:
+        for process in processes:
+            process.join()
+
+    errors = [f"worker {rank}:\n{error}" for rank, (_, error) in sorted(outputs.items()) if error]
+    if errors:
+        raise RuntimeError("Data-parallel worker failed\n" + "\n".join(errors))
+    return [outputs[rank][0] for rank in range(world_size)]
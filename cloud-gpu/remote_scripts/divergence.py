@@ -0,0 +1,585 @@
+#!/usr/bin/env python3
+"""
+Per-token divergence between a base model and its instruct version.
+
+A base model and its MODEL_PAIRS partner (see model-library) are run over
+the same token batches, tokenized once with the base tokenizer (the pair
+must share a vocabulary). For every scored token the engine records:
+
+- kl: KL(instruct || base) of the two next-token distributions, in nats
+- base_loss: negative log-likelihood of the token under the base model
+- loss_delta: instruct loss minus base loss
+- base_rank / instruct_rank: rank of the token among each model's logits
+  (0 = argmax), so rank changes show where fine-tuning moved it
+
+Each field is streamed to a memory-mapped file laid out like the token
+cache (token ``t`` of document ``d`` at ``offsets[d] + t``); unscored
+positions hold NaN (ranks: -1). Files written for an output prefix
+``PATH``: ``PATH.<field>.bin``, ``PATH.idx.npy`` (document offsets) and
+``PATH.json`` (field dtypes and run metadata).
+
+When both models fit in device memory they stay resident and every batch
+runs through both. Otherwise the models alternate: one model runs a chunk
+of ``chunk_batches`` batches and its hidden states are cached on the
+host, then the other model is moved in and scores the same (already
+collated) batches against them. The order flips every chunk, so each
+chunk costs one host-device move instead of a reload per batch. Both
+output heads stay on the device, so the cached hidden states are enough
+to reconstruct full-vocabulary distributions.
+
+Usage: python divergence.py BASE_MODEL [dataset] [max_samples] --output PATH
+"""
+import argparse
+import copy
+import json
+import math
+import os
+import sys
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from autotune import default_memory_budget, free_memory
+from batching import build_token_budget_batches, pad_batch
+from calculate_perplexity import load_token_ids
+from chunked_loss import supports_chunked_loss
+from quantization import model_size_bytes
+from report import PerfReport
+from speculative import tokenizers_compatible
+from token_cache import DEFAULT_CACHE_DIR
+from token_losses import offsets_from_lengths
+
+# MODEL_PAIRS lives in model-library/, which is not always uploaded
+# alongside the remote scripts
+_MODEL_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model-library')
+if os.path.isdir(_MODEL_LIBRARY):
+    sys.path.insert(0, _MODEL_LIBRARY)
+try:
+    from models import get_instruct_model
+except ImportError:
+    get_instruct_model = None
+
+# Field -> (dtype, value of unscored positions)
+FIELDS = {
+    'kl': (np.float16, np.nan),
+    'base_loss': (np.float16, np.nan),
+    'loss_delta': (np.float16, np.nan),
+    'base_rank': (np.int32, -1),
+    'instruct_rank': (np.int32, -1),
+}
+
+# Share of the memory budget the two models' weights may take while both
+# stay resident; the rest is left for activations
+RESIDENT_WEIGHT_FRACTION = 0.8
+
+
+def resolve_instruct_model(base_model: str, instruct_model: str = None) -> str:
+    """
+    Name of the instruct partner of `base_model`.
+
+    Raises:
+        ValueError: If it is not given and not in MODEL_PAIRS
+    """
+    if instruct_model:
+        return instruct_model
+    if get_instruct_model is None:
+        raise ValueError("model-library is not available; pass the instruct model name explicitly")
+    picked = get_instruct_model(base_model)
+    if picked is None:
+        raise ValueError(f"{base_model} has no instruct partner in MODEL_PAIRS")
+    return picked
+
+
+class DivergenceWriter:
+    """Streams per-token divergence fields into memory-mapped files."""
+
+    def __init__(self, path: str, offsets: np.ndarray, metadata: Optional[Dict[str, Any]] = None):
+        """
+        Create the output files for documents with the given offsets.
+
+        Args:
+            path: Output prefix (extensions are appended)
+            offsets: Document offsets, e.g. from TokenizedDataset.offsets
+            metadata: Extra JSON-serializable metadata to store
+        """
+        self.path = path
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.metadata = dict(metadata or {})
+        self.tokens_written = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # memmap cannot map an empty file
+        shape = (max(int(self.offsets[-1]), 1),)
+        self._fields = {}
+        for field, (dtype, fill) in FIELDS.items():
+            self._fields[field] = np.memmap(f"{path}.{field}.bin", dtype=dtype, mode='w+', shape=shape)
+            self._fields[field][:] = fill
+        np.save(path + '.idx.npy', self.offsets)
+
+    def write(self, documents: np.ndarray, positions: np.ndarray, values: Dict[str, np.ndarray]):
+        """
+        Record every field for individual tokens.
+
+        Args:
+            documents: Document index of each token
+            positions: Position of each token within its document
+            values: Field name -> value of each token
+        """
+        index = self.offsets[np.asarray(documents, dtype=np.int64)] + np.asarray(positions, dtype=np.int64)
+        for field, (dtype, _) in FIELDS.items():
+            self._fields[field][index] = np.asarray(values[field], dtype=dtype)
+        self.tokens_written += len(index)
+
+    def close(self):
+        """Flush the fields to disk and write the metadata file."""
+        for memmap in self._fields.values():
+            memmap.flush()
+        metadata = dict(self.metadata)
+        metadata.update({
+            'fields': {field: np.dtype(dtype).name for field, (dtype, _) in FIELDS.items()},
+            'num_documents': len(self.offsets) - 1,
+            'num_tokens': int(self.offsets[-1]),
+            'scored_tokens': self.tokens_written,
+        })
+        with open(self.path + '.json', 'w') as f:
+            json.dump(metadata, f, indent=2, default=str)
+        self._fields = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Divergence:
+    """Read-only view of the files written by DivergenceWriter."""
+
+    def __init__(self, path: str):
+        """
+        Open divergence files.
+
+        Args:
+            path: Output prefix the files were written with
+        """
+        self.path = path
+        self.offsets = np.load(path + '.idx.npy')
+        with open(path + '.json') as f:
+            self.metadata = json.load(f)
+        self.fields = {
+            field: np.memmap(f"{path}.{field}.bin", dtype=dtype, mode='r')
+            for field, dtype in self.metadata['fields'].items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def document(self, index: int) -> Dict[str, np.ndarray]:
+        """Every field of one document (NaN or -1 where a token was not scored)."""
+        begin, end = self.offsets[index], self.offsets[index + 1]
+        return {field: values[begin:end] for field, values in self.fields.items()}
+
+    def summary(self, chunk_size: int = 1 << 22) -> Dict[str, float]:
+        """
+        Aggregate divergence over all scored tokens.
+
+        Returns:
+            Dict with tokens, mean_kl, base_perplexity,
+            instruct_perplexity, mean_loss_delta and the fractions of
+            tokens whose rank improved / worsened under the instruct model
+        """
+        totals = {'tokens': 0, 'kl': 0.0, 'base_loss': 0.0, 'loss_delta': 0.0, 'improved': 0, 'worsened': 0}
+        num_tokens = int(self.offsets[-1])
+        for start in range(0, num_tokens, chunk_size):
+            chunk = {field: values[start:start + chunk_size] for field, values in self.fields.items()}
+            scored = chunk['base_rank'] >= 0
+            totals['tokens'] += int(scored.sum())
+            for field in ('kl', 'base_loss', 'loss_delta'):
+                totals[field] += float(chunk[field][scored].sum(dtype=np.float64))
+            totals['improved'] += int((chunk['instruct_rank'][scored] < chunk['base_rank'][scored]).sum())
+            totals['worsened'] += int((chunk['instruct_rank'][scored] > chunk['base_rank'][scored]).sum())
+
+        count = totals['tokens']
+        if not count:
+            return {'tokens': 0}
+        base_loss = totals['base_loss'] / count
+        return {
+            'tokens': count,
+            'mean_kl': totals['kl'] / count,
+            'base_perplexity': math.exp(base_loss),
+            'instruct_perplexity': math.exp(base_loss + totals['loss_delta'] / count),
+            'mean_loss_delta': totals['loss_delta'] / count,
+            'rank_improved': totals['improved'] / count,
+            'rank_worsened': totals['worsened'] / count,
+        }
+
+
+def output_head(model):
+    """Module mapping the hidden states of `_hidden` to logits."""
+    return model.get_output_embeddings() if supports_chunked_loss(model) else torch.nn.Identity()
+
+
+def _hidden(model, **inputs) -> torch.Tensor:
+    """Backbone output, or the logits themselves for models without a plain LM head."""
+    if supports_chunked_loss(model):
+        return model.base_model(**inputs)[0]
+    return model(**inputs).logits
+
+
+def token_divergence(
+    base_hidden: torch.Tensor,
+    base_head,
+    instruct_hidden: torch.Tensor,
+    instruct_head,
+    targets: torch.Tensor,
+    chunk_size: int = 1024,
+) -> Tuple[torch.Tensor, Dict[str, torch.Tensor]]:
+    """
+    Compare the two models' next-token distributions, `chunk_size` positions at a time.
+
+    Args:
+        base_hidden, instruct_hidden: [batch, seq, hidden] outputs of `_hidden`
+        base_head, instruct_head: Modules turning them into logits
+        targets: [batch, seq] token id each position predicts, -100 for none
+
+    Returns:
+        Tuple of (flat indices into `targets` of the scored positions,
+        field -> value per scored position, plus argmax_agree)
+    """
+    flat_targets = targets.reshape(-1)
+    positions = (flat_targets != -100).nonzero().squeeze(-1)
+    base_flat = base_hidden.reshape(-1, base_hidden.size(-1))
+    instruct_flat = instruct_hidden.reshape(-1, instruct_hidden.size(-1))
+
+    values = {field: [] for field in list(FIELDS) + ['argmax_agree']}
+    for start in range(0, positions.numel(), chunk_size):
+        index = positions[start:start + chunk_size]
+        target = flat_targets[index].unsqueeze(-1)
+        base_logits = base_head(base_flat[index]).float()
+        instruct_logits = instruct_head(instruct_flat[index]).float()
+        if base_logits.size(-1) != instruct_logits.size(-1):
+            raise ValueError(
+                f"vocabulary sizes differ: {base_logits.size(-1)} (base) vs {instruct_logits.size(-1)} (instruct)"
+            )
+
+        base_logp = F.log_softmax(base_logits, dim=-1)
+        instruct_logp = F.log_softmax(instruct_logits, dim=-1)
+        base_loss = -base_logp.gather(-1, target).squeeze(-1)
+        instruct_loss = -instruct_logp.gather(-1, target).squeeze(-1)
+
+        values['kl'].append((instruct_logp.exp() * (instruct_logp - base_logp)).sum(-1))
+        values['base_loss'].append(base_loss)
+        values['loss_delta'].append(instruct_loss - base_loss)
+        values['base_rank'].append((base_logits > base_logits.gather(-1, target)).sum(-1))
+        values['instruct_rank'].append((instruct_logits > instruct_logits.gather(-1, target)).sum(-1))
+        values['argmax_agree'].append(base_logits.argmax(-1) == instruct_logits.argmax(-1))
+    return positions, {field: torch.cat(chunks) for field, chunks in values.items()}
+
+
+def pair_fits(base, instruct, device: str, memory_budget_bytes: int = None) -> bool:
+    """Whether both models can stay resident on `device` (always true on CPU, where they already are)."""
+    if device == "cpu":
+        return True
+    budget = memory_budget_bytes or default_memory_budget(device)
+    return model_size_bytes(base) + model_size_bytes(instruct) <= budget * RESIDENT_WEIGHT_FRACTION
+
+
+def score_divergence(
+    base,
+    instruct,
+    tokenizer,
+    token_ids,
+    device: str,
+    writer: DivergenceWriter = None,
+    max_tokens: int = 2048,
+    max_length: int = 512,
+    alternate: bool = False,
+    chunk_batches: int = 16,
+    loss_chunk_size: int = 1024,
+    report=None,
+) -> Dict[str, Any]:
+    """
+    Run both models over the same batches and compare them token by token.
+
+    Samples are truncated to max_length and batched under a padded-token
+    budget, as in score_batched. Without `alternate` both models must
+    already be on `device`. With it they may be anywhere; each is moved to
+    `device` for its turn and back to the host after.
+
+    Returns:
+        Dict with scored_tokens, batches, chunks, swaps (moves of a model
+        onto the device), mean_kl, base/instruct avg_loss and perplexity,
+        and argmax_agreement (fraction of positions where both models'
+        top token is the same)
+    """
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+
+    # Samples with fewer than two tokens have nothing to predict
+    documents = [i for i, ids in enumerate(token_ids) if len(ids) > 1]
+    samples = [token_ids[i][:max_length] for i in documents]
+    batches = build_token_budget_batches([len(ids) for ids in samples], max_tokens)
+    chunk_batches = chunk_batches if alternate else max(len(batches), 1)
+    print(f"  {len(samples)} samples in {len(batches)} batches "
+          f"({'alternating every ' + str(chunk_batches) + ' batches' if alternate else 'both models resident'})")
+
+    def _collate(batch):
+        input_ids, attention_mask, labels = pad_batch([samples[i] for i in batch], tokenizer.pad_token_id)
+        return {
+            'model_inputs': {'input_ids': input_ids.to(device), 'attention_mask': attention_mask.to(device)},
+            # Position i predicts label i + 1; the last position predicts nothing
+            'targets': F.pad(labels[:, 1:], (0, 1), value=-100).to(device),
+            'documents': np.array([documents[i] for i in batch]),
+        }
+
+    models = {'base': base, 'instruct': instruct}
+    if alternate:
+        # Heads stay on the device so either model's cached hidden states can be projected
+        heads = {role: copy.deepcopy(output_head(model)).to(device) for role, model in models.items()}
+    else:
+        heads = {role: output_head(model) for role, model in models.items()}
+
+    totals = {'scored_tokens': 0, 'kl': 0.0, 'base_loss': 0.0, 'loss_delta': 0.0, 'argmax_agree': 0, 'swaps': 0}
+    on_device = None if alternate else 'base'
+
+    def _record(inputs, hidden):
+        positions, values = token_divergence(
+            hidden['base'], heads['base'], hidden['instruct'], heads['instruct'],
+            inputs['targets'], loss_chunk_size
+        )
+        positions = positions.cpu().numpy()
+        values = {field: value.cpu().numpy() for field, value in values.items()}
+        seq_len = inputs['targets'].size(1)
+        if writer is not None:
+            writer.write(inputs['documents'][positions // seq_len], positions % seq_len + 1, values)
+        totals['scored_tokens'] += len(positions)
+        totals['argmax_agree'] += int(values['argmax_agree'].sum())
+        for field in ('kl', 'base_loss', 'loss_delta'):
+            totals[field] += float(values[field].sum(dtype=np.float64))
+
+    def _move_in(role):
+        nonlocal on_device
+        if on_device is not None:
+            models[on_device].to("cpu")
+            free_memory()
+        models[role].to(device)
+        on_device = role
+        totals['swaps'] += 1
+
+    start = time.perf_counter()
+    if report is not None:
+        report.start_progress()
+    num_chunks = 0
+    with torch.no_grad():
+        for chunk_start in range(0, len(batches), chunk_batches):
+            num_chunks += 1
+            chunk = [_collate(batch) for batch in batches[chunk_start:chunk_start + chunk_batches]]
+            if not alternate:
+                for inputs in chunk:
+                    _record(inputs, {role: _hidden(model, **inputs['model_inputs']) for role, model in models.items()})
+            else:
+                # Whichever model is already on the device goes first
+                first = on_device or 'base'
+                second = 'instruct' if first == 'base' else 'base'
+                if on_device != first:
+                    _move_in(first)
+                cached = [_hidden(models[first], **inputs['model_inputs']).cpu() for inputs in chunk]
+                _move_in(second)
+                for inputs, first_hidden in zip(chunk, cached):
+                    hidden = _hidden(models[second], **inputs['model_inputs'])
+                    _record(inputs, {first: first_hidden.to(device), second: hidden})
+            done = min(chunk_start + chunk_batches, len(batches))
+            print(f"  Processed {done}/{len(batches)} batches...")
+            if report is not None:
+                report.progress(done, len(batches), totals['scored_tokens'])
+
+    count = totals['scored_tokens']
+    base_loss = totals['base_loss'] / count if count else float('nan')
+    instruct_loss = base_loss + totals['loss_delta'] / count if count else float('nan')
+    return {
+        'scored_tokens': count,
+        'batches': len(batches),
+        'chunks': num_chunks,
+        'swaps': totals['swaps'],
+        'alternate': alternate,
+        'seconds': time.perf_counter() - start,
+        'mean_kl': totals['kl'] / count if count else float('nan'),
+        'base_avg_loss': base_loss,
+        'instruct_avg_loss': instruct_loss,
+        'base_perplexity': math.exp(base_loss) if count else float('inf'),
+        'instruct_perplexity': math.exp(instruct_loss) if count else float('inf'),
+        'argmax_agreement': totals['argmax_agree'] / count if count else float('nan'),
+    }
+
+
+def load_pair(base_name: str, instruct_name: str, device: str, alternate: bool = None, memory_budget_bytes: int = None):
+    """
+    Load a base/instruct pair onto the host and place them for scoring.
+
+    Args:
+        alternate: Force alternating (True) or resident (False) mode;
+            None picks resident if both models fit (see pair_fits)
+
+    Returns:
+        Tuple of (base, instruct, tokenizer, alternate)
+
+    Raises:
+        ValueError: If the two tokenizers do not share a vocabulary
+    """
+    tokenizer = AutoTokenizer.from_pretrained(base_name)
+    if not tokenizers_compatible(tokenizer, AutoTokenizer.from_pretrained(instruct_name)):
+        raise ValueError(f"{instruct_name} does not share the tokenizer of {base_name}")
+
+    dtype = torch.float16 if device.startswith("cuda") else torch.float32
+    base = AutoModelForCausalLM.from_pretrained(base_name, torch_dtype=dtype).eval()
+    instruct = AutoModelForCausalLM.from_pretrained(instruct_name, torch_dtype=dtype).eval()
+    if alternate is None:
+        alternate = not pair_fits(base, instruct, device, memory_budget_bytes)
+    if not alternate:
+        base.to(device)
+        instruct.to(device)
+    return base, instruct, tokenizer, alternate
+
+
+def calculate_divergence(
+    base_name: str,
+    output_path: str,
+    dataset_name: str = "wikitext",
+    dataset_config: str = "wikitext-2-raw-v1",
+    split: str = "test",
+    max_samples: int = 1000,
+    instruct_name: str = None,
+    max_length: int = 512,
+    max_tokens: int = 2048,
+    alternate: bool = None,
+    chunk_batches: int = 16,
+    memory_budget_gb: float = None,
+    loss_chunk_size: int = 1024,
+    token_cache_dir: str = DEFAULT_CACHE_DIR,
+    report_path: str = None,
+):
+    """
+    Score a base model against its instruct version on a dataset.
+
+    Args:
+        base_name: Base model name
+        output_path: Prefix of the per-token divergence files
+        instruct_name: Instruct model (default: the MODEL_PAIRS partner)
+        alternate: Force (True) or forbid (False) alternating the models
+            on the device; None decides from memory_budget_gb
+        chunk_batches: Batches per model turn when alternating
+        memory_budget_gb: Device memory budget (default: 90% of the device)
+
+    Returns:
+        Dict of results as from score_divergence, or None on failure
+    """
+    report = PerfReport('divergence', report_path)
+    try:
+        instruct_name = resolve_instruct_model(base_name, instruct_name)
+    except ValueError as e:
+        print(f"  [ERROR] {e}")
+        report.finish(success=False, error=str(e))
+        return None
+    print(f"Divergence of {instruct_name} from {base_name}")
+    print("=" * 60)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    budget = int(memory_budget_gb * 1e9) if memory_budget_gb else None
+    try:
+        with report.stage('model_load'):
+            base, instruct, tokenizer, alternate = load_pair(base_name, instruct_name, device, alternate, budget)
+    except Exception as e:
+        print(f"  [ERROR] Failed to load models: {e}")
+        report.finish(success=False, error=f"model: {e}")
+        return None
+
+    with report.stage('tokenization'):
+        token_ids = load_token_ids(tokenizer, dataset_name, dataset_config, split, max_samples, token_cache_dir)
+    if token_ids is None:
+        report.finish(success=False, error="dataset")
+        return None
+
+    metadata = {
+        'base_model': base_name,
+        'instruct_model': instruct_name,
+        'dataset': f"{dataset_name}/{dataset_config}/{split}",
+        'max_samples': max_samples,
+        'max_length': max_length,
+    }
+    offsets = offsets_from_lengths([len(ids) for ids in token_ids])
+    with report.stage('scoring'), DivergenceWriter(output_path, offsets, metadata) as writer:
+        results = score_divergence(
+            base, instruct, tokenizer, token_ids, device, writer,
+            max_tokens=max_tokens, max_length=max_length, alternate=alternate,
+            chunk_batches=chunk_batches, loss_chunk_size=loss_chunk_size, report=report,
+        )
+
+    print("\n" + "=" * 60)
+    print(f"Results ({results['scored_tokens']:,} tokens, {results['swaps']} model swaps):")
+    print(f"  Base perplexity: {results['base_perplexity']:.4f}")
+    print(f"  Instruct perplexity: {results['instruct_perplexity']:.4f}")
+    print(f"  Mean KL(instruct || base): {results['mean_kl']:.4f} nats")
+    print(f"  Argmax agreement: {results['argmax_agreement']:.1%}")
+    print(f"  Per-token outputs: {output_path}.*")
+    print("=" * 60)
+    report.finish(success=True, device=device, **results)
+    return results
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Per-token divergence between a base model and its instruct version.")
+    parser.add_argument("model_name", help="Base model name")
+    parser.add_argument("dataset_name", nargs="?", default="wikitext", help="HuggingFace dataset name")
+    parser.add_argument("max_samples", nargs="?", type=int, default=1000, help="Maximum number of samples")
+    parser.add_argument("--output", required=True, metavar="PATH", help="Prefix of the per-token output files")
+    parser.add_argument("--instruct", default=None, help="Instruct model (default: MODEL_PAIRS partner)")
+    parser.add_argument("--dataset-config", default="wikitext-2-raw-v1", help="Dataset configuration")
+    parser.add_argument("--split", default="test", help="Dataset split")
+    parser.add_argument("--max-length", type=int, default=512, help="Context length in tokens")
+    parser.add_argument("--max-tokens", type=int, default=2048, help="Token budget per batch")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--alternate", dest="alternate", action="store_true", default=None,
+                      help="Alternate the models on the device even if both fit")
+    mode.add_argument("--resident", dest="alternate", action="store_false",
+                      help="Keep both models on the device even if they may not fit")
+    parser.add_argument("--chunk-batches", type=int, default=16,
+                        help="Batches per model turn when alternating (default: 16)")
+    parser.add_argument("--memory-budget-gb", type=float, default=None,
+                        help="Device memory budget deciding whether both models stay resident")
+    parser.add_argument("--loss-chunk-size", type=int, default=1024,
+                        help="Positions projected to the vocabulary at a time")
+    parser.add_argument("--token-cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory of the pre-tokenized dataset cache")
+    parser.add_argument("--report", default=None, metavar="PATH",
+                        help="Print [REPORT] JSON progress lines and write a JSON performance report to PATH")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = calculate_divergence(
+        args.model_name,
+        args.output,
+        dataset_name=args.dataset_name,
+        dataset_config=args.dataset_config,
+        split=args.split,
+        max_samples=args.max_samples,
+        instruct_name=args.instruct,
+        max_length=args.max_length,
+        max_tokens=args.max_tokens,
+        alternate=args.alternate,
+        chunk_batches=args.chunk_batches,
+        memory_budget_gb=args.memory_budget_gb,
+        loss_chunk_size=args.loss_chunk_size,
+        token_cache_dir=args.token_cache_dir,
+        report_path=args.report,
+    )
+    sys.exit(0 if results is not None else 1)
@@ -3,44 +3,132 @@
 Evaluate a HuggingFace model on remote instance.
 
 This script downloads a model, tests tokenization and inference,
-and reports results.
+and reports results. ``--quantize int8|int4`` runs the model on CPU with
+quantized linear layers (see ``quantization.py``). ``--report PATH``
+streams [REPORT] progress lines and writes a JSON performance report
+(see ``report.py``). ``--prompts FILE`` instead benchmarks batched
+generation over a file of prompts at each ``--batch-sizes`` (see
+``generation_benchmark.py``). ``--speculative [DRAFT]`` additionally
+decodes with a small same-family draft model and reports its acceptance
+rate and speedup (see ``speculative.py``). With ``--prompts``,
+``--prefix-cache-mb MB`` also generates for the prompts one at a time
+with and without reusing the KV cache of shared prompt prefixes, and
+reports the hit rate and prefill time saved (see ``prefix_cache.py``).
+``--fast-load`` builds the model on the meta device and streams its
+safetensors shards onto the GPUs (or CPU), reporting where the load time went
+and its peak RSS (see ``fast_loader.py``).
 """
+import argparse
 import sys
+import time
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers.generation.streamers import BaseStreamer
 
-def evaluate_model(model_name: str, test_text: str = "Hello, how are you today?"):
+from fast_loader import load_model_fast_or_none
+from generation_benchmark import benchmark_generation, load_prompts
+from prefix_cache import benchmark_prefix_cache
+from quantization import QUANTIZATION_MODES, model_size_bytes, quantize_model
+from report import PerfReport
+from speculative import compare_speculative, resolve_draft_model, tokenizers_compatible
+
+class _ProgressStreamer(BaseStreamer):
+    """Reports generation throughput every `interval` tokens while generate() runs."""
+    
+    def __init__(self, report: PerfReport, max_new_tokens: int, interval: int = 5):
+        self.report = report
+        self.max_new_tokens = max_new_tokens
+        self.interval = interval
+        self.generated = None
+    
+    def put(self, value):
+        # The first call carries the prompt
+        if self.generated is None:
+            self.generated = 0
+            self.report.start_progress()
+            return
+        self.generated += 1
+        if self.generated % self.interval == 0:
+            self.report.progress(self.generated, self.max_new_tokens, self.generated, unit="tokens")
+    
+    def end(self):
+        pass
+
+def evaluate_model(
+    model_name: str,
+    test_text: str = "Hello, how are you today?",
+    quantize: str = None,
+    report_path: str = None,
+    prompts_path: str = None,
+    batch_sizes=(1,),
+    max_new_tokens: int = 20,
+    speculative: str = None,
+    num_draft_tokens: int = 4,
+    prefix_cache_mb: float = None,
+    prefix_block_size: int = 32,
+    fast_load: bool = False,
+):
     """
     Download and evaluate a model.
     
     Args:
         model_name: HuggingFace model name
         test_text: Text to use for testing
+        quantize: 'int8' or 'int4' to run on CPU with quantized linear layers
+        report_path: If set, stream [REPORT] progress lines and write a
+            JSON performance report here
+        prompts_path: File of prompts (one per line, or .jsonl) to benchmark
+            batched generation on instead of the single test_text
+        batch_sizes: Batch sizes to benchmark with prompts_path
+        max_new_tokens: Tokens to generate per prompt
+        speculative: Draft model for speculative decoding, or 'auto' for the
+            smallest same-series model in MODEL_PAIRS
+        num_draft_tokens: Draft tokens verified per target step
+        prefix_cache_mb: With prompts_path, also compare generation with a
+            prefix KV cache of this many MB against generation without
+        prefix_block_size: Tokens per prefix cache block
+        fast_load: Load by streaming safetensors shards into a meta-device
+            model on a single device, falling back to from_pretrained
     """
     print(f"Evaluating model: {model_name}")
     print("=" * 60)
+    report = PerfReport('evaluate_model', report_path)
     
     # Load tokenizer
     print("Loading tokenizer...")
     try:
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        with report.stage('model_load'):
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
         print(f"  [OK] Tokenizer loaded (vocab size: {len(tokenizer)}")
     except Exception as e:
         print(f"  [ERROR] Failed to load tokenizer: {e}")
+        report.finish(success=False, error=f"tokenizer: {e}")
         return False
     
     # Load model
     print("Loading model...")
+    use_cuda = torch.cuda.is_available() and not quantize
+    dtype = torch.float16 if use_cuda else torch.float32
     try:
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto" if torch.cuda.is_available() else None
-        )
-        print(f"  [OK] Model loaded")
+        model = None
+        with report.stage('model_load'):
+            if fast_load:
+                model = load_model_fast_or_none(model_name, None, use_cuda, dtype, report)
+            if model is None:
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_name,
+                    torch_dtype=dtype,
+                    device_map="auto" if use_cuda else None
+                )
+        print(f"  [OK] Model loaded ({model_size_bytes(model) / 1e6:,.0f} MB)")
+        
+        if quantize:
+            with report.stage('quantization'):
+                model = quantize_model(model, quantize)
+            print(f"  [OK] Quantized to {quantize} ({model_size_bytes(model) / 1e6:,.0f} MB)")
         
         # Move to GPU if available
-        if torch.cuda.is_available():
+        if use_cuda:
             device = "cuda"
             print(f"  [OK] Model on GPU: {torch.cuda.get_device_name(0)}")
         else:
@@ -48,14 +136,22 @@ def evaluate_model(model_name: str, test_text: str = "Hello, how are you today?"
             print(f"  [WARNING] Using CPU")
     except Exception as e:
         print(f"  [ERROR] Failed to load model: {e}")
+        report.finish(success=False, error=f"model: {e}")
         return False
     
+    if prompts_path:
+        return _benchmark_prompts(
+            model, tokenizer, device, prompts_path, batch_sizes, max_new_tokens, report,
+            prefix_cache_mb=prefix_cache_mb, prefix_block_size=prefix_block_size,
+        )
+    
     # Test tokenization
     print(f"\nTesting tokenization...")
     print(f"  Input text: {test_text}")
     
     try:
-        inputs = tokenizer(test_text, return_tensors="pt")
+        with report.stage('tokenization'):
+            inputs = tokenizer(test_text, return_tensors="pt")
         if device == "cuda":
             inputs = {k: v.to(device) for k, v in inputs.items()}
         
@@ -67,39 +163,199 @@ def evaluate_model(model_name: str, test_text: str = "Hello, how are you today?"
         print(f"  Decoded: {decoded}")
     except Exception as e:
         print(f"  [ERROR] Tokenization failed: {e}")
+        report.finish(success=False, error=f"tokenization: {e}")
         return False
     
     # Test inference
     print(f"\nTesting inference...")
     try:
-        with torch.no_grad():
+        start = time.perf_counter()
+        with torch.no_grad(), report.stage('generation'):
             outputs = model.generate(
                 **inputs,
-                max_new_tokens=20,
+                max_new_tokens=max_new_tokens,
                 do_sample=False,
-                pad_token_id=tokenizer.eos_token_id if tokenizer.pad_token_id is None else tokenizer.pad_token_id
+                pad_token_id=tokenizer.eos_token_id if tokenizer.pad_token_id is None else tokenizer.pad_token_id,
+                streamer=_ProgressStreamer(report, max_new_tokens) if report.emit_lines else None
             )
         
+        elapsed = time.perf_counter() - start
+        
         generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        new_tokens = outputs.shape[1] - inputs['input_ids'].shape[1]
         print(f"  [OK] Inference complete")
         print(f"  Generated: {generated_text}")
         print(f"  Output shape: {outputs.shape}")
+        print(f"  Throughput: {new_tokens / elapsed:.1f} tokens/s")
     except Exception as e:
         print(f"  [ERROR] Inference failed: {e}")
+        report.finish(success=False, error=f"inference: {e}")
         return False
     
+    speculative_result = None
+    if speculative:
+        speculative_result = _speculative_inference(
+            model, tokenizer, device, model_name, speculative, inputs, max_new_tokens, num_draft_tokens, report
+        )
+        if speculative_result is None:
+            return False
+    
     print("\n" + "=" * 60)
     print("[OK] Model evaluation complete!")
+    report.finish(
+        success=True,
+        device=device,
+        quantize=quantize,
+        prompt_tokens=inputs['input_ids'].shape[1],
+        generated_tokens=new_tokens,
+        tokens_per_second=new_tokens / elapsed,
+        speculative=speculative_result,
+    )
     return True
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python evaluate_model.py <model_name> [test_text]")
-        sys.exit(1)
+def _speculative_inference(model, tokenizer, device, model_name, draft, inputs, max_new_tokens, num_draft_tokens, report):
+    """Decode the test prompt with and without a draft model; returns the comparison or None on failure."""
+    print(f"\nTesting speculative decoding...")
+    try:
+        draft_name = resolve_draft_model(model_name, draft)
+        print(f"  Draft model: {draft_name}")
+        with report.stage('model_load'):
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_name)
+            if not tokenizers_compatible(tokenizer, draft_tokenizer):
+                raise ValueError(f"{draft_name} does not share the tokenizer of {model_name}")
+            draft_model = AutoModelForCausalLM.from_pretrained(
+                draft_name, torch_dtype=next(model.parameters()).dtype
+            ).to(device).eval()
+        
+        eos = model.generation_config.eos_token_id
+        eos_token_ids = eos if isinstance(eos, (list, tuple)) else [eos] if eos is not None else []
+        with report.stage('speculative'):
+            result = compare_speculative(
+                model, draft_model, inputs['input_ids'][0].tolist(), max_new_tokens, device,
+                num_draft_tokens=num_draft_tokens, eos_token_ids=eos_token_ids,
+            )
+    except Exception as e:
+        print(f"  [ERROR] Speculative decoding failed: {e}")
+        report.finish(success=False, error=f"speculative: {e}")
+        return None
     
-    model_name = sys.argv[1]
-    test_text = sys.argv[2] if len(sys.argv) > 2 else "Hello, how are you today?"
+    tokens = len(result['tokens'])
+    if result['identical']:
+        print(f"  [OK] Output identical to greedy decoding")
+    else:
+        print(f"  [WARNING] Output differs from greedy decoding")
+    print(f"  Acceptance rate: {result['acceptance_rate']:.1%} ({result['accepted']}/{result['drafted']} draft tokens, "
+          f"{result['target_steps']} target steps for {tokens} tokens)")
+    print(f"  Greedy: {tokens / result['greedy_seconds']:.1f} tokens/s, "
+          f"speculative: {tokens / result['speculative_seconds']:.1f} tokens/s ({result['speedup']:.2f}x)")
+    return {
+        'draft_model': draft_name,
+        'num_draft_tokens': num_draft_tokens,
+        **{key: value for key, value in result.items() if key != 'tokens'},
+    }
+
+def _benchmark_prompts(model, tokenizer, device, prompts_path, batch_sizes, max_new_tokens, report,
+                       prefix_cache_mb=None, prefix_block_size=32):
+    """Run the batched generation benchmark for every batch size and print a summary table."""
+    try:
+        prompts = load_prompts(prompts_path)
+        if not prompts:
+            raise ValueError(f"no prompts in {prompts_path}")
+    except Exception as e:
+        print(f"  [ERROR] Failed to read prompts: {e}")
+        report.finish(success=False, error=f"prompts: {e}")
+        return False
+    
+    print(f"\nBenchmarking generation on {len(prompts)} prompts ({max_new_tokens} new tokens each)...")
+    results = []
+    try:
+        with report.stage('generation'):
+            for batch_size in batch_sizes:
+                results.append(benchmark_generation(
+                    model, tokenizer, prompts, device, batch_size,
+                    max_new_tokens=max_new_tokens, report=report,
+                ))
+    except Exception as e:
+        print(f"  [ERROR] Generation benchmark failed: {e}")
+        report.finish(success=False, error=f"generation: {e}", results=results)
+        return False
+    
+    print(f"\n  {'batch':>5}  {'tokens/s':>9}  {'TTFT p50':>9}  {'TTFT p99':>9}  "
+          f"{'ITL p50':>8}  {'ITL p90':>8}  {'ITL p99':>8}  (ms)")
+    for result in results:
+        ttft, itl = result['ttft_ms'], result['itl_ms']
+        print(f"  {result['batch_size']:>5}  {result['output_tokens_per_second']:>9.1f}  "
+              f"{ttft['p50'] or 0:>9.1f}  {ttft['p99'] or 0:>9.1f}  "
+              f"{itl['p50'] or 0:>8.1f}  {itl['p90'] or 0:>8.1f}  {itl['p99'] or 0:>8.1f}")
+    
+    prefix = None
+    if prefix_cache_mb:
+        print(f"\nBenchmarking prefix cache ({prefix_cache_mb:g} MB, {prefix_block_size}-token blocks)...")
+        try:
+            with report.stage('prefix_cache'):
+                prefix = benchmark_prefix_cache(
+                    model, tokenizer, prompts, device, int(prefix_cache_mb * 1e6),
+                    block_size=prefix_block_size, max_new_tokens=max_new_tokens,
+                )
+        except Exception as e:
+            print(f"  [ERROR] Prefix cache benchmark failed: {e}")
+            report.finish(success=False, error=f"prefix cache: {e}", results=results)
+            return False
+        print(f"  Hit rate: {prefix['hit_rate']:.1%} of prompts, "
+              f"{prefix['cached_token_fraction']:.1%} of prompt tokens reused")
+        print(f"  Prefill: {prefix['prefill_seconds_uncached']:.3f}s -> {prefix['prefill_seconds_cached']:.3f}s "
+              f"({prefix['prefill_seconds_saved']:.3f}s saved, {prefix['evictions']} evictions)")
+        if not prefix['identical']:
+            print(f"  [WARNING] Outputs with the prefix cache differ")
+    
+    print("\n" + "=" * 60)
+    print("[OK] Generation benchmark complete!")
+    report.finish(success=True, device=device, max_new_tokens=max_new_tokens, results=results, prefix_cache=prefix)
+    return True
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Evaluate a HuggingFace model.")
+    parser.add_argument("model_name", help="HuggingFace model name")
+    parser.add_argument("test_text", nargs="?", default="Hello, how are you today?", help="Text to use for testing")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default=None,
+                        help="Run on CPU with int8 (dynamic) or int4 (weight-only) linear layers")
+    parser.add_argument("--report", default=None, metavar="PATH",
+                        help="Print [REPORT] JSON progress lines and write a JSON performance report to PATH")
+    parser.add_argument("--prompts", default=None, metavar="FILE",
+                        help="Benchmark batched generation over prompts in FILE (one per line, or .jsonl)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1], metavar="N",
+                        help="Batch sizes to benchmark with --prompts (default: 1)")
+    parser.add_argument("--max-new-tokens", type=int, default=20,
+                        help="Tokens to generate per prompt (default: 20)")
+    parser.add_argument("--speculative", nargs="?", const="auto", default=None, metavar="DRAFT",
+                        help="Also decode speculatively with DRAFT (default: smallest same-series model)")
+    parser.add_argument("--num-draft-tokens", type=int, default=4,
+                        help="Draft tokens verified per target step (default: 4)")
+    parser.add_argument("--prefix-cache-mb", type=float, default=None, metavar="MB",
+                        help="With --prompts, also benchmark reusing the KV cache of shared prompt prefixes")
+    parser.add_argument("--prefix-block-size", type=int, default=32,
+                        help="Tokens per prefix cache block (default: 32)")
+    parser.add_argument("--fast-load", action="store_true",
+                        help="Stream safetensors shards into a meta-device model and report the load breakdown")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
     
-    success = evaluate_model(model_name, test_text)
+    success = evaluate_model(
+        args.model_name,
+        args.test_text,
+        quantize=args.quantize,
+        report_path=args.report,
+        prompts_path=args.prompts,
+        batch_sizes=args.batch_sizes,
+        max_new_tokens=args.max_new_tokens,
+        speculative=args.speculative,
+        num_draft_tokens=args.num_draft_tokens,
+        prefix_cache_mb=args.prefix_cache_mb,
+        prefix_block_size=args.prefix_block_size,
+        fast_load=args.fast_load,
+    )
     sys.exit(0 if success else 1)
 
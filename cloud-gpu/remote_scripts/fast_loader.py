@@ -0,0 +1,295 @@
+"""
+Low-peak-memory model loading from safetensors checkpoints.
+
+The model is built on the meta device (parameters have shapes but no
+storage), then every tensor of every checkpoint shard is streamed into
+place one at a time:
+
+- read: the tensor's bytes are copied out of the memory-mapped shard into
+  a staging buffer (pinned when loading to a GPU); this is where the
+  disk is read
+- deserialize: the bytes are viewed as the checkpoint dtype and shape and
+  cast to the target dtype
+- device_copy: the tensor is copied to its final storage on the target
+  device
+
+Host memory therefore holds at most one staging buffer the size of the
+largest tensor, plus the page cache the kernel is free to drop; a GPU
+target never needs a copy of the whole model in host RAM. Stage times are
+summed over all tensors and reported with the peak resident memory.
+
+The target is one device or a device map (module name -> device, as for
+``from_pretrained``); ``"auto"`` balances the model over all GPUs with
+``accelerate.infer_auto_device_map``, so models too large for one GPU are
+streamed straight to the GPU holding each layer. Maps that offload to
+disk and checkpoints whose tensor names do not match the model's
+parameters are not handled: `load_model_fast` raises ValueError, and
+`load_model_fast_or_none` returns None so callers fall back to
+``from_pretrained``.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+import torch
+from accelerate import dispatch_model, init_empty_weights
+from accelerate.utils import get_balanced_memory, infer_auto_device_map
+from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+
+from autotune import free_memory, is_oom_error
+from report import peak_host_bytes
+
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool,
+}
+
+LOAD_STAGES = ('download', 'read', 'deserialize', 'device_copy')
+
+
+def checkpoint_files(model_name: str) -> Tuple[str, List[str]]:
+    """
+    Find (downloading if needed) the safetensors shards of a model.
+
+    Returns:
+        Tuple of (model directory, shard paths)
+
+    Raises:
+        ValueError: If the model has no safetensors checkpoint
+    """
+    if os.path.isdir(model_name):
+        directory = model_name
+    else:
+        from huggingface_hub import snapshot_download
+        directory = snapshot_download(model_name, allow_patterns=["*.json", "*.safetensors"])
+
+    index = os.path.join(directory, "model.safetensors.index.json")
+    if os.path.exists(index):
+        with open(index) as f:
+            shards = sorted(set(json.load(f)['weight_map'].values()))
+        return directory, [os.path.join(directory, shard) for shard in shards]
+    single = os.path.join(directory, "model.safetensors")
+    if os.path.exists(single):
+        return directory, [single]
+    raise ValueError(f"no safetensors checkpoint for {model_name}")
+
+
+def read_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """
+    Parse a safetensors header.
+
+    Returns:
+        Tuple of (tensor name -> dtype/shape/data_offsets, offset where
+        tensor data starts)
+    """
+    with open(path, 'rb') as f:
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length))
+    header.pop('__metadata__', None)
+    return header, 8 + length
+
+
+def _set_tensor(model, name: str, tensor: torch.Tensor):
+    module_name, _, attr = name.rpartition('.')
+    module = model.get_submodule(module_name)
+    if attr in module._parameters:
+        module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+    else:
+        module._buffers[attr] = tensor
+
+
+def _device_map(model, device: Union[str, Dict[str, Any]], dtype: torch.dtype) -> Dict[str, str]:
+    """Resolve a device, device map or "auto" into a map of module names to torch device names."""
+    if isinstance(device, dict):
+        device_map = device
+    elif device == "auto":
+        no_split = list(model._no_split_modules or [])
+        max_memory = get_balanced_memory(model, no_split_module_classes=no_split, dtype=dtype)
+        device_map = infer_auto_device_map(model, max_memory=max_memory, no_split_module_classes=no_split, dtype=dtype)
+    else:
+        device_map = {"": device}
+    resolved = {}
+    for name, target in device_map.items():
+        if target == "disk":
+            raise ValueError(f"{name or 'the model'} would be offloaded to disk")
+        resolved[name] = f"cuda:{target}" if isinstance(target, int) else str(target)
+    return resolved
+
+
+def _mapped_device(device_map: Dict[str, str], name: str) -> str:
+    """Device of a tensor: that of its longest module-name prefix in the map."""
+    module = name
+    while module not in device_map:
+        if not module:
+            raise ValueError(f"{name} is not covered by the device map")
+        module = module.rpartition('.')[0]
+    return device_map[module]
+
+
+def format_load_timings(timings: Dict[str, Any]) -> str:
+    """One-line summary of load_model_fast timings."""
+    stages = ", ".join(f"{stage.replace('_', ' ')} {timings[stage]:.1f}s" for stage in LOAD_STAGES)
+    peak = timings.get('peak_host_bytes')
+    peak_text = f", peak RSS {peak / 1e9:.2f} GB" if peak else ""
+    return f"{timings['total_seconds']:.1f}s ({stages}), {timings['bytes_read'] / 1e9:.2f} GB read{peak_text}"
+
+
+def load_model_fast(
+    model_name: str,
+    device: Union[str, Dict[str, Any]] = "cpu",
+    dtype: torch.dtype = torch.float32,
+):
+    """
+    Load a causal LM by streaming its safetensors shards into a meta-device model.
+
+    Args:
+        model_name: HuggingFace model name or local directory
+        device: Device to place every tensor on, a device map (module name
+            -> device or GPU index), or "auto" to balance over all GPUs
+        dtype: Target dtype of floating-point tensors
+
+    Returns:
+        Tuple of (model in eval mode, timings); timings holds the seconds
+        spent per stage (LOAD_STAGES), total_seconds, bytes_read and
+        peak_host_bytes
+
+    Raises:
+        ValueError: If the checkpoint cannot be loaded this way
+    """
+    timings = {stage: 0.0 for stage in LOAD_STAGES}
+    start = time.perf_counter()
+    directory, files = checkpoint_files(model_name)
+    timings['download'] = time.perf_counter() - start
+
+    config = AutoConfig.from_pretrained(directory)
+    # Buffers (e.g. rotary frequencies) are computed, not loaded, so they stay real
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config)
+    targets = dict(model.named_parameters(remove_duplicate=False))
+    targets.update(model.named_buffers())
+    device_map = _device_map(model, device, dtype)
+
+    pin = any(target.startswith("cuda") for target in device_map.values())
+    staging = None
+    bytes_read = 0
+    unexpected = []
+    for path in files:
+        header, data_start = read_header(path)
+        with open(path, 'rb') as f:
+            # Copy-on-write mapping: writable for torch.frombuffer, never written
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        try:
+            for name, info in header.items():
+                if name not in targets:
+                    unexpected.append(name)
+                    continue
+                begin, end = info['data_offsets']
+                nbytes = end - begin
+
+                t0 = time.perf_counter()
+                if staging is None or staging.numel() < nbytes:
+                    staging = torch.empty(nbytes, dtype=torch.uint8, pin_memory=pin)
+                raw = staging[:nbytes]
+                raw.copy_(torch.frombuffer(mapped, dtype=torch.uint8, count=nbytes, offset=data_start + begin))
+                t1 = time.perf_counter()
+
+                tensor = raw.view(SAFETENSORS_DTYPES[info['dtype']]).reshape(info['shape'])
+                cast = tensor.is_floating_point() and tensor.dtype != dtype
+                tensor_device = _mapped_device(device_map, name)
+                if tensor_device.startswith("cuda"):
+                    # Cast on the GPU, after the copy of the (smaller or equal) checkpoint bytes
+                    t2 = time.perf_counter()
+                    tensor = tensor.to(tensor_device)
+                    t3 = time.perf_counter()
+                    if cast:
+                        tensor = tensor.to(dtype)
+                    t4 = time.perf_counter()
+                    timings['device_copy'] += t3 - t2
+                    timings['deserialize'] += (t2 - t1) + (t4 - t3)
+                else:
+                    if cast:
+                        tensor = tensor.to(dtype)
+                    t2 = time.perf_counter()
+                    # Uncast tensors still point into the staging buffer
+                    if tensor.data_ptr() == staging.data_ptr():
+                        tensor = tensor.clone()
+                    t3 = time.perf_counter()
+                    timings['deserialize'] += t2 - t1
+                    timings['device_copy'] += t3 - t2
+                timings['read'] += t1 - t0
+                bytes_read += nbytes
+                _set_tensor(model, name, tensor)
+        finally:
+            mapped.close()
+
+    if unexpected:
+        raise ValueError(f"checkpoint tensors not in the model: {', '.join(unexpected[:5])}")
+    # Tied parameters (e.g. the LM head) are not stored twice in the checkpoint
+    model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"parameters missing from the checkpoint: {', '.join(missing[:5])}")
+    for name, buffer in list(model.named_buffers()):
+        buffer_device = torch.device(_mapped_device(device_map, name))
+        if buffer.device != buffer_device:
+            _set_tensor(model, name, buffer.to(buffer_device))
+    if len(set(device_map.values())) > 1:
+        # Hooks moving activations between devices, as from_pretrained adds for a device map
+        model = dispatch_model(model, device_map=device_map)
+        model.hf_device_map = device_map
+
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(directory)
+    except OSError:
+        pass
+
+    timings['total_seconds'] = time.perf_counter() - start
+    timings['bytes_read'] = bytes_read
+    timings['peak_host_bytes'] = peak_host_bytes()
+    return model.eval(), timings
+
+
+def load_model_fast_or_none(model_name: str, device: str, use_cuda: bool, dtype: torch.dtype, report=None):
+    """
+    Load with load_model_fast, or return None where from_pretrained must be used instead.
+
+    Args:
+        model_name: HuggingFace model name or local directory
+        device: Device to place the model on; None balances it over all
+            GPUs (or loads on CPU without CUDA)
+        use_cuda: Whether the model goes to GPUs
+        dtype: Target dtype of floating-point tensors
+        report: PerfReport receiving the per-stage load times
+
+    Returns:
+        The model, or None for checkpoints fast loading cannot read and
+        models that do not fit where they were to be placed
+    """
+    target = (device or "auto") if use_cuda else "cpu"
+    try:
+        model, timings = load_model_fast(model_name, target, dtype)
+    except ValueError as e:
+        print(f"  [WARNING] Fast loading not possible ({e}); using from_pretrained")
+        return None
+    except Exception as e:
+        if not is_oom_error(e):
+            raise
+        free_memory()
+        print(f"  [WARNING] Model does not fit on {target} for fast loading; using from_pretrained")
+        return None
+    print(f"  [OK] Fast load: {format_load_timings(timings)}")
+    if report is not None:
+        for stage in LOAD_STAGES:
+            report.add_stage(f"load_{stage}", timings[stage])
+    return model
@@ -0,0 +1,186 @@
+"""
+Batched generation benchmark.
+
+Measures serving-style generation throughput: prompts from a file are
+generated for in batches of a fixed size (left-padded, so every prompt
+ends at the same position and new tokens line up), and each decoding
+step is timestamped as it is produced. Reported per batch size:
+
+- time to first token (TTFT): from the start of a batch to its first
+  generated token, i.e. the prefill latency every request in it sees
+- inter-token latency (ITL): time between consecutive decoding steps
+- output tokens/sec: generated tokens (up to and including EOS) over
+  the total wall time, across all batches
+
+Latencies are summarized as mean, p50, p90 and p99 in milliseconds.
+"""
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+
+def load_prompts(path: str, max_prompts: Optional[int] = None) -> List[str]:
+    """
+    Read prompts from a .jsonl file (`prompt`, `text` or `content` field) or one per line.
+
+    Blank lines are skipped.
+    """
+    prompts = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if path.endswith(('.jsonl', '.json')):
+                record = json.loads(line)
+                prompts.append(next(record[key] for key in ('prompt', 'text', 'content') if key in record))
+            else:
+                prompts.append(line.rstrip('\n'))
+            if max_prompts is not None and len(prompts) >= max_prompts:
+                break
+    return prompts
+
+
+def latency_percentiles(seconds: Sequence[float]) -> Dict[str, Optional[float]]:
+    """Mean, p50, p90 and p99 of latencies, in milliseconds."""
+    if len(seconds) == 0:
+        return {'mean': None, 'p50': None, 'p90': None, 'p99': None}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'mean': round(float(ms.mean()), 3), 'p50': round(float(p50), 3),
+            'p90': round(float(p90), 3), 'p99': round(float(p99), 3)}
+
+
+class StepTimer(BaseStreamer):
+    """Streamer recording when each decoding step's tokens come out of generate()."""
+
+    def __init__(self):
+        self.steps: List[float] = []
+        self._prompt_seen = False
+
+    def put(self, value):
+        # The first call carries the prompt; generate() copies each step's
+        # tokens to the host before calling put, so timestamps are synchronized
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        self.steps.append(time.perf_counter())
+
+    def end(self):
+        pass
+
+
+def _eos_ids(model, tokenizer) -> set:
+    eos = getattr(model.generation_config, 'eos_token_id', None)
+    if eos is None:
+        eos = tokenizer.eos_token_id
+    if eos is None:
+        return set()
+    return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+
+def _output_tokens(generated: torch.Tensor, eos_ids: set) -> int:
+    """Tokens generated per row up to and including the first EOS (padding after it excluded)."""
+    total = 0
+    for row in generated.tolist():
+        for position, token in enumerate(row):
+            if token in eos_ids:
+                total += position + 1
+                break
+        else:
+            total += len(row)
+    return total
+
+
+def generate_batch(model, tokenizer, prompts: Sequence[str], device: str, max_new_tokens: int) -> Dict[str, Any]:
+    """
+    Generate greedily for one left-padded batch of prompts, timing every step.
+
+    Returns:
+        Dict with ttft (seconds), step_latencies (seconds between steps),
+        output_tokens, seconds (wall time) and the generated token ids
+    """
+    inputs = tokenizer(list(prompts), return_tensors="pt", padding=True)
+    inputs = {key: value.to(device) for key, value in inputs.items()}
+    timer = StepTimer()
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+            streamer=timer,
+        )
+    seconds = time.perf_counter() - start
+
+    generated = outputs[:, inputs['input_ids'].shape[1]:].cpu()
+    return {
+        'ttft': timer.steps[0] - start if timer.steps else None,
+        'step_latencies': np.diff(timer.steps).tolist(),
+        'output_tokens': _output_tokens(generated, _eos_ids(model, tokenizer)),
+        'seconds': seconds,
+        'generated': generated,
+    }
+
+
+def benchmark_generation(
+    model,
+    tokenizer,
+    prompts: Sequence[str],
+    device: str,
+    batch_size: int,
+    max_new_tokens: int = 64,
+    report=None,
+) -> Dict[str, Any]:
+    """
+    Generate for all prompts in batches of `batch_size` and summarize latency and throughput.
+
+    A short warm-up generation runs first so one-time initialization is
+    not counted. With `report` (a PerfReport), a throughput sample is
+    recorded after every batch.
+
+    Returns:
+        Dict with batch_size, prompts, batches, output_tokens, seconds,
+        output_tokens_per_second, ttft_ms and itl_ms (latency_percentiles)
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be positive, got {batch_size}")
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+    # New tokens must line up after the last prompt token of every row
+    tokenizer.padding_side = 'left'
+
+    batches = [prompts[i:i + batch_size] for i in range(0, len(prompts), batch_size)]
+    generate_batch(model, tokenizer, batches[0], device, max_new_tokens=2)
+
+    ttfts, step_latencies = [], []
+    output_tokens = 0
+    seconds = 0.0
+    if report is not None:
+        report.start_progress()
+    for index, batch in enumerate(batches):
+        result = generate_batch(model, tokenizer, batch, device, max_new_tokens)
+        if result['ttft'] is not None:
+            # Every request in the batch waits for the same first step
+            ttfts.extend([result['ttft']] * len(batch))
+        step_latencies.extend(result['step_latencies'])
+        output_tokens += result['output_tokens']
+        seconds += result['seconds']
+        if report is not None:
+            report.progress(index + 1, len(batches), output_tokens)
+
+    return {
+        'batch_size': batch_size,
+        'prompts': len(prompts),
+        'batches': len(batches),
+        'output_tokens': output_tokens,
+        'seconds': round(seconds, 3),
+        'output_tokens_per_second': round(output_tokens / seconds, 1) if seconds > 0 else 0.0,
+        'ttft_ms': latency_percentiles(ttfts),
+        'itl_ms': latency_percentiles(step_latencies),
+    }
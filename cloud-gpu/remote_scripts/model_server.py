@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Keep models loaded and serve generate/score requests over local HTTP.
+
+Every ``python3 evaluate_model.py ...`` call pays for a fresh interpreter,
+the torch/transformers imports and loading the weights: tens of seconds
+for a 7B model before any token is computed. This server pays that once.
+It listens on ``127.0.0.1`` only; clients reach it through the SSH
+connection (see ``lib/model_client.py``).
+
+Requests and responses are JSON:
+
+- ``GET /health``: loaded models and server uptime
+- ``POST /load`` ``{"model", "quantize"?, "device"?}``: load a model (no-op if loaded)
+- ``POST /unload`` ``{"model"}``: free a model
+- ``POST /generate`` ``{"model", "prompts", "max_new_tokens"?}``: greedy
+  continuations of a left-padded batch of prompts
+- ``POST /score`` ``{"model", "texts", "max_length"?, "max_tokens"?}``:
+  perplexity of the texts, overall and per text
+- ``POST /shutdown``: stop the server
+
+Models named in generate/score requests are loaded on first use. Requests
+to one model run one at a time; different models are served concurrently.
+
+With ``--prefix-cache-mb`` every model keeps a PrefixCache (see
+``prefix_cache.py``) of that size: single-prompt generate requests reuse
+the keys/values of prompt prefixes seen before (a shared system prompt,
+say) and report how many prompt tokens came from the cache. Batched
+requests are generated as before.
+
+Usage:
+    python model_server.py [--port 8765] [--preload MODEL ...] [--quantize int8|int4] [--prefix-cache-mb 512]
+"""
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+import torch
+
+from calculate_perplexity import load_model, score_batched, tokenize_texts
+from confidence import DocumentStats
+from generation_benchmark import generate_batch
+from prefix_cache import PrefixCache, generate_cached
+from quantization import QUANTIZATION_MODES, model_size_bytes
+
+DEFAULT_PORT = 8765
+
+
+class RequestError(Exception):
+    """A request the server cannot serve, returned to the client with an HTTP status."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class LoadedModel:
+    """A resident model, its tokenizer and the lock serializing requests to it."""
+
+    def __init__(
+        self,
+        name: str,
+        model,
+        tokenizer,
+        device: str,
+        quantize: str = None,
+        load_seconds: float = 0.0,
+        prefix_cache: PrefixCache = None,
+    ):
+        self.name = name
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.quantize = quantize
+        self.load_seconds = load_seconds
+        self.prefix_cache = prefix_cache
+        self.requests = 0
+        # Set by ModelRegistry.unload; requests check it once they hold the lock
+        self.unloaded = False
+        self.lock = threading.Lock()
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token_id = tokenizer.eos_token_id
+        # Generation appends to the end of every row
+        tokenizer.padding_side = 'left'
+
+    def check_loaded(self):
+        """Raise RequestError if the model was unloaded; call while holding the lock."""
+        if self.unloaded:
+            raise RequestError(f"model '{self.name}' was unloaded", status=409)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'model': self.name,
+            'device': self.device,
+            'quantize': self.quantize,
+            'model_bytes': model_size_bytes(self.model),
+            'load_seconds': round(self.load_seconds, 3),
+            'requests': self.requests,
+            'prefix_cache': self.prefix_cache.summary() if self.prefix_cache is not None else None,
+        }
+
+
+class ModelRegistry:
+    """Models kept resident by the server, by name."""
+
+    def __init__(self, default_quantize: str = None, prefix_cache_bytes: int = 0):
+        self.default_quantize = default_quantize
+        self.prefix_cache_bytes = prefix_cache_bytes
+        self.models: Dict[str, LoadedModel] = {}
+        self._lock = threading.Lock()
+
+    def load(self, name: str, quantize: str = None, device: str = None) -> LoadedModel:
+        """Load a model unless it is already resident."""
+        # Requests to resident models must not wait for another model to load
+        loaded = self.models.get(name)
+        if loaded is not None:
+            return loaded
+        with self._lock:
+            if name not in self.models:
+                quantize = quantize or self.default_quantize
+                start = time.perf_counter()
+                model, tokenizer, device = load_model(name, device=device, quantize=quantize)
+                prefix_cache = PrefixCache(self.prefix_cache_bytes) if self.prefix_cache_bytes else None
+                self.models[name] = LoadedModel(
+                    name, model, tokenizer, device, quantize, time.perf_counter() - start, prefix_cache
+                )
+            return self.models[name]
+
+    def unload(self, name: str) -> bool:
+        """Drop a model; returns whether it was loaded."""
+        with self._lock:
+            loaded = self.models.pop(name, None)
+            if loaded is None:
+                return False
+            loaded.unloaded = True
+        # Wait for in-flight requests before releasing the memory
+        with loaded.lock:
+            loaded.model = None
+            loaded.prefix_cache = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return True
+
+
+def generate(loaded: LoadedModel, prompts, max_new_tokens: int = 64) -> Dict[str, Any]:
+    """Greedy continuations of a batch of prompts."""
+    if loaded.prefix_cache is not None and len(prompts) == 1:
+        return _generate_cached(loaded, prompts[0], max_new_tokens)
+    with loaded.lock:
+        loaded.check_loaded()
+        result = generate_batch(loaded.model, loaded.tokenizer, prompts, loaded.device, max_new_tokens)
+        loaded.requests += 1
+    texts = loaded.tokenizer.batch_decode(result['generated'], skip_special_tokens=True)
+    return {
+        'texts': texts,
+        'output_tokens': result['output_tokens'],
+        'seconds': round(result['seconds'], 4),
+        'ttft_seconds': round(result['ttft'], 4) if result['ttft'] is not None else None,
+    }
+
+
+def _generate_cached(loaded: LoadedModel, prompt: str, max_new_tokens: int) -> Dict[str, Any]:
+    """Greedy continuation of one prompt, reusing cached prefix keys/values."""
+    prompt_ids = loaded.tokenizer(prompt)['input_ids']
+    with loaded.lock:
+        loaded.check_loaded()
+        result = generate_cached(
+            loaded.model, prompt_ids, loaded.device, max_new_tokens, loaded.prefix_cache,
+            loaded.tokenizer.pad_token_id,
+        )
+        loaded.requests += 1
+    return {
+        'texts': [loaded.tokenizer.decode(result['tokens'], skip_special_tokens=True)],
+        'output_tokens': len(result['tokens']),
+        'seconds': round(result['seconds'], 4),
+        'ttft_seconds': round(result['prefill_seconds'], 4),
+        'cached_tokens': result['cached_tokens'],
+    }
+
+
+def score(loaded: LoadedModel, texts, max_length: int = 512, max_tokens: int = 2048) -> Dict[str, Any]:
+    """Perplexity of a list of texts, overall and per text."""
+    start = time.perf_counter()
+    with loaded.lock:
+        loaded.check_loaded()
+        token_ids = tokenize_texts(loaded.tokenizer, list(texts))
+        stats = DocumentStats(len(token_ids))
+        totals = score_batched(
+            loaded.model, loaded.tokenizer, token_ids, loaded.device,
+            max_tokens=max_tokens, max_length=max_length, loss_writer=stats,
+        )
+        loaded.requests += 1
+    per_text = [
+        {
+            'tokens': int(tokens),
+            'loss': float(loss),
+            'perplexity': math.exp(loss / tokens) if tokens else None,
+        }
+        for loss, tokens in zip(stats.losses, stats.tokens)
+    ]
+    total_tokens = totals['total_tokens']
+    return {
+        'perplexity': math.exp(totals['total_loss'] / total_tokens) if total_tokens else None,
+        'total_tokens': int(total_tokens),
+        'texts': per_text,
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+
+
+def _require(payload: Dict[str, Any], field: str):
+    if field not in payload:
+        raise RequestError(f"missing field '{field}'")
+    return payload[field]
+
+
+class ModelServer(ThreadingHTTPServer):
+    """HTTP server holding a ModelRegistry."""
+
+    daemon_threads = True
+
+    def __init__(self, address, registry: ModelRegistry):
+        super().__init__(address, _Handler)
+        self.registry = registry
+        self.started = time.time()
+
+    def handle_request_json(self, method: str, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Dispatch one request; raises RequestError for bad requests."""
+        registry = self.registry
+        if method == 'GET' and path == '/health':
+            return {
+                'status': 'ok',
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'models': [loaded.info() for loaded in list(registry.models.values())],
+            }
+        if method != 'POST':
+            raise RequestError(f"unknown endpoint {method} {path}", status=404)
+
+        if path == '/load':
+            quantize = payload.get('quantize')
+            if quantize is not None and quantize not in QUANTIZATION_MODES:
+                raise RequestError(f"unknown quantization mode '{quantize}'")
+            return registry.load(_require(payload, 'model'), quantize, payload.get('device')).info()
+        if path == '/unload':
+            return {'unloaded': registry.unload(_require(payload, 'model'))}
+        if path == '/generate':
+            prompts = _require(payload, 'prompts')
+            if isinstance(prompts, str):
+                prompts = [prompts]
+            if not prompts:
+                raise RequestError("no prompts")
+            loaded = registry.load(_require(payload, 'model'))
+            return generate(loaded, prompts, int(payload.get('max_new_tokens', 64)))
+        if path == '/score':
+            texts = _require(payload, 'texts')
+            if isinstance(texts, str):
+                texts = [texts]
+            if not texts:
+                raise RequestError("no texts")
+            loaded = registry.load(_require(payload, 'model'))
+            return score(
+                loaded, texts,
+                max_length=int(payload.get('max_length', 512)),
+                max_tokens=int(payload.get('max_tokens', 2048)),
+            )
+        if path == '/shutdown':
+            # shutdown() waits for serve_forever, which is waiting for this request
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {'status': 'shutting down'}
+        raise RequestError(f"unknown endpoint {method} {path}", status=404)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length)) if length else {}
+            if not isinstance(payload, dict):
+                raise RequestError("request body must be a JSON object")
+            status, body = 200, self.server.handle_request_json(method, self.path, payload)
+        except RequestError as e:
+            status, body = e.status, {'error': str(e)}
+        except json.JSONDecodeError as e:
+            status, body = 400, {'error': f"invalid JSON: {e}"}
+        except Exception as e:
+            status, body = 500, {'error': f"{type(e).__name__}: {e}"}
+
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"  [{self.log_date_time_string()}] {format % args}", flush=True)
+
+
+def serve(
+    port: int = DEFAULT_PORT,
+    host: str = '127.0.0.1',
+    preload=(),
+    quantize: str = None,
+    prefix_cache_bytes: int = 0,
+):
+    """
+    Run the server until a /shutdown request or Ctrl-C.
+
+    Args:
+        port: Port to listen on (0 picks a free one)
+        host: Interface to listen on; keep the default and reach the
+            server through SSH rather than exposing it
+        preload: Models to load before accepting requests
+        quantize: Quantization mode for models loaded without one
+        prefix_cache_bytes: Per-model prefix cache budget for single-prompt
+            generation (0: no prefix cache)
+    """
+    registry = ModelRegistry(default_quantize=quantize, prefix_cache_bytes=prefix_cache_bytes)
+    for name in preload:
+        registry.load(name)
+    server = ModelServer((host, port), registry)
+    print(f"[OK] Model server listening on {host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print("[OK] Model server stopped", flush=True)
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Serve generate/score requests from resident models.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument("--preload", nargs="*", default=[], metavar="MODEL",
+                        help="Models to load before accepting requests")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default=None,
+                        help="Run models on CPU with int8 (dynamic) or int4 (weight-only) linear layers")
+    parser.add_argument("--prefix-cache-mb", type=float, default=0,
+                        help="Per-model cache of prompt-prefix keys/values for single-prompt generation "
+                             "(default: off)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        serve(args.port, args.host, preload=args.preload, quantize=args.quantize,
+              prefix_cache_bytes=int(args.prefix_cache_mb * 1e6))
+    except Exception as e:
+        print(f"[ERROR] Model server failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,211 @@
+"""
+Overlapped batch preparation for evaluation loops.
+
+Collating a batch (slicing token ids, padding, building masks) and copying
+it to the accelerator otherwise run on the same thread as the forward
+pass, so the device idles while the CPU works. `Prefetcher` moves that
+work into a small thread pool: batches are collated by the workers, placed
+in pinned memory, and copied to the device on a separate CUDA stream a few
+batches ahead of the model.
+
+Stall counters show which side is the bottleneck: time the consumer (the
+model) spends waiting for a batch means preparation is too slow, time the
+producer spends waiting for a free queue slot means the model is.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Sequence
+
+import torch
+
+_DONE = object()
+
+
+class PipelineStats:
+    """Counters describing how well batch preparation keeps up with the model."""
+
+    def __init__(self):
+        self.batches = 0
+        self.consumer_stall_seconds = 0.0
+        self.producer_stall_seconds = 0.0
+        self.queue_depth_total = 0
+        self.max_queue_depth = 0
+
+    def record_get(self, depth: int, waited: float):
+        """Record one batch handed to the consumer."""
+        self.batches += 1
+        self.consumer_stall_seconds += waited
+        self.queue_depth_total += depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    @property
+    def mean_queue_depth(self) -> float:
+        """Average number of ready batches when the consumer asked for one."""
+        return self.queue_depth_total / self.batches if self.batches else 0.0
+
+    @property
+    def bottleneck(self) -> str:
+        """'producer' if the model mostly waited for data, otherwise 'consumer'."""
+        return 'producer' if self.consumer_stall_seconds > self.producer_stall_seconds else 'consumer'
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'batches': self.batches,
+            'consumer_stall_seconds': round(self.consumer_stall_seconds, 4),
+            'producer_stall_seconds': round(self.producer_stall_seconds, 4),
+            'mean_queue_depth': round(self.mean_queue_depth, 2),
+            'max_queue_depth': self.max_queue_depth,
+            'bottleneck': self.bottleneck,
+        }
+
+
+def merge_pipeline_stats(pipelines: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine PipelineStats.as_dict() summaries of several runs (workers or chunks)."""
+    consumer = sum(p['consumer_stall_seconds'] for p in pipelines)
+    producer = sum(p['producer_stall_seconds'] for p in pipelines)
+    batches = sum(p['batches'] for p in pipelines)
+    depth_total = sum(p['mean_queue_depth'] * p['batches'] for p in pipelines)
+    return {
+        'batches': batches,
+        'consumer_stall_seconds': round(consumer, 4),
+        'producer_stall_seconds': round(producer, 4),
+        'mean_queue_depth': round(depth_total / batches if batches else 0.0, 2),
+        'max_queue_depth': max((p['max_queue_depth'] for p in pipelines), default=0),
+        'bottleneck': 'producer' if consumer > producer else 'consumer',
+    }
+
+
+def _map_tensors(batch, fn):
+    """Apply `fn` to every tensor in a dict, tuple or list of tensors."""
+    if isinstance(batch, torch.Tensor):
+        return fn(batch)
+    if isinstance(batch, dict):
+        return {key: _map_tensors(value, fn) for key, value in batch.items()}
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(_map_tensors(value, fn) for value in batch)
+    return batch
+
+
+class Prefetcher:
+    """
+    Iterate over collated, device-resident batches prepared in the background.
+
+    Args:
+        items: Work items, e.g. lists of sample indices (one per batch)
+        collate: `collate(item)` builds a CPU batch (a tensor, or a dict,
+            tuple or list of tensors); runs in the worker threads
+        device: Device the batches are copied to
+        num_workers: Collation threads; 0 prepares every batch inline
+        depth: Batches prepared ahead of the consumer
+
+    Batches are yielded in the order of `items`. Exceptions raised by
+    `collate` are re-raised in the consumer.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[Any],
+        collate: Callable[[Any], Any],
+        device: str,
+        num_workers: int = 2,
+        depth: int = 4,
+    ):
+        self.items = items
+        self.collate = collate
+        self.device = device
+        self.num_workers = num_workers
+        self.depth = max(1, depth)
+        self.stats = PipelineStats()
+        self._cuda = str(device).startswith('cuda') and torch.cuda.is_available()
+
+    def _prepare(self, item):
+        batch = self.collate(item)
+        if self._cuda:
+            batch = _map_tensors(batch, lambda t: t.pin_memory())
+        return batch
+
+    def _to_device(self, batch, stream):
+        """Start an asynchronous host-to-device copy, returning (batch, ready event)."""
+        if not self._cuda:
+            return _map_tensors(batch, lambda t: t.to(self.device)), None
+        with torch.cuda.stream(stream):
+            batch = _map_tensors(batch, lambda t: t.to(self.device, non_blocking=True))
+            event = torch.cuda.Event()
+            event.record(stream)
+        return batch, event
+
+    def _produce(self, ready: queue.Queue, stop: threading.Event):
+        stream = torch.cuda.Stream(device=self.device) if self._cuda else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+                pending = deque()
+                items = iter(self.items)
+                exhausted = False
+                while not stop.is_set():
+                    # Keep every worker busy, in item order
+                    while not exhausted and len(pending) < self.num_workers + self.depth:
+                        try:
+                            pending.append(pool.submit(self._prepare, next(items)))
+                        except StopIteration:
+                            exhausted = True
+                    if not pending:
+                        break
+
+                    batch = self._to_device(pending.popleft().result(), stream)
+                    start = time.perf_counter()
+                    while not stop.is_set():
+                        try:
+                            ready.put(batch, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    self.stats.producer_stall_seconds += time.perf_counter() - start
+                for future in pending:
+                    future.cancel()
+        except BaseException as e:
+            ready.put(e)
+            return
+        ready.put(_DONE)
+
+    def __iter__(self) -> Iterator[Any]:
+        if self.num_workers <= 0:
+            for item in self.items:
+                start = time.perf_counter()
+                batch, _ = self._to_device(self._prepare(item), None)
+                self.stats.record_get(0, time.perf_counter() - start)
+                yield batch
+            return
+
+        ready = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(ready, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                depth = ready.qsize()
+                start = time.perf_counter()
+                entry = ready.get()
+                waited = time.perf_counter() - start
+                if entry is _DONE:
+                    return
+                if isinstance(entry, BaseException):
+                    raise entry
+                batch, event = entry
+                if event is not None:
+                    stream = torch.cuda.current_stream()
+                    stream.wait_event(event)
+                    # Keep the copy's memory alive until the compute stream is done with it
+                    _map_tensors(batch, lambda t: t.record_stream(stream))
+                self.stats.record_get(depth, waited)
+                yield batch
+        finally:
+            stop.set()
+            # Unblock a producer waiting on a full queue
+            while producer.is_alive():
+                try:
+                    ready.get_nowait()
+                except queue.Empty:
+                    producer.join(timeout=0.1)
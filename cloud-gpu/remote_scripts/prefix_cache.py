@@ -0,0 +1,236 @@
+"""
+Reuse the KV cache of prompt prefixes shared between generations.
+
+Prompts that start with the same system prompt or few-shot preamble
+compute the same keys/values for it every time. `PrefixCache` keeps them:
+
+- A prompt is split into blocks of ``block_size`` tokens. Each complete
+  block's keys/values are stored under a hash of all tokens up to the
+  end of the block (the previous block's hash chained with the block's
+  tokens), so two prompts share exactly the entries of their common
+  block-aligned prefix, and no entry is stored twice.
+- A lookup walks the prompt's blocks from the start and stops at the
+  first block that is not cached; the blocks found are joined into a
+  DynamicCache and only the rest of the prompt is computed. At least one
+  prompt token is always left to compute, as generation needs its logits.
+- Entries are evicted least recently used first once their total size
+  exceeds ``max_bytes``. The blocks of a prompt are marked used from the
+  last to the first, so a block is always more recently used than every
+  block after it: a prefix loses its tail first, and no block outlives
+  the block it extends (which would leave it unreachable but counted).
+
+Greedy outputs are the same with and without the cache.
+
+The model server (see ``model_server.py --prefix-cache-mb``) uses it for
+single-prompt generate requests.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from transformers import DynamicCache
+
+from generation_benchmark import StepTimer
+
+
+def _block_hash(parent: str, tokens: Sequence[int]) -> str:
+    digest = hashlib.sha256(parent.encode('ascii'))
+    digest.update(np.asarray(tokens, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def _layer_tensors(cache) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """(keys, values) of every layer, each (batch, heads, length, head_dim)."""
+    if hasattr(cache, 'layers'):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+class PrefixCache:
+    """LRU cache of prompt-prefix keys/values, in blocks keyed by token-prefix hash."""
+
+    def __init__(self, max_bytes: int, block_size: int = 32):
+        """
+        Initialize prefix cache.
+
+        Args:
+            max_bytes: Memory budget for cached keys/values
+            block_size: Tokens per cached block; prefixes are shared in
+                whole blocks
+        """
+        if block_size < 1:
+            raise ValueError(f"block_size must be positive, got {block_size}")
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.bytes = 0
+        self._blocks: "OrderedDict[str, Tuple[List[Tuple[torch.Tensor, torch.Tensor]], int]]" = OrderedDict()
+        self.stats = {'lookups': 0, 'hits': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'evictions': 0}
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def _hashes(self, token_ids: Sequence[int], num_blocks: int) -> List[str]:
+        hashes, parent = [], ''
+        for index in range(num_blocks):
+            parent = _block_hash(parent, token_ids[index * self.block_size:(index + 1) * self.block_size])
+            hashes.append(parent)
+        return hashes
+
+    def lookup(self, token_ids: Sequence[int]) -> Tuple[int, Optional[DynamicCache]]:
+        """
+        Find the longest cached block-aligned prefix of a prompt.
+
+        Returns:
+            Tuple of (cached token count, DynamicCache holding their
+            keys/values, or None on a miss)
+        """
+        # Leave at least one token to compute
+        num_blocks = (len(token_ids) - 1) // self.block_size
+        keys = []
+        for key in self._hashes(token_ids, num_blocks):
+            if key not in self._blocks:
+                break
+            keys.append(key)
+        self._touch(keys)
+        found = [self._blocks[key][0] for key in keys]
+
+        cached = len(found) * self.block_size
+        self.stats['lookups'] += 1
+        self.stats['prompt_tokens'] += len(token_ids)
+        self.stats['cached_tokens'] += cached
+        if not found:
+            return 0, None
+        self.stats['hits'] += 1
+        layers = [
+            (torch.cat([block[layer][0] for block in found], dim=-2),
+             torch.cat([block[layer][1] for block in found], dim=-2))
+            for layer in range(len(found[0]))
+        ]
+        return cached, DynamicCache(ddp_cache_data=layers)
+
+    def insert(self, token_ids: Sequence[int], cache):
+        """
+        Store the complete blocks of a prompt from a cache holding (at least) its keys/values.
+
+        Blocks already cached are only marked as recently used.
+        """
+        tensors = _layer_tensors(cache)
+        num_blocks = min(len(token_ids), tensors[0][0].shape[-2]) // self.block_size
+        keys = []
+        for index, key in enumerate(self._hashes(token_ids, num_blocks)):
+            if key not in self._blocks:
+                start, end = index * self.block_size, (index + 1) * self.block_size
+                # Copies, so the full cache they are cut from can be freed
+                block = [(k[..., start:end, :].clone(), v[..., start:end, :].clone()) for k, v in tensors]
+                size = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in block)
+                if size > self.max_bytes:
+                    break
+                self._blocks[key] = (block, size)
+                self.bytes += size
+            keys.append(key)
+        self._touch(keys)
+        self._evict()
+
+    def _touch(self, keys: List[str]):
+        """Mark a prompt's blocks as most recently used, its first block last."""
+        for key in reversed(keys):
+            self._blocks.move_to_end(key)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            _, (_, size) = self._blocks.popitem(last=False)
+            self.bytes -= size
+            self.stats['evictions'] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        """Lookup statistics: hit_rate (lookups reusing a prefix) and cached_token_fraction."""
+        stats = self.stats
+        return {
+            **stats,
+            'blocks': len(self._blocks),
+            'bytes': self.bytes,
+            'hit_rate': stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0,
+            'cached_token_fraction': stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0,
+        }
+
+
+def generate_cached(
+    model,
+    prompt_ids: Sequence[int],
+    device: str,
+    max_new_tokens: int,
+    prefix_cache: PrefixCache = None,
+    pad_token_id: int = None,
+) -> Dict[str, Any]:
+    """
+    Greedy generation for one prompt, reusing and filling `prefix_cache`.
+
+    Returns:
+        Dict with tokens (generated ids), cached_tokens, prefill_seconds
+        (time to the first generated token) and seconds
+    """
+    cached, past = prefix_cache.lookup(prompt_ids) if prefix_cache is not None else (0, None)
+    input_ids = torch.tensor([list(prompt_ids)], device=device)
+    timer = StepTimer()
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=past,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=pad_token_id,
+            streamer=timer,
+            return_dict_in_generate=True,
+        )
+    seconds = time.perf_counter() - start
+    if prefix_cache is not None:
+        prefix_cache.insert(prompt_ids, outputs.past_key_values)
+    return {
+        'tokens': outputs.sequences[0, len(prompt_ids):].tolist(),
+        'cached_tokens': cached,
+        'prefill_seconds': timer.steps[0] - start,
+        'seconds': seconds,
+    }
+
+
+def benchmark_prefix_cache(
+    model,
+    tokenizer,
+    prompts: Sequence[str],
+    device: str,
+    max_bytes: int,
+    block_size: int = 32,
+    max_new_tokens: int = 20,
+) -> Dict[str, Any]:
+    """
+    Generate for every prompt without and with a prefix cache and compare prefill time.
+
+    Returns:
+        Dict with the cache summary (hit_rate, cached_token_fraction, ...),
+        prefill_seconds without and with the cache, prefill_seconds_saved
+        and identical (whether all outputs matched)
+    """
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    token_ids = [tokenizer(prompt)['input_ids'] for prompt in prompts]
+    # Warm-up, so neither pass pays for one-time initialization
+    generate_cached(model, token_ids[0], device, 2, pad_token_id=pad_token_id)
+
+    baseline = [generate_cached(model, ids, device, max_new_tokens, pad_token_id=pad_token_id) for ids in token_ids]
+    prefix_cache = PrefixCache(max_bytes, block_size)
+    cached = [generate_cached(model, ids, device, max_new_tokens, prefix_cache, pad_token_id) for ids in token_ids]
+
+    uncached_seconds = sum(result['prefill_seconds'] for result in baseline)
+    cached_seconds = sum(result['prefill_seconds'] for result in cached)
+    return {
+        **prefix_cache.summary(),
+        'prefill_seconds_uncached': round(uncached_seconds, 4),
+        'prefill_seconds_cached': round(cached_seconds, 4),
+        'prefill_seconds_saved': round(uncached_seconds - cached_seconds, 4),
+        'identical': all(a['tokens'] == b['tokens'] for a, b in zip(baseline, cached)),
+    }
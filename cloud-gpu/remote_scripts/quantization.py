@@ -0,0 +1,158 @@
+"""
+Weight-quantized CPU inference.
+
+Without a GPU the remote scripts run models in fp32, which is slow and
+memory hungry: Qwen2.5-1.5B needs 6 GB of weights and most of each step is
+spent streaming them from memory. Quantizing the linear layers cuts both:
+
+- ``int8``: dynamic quantization. Weights are stored as int8 per output
+  channel and activations are quantized on the fly, so matmuls run on the
+  int8 kernels (fbgemm/oneDNN). The best choice for scoring (perplexity),
+  where steps process many tokens at once.
+- ``int4``: weight-only quantization in groups of ``group_size`` input
+  channels with a scale and zero point each, multiplied by bf16
+  activations. Weights are a quarter of their int8 size, which pays off
+  when decoding a token at a time; with long inputs the bf16 matmul is
+  slower than int8.
+
+The LM head is left in full precision in int4 mode, where rounding its
+weights costs the most accuracy. Embeddings and norms are never quantized.
+"""
+from typing import Optional
+
+import torch
+import torch.nn as nn
+
+QUANTIZATION_MODES = ('int8', 'int4')
+
+
+def _supports_int4() -> bool:
+    return (hasattr(torch.ops.aten, '_convert_weight_to_int4pack_for_cpu')
+            and hasattr(torch.ops.aten, '_weight_int4pack_mm_for_cpu'))
+
+
+class Int4Linear(nn.Module):
+    """Linear layer with group-wise asymmetric int4 weights (CPU only)."""
+
+    def __init__(self, linear: nn.Linear, group_size: int = 128):
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.group_size = group_size
+
+        weight = linear.weight.detach().float()
+        groups = weight.reshape(-1, group_size)
+        low = groups.amin(dim=1, keepdim=True)
+        high = groups.amax(dim=1, keepdim=True)
+        scale = (high - low).clamp(min=1e-6) / 15
+        quantized = ((groups - low) / scale).round().clamp(0, 15).to(torch.int32)
+
+        # The kernel dequantizes as (q - 8) * scale + zero
+        zero = low + 8 * scale
+        scales_and_zeros = torch.stack([
+            scale.reshape(self.out_features, -1).t(),
+            zero.reshape(self.out_features, -1).t(),
+        ], dim=-1)
+        self.register_buffer('weight', torch.ops.aten._convert_weight_to_int4pack_for_cpu(
+            quantized.reshape(self.out_features, self.in_features), 1))
+        self.register_buffer('scales_and_zeros', scales_and_zeros.to(torch.bfloat16).contiguous())
+        bias = linear.bias.detach().to(torch.bfloat16) if linear.bias is not None else None
+        self.register_buffer('bias', bias)
+
+    @staticmethod
+    def supports(linear: nn.Linear, group_size: int) -> bool:
+        """Whether the packed kernel accepts this layer's shape."""
+        return linear.in_features % group_size == 0 and linear.out_features % 16 == 0
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        shape = x.shape[:-1]
+        out = torch.ops.aten._weight_int4pack_mm_for_cpu(
+            x.reshape(-1, self.in_features).to(torch.bfloat16),
+            self.weight,
+            self.group_size,
+            self.scales_and_zeros,
+        )
+        if self.bias is not None:
+            out = out + self.bias
+        return out.to(x.dtype).reshape(*shape, self.out_features)
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, group_size={self.group_size}"
+
+
+def _quantize_int4(module: nn.Module, group_size: int, skip: Optional[nn.Module]) -> int:
+    replaced = 0
+    for name, child in module.named_children():
+        if child is skip:
+            continue
+        if isinstance(child, nn.Linear):
+            if Int4Linear.supports(child, group_size):
+                setattr(module, name, Int4Linear(child, group_size))
+                replaced += 1
+        else:
+            replaced += _quantize_int4(child, group_size, skip)
+    return replaced
+
+
+def quantize_model(model, mode: str, group_size: int = 128):
+    """
+    Quantize the linear layers of a CPU model in place.
+
+    Args:
+        model: fp32 causal LM on CPU
+        mode: 'int8' (dynamic) or 'int4' (weight-only)
+        group_size: Input channels sharing a scale in int4 mode (32, 64,
+            128 or 256); layers whose width it does not divide stay fp32
+
+    Returns:
+        The quantized model
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode {mode!r}; expected one of {QUANTIZATION_MODES}")
+    if next(model.parameters()).device.type != 'cpu':
+        raise ValueError("Quantized inference is CPU-only; load the model on CPU")
+
+    if mode == 'int8':
+        model = torch.ao.quantization.quantize_dynamic(
+            model,
+            {nn.Linear: torch.ao.quantization.per_channel_dynamic_qconfig},
+            dtype=torch.qint8,
+            inplace=True,
+        )
+    else:
+        if not _supports_int4():
+            raise RuntimeError(f"int4 kernels are not available in torch {torch.__version__}")
+        if _quantize_int4(model, group_size, model.get_output_embeddings()) == 0:
+            raise ValueError(f"No linear layer has a width divisible by group_size={group_size}")
+    model.eval()
+    return model
+
+
+def _tensor_bytes(value) -> int:
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+
+def model_size_bytes(model) -> int:
+    """
+    Bytes of weights held by the model.
+
+    Counts quantized weights (which are not parameters) through the state
+    dict, and tied weights once.
+    """
+    seen = set()
+    total = 0
+    for value in model.state_dict().values():
+        if isinstance(value, torch.Tensor):
+            if value.is_quantized:
+                total += _tensor_bytes(value)
+                continue
+            key = (value.untyped_storage().data_ptr(), value.storage_offset(), tuple(value.shape))
+            if key in seen:
+                continue
+            seen.add(key)
+        total += _tensor_bytes(value)
+    return total
@@ -0,0 +1,143 @@
+"""
+Machine-readable performance reports.
+
+`PerfReport` collects what a run spent its time and memory on: wall time
+per stage (model load, tokenization, forward, generation), throughput
+samples with an ETA, and peak host and device memory. When enabled, every
+throughput sample and the final summary are also printed as single JSON
+lines prefixed with ``[REPORT] `` in between the usual progress output,
+so a caller streaming the script's stdout (see
+RemoteExecutor.execute_command_streaming and parse_report_line) can track
+a run live; the summary is additionally written to a JSON file.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import torch
+
+REPORT_PREFIX = "[REPORT] "
+
+
+def peak_host_bytes() -> Optional[int]:
+    """Peak resident memory of this process, or None where it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def peak_device_bytes() -> Dict[str, int]:
+    """Peak allocated memory of every visible CUDA device."""
+    if not torch.cuda.is_available():
+        return {}
+    return {f"cuda:{i}": torch.cuda.max_memory_allocated(i) for i in range(torch.cuda.device_count())}
+
+
+class PerfReport:
+    """Stage timings, throughput and memory of one script run."""
+
+    def __init__(self, script: str, path: Optional[str] = None, emit: Optional[bool] = None):
+        """
+        Args:
+            script: Name of the reporting script
+            path: File the final report is written to (None: not written)
+            emit: Print [REPORT] lines to stdout; defaults to whether a
+                path was given
+        """
+        self.script = script
+        self.path = path
+        self.emit_lines = path is not None if emit is None else emit
+        self.stages: Dict[str, float] = {}
+        self.throughput = []
+        self._start = time.perf_counter()
+        self._origin = None
+        self._last = None
+
+    def emit(self, event: str, data: Dict[str, Any]):
+        """Print one [REPORT] line if enabled."""
+        if self.emit_lines:
+            print(REPORT_PREFIX + json.dumps({'event': event, 'script': self.script, **data}, default=str), flush=True)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block of code, adding to the stage's total."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float):
+        """Add time measured elsewhere (e.g. summed over a loop) to a stage's total."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def start_progress(self, done: int = 0, tokens: int = 0):
+        """Mark the start of a loop whose progress is reported (e.g. after resuming at `done`)."""
+        self._origin = self._last = (time.perf_counter(), done, tokens)
+
+    def progress(self, done: int, total: int, tokens: int, unit: str = "batches"):
+        """
+        Record a throughput sample.
+
+        Args:
+            done: Units (batches, samples) completed so far
+            total: Units in the loop
+            tokens: Tokens processed so far
+            unit: Name of the units
+        """
+        now = time.perf_counter()
+        if self._origin is None:
+            self.start_progress()
+        origin_time, origin_done, origin_tokens = self._origin
+        last_time, _, last_tokens = self._last
+        elapsed = now - origin_time
+
+        rate = (done - origin_done) / elapsed if elapsed > 0 else 0.0
+        sample = {
+            'elapsed_seconds': round(now - self._start, 3),
+            'done': done,
+            'total': total,
+            'unit': unit,
+            'tokens': tokens,
+            'tokens_per_second': round((tokens - last_tokens) / max(now - last_time, 1e-9), 1),
+            'mean_tokens_per_second': round((tokens - origin_tokens) / max(elapsed, 1e-9), 1),
+            'eta_seconds': round((total - done) / rate, 1) if rate > 0 else None,
+        }
+        self._last = (now, done, tokens)
+        self.throughput.append(sample)
+        self.emit('progress', sample)
+
+    def finish(self, **metrics) -> Dict[str, Any]:
+        """
+        Emit the summary and write it to `path`.
+
+        Args:
+            metrics: Script results (perplexity, padding efficiency, ...)
+
+        Returns:
+            The report as a dict
+        """
+        summary = {
+            'script': self.script,
+            'total_seconds': round(time.perf_counter() - self._start, 3),
+            'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            'peak_host_bytes': peak_host_bytes(),
+            'peak_device_bytes': peak_device_bytes(),
+            'metrics': metrics,
+            'throughput': self.throughput,
+        }
+        self.emit('summary', {key: value for key, value in summary.items() if key != 'throughput'})
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump(summary, f, indent=2, default=str)
+        return summary
@@ -0,0 +1,181 @@
+"""
+Content-addressed cache of evaluation results.
+
+A perplexity run is fully determined by the model weights, the dataset,
+the scoring settings and the code that scores it. Entries are keyed by a
+hash of all four: the model's resolved revision (the Hub commit, or a
+fingerprint of a local model directory), the run configuration, and a
+hash of the scripts in this directory. A later run with the same key
+returns the stored metrics without loading the model or the dataset.
+
+Any change to the scripts invalidates every entry, which errs on the side
+of recomputing. Settings that provably do not change results (prefetching,
+checkpointing, data parallelism) are not part of the key.
+
+Per-token loss files (see token_losses.py) can be stored alongside the
+metrics and are copied back to the requested path on a hit.
+"""
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_RESULT_CACHE_DIR = os.environ.get(
+    "RESULT_CACHE_DIR", os.path.expanduser("~/.cache/transformer-questions/results")
+)
+
+# Seconds to wait for the Hub when resolving a model's revision
+HUB_TIMEOUT_SECONDS = 2
+
+# Files making up a per-token loss artifact, by suffix
+LOSS_FILE_SUFFIXES = ('.f16', '.idx.npy', '.json')
+
+
+def source_fingerprint(directory: str = None) -> str:
+    """Hash of every Python script in `directory` (default: this one)."""
+    directory = directory or os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(directory, '*.py'))):
+        digest.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def file_fingerprint(path: str) -> Dict[str, Any]:
+    """Identity of a local data file: its absolute path, size and modification time."""
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def _local_model_fingerprint(path: str) -> str:
+    """Hash of the names, sizes and modification times of a model directory's files."""
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            stat = os.stat(file_path)
+            entries.append((os.path.relpath(file_path, path), stat.st_size, int(stat.st_mtime)))
+    payload = json.dumps(sorted(entries)).encode('utf-8')
+    return 'local-' + hashlib.sha256(payload).hexdigest()[:16]
+
+
+def _cached_revision(model_name: str) -> Optional[str]:
+    """Commit the local HF cache last resolved a model's default branch to, if any."""
+    try:
+        from huggingface_hub import constants
+        from huggingface_hub.file_download import repo_folder_name
+        ref = os.path.join(
+            constants.HF_HUB_CACHE, repo_folder_name(repo_id=model_name, repo_type='model'), 'refs', 'main'
+        )
+        with open(ref) as f:
+            return f.read().strip()
+    except Exception:
+        return None
+
+
+def model_revision(model_name: str) -> Optional[str]:
+    """
+    Resolve the exact revision a model name currently loads, without downloading it.
+
+    Local directories are fingerprinted; Hub models resolve to the commit
+    of their default branch. That is asked of the Hub with a short timeout,
+    as from_pretrained would load a newer commit than the local HF cache
+    holds; offline (HF_HUB_OFFLINE) or when the Hub does not answer, the
+    local cache's record is used.
+
+    Returns:
+        Revision string, or None if it cannot be determined
+    """
+    if os.path.isdir(model_name):
+        return _local_model_fingerprint(model_name)
+
+    try:
+        from huggingface_hub import HfApi, constants
+        if not constants.HF_HUB_OFFLINE:
+            return HfApi().model_info(model_name, timeout=HUB_TIMEOUT_SECONDS).sha
+    except Exception:
+        pass
+    return _cached_revision(model_name)
+
+
+class ResultCache:
+    """On-disk cache of final evaluation metrics."""
+
+    def __init__(self, cache_dir: str = DEFAULT_RESULT_CACHE_DIR):
+        """
+        Initialize result cache.
+
+        Args:
+            cache_dir: Directory holding cache entries (created on first write)
+        """
+        self.cache_dir = cache_dir
+
+    def key(self, inputs: Dict[str, Any]) -> str:
+        """Cache key for a JSON-serializable description of a run."""
+        payload = json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()[:32]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _losses_prefix(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.losses')
+
+    def load(self, key: str, token_losses_path: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Look up an entry, restoring its per-token losses to `token_losses_path`.
+
+        Returns:
+            Dict with the stored metrics, inputs and creation time, or None
+            on a miss (including an entry stored without the requested losses)
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            entry = json.load(f)
+
+        if token_losses_path:
+            if not entry.get('token_losses'):
+                return None
+            directory = os.path.dirname(token_losses_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            for suffix in LOSS_FILE_SUFFIXES:
+                shutil.copyfile(self._losses_prefix(key) + suffix, token_losses_path + suffix)
+        return entry
+
+    def store(
+        self,
+        key: str,
+        metrics: Dict[str, Any],
+        inputs: Dict[str, Any],
+        token_losses_path: str = None,
+    ):
+        """
+        Write an entry atomically, copying per-token losses into the cache if given.
+
+        The metrics file is written last, so its presence marks a complete entry.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if token_losses_path:
+            for suffix in LOSS_FILE_SUFFIXES:
+                tmp_path = self._losses_prefix(key) + suffix + f".tmp{os.getpid()}"
+                shutil.copyfile(token_losses_path + suffix, tmp_path)
+                os.replace(tmp_path, self._losses_prefix(key) + suffix)
+
+        entry = {
+            'key': key,
+            'metrics': metrics,
+            'inputs': inputs,
+            'token_losses': bool(token_losses_path),
+            'created': time.time(),
+        }
+        tmp_path = self._path(key) + f".tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, indent=2, default=str)
+        os.replace(tmp_path, self._path(key))
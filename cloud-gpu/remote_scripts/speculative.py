@@ -0,0 +1,222 @@
+"""
+Speculative decoding with a small same-family draft model.
+
+Each step, the draft model proposes ``k`` tokens greedily, one at a time,
+and the target model scores all of them in a single forward pass. The
+longest prefix of the draft that matches the target's own greedy choices
+is accepted, followed by the target's token at the first mismatch (or a
+bonus token if all ``k`` matched). Every emitted token is the target's
+argmax given the tokens before it, so the output is identical to plain
+greedy decoding with the target; the speedup comes from the target
+running once per accepted run instead of once per token.
+
+Both models keep KV caches across steps; after verification each cache
+is cut back to the tokens that were accepted.
+
+Drafts are picked with model-library's get_draft_model (the smallest model
+of the same series in MODEL_PAIRS, which shares the tokenizer).
+"""
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import torch
+
+# MODEL_PAIRS lives in model-library/, which is not always uploaded
+# alongside the remote scripts
+_MODEL_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model-library')
+if os.path.isdir(_MODEL_LIBRARY):
+    sys.path.insert(0, _MODEL_LIBRARY)
+try:
+    from models import get_draft_model
+except ImportError:
+    get_draft_model = None
+
+
+def resolve_draft_model(model_name: str, draft: str = 'auto') -> str:
+    """
+    Name of the draft model for `model_name`.
+
+    Args:
+        draft: Draft model name, or 'auto' for the smallest same-series
+            model in MODEL_PAIRS
+
+    Raises:
+        ValueError: If no draft can be picked automatically
+    """
+    if draft != 'auto':
+        return draft
+    if get_draft_model is None:
+        raise ValueError("model-library is not available; pass the draft model name explicitly")
+    picked = get_draft_model(model_name)
+    if picked is None:
+        raise ValueError(f"no smaller same-series model for {model_name} in MODEL_PAIRS")
+    return picked
+
+
+def tokenizers_compatible(target_tokenizer, draft_tokenizer) -> bool:
+    """Whether token ids mean the same in both tokenizers."""
+    return target_tokenizer.get_vocab() == draft_tokenizer.get_vocab()
+
+
+def truncate_cache(cache, length: int):
+    """
+    Keep only the first `length` positions of a KV cache.
+
+    Handles the layered `DynamicCache` of recent transformers releases and
+    the `key_cache`/`value_cache` lists of older ones.
+    """
+    if hasattr(cache, 'layers'):
+        for layer in cache.layers:
+            if getattr(layer, 'keys', None) is None or layer.keys.numel() == 0:
+                continue
+            layer.keys = layer.keys[..., :length, :]
+            layer.values = layer.values[..., :length, :]
+    else:
+        cache.key_cache = [k[..., :length, :] for k in cache.key_cache]
+        cache.value_cache = [v[..., :length, :] for v in cache.value_cache]
+        if hasattr(cache, '_seen_tokens'):
+            cache._seen_tokens = length
+    return cache
+
+
+def _cache_length(cache) -> int:
+    return cache.get_seq_length() if cache is not None else 0
+
+
+def _forward(model, tokens: Sequence[int], cache, device: str):
+    """Run `tokens` after the cached positions; returns (logits (len, vocab), cache)."""
+    input_ids = torch.tensor([list(tokens)], device=device)
+    outputs = model(input_ids=input_ids, past_key_values=cache, use_cache=True)
+    return outputs.logits[0], outputs.past_key_values
+
+
+def speculative_generate(
+    target,
+    draft,
+    prompt_ids: Sequence[int],
+    max_new_tokens: int,
+    device: str,
+    num_draft_tokens: int = 4,
+    eos_token_ids: Iterable[int] = (),
+) -> Dict[str, Any]:
+    """
+    Greedy generation with the target model, drafted by a smaller model.
+
+    Args:
+        target: Model whose greedy output is produced
+        draft: Model proposing tokens; must share the target's tokenizer
+        prompt_ids: Prompt token ids
+        max_new_tokens: Maximum tokens to generate
+        device: Device of both models
+        num_draft_tokens: Tokens proposed per verification step (k)
+        eos_token_ids: Tokens that end generation
+
+    Returns:
+        Dict with tokens (generated ids), target_steps (verification
+        passes), drafted and accepted (draft token counts) and
+        acceptance_rate
+    """
+    eos_token_ids = set(eos_token_ids)
+    sequence = list(prompt_ids)
+    generated: List[int] = []
+    target_cache = draft_cache = None
+    stats = {'target_steps': 0, 'drafted': 0, 'accepted': 0}
+
+    with torch.no_grad():
+        while len(generated) < max_new_tokens:
+            # The target's own token after the draft always comes for free
+            k = min(num_draft_tokens, max_new_tokens - len(generated) - 1)
+
+            proposal = []
+            for _ in range(k):
+                pending = (sequence + proposal)[_cache_length(draft_cache):]
+                logits, draft_cache = _forward(draft, pending, draft_cache, device)
+                proposal.append(int(logits[-1].argmax()))
+                if proposal[-1] in eos_token_ids:
+                    break
+
+            cached = _cache_length(target_cache)
+            logits, target_cache = _forward(target, (sequence + proposal)[cached:], target_cache, device)
+            # Target choices after sequence[-1], proposal[0], ..., proposal[-1]
+            choices = logits[len(sequence) - 1 - cached:].argmax(dim=-1).tolist()
+
+            accepted = 0
+            while accepted < len(proposal) and proposal[accepted] == choices[accepted]:
+                accepted += 1
+            new_tokens = proposal[:accepted] + [choices[accepted]]
+
+            stats['target_steps'] += 1
+            stats['drafted'] += len(proposal)
+            stats['accepted'] += accepted
+
+            sequence += new_tokens
+            generated += new_tokens
+            # The last token is not fed yet; rejected proposals never should have been
+            truncate_cache(target_cache, len(sequence) - 1)
+            if draft_cache is not None:
+                truncate_cache(draft_cache, min(_cache_length(draft_cache), len(sequence) - 1))
+
+            stop = next((i for i, token in enumerate(new_tokens) if token in eos_token_ids), None)
+            if stop is not None:
+                generated = generated[:len(generated) - len(new_tokens) + stop + 1]
+                break
+
+    stats['tokens'] = generated[:max_new_tokens]
+    stats['acceptance_rate'] = stats['accepted'] / stats['drafted'] if stats['drafted'] else 0.0
+    return stats
+
+
+def greedy_generate(model, prompt_ids: Sequence[int], max_new_tokens: int, device: str,
+                    eos_token_ids: Iterable[int] = ()) -> List[int]:
+    """Plain cached greedy decoding, one target pass per token (the speculative baseline)."""
+    eos_token_ids = set(eos_token_ids)
+    sequence = list(prompt_ids)
+    generated = []
+    cache = None
+    with torch.no_grad():
+        while len(generated) < max_new_tokens:
+            logits, cache = _forward(model, sequence[_cache_length(cache):], cache, device)
+            token = int(logits[-1].argmax())
+            sequence.append(token)
+            generated.append(token)
+            if token in eos_token_ids:
+                break
+    return generated
+
+
+def compare_speculative(
+    target,
+    draft,
+    prompt_ids: Sequence[int],
+    max_new_tokens: int,
+    device: str,
+    num_draft_tokens: int = 4,
+    eos_token_ids: Iterable[int] = (),
+) -> Dict[str, Any]:
+    """
+    Time greedy and speculative decoding of the same prompt and check they agree.
+
+    Returns:
+        Dict as from speculative_generate, plus greedy_seconds,
+        speculative_seconds, speedup and identical
+    """
+    eos_token_ids = list(eos_token_ids)
+    start = time.perf_counter()
+    baseline = greedy_generate(target, prompt_ids, max_new_tokens, device, eos_token_ids)
+    greedy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = speculative_generate(
+        target, draft, prompt_ids, max_new_tokens, device, num_draft_tokens, eos_token_ids
+    )
+    speculative_seconds = time.perf_counter() - start
+
+    result.update(
+        greedy_seconds=greedy_seconds,
+        speculative_seconds=speculative_seconds,
+        speedup=greedy_seconds / speculative_seconds if speculative_seconds > 0 else 0.0,
+        identical=result['tokens'] == baseline,
+    )
+    return result
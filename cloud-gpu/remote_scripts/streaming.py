@@ -0,0 +1,106 @@
+"""
+Streaming, bounded-memory dataset input.
+
+Documents are read lazily from a streamed HuggingFace dataset or a local
+file, tokenized a chunk at a time and handed to the scoring loop chunk by
+chunk. Only one chunk of text and tokens is alive at any time, so peak
+memory does not depend on the size of the source, and reading stops as
+soon as the sample or token budget is reached.
+
+Local files are read as JSON lines (``.jsonl``, using the ``text`` or
+``content`` field) or as plain text with one document per line, matching
+the one-line-per-sample layout of wikitext.
+"""
+import json
+from typing import Iterable, Iterator, List, Optional
+
+from datasets import load_dataset
+
+
+def iter_file_texts(path: str) -> Iterator[str]:
+    """Yield the documents of a local .jsonl or plain text file."""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.json')):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['text'] if 'text' in record else record['content']
+        else:
+            for line in f:
+                yield line.rstrip('\n')
+
+
+def iter_dataset_texts(dataset_name: str, dataset_config: str, split: str) -> Iterator[str]:
+    """Yield the text column of a HuggingFace dataset in streaming mode."""
+    dataset = load_dataset(dataset_name, dataset_config, split=split, streaming=True)
+    for row in dataset:
+        yield row['text'] if 'text' in row else row['content']
+
+
+def iter_texts(
+    dataset_name: str = None,
+    dataset_config: str = None,
+    split: str = "test",
+    data_file: str = None,
+) -> Iterator[str]:
+    """Yield documents from `data_file` if given, else from a streamed HF dataset."""
+    if data_file:
+        return iter_file_texts(data_file)
+    return iter_dataset_texts(dataset_name, dataset_config, split)
+
+
+def iter_token_chunks(
+    tokenizer,
+    texts: Iterable[str],
+    chunk_size: int = 1000,
+    max_samples: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> Iterator[List[List[int]]]:
+    """
+    Tokenize documents lazily, yielding chunks of up to `chunk_size` documents.
+
+    Args:
+        tokenizer: Tokenizer to encode with
+        texts: Document source, consumed only as far as needed
+        chunk_size: Documents tokenized and yielded together
+        max_samples: Stop after this many documents (None or 0: no limit)
+        max_tokens: Stop once this many tokens have been yielded; the
+            document that crosses the budget is still included whole
+
+    Yields:
+        Lists of token id lists
+    """
+    if chunk_size <= 0:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+
+    samples = 0
+    tokens = 0
+    buffer = []
+
+    def _flush():
+        nonlocal tokens
+        chunk = tokenizer(buffer)['input_ids']
+        if max_tokens:
+            # Cut the chunk at the document that reaches the token budget
+            for end, ids in enumerate(chunk, 1):
+                tokens += len(ids)
+                if tokens >= max_tokens:
+                    return chunk[:end], True
+            return chunk, False
+        tokens += sum(len(ids) for ids in chunk)
+        return chunk, False
+
+    for text in texts:
+        buffer.append(text)
+        samples += 1
+        done = bool(max_samples) and samples >= max_samples
+        if len(buffer) == chunk_size or done:
+            chunk, exhausted = _flush()
+            buffer = []
+            yield chunk
+            if done or exhausted:
+                return
+
+    if buffer:
+        chunk, _ = _flush()
+        yield chunk
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Perplexity sweep over several models in one process.
+
+Running ``calculate_perplexity.py`` once per model reloads the dataset
+and re-tokenizes it every time. Here:
+
+- the dataset is tokenized once per tokenizer fingerprint (see
+  token_cache.py), so every model of a family that shares a tokenizer
+  (e.g. all Qwen2.5 sizes) scores the same token ids
+- each model is deleted and cached allocator memory is released before
+  the next one is loaded
+- the next model is loaded into host memory in a background thread while
+  the current one is evaluated, when its estimated size fits both in the
+  RAM that is still available and on a single device; it is then moved
+  onto that device once the current one is freed. Every other model is
+  loaded by ``load_model`` after the current one is freed, which spreads
+  it over all GPUs (``device_map="auto"``) unless a device is given
+
+Models are in fp16 on GPU (fp32 on CPU) either way, and are scored with
+``score_dataset`` using the same settings for every model.
+The result is one table with perplexity and load / tokenize / evaluation
+times per model.
+
+Usage: python sweep.py MODEL [MODEL ...] | --family Qwen [--max-size 7B]
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from autotune import available_host_bytes, free_memory
+from calculate_perplexity import load_model, load_token_ids, score_dataset
+from report import PerfReport
+from token_cache import DEFAULT_CACHE_DIR, tokenizer_fingerprint
+
+# MODEL_PAIRS and the estimator live in model-library/, which is not
+# always uploaded alongside the remote scripts
+_MODEL_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model-library')
+if os.path.isdir(_MODEL_LIBRARY):
+    sys.path.insert(0, _MODEL_LIBRARY)
+try:
+    from models import filter_by_family, filter_by_size
+    from perplexity_requirements import estimate_memory_requirements
+except ImportError:
+    filter_by_family = filter_by_size = estimate_memory_requirements = None
+
+# Share of the available RAM a model loaded in the background may take
+PREFETCH_RAM_FRACTION = 0.8
+# Share of one device's memory a prefetched model's weights may take,
+# leaving the rest for activations
+PREFETCH_DEVICE_FRACTION = 0.8
+
+TABLE_COLUMNS = (
+    ('model', 'model', '{}'),
+    ('tokenizer', 'tokenizer', '{}'),
+    ('perplexity', 'ppl', '{:.4f}'),
+    ('tokens', 'tokens', '{:,}'),
+    ('load_seconds', 'load', '{:.1f}s'),
+    ('load_wait_seconds', 'wait', '{:.1f}s'),
+    ('tokenize_seconds', 'tokenize', '{:.1f}s'),
+    ('eval_seconds', 'eval', '{:.1f}s'),
+    ('tokens_per_second', 'tok/s', '{:,.0f}'),
+)
+
+
+def select_models(family: str, max_size: str = None, min_size: str = None, include_instruct: bool = False) -> List[str]:
+    """
+    Models of a MODEL_PAIRS family, in MODEL_PAIRS order.
+
+    Raises:
+        ValueError: If model-library is not available
+    """
+    if filter_by_family is None:
+        raise ValueError("model-library is not available; list the models explicitly")
+    pairs = filter_by_family(family)
+    if max_size or min_size:
+        sized = filter_by_size(max_size, min_size)
+        pairs = {base: instruct for base, instruct in pairs.items() if base in sized}
+    models = []
+    for base, instruct in pairs.items():
+        models.append(base)
+        if include_instruct:
+            models.append(instruct)
+    return models
+
+
+def estimate_model_bytes(model_name: str, bytes_per_param: int) -> Optional[int]:
+    """
+    Host memory a model will take once loaded, or None if unknown.
+
+    Local checkpoints are measured on disk; hub models are estimated from
+    the parameter count in their name (see perplexity_requirements).
+    """
+    if os.path.isdir(model_name):
+        files = glob.glob(os.path.join(model_name, '*.safetensors')) or glob.glob(os.path.join(model_name, '*.bin'))
+        return sum(os.path.getsize(path) for path in files) or None
+    if estimate_memory_requirements is None:
+        return None
+    estimate = estimate_memory_requirements(model_name, batch_size=1, seq_length=1)
+    if 'note' in estimate:
+        return None
+    weights_gb = estimate['model_memory_fp16_gb'] if bytes_per_param <= 2 else estimate['model_memory_fp32_gb']
+    return int(weights_gb * 1e9)
+
+
+def can_prefetch(model_name: str, bytes_per_param: int, device: str = "cpu") -> bool:
+    """
+    Whether `model_name` can be loaded into RAM while the current model is
+    still alive, and then moved onto `device` as a whole.
+    """
+    needed = estimate_model_bytes(model_name, bytes_per_param)
+    if needed is None or needed > available_host_bytes() * PREFETCH_RAM_FRACTION:
+        return False
+    if device.startswith("cuda"):
+        return needed <= torch.cuda.get_device_properties(torch.device(device)).total_memory * PREFETCH_DEVICE_FRACTION
+    return True
+
+
+def _load_to_host(model_name: str, dtype: torch.dtype):
+    """Load a model and its tokenizer into host memory for one device; returns (model, tokenizer, seconds)."""
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=dtype).eval()
+    return model, tokenizer, time.perf_counter() - start
+
+
+def run_sweep(
+    model_names: Sequence[str],
+    dataset_args: Dict[str, Any],
+    device: str = None,
+    score_args: Optional[Dict[str, Any]] = None,
+    token_cache_dir: str = DEFAULT_CACHE_DIR,
+    prefetch: bool = True,
+    report=None,
+) -> List[Dict[str, Any]]:
+    """
+    Score every model on one dataset, in order.
+
+    Args:
+        model_names: Models to evaluate
+        dataset_args: dataset_name, dataset_config, split and max_samples
+            as for load_token_ids
+        device: Device to evaluate on (default: all GPUs if available,
+            as for load_model; prefetched models go to the first)
+        score_args: Scoring settings passed to score_dataset (max_length,
+            max_tokens, stride, pack, ...)
+        token_cache_dir: Token cache directory, or None to tokenize in
+            memory only
+        prefetch: Load the next model in the background when RAM allows
+        report: PerfReport receiving per-model stage times
+
+    Returns:
+        One row per model: model, tokenizer (short fingerprint),
+        perplexity, avg_loss, tokens, load_seconds, load_wait_seconds (time
+        evaluation was blocked on loading), prefetched, tokenize_seconds,
+        eval_seconds, tokens_per_second, and error if the model failed
+    """
+    # Where a prefetched model is moved; load_model places the others itself
+    single_device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.float16 if single_device.startswith("cuda") else torch.float32
+    bytes_per_param = 2 if dtype == torch.float16 else 4
+    score_args = dict(score_args or {})
+    token_ids_by_fingerprint = {}
+    rows = []
+
+    with ThreadPoolExecutor(max_workers=1) as loader:
+        pending = None
+        for index, model_name in enumerate(model_names):
+            print(f"\n[{index + 1}/{len(model_names)}] {model_name}")
+            row = {'model': model_name, 'prefetched': pending is not None}
+            rows.append(row)
+            next_name = model_names[index + 1] if index + 1 < len(model_names) else None
+
+            wait_start = time.perf_counter()
+            try:
+                if pending is not None:
+                    model, tokenizer, row['load_seconds'] = pending.result()
+                    model_device = single_device
+                    model.to(model_device)
+                else:
+                    model, tokenizer, model_device = load_model(model_name, device=device)
+                    row['load_seconds'] = time.perf_counter() - wait_start
+            except Exception as e:
+                print(f"  [ERROR] Failed to load model: {e}")
+                row['error'] = f"model: {e}"
+                pending = None
+                continue
+            row['load_wait_seconds'] = time.perf_counter() - wait_start
+
+            # Start loading the next model now if it fits next to this one and on one device
+            pending = None
+            if next_name and prefetch and can_prefetch(next_name, bytes_per_param, single_device):
+                pending = loader.submit(_load_to_host, next_name, dtype)
+
+            fingerprint = tokenizer_fingerprint(tokenizer)
+            row['tokenizer'] = fingerprint[:12]
+            start = time.perf_counter()
+            if fingerprint not in token_ids_by_fingerprint:
+                token_ids_by_fingerprint[fingerprint] = load_token_ids(tokenizer, token_cache_dir=token_cache_dir, **dataset_args)
+            token_ids = token_ids_by_fingerprint[fingerprint]
+            row['tokenize_seconds'] = time.perf_counter() - start
+
+            try:
+                if token_ids is None:
+                    raise ValueError("dataset could not be loaded")
+                start = time.perf_counter()
+                stats = score_dataset(model, tokenizer, token_ids, model_device, **score_args)
+                row['eval_seconds'] = time.perf_counter() - start
+                avg_loss = stats['total_loss'] / stats['total_tokens']
+                row.update(
+                    perplexity=math.exp(avg_loss),
+                    avg_loss=avg_loss,
+                    tokens=stats['total_tokens'],
+                    tokens_per_second=stats['computed_tokens'] / row['eval_seconds'],
+                )
+                print(f"  [OK] Perplexity {row['perplexity']:.4f} in {row['eval_seconds']:.1f}s")
+            except Exception as e:
+                print(f"  [ERROR] Evaluation failed: {e}")
+                row['error'] = f"evaluation: {e}"
+
+            if report is not None:
+                for stage in ('load_wait_seconds', 'tokenize_seconds', 'eval_seconds'):
+                    report.add_stage(stage.replace('_seconds', ''), row.get(stage, 0.0))
+            del model
+            free_memory()
+    return rows
+
+
+def format_table(rows: Sequence[Dict[str, Any]]) -> str:
+    """Render sweep rows as an aligned text table."""
+    header = [title for _, title, _ in TABLE_COLUMNS]
+    lines = []
+    for row in rows:
+        cells = []
+        for key, _, fmt in TABLE_COLUMNS:
+            value = row.get(key)
+            cells.append(fmt.format(value) if value is not None else '-')
+        if 'error' in row:
+            cells[-1] += f"  [ERROR] {row['error']}"
+        lines.append(cells)
+    widths = [max(len(header[i]), *(len(line[i]) for line in lines)) if lines else len(header[i])
+              for i in range(len(header))]
+    out = ["  ".join(title.ljust(widths[i]) for i, title in enumerate(header))]
+    out += ["  ".join(cell.ljust(widths[i]) for i, cell in enumerate(line)).rstrip() for line in lines]
+    return "\n".join(out)
+
+
+def sweep(
+    model_names: Sequence[str],
+    dataset_name: str = "wikitext",
+    dataset_config: str = "wikitext-2-raw-v1",
+    split: str = "test",
+    max_samples: int = 1000,
+    max_length: int = 512,
+    max_tokens: int = 2048,
+    stride: int = None,
+    pack: bool = False,
+    prefetch: bool = True,
+    token_cache_dir: str = DEFAULT_CACHE_DIR,
+    output_path: str = None,
+    report_path: str = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run a sweep, print the result table and optionally save it as JSON.
+
+    Returns:
+        Rows as from run_sweep
+    """
+    print(f"Sweeping {len(model_names)} models on {dataset_name}/{dataset_config}")
+    print("=" * 60)
+    report = PerfReport('sweep', report_path)
+    start = time.perf_counter()
+    rows = run_sweep(
+        model_names,
+        {'dataset_name': dataset_name, 'dataset_config': dataset_config, 'split': split, 'max_samples': max_samples},
+        score_args={'max_length': max_length, 'max_tokens': max_tokens, 'stride': stride, 'pack': pack},
+        token_cache_dir=token_cache_dir,
+        prefetch=prefetch,
+        report=report,
+    )
+    total_seconds = time.perf_counter() - start
+
+    print("\n" + "=" * 60)
+    print(format_table(rows))
+    print(f"\nTotal: {total_seconds:.1f}s for {len(rows)} models, "
+          f"{len({row['tokenizer'] for row in rows if 'tokenizer' in row})} tokenizations")
+    print("=" * 60)
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump({'models': rows, 'total_seconds': total_seconds}, f, indent=2)
+        print(f"  [OK] Results written to {output_path}")
+    failed = [row['model'] for row in rows if 'error' in row]
+    report.finish(success=not failed, failed=failed, models=rows, total_seconds=total_seconds)
+    return rows
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Perplexity sweep over several models in one process.")
+    parser.add_argument("models", nargs="*", help="HuggingFace model names")
+    parser.add_argument("--family", default=None, help="Sweep the base models of a MODEL_PAIRS family instead")
+    parser.add_argument("--max-size", default=None, help="With --family, largest model size (e.g. 7B)")
+    parser.add_argument("--min-size", default=None, help="With --family, smallest model size (e.g. 1.5B)")
+    parser.add_argument("--include-instruct", action="store_true", help="With --family, also sweep instruct models")
+    parser.add_argument("--dataset", default="wikitext", help="HuggingFace dataset name")
+    parser.add_argument("--dataset-config", default="wikitext-2-raw-v1", help="Dataset configuration")
+    parser.add_argument("--split", default="test", help="Dataset split")
+    parser.add_argument("--max-samples", type=int, default=1000, help="Maximum number of samples")
+    parser.add_argument("--max-length", type=int, default=512, help="Context length in tokens")
+    parser.add_argument("--max-tokens", type=int, default=2048, help="Token budget per batch")
+    parser.add_argument("--stride", type=int, default=None, help="Sliding-window stride in tokens")
+    parser.add_argument("--pack", action="store_true", help="Pack samples into dense blocks of --max-length")
+    parser.add_argument("--no-prefetch", action="store_true",
+                        help="Never load the next model while the current one is evaluated")
+    parser.add_argument("--token-cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Directory of the pre-tokenized dataset cache")
+    parser.add_argument("--output", default=None, metavar="PATH", help="Write the result table as JSON to PATH")
+    parser.add_argument("--report", default=None, metavar="PATH",
+                        help="Print [REPORT] JSON progress lines and write a JSON performance report to PATH")
+    args = parser.parse_args(argv)
+    if not args.models and not args.family:
+        parser.error("give model names or --family")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    models = list(args.models)
+    if args.family:
+        models += select_models(args.family, args.max_size, args.min_size, args.include_instruct)
+
+    rows = sweep(
+        models,
+        dataset_name=args.dataset,
+        dataset_config=args.dataset_config,
+        split=args.split,
+        max_samples=args.max_samples,
+        max_length=args.max_length,
+        max_tokens=args.max_tokens,
+        stride=args.stride,
+        pack=args.pack,
+        prefetch=not args.no_prefetch,
+        token_cache_dir=args.token_cache_dir,
+        output_path=args.output,
+        report_path=args.report,
+    )
+    sys.exit(1 if any('error' in row for row in rows) else 0)
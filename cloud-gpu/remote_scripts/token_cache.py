@@ -0,0 +1,214 @@
+"""
+Persistent pre-tokenized dataset cache.
+
+Tokenized datasets are stored as a flat uint32 ``.bin`` file of token ids
+plus an ``.idx.npy`` array of document offsets, and opened with
+``np.memmap`` so later runs read zero-copy slices instead of
+re-tokenizing. Entries are keyed by a fingerprint of the tokenizer
+(vocabulary, merges, normalization and special-token handling) together
+with the dataset identity, so every model that shares a tokenizer (e.g.
+all Qwen2.5 sizes) shares one cache entry.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TOKEN_CACHE_DIR", os.path.expanduser("~/.cache/transformer-questions/tokens")
+)
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Hash everything about a tokenizer that affects the ids it produces.
+
+    Fast tokenizers serialize their full pipeline (normalizer,
+    pre-tokenizer, model, post-processor); runtime truncation and padding
+    state is excluded. Slow tokenizers fall back to the vocabulary and
+    special tokens.
+    """
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        state = json.loads(backend.to_str())
+        state.pop('truncation', None)
+        state.pop('padding', None)
+    else:
+        state = {
+            'vocab': sorted(tokenizer.get_vocab().items()),
+            'special_tokens': tokenizer.special_tokens_map,
+        }
+    state['class'] = type(tokenizer).__name__
+    for attr in ('add_bos_token', 'add_eos_token', 'do_lower_case'):
+        if hasattr(tokenizer, attr):
+            state[attr] = getattr(tokenizer, attr)
+
+    payload = json.dumps(state, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+class TokenizedDataset(Sequence):
+    """Read-only view of a cached tokenized dataset backed by np.memmap."""
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray, metadata: Optional[Dict[str, Any]] = None):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.metadata = metadata or {}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"document index {index} out of range")
+        # Zero-copy view into the memory-mapped token file
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    @property
+    def num_tokens(self) -> int:
+        """Total number of tokens across all documents."""
+        return int(self.offsets[-1])
+
+    def lengths(self) -> np.ndarray:
+        """Token count of every document."""
+        return np.diff(self.offsets)
+
+
+class TokenCache:
+    """On-disk cache of tokenized datasets."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        """
+        Initialize token cache.
+
+        Args:
+            cache_dir: Directory holding cache entries (created on first write)
+        """
+        self.cache_dir = cache_dir
+
+    def key(self, tokenizer, dataset_identity: Dict[str, Any]) -> str:
+        """Cache key for a tokenizer and dataset identity."""
+        payload = json.dumps(
+            {'tokenizer': tokenizer_fingerprint(tokenizer), 'dataset': dataset_identity},
+            sort_keys=True,
+            default=str,
+        ).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()[:32]
+
+    def _paths(self, key: str) -> Dict[str, str]:
+        base = os.path.join(self.cache_dir, key)
+        return {
+            'tokens': base + '.bin',
+            'offsets': base + '.idx.npy',
+            'metadata': base + '.json',
+        }
+
+    def load(self, key: str) -> Optional[TokenizedDataset]:
+        """
+        Open a cache entry.
+
+        Returns:
+            TokenizedDataset, or None if the entry does not exist
+        """
+        paths = self._paths(key)
+        # The metadata file is written last, so its presence marks a complete entry
+        if not os.path.exists(paths['metadata']):
+            return None
+
+        with open(paths['metadata']) as f:
+            metadata = json.load(f)
+        offsets = np.load(paths['offsets'])
+        if offsets[-1] > 0:
+            tokens = np.memmap(paths['tokens'], dtype=np.uint32, mode='r')
+        else:
+            tokens = np.empty(0, dtype=np.uint32)
+        return TokenizedDataset(tokens, offsets, metadata)
+
+    def store(
+        self,
+        key: str,
+        token_ids: Iterable[Sequence[int]],
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> TokenizedDataset:
+        """
+        Write a cache entry, streaming documents to disk one at a time.
+
+        Files are written under temporary names and renamed into place, so
+        an interrupted write never leaves a partial entry behind.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        paths = self._paths(key)
+        suffix = f".tmp{os.getpid()}"
+
+        offsets = [0]
+        with open(paths['tokens'] + suffix, 'wb') as f:
+            for ids in token_ids:
+                array = np.asarray(ids, dtype=np.uint32)
+                f.write(array.tobytes())
+                offsets.append(offsets[-1] + len(array))
+        np.save(paths['offsets'] + suffix, np.asarray(offsets, dtype=np.int64))
+
+        metadata = dict(metadata or {})
+        metadata.update({
+            'key': key,
+            'num_documents': len(offsets) - 1,
+            'num_tokens': offsets[-1],
+            'created': time.time(),
+        })
+        with open(paths['metadata'] + suffix, 'w') as f:
+            json.dump(metadata, f, indent=2, default=str)
+
+        os.replace(paths['tokens'] + suffix, paths['tokens'])
+        # np.save appends .npy to names that lack it
+        os.replace(paths['offsets'] + suffix + '.npy', paths['offsets'])
+        os.replace(paths['metadata'] + suffix, paths['metadata'])
+        return self.load(key)
+
+    def get_or_create(
+        self,
+        tokenizer,
+        dataset_identity: Dict[str, Any],
+        load_texts: Callable[[], Optional[List[str]]],
+        batch_size: int = 1000,
+    ) -> Optional[TokenizedDataset]:
+        """
+        Return the cached tokenization, tokenizing and storing it on a miss.
+
+        Args:
+            tokenizer: Tokenizer whose fingerprint keys the entry
+            dataset_identity: JSON-serializable description of the dataset
+            load_texts: Called on a miss to get the raw texts
+            batch_size: Texts tokenized per tokenizer call on a miss
+
+        Returns:
+            TokenizedDataset, or None if load_texts returned None
+        """
+        key = self.key(tokenizer, dataset_identity)
+        cached = self.load(key)
+        if cached is not None:
+            print(f"  [OK] Token cache hit: {cached.num_tokens:,} tokens in {len(cached)} samples")
+            return cached
+
+        texts = load_texts()
+        if texts is None:
+            return None
+
+        def _tokenize():
+            for start in range(0, len(texts), batch_size):
+                yield from tokenizer(list(texts[start:start + batch_size]))['input_ids']
+
+        metadata = {
+            'dataset': dataset_identity,
+            'tokenizer': getattr(tokenizer, 'name_or_path', None),
+            'tokenizer_fingerprint': tokenizer_fingerprint(tokenizer),
+        }
+        dataset = self.store(key, _tokenize(), metadata)
+        print(f"  [OK] Cached {dataset.num_tokens:,} tokens in {self.cache_dir}")
+        return dataset
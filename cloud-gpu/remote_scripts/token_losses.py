@@ -0,0 +1,183 @@
+"""
+Per-token loss files.
+
+During evaluation, the negative log-likelihood of every scored token is
+streamed into a float16 ``np.memmap`` laid out exactly like the token
+cache: token ``t`` of document ``d`` lives at ``offsets[d] + t``.
+Positions that were never scored (the first token of each document,
+tokens beyond a truncation limit, masked tokens) hold NaN. Perplexity for
+any subset of documents or range of positions can then be recomputed
+later without running the model again.
+
+Files written for an output prefix ``PATH``:
+- ``PATH.f16``: float16 losses, one per token
+- ``PATH.idx.npy``: int64 document offsets (same as the token cache)
+- ``PATH.json``: metadata (model, dataset, scoring settings)
+"""
+import json
+import math
+import os
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def offsets_from_lengths(lengths: Sequence[int]) -> np.ndarray:
+    """Document offsets for documents of the given token lengths."""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(np.asarray(lengths, dtype=np.int64), out=offsets[1:])
+    return offsets
+
+
+class TokenLossWriter:
+    """Streams per-token losses into a memory-mapped float16 file."""
+
+    def __init__(
+        self,
+        path: str,
+        offsets: np.ndarray,
+        metadata: Optional[Dict[str, Any]] = None,
+        resume: bool = False,
+    ):
+        """
+        Create the loss file for documents with the given offsets.
+
+        Args:
+            path: Output prefix (extensions are appended)
+            offsets: Document offsets, e.g. from TokenizedDataset.offsets
+            metadata: Extra JSON-serializable metadata to store
+            resume: Keep the losses already in an existing file (for a
+                resumed run) instead of resetting them to NaN
+        """
+        self.path = path
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.metadata = dict(metadata or {})
+        self.tokens_written = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        num_tokens = int(self.offsets[-1])
+        # memmap cannot map an empty file
+        shape = (max(num_tokens, 1),)
+        if resume and os.path.exists(path + '.f16') and os.path.getsize(path + '.f16') == shape[0] * 2:
+            self._losses = np.memmap(path + '.f16', dtype=np.float16, mode='r+', shape=shape)
+        else:
+            self._losses = np.memmap(path + '.f16', dtype=np.float16, mode='w+', shape=shape)
+            self._losses[:] = np.nan
+        np.save(path + '.idx.npy', self.offsets)
+
+    def write(self, documents: np.ndarray, positions: np.ndarray, losses: np.ndarray):
+        """
+        Record losses for individual tokens.
+
+        Args:
+            documents: Document index of each token
+            positions: Position of each token within its document
+            losses: Negative log-likelihood of each token
+        """
+        documents = np.asarray(documents, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        self._losses[self.offsets[documents] + positions] = np.asarray(losses, dtype=np.float16)
+        self.tokens_written += len(positions)
+
+    def write_document(self, document: int, start: int, losses: np.ndarray):
+        """Record losses for consecutive tokens of one document, starting at position `start`."""
+        begin = self.offsets[document] + start
+        self._losses[begin:begin + len(losses)] = np.asarray(losses, dtype=np.float16)
+        self.tokens_written += len(losses)
+
+    def flush(self):
+        """Flush the losses written so far to disk."""
+        self._losses.flush()
+
+    def close(self):
+        """Flush the losses to disk and write the metadata file."""
+        self.flush()
+        metadata = dict(self.metadata)
+        metadata.update({
+            'num_documents': len(self.offsets) - 1,
+            'num_tokens': int(self.offsets[-1]),
+            'scored_tokens': self.tokens_written,
+        })
+        with open(self.path + '.json', 'w') as f:
+            json.dump(metadata, f, indent=2, default=str)
+        del self._losses
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class TokenLosses:
+    """Read-only view of a per-token loss file."""
+
+    def __init__(self, path: str):
+        """
+        Open a loss file written by TokenLossWriter.
+
+        Args:
+            path: Output prefix the file was written with
+        """
+        self.path = path
+        self.offsets = np.load(path + '.idx.npy')
+        self.losses = np.memmap(path + '.f16', dtype=np.float16, mode='r')
+        with open(path + '.json') as f:
+            self.metadata = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def document(self, index: int) -> np.ndarray:
+        """Losses of one document (NaN where a token was not scored)."""
+        return self.losses[self.offsets[index]:self.offsets[index + 1]]
+
+    def perplexity(
+        self,
+        documents: Optional[Sequence[int]] = None,
+        positions: Optional[Tuple[int, int]] = None,
+        chunk_size: int = 1 << 22,
+    ) -> Dict[str, float]:
+        """
+        Recompute perplexity over a subset of the scored tokens.
+
+        Losses are stored in float16, so results agree with the original
+        run to about three significant digits.
+
+        Args:
+            documents: Document indices to include (default: all)
+            positions: Optional (start, end) range of in-document positions
+            chunk_size: Tokens read at a time when scanning the whole file
+
+        Returns:
+            Dict with perplexity, avg_loss and tokens
+        """
+        total = 0.0
+        count = 0
+
+        def _accumulate(values):
+            nonlocal total, count
+            values = values[~np.isnan(values)]
+            total += float(values.sum(dtype=np.float64))
+            count += len(values)
+
+        if documents is None and positions is None:
+            num_tokens = int(self.offsets[-1])
+            for start in range(0, num_tokens, chunk_size):
+                _accumulate(self.losses[start:min(start + chunk_size, num_tokens)])
+        else:
+            for index in (range(len(self)) if documents is None else documents):
+                values = self.document(index)
+                if positions is not None:
+                    values = values[positions[0]:positions[1]]
+                _accumulate(values)
+
+        avg_loss = total / count if count else float('inf')
+        return {
+            'perplexity': math.exp(avg_loss) if count else float('inf'),
+            'avg_loss': avg_loss,
+            'tokens': count,
+        }
@@ -5,9 +5,11 @@ import sys
 import os
 from pathlib import Path
 
-# Add lib directory to path for imports
+# Add lib and remote_scripts directories to path for imports
 lib_path = Path(__file__).parent.parent / 'lib'
 sys.path.insert(0, str(lib_path))
+remote_scripts_path = Path(__file__).parent.parent / 'remote_scripts'
+sys.path.insert(0, str(remote_scripts_path))
 
 
 def has_nvidia_smi():
@@ -48,6 +50,16 @@ def pytorch_cuda_available():
         return False
 
 
+def has_transformers():
+    """Check if PyTorch and transformers are installed."""
+    try:
+        import torch
+        import transformers
+        return True
+    except ImportError:
+        return False
+
+
 def has_vast_api_key():
     """Check if Vast.ai API key is available."""
     from dotenv import load_dotenv
@@ -80,6 +92,81 @@ def pytorch_cuda_available_fixture():
     return pytorch_cuda_available()
 
 
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """
+    Build a tiny Llama-style model and tokenizer on disk.
+
+    Nothing is downloaded, so tests that need a real causal LM can run
+    offline on CPU in a few seconds.
+    """
+    if not has_transformers():
+        pytest.skip("transformers not installed")
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    corpus = [
+        "the quick brown fox jumps over the lazy dog",
+        "a model is scored on how well it predicts the next token",
+        "perplexity is the exponential of the average negative log likelihood",
+    ]
+    backend = Tokenizer(models.BPE(unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=320,
+        special_tokens=["<unk>", "<s>", "</s>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    backend.train_from_iterator(corpus * 10, trainer)
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        unk_token="<unk>",
+        bos_token="<s>",
+        eos_token="</s>",
+    )
+
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=1024,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    torch.manual_seed(0)
+    model = LlamaForCausalLM(config)
+
+    model_dir = tmp_path_factory.mktemp("tiny-llama")
+    model.save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+    return str(model_dir)
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tiny_model_dir):
+    """
+    The tiny test model in fp32, in eval mode.
+
+    Shared by the whole session: tests that change its weights or config
+    take a ``copy.deepcopy``.
+    """
+    import torch
+    from transformers import AutoModelForCausalLM
+    return AutoModelForCausalLM.from_pretrained(tiny_model_dir, torch_dtype=torch.float32).eval()
+
+
+@pytest.fixture(scope="session")
+def tiny_tokenizer(tiny_model_dir):
+    """The tiny test model's tokenizer, shared like `tiny_model`."""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(tiny_model_dir)
+
+
 @pytest.fixture(scope="session")
 def vast_api_key():
     """Fixture to get Vast.ai API key."""
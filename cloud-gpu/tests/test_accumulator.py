@@ -0,0 +1,55 @@
+"""Tests for on-device loss accumulation."""
+import pytest
+
+try:
+    import torch
+    from accumulator import LossAccumulator
+except ImportError as e:
+    pytest.skip(f"accumulator not available: {e}", allow_module_level=True)
+
+
+@pytest.mark.pytorch
+class TestLossAccumulator:
+    """Test lazy synchronization of running totals."""
+
+    def test_matches_per_batch_item(self):
+        """Totals equal adding .item() after every batch, bit for bit."""
+        torch.manual_seed(0)
+        losses = [torch.rand(7).sum() * 1000 for _ in range(25)]
+
+        expected = 0.0
+        for loss in losses:
+            expected += loss.item()
+
+        accumulator = LossAccumulator("cpu")
+        for index, loss in enumerate(losses):
+            accumulator.add(index, loss, torch.tensor(7), 8, 10)
+        totals = accumulator.totals()
+
+        assert totals['total_loss'] == expected
+        assert totals['total_tokens'] == 7 * 25
+        assert totals['real_tokens'] == 8 * 25
+        assert totals['computed_tokens'] == 10 * 25
+        assert [index for index, _ in accumulator.batch_losses] == list(range(25))
+
+    def test_repeated_totals_do_not_double_count(self):
+        """Reading totals mid-run folds pending values in exactly once."""
+        accumulator = LossAccumulator("cpu", {'total_loss': 1.5, 'total_tokens': 3})
+        accumulator.add(0, torch.tensor(2.0), torch.tensor(4), 0, 0)
+        accumulator.totals()
+        accumulator.add(1, torch.tensor(0.5), 1, 0, 0)
+        totals = accumulator.totals()
+        assert totals['total_loss'] == 4.0
+        assert totals['total_tokens'] == 8
+        assert accumulator.totals() == totals
+
+
+@pytest.mark.pytorch
+def test_benchmark_totals_agree(tiny_model):
+    """Both benchmark modes score the same batches to the same totals."""
+    from benchmark_accumulation import benchmark_accumulation
+
+    results = benchmark_accumulation(tiny_model, "cpu", batch_size=2, seq_len=16, steps=5, warmup=1)
+    assert results['item']['total_loss'] == results['device']['total_loss']
+    assert results['item']['total_tokens'] == results['device']['total_tokens'] == 5 * 2 * 15
+    assert results['speedup'] > 0
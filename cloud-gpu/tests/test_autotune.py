@@ -0,0 +1,129 @@
+"""Tests for batch size autotuning."""
+import pytest
+
+try:
+    import torch
+    import autotune as at
+except ImportError as e:
+    pytest.skip(f"autotune dependencies not available: {e}", allow_module_level=True)
+
+
+def _fake_probe(max_tokens, calls=None):
+    """Probe that runs out of memory above a fixed token count."""
+    def probe(batch_size, seq_len):
+        if calls is not None:
+            calls.append((batch_size, seq_len))
+        if batch_size * seq_len > max_tokens:
+            raise torch.cuda.OutOfMemoryError("CUDA out of memory. Tried to allocate 2.00 GiB")
+    return probe
+
+
+class TestSearch:
+    """Test the batch size and sequence length search."""
+
+    @pytest.mark.parametrize("initial", [1, 3, 40, 1000])
+    def test_finds_largest_batch(self, initial):
+        """The search converges on the exact limit from any starting point."""
+        probe = _fake_probe(max_tokens=37 * 512)
+        assert at.find_max_batch_size(probe, 512, initial=initial, max_batch_size=1024) == 37
+
+    def test_capped_by_max_batch_size(self):
+        """The search stops at max_batch_size when everything fits."""
+        probe = _fake_probe(max_tokens=10 ** 9)
+        assert at.find_max_batch_size(probe, 512, initial=5, max_batch_size=64) == 64
+
+    def test_single_sample_too_large(self):
+        """Zero is returned when not even one sample fits."""
+        assert at.find_max_batch_size(_fake_probe(max_tokens=100), 512) == 0
+
+    def test_max_seq_len(self):
+        """The sequence length search finds the largest fitting multiple of the granularity."""
+        assert at.find_max_seq_len(_fake_probe(max_tokens=1000), 4096, granularity=64) == 960
+
+    def test_other_errors_propagate(self):
+        """Errors that are not out-of-memory are not swallowed."""
+        def probe(batch_size, seq_len):
+            raise ValueError("bad input")
+        with pytest.raises(ValueError):
+            at.find_max_batch_size(probe, 512)
+
+    def test_is_oom_error(self):
+        """OOM errors are recognised by type or message."""
+        assert at.is_oom_error(at.OutOfMemory("over budget"))
+        assert at.is_oom_error(RuntimeError("CUDA error: out of memory"))
+        assert not at.is_oom_error(RuntimeError("shape mismatch"))
+
+
+class TestAutotuneBatchSize:
+    """Test the end-to-end tuner and its persisted results."""
+
+    def test_result_is_persisted(self, tmp_path):
+        """A second call for the same key skips the search."""
+        cache_path = str(tmp_path / "autotune.json")
+        calls = []
+        probe = _fake_probe(max_tokens=8 * 256, calls=calls)
+
+        first = at.autotune_batch_size(probe, "tiny", "cpu", "float32", 256, 10 ** 9, cache_path=cache_path)
+        searched = len(calls)
+        second = at.autotune_batch_size(probe, "tiny", "cpu", "float32", 256, 10 ** 9, cache_path=cache_path)
+
+        assert first['batch_size'] == second['batch_size'] == 8
+        assert first['max_tokens'] == 8 * 256
+        assert not first['cached'] and second['cached']
+        assert len(calls) == searched
+
+    def test_budget_change_searches_again(self, tmp_path):
+        """A result tuned for a different budget is not reused."""
+        cache_path = str(tmp_path / "autotune.json")
+        at.autotune_batch_size(_fake_probe(8 * 256), "tiny", "cpu", "float32", 256, 10 ** 9, cache_path=cache_path)
+        result = at.autotune_batch_size(_fake_probe(4 * 256), "tiny", "cpu", "float32", 256, 10 ** 8, cache_path=cache_path)
+        assert not result['cached']
+        assert result['batch_size'] == 4
+
+    def test_shrinks_seq_len(self, tmp_path):
+        """If one sample does not fit, the sequence length is reduced."""
+        result = at.autotune_batch_size(_fake_probe(300), "tiny", "cpu", "float32", 512, cache_path=None)
+        assert result['batch_size'] == 1
+        assert result['seq_len'] == 256
+
+    def test_estimator_start(self):
+        """Known model sizes start from the estimator's prediction."""
+        if at.estimate_memory_requirements is None:
+            pytest.skip("model-library not available")
+        small = at.estimate_initial_batch_size("Qwen/Qwen2.5-0.5B", 512, int(80e9))
+        large = at.estimate_initial_batch_size("Qwen/Qwen2.5-32B", 512, int(80e9))
+        assert small > large >= 1
+        assert at.estimate_initial_batch_size("unknown/model", 512, int(80e9)) == 1
+
+
+@pytest.fixture(scope="module")
+def probe_factory(tiny_model):
+    """Build CPU probes for the tiny test model under a given RAM budget."""
+    import calculate_perplexity as cp
+    return lambda budget: cp.make_probe(tiny_model, "cpu", budget)
+
+
+class TestCpuBudget:
+    """Test the CPU RAM budget with a real model."""
+
+    def test_generous_budget(self, probe_factory):
+        """With plenty of RAM the search reaches the batch size cap."""
+        probe = probe_factory(at._rss_bytes() + int(4e9))
+        assert at.find_max_batch_size(probe, 64, initial=2, max_batch_size=8) == 8
+
+    def test_exhausted_budget(self, probe_factory):
+        """A budget below current usage fails cleanly."""
+        with pytest.raises(at.OutOfMemory):
+            at.autotune_batch_size(probe_factory(1), "tiny", "cpu", "float32", 128, 1, cache_path=None)
+
+    def test_retained_memory_not_charged(self):
+        """Memory left resident before a probe does not count against its budget."""
+        resident = at._rss_bytes()
+        retained = b"\x01" * (256 * 1024 * 1024)  # stands in for pages a failed probe left behind
+        with at.MemoryMonitor("cpu", resident + int(128e6), resident_bytes=resident) as monitor:
+            torch.ones(1024).sum()
+        assert monitor.peak_bytes >= resident + len(retained) and monitor.increase_bytes < int(128e6)
+        with pytest.raises(at.OutOfMemory):
+            with at.MemoryMonitor("cpu", resident + int(128e6)):
+                pass
+        del retained
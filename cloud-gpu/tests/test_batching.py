@@ -0,0 +1,98 @@
+"""Tests for the token-budget batching helpers."""
+import pytest
+
+try:
+    import torch
+    from batching import (
+        build_token_budget_batches,
+        document_attention,
+        pack_sequences,
+        pad_batch,
+        padding_efficiency,
+    )
+except ImportError as e:
+    pytest.skip(f"batching not available: {e}", allow_module_level=True)
+
+
+class TestBuildTokenBudgetBatches:
+    """Test length-bucketed batch construction."""
+
+    def test_batches_respect_budget(self):
+        """No padded batch exceeds the token budget."""
+        lengths = [5, 120, 3, 64, 64, 1, 30, 31, 200, 7]
+        batches = build_token_budget_batches(lengths, max_tokens=256)
+        for batch in batches:
+            padded = len(batch) * max(lengths[i] for i in batch)
+            assert padded <= 256 or len(batch) == 1
+
+    def test_every_sample_used_once(self):
+        """Each sample index appears in exactly one batch."""
+        lengths = [9, 2, 7, 7, 3, 12]
+        batches = build_token_budget_batches(lengths, max_tokens=16)
+        assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+
+    def test_longest_first(self):
+        """The first batch holds the longest sample."""
+        lengths = [4, 50, 8]
+        batches = build_token_budget_batches(lengths, max_tokens=64)
+        assert batches[0][0] == 1
+
+    def test_oversized_sample_gets_own_batch(self):
+        """A sample longer than the budget is still batched."""
+        batches = build_token_budget_batches([100, 2, 2], max_tokens=10)
+        assert batches[0] == [0]
+
+    def test_max_batch_size(self):
+        """The optional sample cap is honoured."""
+        batches = build_token_budget_batches([1] * 10, max_tokens=1000, max_batch_size=4)
+        assert [len(b) for b in batches] == [4, 4, 2]
+
+    def test_invalid_budget(self):
+        """A non-positive budget is rejected."""
+        with pytest.raises(ValueError):
+            build_token_budget_batches([1, 2], max_tokens=0)
+
+
+class TestPadBatch:
+    """Test padding and label masking."""
+
+    def test_padding_masked_in_labels(self):
+        """Padding positions are masked out of attention and labels."""
+        input_ids, attention_mask, labels = pad_batch([[5, 6, 7], [8]], pad_token_id=0)
+        assert input_ids.tolist() == [[5, 6, 7], [8, 0, 0]]
+        assert attention_mask.tolist() == [[1, 1, 1], [1, 0, 0]]
+        assert labels.tolist() == [[5, 6, 7], [8, -100, -100]]
+
+    def test_padding_efficiency(self):
+        """Efficiency is real over computed tokens."""
+        assert padding_efficiency(3, 4) == 0.75
+        assert padding_efficiency(0, 0) == 1.0
+
+
+class TestPacking:
+    """Test sequence packing and per-document attention."""
+
+    def test_pack_sequences(self):
+        """Sequences are joined with separators and cut into blocks."""
+        blocks, segments, positions = pack_sequences([[1, 2, 3], [], [4, 5]], separator_id=0, block_size=4)
+        assert [b.tolist() for b in blocks] == [[1, 2, 3, 0], [4, 5, 0]]
+        assert [s.tolist() for s in segments] == [[0, 0, 0, -1], [2, 2, -1]]
+        assert [p.tolist() for p in positions] == [[0, 1, 2, 3], [0, 1, 2]]
+
+    def test_pack_sequences_block_size(self):
+        """Blocks need room for at least one prediction."""
+        with pytest.raises(ValueError):
+            pack_sequences([[1, 2]], separator_id=0, block_size=1)
+
+    def test_document_attention(self):
+        """Tokens only see their own document and positions restart per document."""
+        segments = torch.tensor([[0, 0, -1, 1, 1, 1]])
+        attention_mask = torch.tensor([[1, 1, 1, 1, 1, 0]])
+        mask, position_ids = document_attention(segments, attention_mask, torch.float32)
+
+        assert position_ids.tolist() == [[0, 1, 0, 0, 1, 0]]
+        allowed = (mask[0, 0] == 0).int().tolist()
+        assert allowed[1] == [1, 1, 0, 0, 0, 0]
+        assert allowed[4] == [0, 0, 0, 1, 1, 0]
+        # Padding only attends to itself
+        assert allowed[5] == [0, 0, 0, 0, 0, 1]
@@ -0,0 +1,113 @@
+"""Tests for the requirements estimator calibration harness."""
+import json
+
+import pytest
+
+try:
+    import torch
+    import benchmark_requirements as br
+except ImportError as e:
+    pytest.skip(f"requirements benchmark not available: {e}", allow_module_level=True)
+
+needs_estimator = pytest.mark.skipif(br.estimate_memory_requirements is None, reason="model-library not available")
+
+
+def _synthetic_rows(sizes_b, overhead=0.01, rate=2e-3, weights_scale=1.1, activation_scale=1.5, overhead_gb=0.5):
+    """Points whose time and memory follow the calibration model exactly."""
+    rows = []
+    for size_b in sizes_b:
+        for batch_size in (1, 4, 16):
+            for seq_length in (128, 512):
+                row = {
+                    'hardware': 'Test GPU', 'model': f'test-{size_b}', 'params': int(size_b * 1e9),
+                    'dtype': 'float16', 'batch_size': batch_size, 'seq_length': seq_length,
+                    'seconds_per_batch': overhead + rate * batch_size * seq_length * size_b,
+                }
+                if br.estimate_memory_requirements is not None:
+                    terms = br._estimated_terms(row)
+                    peak_gb = terms['weights_gb'] * weights_scale + terms['activation_gb'] * activation_scale + overhead_gb
+                    row['peak_bytes'] = int(peak_gb * 1e9)
+                rows.append(row)
+    return rows
+
+
+@pytest.mark.pytorch
+def test_benchmark_matrix(tiny_model_dir):
+    rows = br.benchmark_requirements(
+        tiny_model_dir, "cpu", batch_sizes=[2, 1], seq_lengths=[16, 32], dtypes=['float32', 'bfloat16'], repeats=1
+    )
+    assert len(rows) == 8
+    assert [row['batch_size'] for row in rows[:2]] == [1, 2]
+    assert {row['dtype'] for row in rows} == {'float32', 'bfloat16'}
+    for row in rows:
+        assert row['hardware'].startswith("CPU ")
+        assert row['tokens_per_second'] > 0 and row['peak_bytes'] > 0
+        assert row['params'] == rows[0]['params']
+
+
+@needs_estimator
+def test_fit_recovers_coefficients():
+    rows = _synthetic_rows([1.5, 7.0]) + [{'hardware': 'Test GPU', 'dtype': 'float16', 'oom': True}]
+    coefficients = br.fit_calibration(rows)['Test GPU']['float16']
+    assert coefficients['points'] == 12
+    assert coefficients['forward_overhead_seconds'] == pytest.approx(0.01, rel=1e-6)
+    assert coefficients['seconds_per_token_per_b'] == pytest.approx(2e-3, rel=1e-6)
+    assert coefficients['weights_scale'] == pytest.approx(1.1, rel=1e-3)
+    assert coefficients['activation_scale'] == pytest.approx(1.5, rel=1e-3)
+    assert coefficients['overhead_gb'] == pytest.approx(0.5, abs=1e-3)
+
+
+@needs_estimator
+def test_fit_single_model_fixes_weights_scale():
+    coefficients = br.fit_calibration(_synthetic_rows([7.0], weights_scale=1.0))['Test GPU']['float16']
+    assert coefficients['weights_scale'] == 1.0
+    assert coefficients['overhead_gb'] == pytest.approx(0.5, abs=1e-3)
+
+
+def test_too_few_points():
+    assert br.fit_calibration(_synthetic_rows([7.0])[:br.MIN_FIT_POINTS - 1]) == {}
+
+
+@needs_estimator
+def test_estimator_loads_calibration(tmp_path):
+    import perplexity_requirements as pr
+    path = str(tmp_path / "calibration.json")
+    br.update_calibration(path, br.fit_calibration(_synthetic_rows([1.5, 7.0])))
+    br.update_calibration(path, {'Other GPU': {'float32': {}}})
+    with open(path) as f:
+        assert set(json.load(f)) == {'Test GPU', 'Other GPU'}
+
+    # Neither entry is this machine's hardware
+    assert pr.estimate_compute_time("Qwen/Qwen2.5-7B", calibration_path=path)['calibrated'] is None
+    estimate = pr.estimate_compute_time(
+        "Qwen/Qwen2.5-7B", dataset_size=100, batch_size=10, seq_length=100, hardware="test", calibration_path=path
+    )
+    assert estimate['calibrated'] == 'Test GPU'
+    assert estimate['estimated_time_seconds'] == pytest.approx(10 * (0.01 + 2e-3 * 10 * 100 * 7.0), rel=1e-3)
+
+    memory = pr.estimate_memory_requirements("Qwen/Qwen2.5-7B", hardware="Test GPU", calibration_path=path)
+    expected = memory['model_memory_fp16_gb'] * 1.1 + (memory['activation_memory_gb'] + memory['kv_cache_memory_gb']) * 1.5 + 0.5
+    assert memory['total_fp16_gb'] == pytest.approx(expected, rel=1e-2)
+    assert memory['calibrated'] == 'Test GPU'
+    # Not an A100 calibration, so the A100 flags keep the rule of thumb
+    uncalibrated = pr.estimate_memory_requirements("Qwen/Qwen2.5-7B", calibration_path=path)
+    assert all(memory[key] == uncalibrated[key] for key in memory if key.startswith('fits_a100'))
+    # float32 was not calibrated for this hardware
+    assert pr.estimate_compute_time("Qwen/Qwen2.5-7B", hardware="Test GPU", dtype="float32",
+                                    calibration_path=path)['estimated_tokens_per_sec'] == 50
+    # The parsed file is cached until it is rewritten
+    assert pr.load_calibration("Third GPU", path) == (None, {})
+    br.update_calibration(path, {'Third GPU': {'float32': {}}})
+    assert pr.load_calibration("Third GPU", path)[0] == 'Third GPU'
+
+
+@needs_estimator
+def test_estimator_uses_local_hardware_calibration(tmp_path):
+    import perplexity_requirements as pr
+    local = pr.local_hardware_names()[0]
+    if local.startswith("CPU "):
+        assert local == br.hardware_name("cpu")
+    path = str(tmp_path / "calibration.json")
+    rows = [dict(row, hardware=local) for row in _synthetic_rows([1.5, 7.0])]
+    br.update_calibration(path, br.fit_calibration(rows + _synthetic_rows([1.5, 7.0])))
+    assert pr.estimate_compute_time("Qwen/Qwen2.5-7B", calibration_path=path)['calibrated'] == local
@@ -0,0 +1,483 @@
+"""Tests for the calculate_perplexity remote script."""
+import pytest
+
+try:
+    import numpy as np
+    import torch
+    import calculate_perplexity as cp
+    from token_losses import TokenLosses, TokenLossWriter, offsets_from_lengths
+except ImportError as e:
+    pytest.skip(f"calculate_perplexity dependencies not available: {e}", allow_module_level=True)
+
+
+TEXTS = [
+    "the quick brown fox jumps over the lazy dog " * 12,
+    "perplexity is the exponential of the average negative log likelihood",
+    "a",
+]
+
+
+@pytest.fixture(scope="module")
+def model_and_tokenizer(tiny_model, tiny_tokenizer):
+    """The tiny test model in fp32 on CPU, with its tokenizer."""
+    return tiny_model, tiny_tokenizer
+
+
+@pytest.fixture(scope="module")
+def token_ids(model_and_tokenizer):
+    """TEXTS tokenized with the tiny test tokenizer."""
+    _, tokenizer = model_and_tokenizer
+    return cp.tokenize_texts(tokenizer, TEXTS)
+
+
+def _model_loss(model, tokenizer, text):
+    """Mean loss the model itself reports for a single unpadded text."""
+    ids = tokenizer(text, return_tensors="pt")['input_ids']
+    with torch.no_grad():
+        return model(input_ids=ids, labels=ids).loss.item()
+
+
+def _full_context_tokens(tokenizer, texts):
+    """Number of scorable tokens when nothing is truncated."""
+    return sum(max(len(tokenizer(t)['input_ids']) - 1, 0) for t in texts)
+
+
+@pytest.mark.pytorch
+class TestBatched:
+    """Test the length-bucketed batched perplexity mode."""
+
+    def test_padding_not_scored(self, model_and_tokenizer, token_ids):
+        """Batched scoring matches scoring each text on its own."""
+        model, tokenizer = model_and_tokenizer
+        stats = cp.score_batched(model, tokenizer, token_ids, "cpu", max_tokens=512, max_length=512)
+
+        scored = [t for t in TEXTS if len(tokenizer(t)['input_ids']) > 1]
+        expected_loss = sum(
+            _model_loss(model, tokenizer, t) * (len(tokenizer(t)['input_ids']) - 1) for t in scored
+        )
+        assert stats['total_tokens'] == _full_context_tokens(tokenizer, TEXTS)
+        assert stats['total_loss'] == pytest.approx(expected_loss, rel=1e-4)
+
+    def test_padding_efficiency_reported(self, model_and_tokenizer, token_ids):
+        """Padding efficiency is real tokens over computed tokens."""
+        model, tokenizer = model_and_tokenizer
+        stats = cp.score_batched(model, tokenizer, token_ids, "cpu", max_tokens=512, max_length=512)
+        assert 0 < stats['padding_efficiency'] <= 1.0
+        assert stats['padding_efficiency'] == pytest.approx(
+            stats['real_tokens'] / stats['computed_tokens']
+        )
+
+
+@pytest.mark.pytorch
+class TestPacked:
+    """Test the sequence-packing perplexity mode."""
+
+    def test_document_mask_matches_unpacked(self, model_and_tokenizer, token_ids):
+        """With document masks, one block scores exactly like batched mode."""
+        model, tokenizer = model_and_tokenizer
+        batched = cp.score_batched(model, tokenizer, token_ids, "cpu", max_tokens=1024, max_length=1024)
+        packed = cp.score_packed(
+            model, tokenizer, token_ids, "cpu", max_tokens=1024, block_size=1024, document_mask=True
+        )
+        assert packed['total_tokens'] == batched['total_tokens']
+        assert packed['total_loss'] == pytest.approx(batched['total_loss'], rel=1e-4)
+
+    def test_blocks_are_dense(self, model_and_tokenizer, token_ids):
+        """Every block but the last is full, and all tokens but block starts are scored."""
+        model, tokenizer = model_and_tokenizer
+        stats = cp.score_packed(model, tokenizer, token_ids, "cpu", max_tokens=64, block_size=16)
+
+        stream_len = sum(len(tokenizer(t)['input_ids']) + 1 for t in TEXTS)
+        num_blocks = -(-stream_len // 16)
+        assert stats['real_tokens'] == stream_len
+        assert stats['computed_tokens'] - stats['real_tokens'] < 16
+        assert stats['total_tokens'] == stream_len - num_blocks
+
+
+@pytest.mark.pytorch
+class TestSlidingWindow:
+    """Test the strided sliding-window perplexity mode."""
+
+    def test_scores_every_token(self, model_and_tokenizer, token_ids):
+        """Every token after the first of each text is scored exactly once."""
+        model, tokenizer = model_and_tokenizer
+        stats = cp.score_sliding_window(
+            model, tokenizer, token_ids, "cpu", max_length=32, stride=8, reuse_kv=False
+        )
+        assert stats['total_tokens'] == _full_context_tokens(tokenizer, TEXTS)
+
+    def test_kv_reuse_close_to_recompute(self, model_and_tokenizer, token_ids):
+        """Reusing the KV cache scores the same tokens with a close loss."""
+        model, tokenizer = model_and_tokenizer
+        assert cp.supports_kv_reuse(model)
+
+        recompute = cp.score_sliding_window(
+            model, tokenizer, token_ids, "cpu", max_length=32, stride=8, reuse_kv=False
+        )
+        reuse = cp.score_sliding_window(
+            model, tokenizer, token_ids, "cpu", max_length=32, stride=8, reuse_kv=True
+        )
+        assert reuse['total_tokens'] == recompute['total_tokens']
+        assert reuse['total_loss'] == pytest.approx(recompute['total_loss'], rel=1e-2)
+        # Only the new tokens of each window are run through the model
+        assert reuse['computed_tokens'] < recompute['computed_tokens']
+
+    def test_single_window_matches_model_loss(self, model_and_tokenizer):
+        """A text shorter than the window reproduces the model's own loss."""
+        model, tokenizer = model_and_tokenizer
+        text = TEXTS[1]
+        stats = cp.score_sliding_window(
+            model, tokenizer, cp.tokenize_texts(tokenizer, [text]), "cpu", max_length=128, stride=64
+        )
+        assert stats['total_loss'] / stats['total_tokens'] == pytest.approx(
+            _model_loss(model, tokenizer, text), rel=1e-4
+        )
+
+    def test_invalid_stride(self, model_and_tokenizer, token_ids):
+        """Stride must be positive and no larger than the window."""
+        model, tokenizer = model_and_tokenizer
+        with pytest.raises(ValueError):
+            cp.score_sliding_window(model, tokenizer, token_ids, "cpu", max_length=16, stride=32)
+        with pytest.raises(ValueError):
+            cp.score_sliding_window(model, tokenizer, token_ids, "cpu", max_length=16, stride=0)
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("mode", ["batched", "packed", "sliding"])
+def test_token_losses_reproduce_perplexity(model_and_tokenizer, token_ids, tmp_path, mode):
+    """Streamed per-token losses add up to the run's own loss."""
+    model, tokenizer = model_and_tokenizer
+    path = str(tmp_path / mode)
+    offsets = offsets_from_lengths([len(ids) for ids in token_ids])
+
+    with TokenLossWriter(path, offsets) as writer:
+        if mode == "batched":
+            stats = cp.score_batched(model, tokenizer, token_ids, "cpu", max_length=64, loss_writer=writer)
+        elif mode == "packed":
+            stats = cp.score_packed(
+                model, tokenizer, token_ids, "cpu", max_tokens=64, block_size=32,
+                document_mask=True, loss_writer=writer
+            )
+        else:
+            stats = cp.score_sliding_window(
+                model, tokenizer, token_ids, "cpu", max_length=32, stride=8, loss_writer=writer
+            )
+
+    recomputed = TokenLosses(path).perplexity()
+    assert recomputed['tokens'] == stats['total_tokens']
+    assert recomputed['avg_loss'] == pytest.approx(stats['total_loss'] / stats['total_tokens'], rel=1e-3)
+
+
+@pytest.mark.pytorch
+def test_load_token_ids_uses_cache(model_and_tokenizer, tmp_path, monkeypatch):
+    """The dataset is only loaded and tokenized on the first run."""
+    _, tokenizer = model_and_tokenizer
+    calls = []
+
+    def _load_texts(*args):
+        calls.append(args)
+        return TEXTS
+
+    monkeypatch.setattr(cp, "load_texts", _load_texts)
+    first = cp.load_token_ids(tokenizer, "wikitext", "wikitext-2-raw-v1", "test", 3, str(tmp_path))
+    second = cp.load_token_ids(tokenizer, "wikitext", "wikitext-2-raw-v1", "test", 3, str(tmp_path))
+
+    assert len(calls) == 1
+    assert [d.tolist() for d in second] == [d.tolist() for d in first] == cp.tokenize_texts(tokenizer, TEXTS)
+
+
+@pytest.mark.pytorch
+def test_trim_cache_keeps_last_positions():
+    """Trimming a legacy tuple cache keeps only the most recent positions."""
+    keys = torch.arange(10, dtype=torch.float32).view(1, 1, 10, 1)
+    cache = ((keys, keys.clone()),)
+    trimmed = cp.trim_cache(cache, 3)
+    assert trimmed[0][0].flatten().tolist() == [7.0, 8.0, 9.0]
+    assert cp.trim_cache(cache, 0)[0][0].shape[-2] == 0
+
+
+def test_parse_args_positional():
+    """The original positional usage still works."""
+    args = cp.parse_args(["gpt2", "wikitext", "100", "--stride", "256"])
+    assert args.model_name == "gpt2"
+    assert args.max_samples == 100
+    assert args.stride == 256
+    assert args.max_length == 512
+    assert args.max_tokens == 2048
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("mode", ["batched", "packed", "sliding"])
+def test_prefetch_matches_inline(model_and_tokenizer, token_ids, mode):
+    """Background batch preparation does not change the result."""
+    model, tokenizer = model_and_tokenizer
+    results = []
+    for workers in (0, 3):
+        if mode == "batched":
+            stats = cp.score_batched(model, tokenizer, token_ids, "cpu", max_tokens=64, prefetch_workers=workers)
+        elif mode == "packed":
+            stats = cp.score_packed(
+                model, tokenizer, token_ids, "cpu", max_tokens=64, block_size=16,
+                document_mask=True, prefetch_workers=workers
+            )
+        else:
+            stats = cp.score_sliding_window(
+                model, tokenizer, token_ids, "cpu", max_length=32, stride=8, prefetch_workers=workers
+            )
+        results.append(stats)
+
+    inline, prefetched = results
+    assert prefetched['total_tokens'] == inline['total_tokens']
+    assert prefetched['total_loss'] == pytest.approx(inline['total_loss'], rel=1e-5)
+    assert prefetched['pipeline']['batches'] == inline['pipeline']['batches'] > 0
+
+
+class _Interrupted(Exception):
+    pass
+
+
+class _CrashingCheckpoint(cp.EvalCheckpoint):
+    """Checkpoint that simulates a crash right after its first save."""
+
+    def save(self, cursor, **totals):
+        super().save(cursor, **totals)
+        raise _Interrupted()
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("mode", ["batched", "packed", "sliding"])
+def test_resume_matches_uninterrupted(model_and_tokenizer, token_ids, tmp_path, mode):
+    """A run interrupted after a checkpoint resumes to exactly the same result."""
+    model, tokenizer = model_and_tokenizer
+    offsets = offsets_from_lengths([len(ids) for ids in token_ids])
+
+    def _score(checkpoint, loss_path, resume=False):
+        with TokenLossWriter(str(loss_path), offsets, resume=resume) as writer:
+            if checkpoint is not None:
+                checkpoint.loss_writer = writer
+            if mode == "batched":
+                return cp.score_batched(
+                    model, tokenizer, token_ids, "cpu", max_tokens=48, max_length=64,
+                    loss_writer=writer, checkpoint=checkpoint
+                )
+            if mode == "packed":
+                return cp.score_packed(
+                    model, tokenizer, token_ids, "cpu", max_tokens=32, block_size=16,
+                    loss_writer=writer, checkpoint=checkpoint
+                )
+            return cp.score_sliding_window(
+                model, tokenizer, token_ids, "cpu", max_length=32, stride=8,
+                loss_writer=writer, checkpoint=checkpoint
+            )
+
+    expected = _score(None, tmp_path / "full")
+
+    path = str(tmp_path / "checkpoint.json")
+    with pytest.raises(_Interrupted):
+        _score(_CrashingCheckpoint(path, {'mode': mode}, every=1), tmp_path / "resumed")
+    resumed = _score(cp.EvalCheckpoint(path, {'mode': mode}, every=1, resume=True), tmp_path / "resumed", resume=True)
+
+    for key in ('total_loss', 'total_tokens', 'real_tokens', 'computed_tokens'):
+        assert resumed[key] == expected[key]
+    assert resumed['pipeline']['batches'] < expected['pipeline']['batches']
+    full, partial = TokenLosses(str(tmp_path / "full")), TokenLosses(str(tmp_path / "resumed"))
+    assert np.array_equal(np.asarray(full.losses), np.asarray(partial.losses), equal_nan=True)
+    assert partial.metadata['scored_tokens'] == full.metadata['scored_tokens']
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("mode", ["batched", "packed", "sliding"])
+def test_sharded_scoring_reduces_exactly(model_and_tokenizer, token_ids, mode):
+    """Scoring in shards and reducing gives bit-identical totals."""
+    model, tokenizer = model_and_tokenizer
+    args = {
+        "batched": {'max_tokens': 48, 'max_length': 64},
+        "packed": {'max_tokens': 32, 'max_length': 16, 'pack': True},
+        "sliding": {'max_length': 32, 'stride': 8},
+    }[mode]
+
+    single = cp.score_dataset(model, tokenizer, token_ids, "cpu", **args)
+    shards = [cp.score_dataset(model, tokenizer, token_ids, "cpu", shard=(rank, 3), **args) for rank in range(3)]
+    reduced = cp.reduce_stats(shards)
+
+    for key in ('total_loss', 'total_tokens', 'real_tokens', 'computed_tokens'):
+        assert reduced[key] == single[key]
+
+
+@pytest.mark.pytorch
+def test_data_parallel_matches_single_process(tiny_model_dir, tmp_path, monkeypatch):
+    """Worker processes reproduce the single-process perplexity and loss file."""
+    monkeypatch.setattr(cp, "load_texts", lambda *args: TEXTS * 4)
+    common = {'max_samples': len(TEXTS) * 4, 'max_tokens': 64, 'token_cache_dir': str(tmp_path / "tokens"),
+              'checkpoint_every': 0, 'prefetch_workers': 0, 'result_cache_dir': None}
+
+    single = cp.calculate_perplexity(tiny_model_dir, token_losses_path=str(tmp_path / "single"), **common)
+    parallel = cp.calculate_perplexity(
+        tiny_model_dir, token_losses_path=str(tmp_path / "parallel"), data_parallel=2, **common
+    )
+
+    assert parallel == single
+    assert np.array_equal(
+        np.asarray(TokenLosses(str(tmp_path / "single")).losses),
+        np.asarray(TokenLosses(str(tmp_path / "parallel")).losses),
+        equal_nan=True,
+    )
+
+
+@pytest.mark.pytorch
+def test_streamed_scoring_matches_in_memory(model_and_tokenizer, token_ids):
+    """Scoring in chunks scores the same tokens with the same loss."""
+    model, tokenizer = model_and_tokenizer
+    in_memory = cp.score_dataset(model, tokenizer, token_ids, "cpu", max_tokens=512)
+    streamed = cp.score_stream(
+        model, tokenizer, (token_ids[i:i + 1] for i in range(len(token_ids))), "cpu", max_tokens=512
+    )
+    assert streamed['samples'] == len(token_ids)
+    assert streamed['total_tokens'] == in_memory['total_tokens']
+    assert streamed['total_loss'] == pytest.approx(in_memory['total_loss'], rel=1e-4)
+
+
+@pytest.mark.pytorch
+def test_calculate_perplexity_from_data_file(tiny_model_dir, model_and_tokenizer, tmp_path, monkeypatch):
+    """A local file streams to the same perplexity as the in-memory path."""
+    _, tokenizer = model_and_tokenizer
+    path = tmp_path / "data.txt"
+    path.write_text("\n".join(TEXTS) + "\n")
+    monkeypatch.setattr(cp, "load_texts", lambda *args: TEXTS)
+
+    common = {'token_cache_dir': None, 'checkpoint_every': 0, 'max_tokens': 512, 'result_cache_dir': None}
+    expected = cp.calculate_perplexity(tiny_model_dir, **common)
+    streamed = cp.calculate_perplexity(tiny_model_dir, data_file=str(path), stream_chunk_size=2, **common)
+    assert streamed == pytest.approx(expected, rel=1e-4)
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("mode", ["batched", "packed", "sliding"])
+def test_chunked_loss_matches_full_logits(model_and_tokenizer, token_ids, mode):
+    """The chunked loss path gives the same totals as full logits."""
+    model, tokenizer = model_and_tokenizer
+    args = {
+        "batched": {'max_tokens': 512},
+        "packed": {'max_tokens': 64, 'max_length': 16, 'pack': True, 'document_mask': True},
+        "sliding": {'max_length': 32, 'stride': 8},
+    }[mode]
+
+    full = cp.score_dataset(model, tokenizer, token_ids, "cpu", loss_chunk_size=0, **args)
+    chunked = cp.score_dataset(model, tokenizer, token_ids, "cpu", loss_chunk_size=5, **args)
+    assert chunked['total_tokens'] == full['total_tokens']
+    assert chunked['total_loss'] == pytest.approx(full['total_loss'], rel=1e-5)
+
+
+@pytest.mark.pytorch
+@pytest.mark.filterwarnings("ignore::DeprecationWarning", "ignore::UserWarning")
+def test_calculate_perplexity_quantized(tiny_model_dir, monkeypatch):
+    """int8 perplexity stays close to the fp32 result."""
+    monkeypatch.setattr(cp, "load_texts", lambda *args: TEXTS)
+
+    common = {'token_cache_dir': None, 'checkpoint_every': 0, 'max_tokens': 512, 'result_cache_dir': None}
+    expected = cp.calculate_perplexity(tiny_model_dir, **common)
+    quantized = cp.calculate_perplexity(tiny_model_dir, quantize='int8', **common)
+    assert quantized == pytest.approx(expected, rel=0.05)
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("mode", ["batched", "sliding"])
+def test_adaptive_scores_everything_without_convergence(model_and_tokenizer, token_ids, mode):
+    """An unreachable CI target scores every document, matching a full run."""
+    model, tokenizer = model_and_tokenizer
+    # Packing is left out: blocks (and so split documents) depend on which documents share a round
+    args = {
+        "batched": {'max_tokens': 512},
+        "sliding": {'max_length': 32, 'stride': 8},
+    }[mode]
+    documents = list(token_ids) * 4
+
+    full = cp.score_dataset(model, tokenizer, documents, "cpu", **args)
+    adaptive = cp.score_adaptive(model, tokenizer, documents, "cpu", target_ci=0.0, round_size=3, **args)
+    assert not adaptive['converged']
+    assert adaptive['documents'] == 8
+    assert adaptive['total_tokens'] == full['total_tokens']
+    assert adaptive['total_loss'] == pytest.approx(full['total_loss'], rel=1e-5)
+    assert adaptive['ci_low'] < adaptive['perplexity'] < adaptive['ci_high']
+
+
+@pytest.mark.pytorch
+def test_adaptive_stops_at_target(model_and_tokenizer, token_ids):
+    """A loose target stops after the minimum number of documents."""
+    model, tokenizer = model_and_tokenizer
+    documents = list(token_ids) * 40
+
+    adaptive = cp.score_adaptive(model, tokenizer, documents, "cpu", target_ci=1.0, round_size=10, max_tokens=512)
+    assert adaptive['converged']
+    assert adaptive['documents'] == 30
+    assert adaptive['relative_half_width'] <= 1.0
+
+
+@pytest.mark.pytorch
+def test_result_cache_skips_model_load(tiny_model_dir, tmp_path, monkeypatch):
+    """A repeated run returns the cached perplexity and losses without loading the model."""
+    monkeypatch.setattr(cp, "load_texts", lambda *args: TEXTS)
+    common = {'token_cache_dir': None, 'checkpoint_every': 0, 'max_tokens': 512,
+              'result_cache_dir': str(tmp_path / "results")}
+
+    expected = cp.calculate_perplexity(tiny_model_dir, token_losses_path=str(tmp_path / "first"), **common)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("model loaded despite a cache hit")
+
+    monkeypatch.setattr(cp, "load_model", _fail)
+    cached = cp.calculate_perplexity(tiny_model_dir, token_losses_path=str(tmp_path / "second"), **common)
+    assert cached == expected
+    assert np.array_equal(
+        np.asarray(TokenLosses(str(tmp_path / "first")).losses),
+        np.asarray(TokenLosses(str(tmp_path / "second")).losses),
+        equal_nan=True,
+    )
+
+    # Different settings miss
+    with pytest.raises(AssertionError, match="cache hit"):
+        cp.calculate_perplexity(tiny_model_dir, max_length=64, **common)
+
+
+@pytest.mark.pytorch
+def test_result_cache_keys_autotuned_settings(tiny_model_dir, tmp_path, monkeypatch, capsys):
+    """Autotuned runs are cached under the batch and sequence length tuning chose."""
+    monkeypatch.setattr(cp, "load_texts", lambda *args: TEXTS)
+    tuned = {'seq_len': 64, 'max_tokens': 256}
+    monkeypatch.setattr(cp, "autotune_batch_size", lambda *args, **kwargs: dict(tuned))
+    common = {'token_cache_dir': None, 'checkpoint_every': 0, 'autotune': True,
+              'result_cache_dir': str(tmp_path / "results")}
+
+    expected = cp.calculate_perplexity(tiny_model_dir, **common)
+    capsys.readouterr()
+    assert cp.calculate_perplexity(tiny_model_dir, **common) == expected
+    assert "Result cache hit" in capsys.readouterr().out
+
+    # A tuning result with a shorter context is a different evaluation
+    tuned['seq_len'] = 32
+    cp.calculate_perplexity(tiny_model_dir, **common)
+    assert "Result cache hit" not in capsys.readouterr().out
+
+
+@pytest.mark.pytorch
+def test_calculate_perplexity_report(tiny_model_dir, tmp_path, monkeypatch, capsys):
+    """--report streams progress lines and writes stage timings and metrics."""
+    import json
+    from report import REPORT_PREFIX
+
+    monkeypatch.setattr(cp, "load_texts", lambda *args: TEXTS * 8)
+    path = tmp_path / "report.json"
+    perplexity = cp.calculate_perplexity(
+        tiny_model_dir, token_cache_dir=None, checkpoint_every=0, max_tokens=64,
+        result_cache_dir=None, report_path=str(path)
+    )
+
+    report = json.loads(path.read_text())
+    assert set(report['stages']) == {'model_load', 'tokenization', 'forward'}
+    assert report['metrics']['perplexity'] == pytest.approx(perplexity)
+    assert 0 < report['metrics']['padding_efficiency'] <= 1
+    assert report['throughput'] and report['throughput'][-1]['eta_seconds'] is not None
+
+    events = [json.loads(line[len(REPORT_PREFIX):]) for line in capsys.readouterr().out.splitlines()
+              if line.startswith(REPORT_PREFIX)]
+    assert [event['event'] for event in events] == ['progress'] * len(report['throughput']) + ['summary']
@@ -0,0 +1,75 @@
+"""Tests for resumable evaluation checkpoints."""
+import random
+
+import pytest
+
+try:
+    import numpy as np
+    import torch
+    from checkpoint import EvalCheckpoint, config_key, get_rng_state, set_rng_state
+except ImportError as e:
+    pytest.skip(f"checkpoint not available: {e}", allow_module_level=True)
+
+
+TOTALS = {'total_loss': 1234.5678901234567, 'total_tokens': 42, 'real_tokens': 50, 'computed_tokens': 64}
+
+
+class TestEvalCheckpoint:
+    """Test saving, restoring and validating checkpoints."""
+
+    def test_totals_restored_exactly(self, tmp_path):
+        """Float totals survive the round trip bit for bit."""
+        path = str(tmp_path / "run.json")
+        EvalCheckpoint(path, {'model': 'm'}).save(7, **TOTALS)
+
+        cursor, totals = EvalCheckpoint(path, {'model': 'm'}, resume=True).restore()
+        assert cursor == 7
+        assert totals == TOTALS
+
+    def test_saves_every_n_steps(self, tmp_path):
+        """A checkpoint is written after every `every` committed batches."""
+        path = tmp_path / "run.json"
+        checkpoint = EvalCheckpoint(str(path), every=3)
+        checkpoint.step(1, lambda: TOTALS)
+        checkpoint.step(2, lambda: TOTALS)
+        assert not path.exists()
+        checkpoint.step(3, lambda: TOTALS)
+        assert EvalCheckpoint(str(path), resume=True).restore()[0] == 3
+
+    def test_without_resume_starts_fresh(self, tmp_path):
+        """An existing checkpoint is ignored unless resuming."""
+        path = str(tmp_path / "run.json")
+        EvalCheckpoint(path).save(5, **TOTALS)
+        cursor, totals = EvalCheckpoint(path).restore()
+        assert cursor == 0
+        assert totals['total_loss'] == 0.0
+
+    def test_config_mismatch_rejected(self, tmp_path):
+        """Resuming with different settings raises instead of mixing results."""
+        path = str(tmp_path / "run.json")
+        EvalCheckpoint(path, {'max_length': 512}).save(5, **TOTALS)
+        with pytest.raises(ValueError):
+            EvalCheckpoint(path, {'max_length': 1024}, resume=True)
+
+    def test_complete_removes_file(self, tmp_path):
+        """A finished run leaves no checkpoint behind."""
+        path = tmp_path / "run.json"
+        checkpoint = EvalCheckpoint(str(path))
+        checkpoint.save(1, **TOTALS)
+        checkpoint.complete()
+        assert not path.exists()
+
+
+@pytest.mark.pytorch
+def test_rng_state_round_trip():
+    """Python, numpy and torch generators continue where they were saved."""
+    state = get_rng_state()
+    expected = (random.random(), np.random.rand(), torch.rand(1).item())
+    set_rng_state(state)
+    assert (random.random(), np.random.rand(), torch.rand(1).item()) == expected
+
+
+def test_config_key_order_independent():
+    """The default checkpoint name does not depend on key order."""
+    assert config_key({'a': 1, 'b': 2}) == config_key({'b': 2, 'a': 1})
+    assert config_key({'a': 1}) != config_key({'a': 2})
@@ -0,0 +1,80 @@
+"""Tests for the chunked cross-entropy loss path."""
+import pytest
+
+try:
+    import torch
+    import torch.nn.functional as F
+    from chunked_loss import chunked_nll, forward_nll, supports_chunked_loss
+except ImportError as e:
+    pytest.skip(f"chunked_loss not available: {e}", allow_module_level=True)
+
+
+class _CountingHead(torch.nn.Linear):
+    """LM head that records the largest number of rows projected at once."""
+
+    max_rows = 0
+
+    def forward(self, hidden):
+        self.max_rows = max(self.max_rows, hidden.reshape(-1, hidden.size(-1)).size(0))
+        return super().forward(hidden)
+
+
+@pytest.mark.pytorch
+class TestChunkedNll:
+    """Test chunked NLL against full logits."""
+
+    def setup_method(self):
+        torch.manual_seed(0)
+        self.head = _CountingHead(16, 50, bias=False)
+        self.hidden = torch.randn(3, 11, 16)
+        self.targets = torch.randint(0, 50, (3, 11))
+        self.targets[1, 6:] = -100
+
+    def _full(self):
+        logits = self.head(self.hidden).float()
+        return F.cross_entropy(
+            logits.reshape(-1, 50), self.targets.reshape(-1), ignore_index=-100, reduction='none'
+        ).view(self.targets.shape)
+
+    def test_matches_full_logits(self):
+        """Per-token losses equal those computed from full logits."""
+        expected = self._full()
+        assert torch.allclose(chunked_nll(self.hidden, self.head, self.targets, chunk_size=4), expected, atol=1e-6)
+
+    def test_bounded_projection(self):
+        """The LM head never sees more than chunk_size positions at once."""
+        chunked_nll(self.hidden, self.head, self.targets, chunk_size=4)
+        assert self.head.max_rows == 4
+
+    def test_ignored_targets_zeroed(self):
+        """Positions without a target get zero loss, even from non-finite hidden states."""
+        self.targets[:] = -100
+        self.hidden[0, 0] = float('nan')
+        nll = chunked_nll(self.hidden, self.head, self.targets, chunk_size=4)
+        # Chunks have a fixed shape, so the positions are still projected
+        assert self.head.max_rows == 4
+        assert nll.abs().sum() == 0
+
+
+@pytest.mark.pytorch
+class TestForwardNll:
+    """Test the model-level loss path on the tiny test model."""
+
+    def test_supported(self, tiny_model):
+        """A plain Llama head supports the chunked path."""
+        assert supports_chunked_loss(tiny_model)
+
+    def test_softcapped_logits_fall_back(self, tiny_model, monkeypatch):
+        """Models that transform logits after the head use full logits."""
+        monkeypatch.setattr(tiny_model.config, "final_logit_softcapping", 30.0, raising=False)
+        assert not supports_chunked_loss(tiny_model)
+
+    def test_matches_model_logits(self, tiny_model):
+        """Chunked and full-logit paths agree on a real model."""
+        input_ids = torch.randint(0, tiny_model.config.vocab_size, (2, 20))
+        targets = torch.roll(input_ids, -1, dims=1)
+        targets[:, -1] = -100
+        with torch.no_grad():
+            chunked, _ = forward_nll(tiny_model, targets, 7, input_ids=input_ids)
+            full, _ = forward_nll(tiny_model, targets, 0, input_ids=input_ids)
+        assert torch.allclose(chunked, full, atol=1e-5)
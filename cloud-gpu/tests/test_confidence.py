@@ -0,0 +1,78 @@
+"""Tests for perplexity confidence intervals."""
+import math
+
+import pytest
+
+try:
+    import numpy as np
+    from confidence import DocumentStats, log_perplexity_ci, perplexity_ci
+except ImportError as e:
+    pytest.skip(f"confidence not available: {e}", allow_module_level=True)
+
+
+def _documents(num_documents, seed=0):
+    """Synthetic per-document loss sums and token counts with varying difficulty."""
+    rng = np.random.default_rng(seed)
+    tokens = rng.integers(20, 400, num_documents)
+    difficulty = rng.normal(3.0, 0.4, num_documents)
+    losses = np.array([rng.normal(d, 1.0, n).sum() for d, n in zip(difficulty, tokens)])
+    return losses, tokens
+
+
+class TestDocumentStats:
+    """Test per-document accumulation through the loss writer interface."""
+
+    def test_write_tokens(self):
+        stats = DocumentStats(3)
+        stats.write(np.array([0, 2, 2, 0]), np.array([1, 1, 2, 2]), np.array([1.0, 2.0, 3.0, 0.5]))
+        assert stats.losses.tolist() == [1.5, 0.0, 5.0]
+        assert stats.tokens.tolist() == [2, 0, 2]
+        assert stats.tokens_written == 4
+
+    def test_write_document(self):
+        stats = DocumentStats(2)
+        stats.write_document(1, 1, np.array([1.0, 2.0]))
+        stats.write_document(1, 3, np.array([0.5]))
+        assert stats.losses.tolist() == [0.0, 3.5]
+        assert stats.tokens.tolist() == [0, 3]
+
+
+class TestLogPerplexityCi:
+    """Test the delta-method interval."""
+
+    def test_estimate_is_token_weighted(self):
+        estimate, _ = log_perplexity_ci(np.array([10.0, 2.0]), np.array([4, 1]))
+        assert estimate == pytest.approx(12.0 / 5)
+
+    def test_matches_bootstrap(self):
+        """The delta-method width agrees with a document-level bootstrap."""
+        losses, tokens = _documents(400)
+        _, half_width = log_perplexity_ci(losses, tokens, confidence=0.95)
+
+        rng = np.random.default_rng(1)
+        resamples = rng.integers(0, len(losses), (4000, len(losses)))
+        ratios = losses[resamples].sum(axis=1) / tokens[resamples].sum(axis=1)
+        low, high = np.percentile(ratios, [2.5, 97.5])
+        assert half_width == pytest.approx((high - low) / 2, rel=0.1)
+
+    def test_narrows_with_more_documents(self):
+        losses, tokens = _documents(1600)
+        _, wide = log_perplexity_ci(losses[:400], tokens[:400])
+        _, narrow = log_perplexity_ci(losses, tokens)
+        assert narrow == pytest.approx(wide / 2, rel=0.2)
+
+    def test_unscored_documents_ignored(self):
+        losses, tokens = _documents(50)
+        padded = log_perplexity_ci(np.append(losses, 0.0), np.append(tokens, 0))
+        assert padded == pytest.approx(log_perplexity_ci(losses, tokens))
+
+    def test_too_few_documents(self):
+        assert log_perplexity_ci(np.array([3.0]), np.array([2]))[1] == math.inf
+        assert math.isnan(log_perplexity_ci(np.array([]), np.array([]))[0])
+
+
+def test_perplexity_ci():
+    interval = perplexity_ci(math.log(20.0), 0.01)
+    assert interval['perplexity'] == pytest.approx(20.0)
+    assert interval['ci_low'] < 20.0 < interval['ci_high']
+    assert interval['ci_high'] / 20.0 - 1 == pytest.approx(interval['relative_half_width'])
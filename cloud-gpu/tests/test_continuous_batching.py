@@ -0,0 +1,131 @@
+"""Tests for continuous batching with a paged KV cache."""
+import copy
+import random
+
+import pytest
+
+try:
+    import torch
+    from continuous_batching import BlockAllocator, ContinuousBatchingEngine, PagedKVCache, blocks_needed
+    from benchmark_continuous_batching import benchmark_continuous_batching
+except ImportError as e:
+    pytest.skip(f"continuous batching not available: {e}", allow_module_level=True)
+
+
+@pytest.fixture(scope="module")
+def model(tiny_model):
+    model = copy.deepcopy(tiny_model)
+    # Never stop early, so every request generates exactly its tokens
+    model.generation_config.eos_token_id = None
+    return model
+
+
+def _requests(count, seed=0):
+    rng = random.Random(seed)
+    return [([rng.randrange(3, 300) for _ in range(rng.randint(2, 30))], rng.randint(1, 20)) for _ in range(count)]
+
+
+def _reference(model, prompt, new_tokens):
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([prompt]), max_new_tokens=new_tokens, min_new_tokens=new_tokens,
+            do_sample=False, pad_token_id=0,
+        )
+    return output[0, len(prompt):].tolist()
+
+
+class TestBlockAllocator:
+    """Test the cache block free list."""
+
+    def test_allocate_and_free(self):
+        allocator = BlockAllocator(4)
+        blocks = allocator.allocate(3)
+        assert len(set(blocks)) == 3
+        assert allocator.num_free == 1
+        allocator.free(blocks)
+        assert allocator.num_used == 0
+
+    def test_exhausted(self):
+        allocator = BlockAllocator(2)
+        with pytest.raises(MemoryError):
+            allocator.allocate(3)
+
+    def test_blocks_needed(self):
+        assert blocks_needed(16, 16) == 1
+        assert blocks_needed(17, 16) == 2
+
+
+def test_paged_cache_round_trip():
+    cache = PagedKVCache(num_layers=1, num_blocks=4, block_size=2, device="cpu")
+    # A sequence whose blocks are not contiguous
+    table = [3, 0, 2]
+    slots = torch.tensor(cache.slots(table, 0, 5))
+    keys = torch.randn(5, 2, 4)
+    cache.write(0, slots, keys, -keys)
+    gathered_keys, gathered_values = cache.gather(0, slots.unsqueeze(0))
+    assert torch.equal(gathered_keys[0].transpose(0, 1), keys)
+    assert torch.equal(gathered_values[0].transpose(0, 1), -keys)
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("num_blocks", [200, 8])
+def test_matches_generate(model, num_blocks):
+    """Outputs equal one-request-at-a-time generation, with or without preemptions."""
+    requests = _requests(10)
+    engine = ContinuousBatchingEngine(model, "cpu", num_blocks=num_blocks, block_size=8, max_batch_size=4)
+    queued = [engine.add_request(prompt, count) for prompt, count in requests]
+    finished = engine.run()
+
+    assert len(finished) == len(requests)
+    assert engine.stats['peak_running'] <= 4
+    assert engine.stats['peak_blocks'] <= num_blocks
+    assert engine.cache.allocator.num_used == 0
+    if num_blocks == 8:
+        assert engine.stats['preemptions'] > 0
+    for request, (prompt, count) in zip(queued, requests):
+        assert request.output_ids == _reference(model, prompt, count)
+
+
+@pytest.mark.pytorch
+def test_pool_grows_with_use(model):
+    """The pools cover the blocks actually used, not the configured maximum."""
+    engine = ContinuousBatchingEngine(model, "cpu", num_blocks=1000, block_size=4, max_batch_size=2)
+    for prompt, count in _requests(4):
+        engine.add_request(prompt, count)
+    engine.run()
+    per_slot = 2 * 2 * 8 * 4 * 2  # keys+values, 2 layers, 2 heads, head_dim 8, fp32
+    assert 0 < engine.cache.pool_bytes() <= 2 * engine.stats['peak_blocks'] * 4 * per_slot
+    # One layer of one decode batch at a time
+    assert engine.cache.peak_gather_bytes <= 2 * 60 * per_slot // 2
+
+
+@pytest.mark.pytorch
+def test_stops_at_eos(model):
+    prompt = [5, 6, 7]
+    expected = _reference(model, prompt, 6)
+    engine = ContinuousBatchingEngine(model, "cpu", num_blocks=8, block_size=4, eos_token_ids=[expected[2]])
+    request = engine.add_request(prompt, 6)
+    engine.run()
+    assert request.output_ids == expected[:expected.index(expected[2]) + 1]
+
+
+def test_rejects_request_larger_than_cache(model):
+    engine = ContinuousBatchingEngine(model, "cpu", num_blocks=2, block_size=4)
+    with pytest.raises(ValueError):
+        engine.add_request(list(range(3, 10)), 4)
+
+
+@pytest.mark.pytorch
+def test_benchmark(model, tiny_tokenizer):
+    results = benchmark_continuous_batching(
+        model, tiny_tokenizer, "cpu", num_requests=6, batch_size=3, prompt_lengths=(2, 12), new_tokens=(1, 12),
+        block_size=4,
+    )
+    static, continuous = results['static'], results['continuous']
+    assert static['output_tokens'] == continuous['output_tokens']
+    # Continuous batching never decodes more steps than the static batches
+    assert continuous['steps'] <= static['steps']
+    # Pools plus the gathered copy, both counted in bytes like the static cache
+    assert 0 < continuous['peak_kv_bytes'] and 0 < static['peak_kv_bytes']
+    assert continuous['peak_blocks'] <= results['num_blocks']
+    assert results['speedup'] > 0
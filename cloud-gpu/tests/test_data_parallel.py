@@ -0,0 +1,94 @@
+"""Tests for single-node data-parallel evaluation."""
+import pytest
+
+try:
+    import torch
+    from data_parallel import cpu_sockets, reduce_stats, run_workers, shard
+except ImportError as e:
+    pytest.skip(f"data_parallel not available: {e}", allow_module_level=True)
+
+
+def _pipeline(batches):
+    return {
+        'batches': batches,
+        'consumer_stall_seconds': 0.1,
+        'producer_stall_seconds': 0.2,
+        'mean_queue_depth': 1.0,
+        'max_queue_depth': 2,
+    }
+
+
+def _square(rank, world_size, offset):
+    """Module-level so spawned workers can import it."""
+    return {'rank': rank, 'world_size': world_size, 'value': rank * rank + offset}
+
+
+def _fail(rank, world_size):
+    if rank == 1:
+        raise ValueError("worker exploded")
+    return {}
+
+
+class TestShard:
+    """Test deterministic round-robin sharding."""
+
+    def test_shards_partition_items(self):
+        """Every item is in exactly one shard."""
+        items = list(range(11))
+        shards = [shard(items, rank, 3) for rank in range(3)]
+        assert sorted(i for s in shards for i in s) == items
+        assert shards[0] == [0, 3, 6, 9]
+
+    def test_more_workers_than_items(self):
+        """Surplus workers get empty shards."""
+        assert shard([1, 2], 3, 4) == []
+
+
+class TestReduceStats:
+    """Test the exact reduction of worker results."""
+
+    def test_sum_in_global_order(self):
+        """The reduced loss is summed in global batch order, not worker order."""
+        losses = [0.1, 1e16, -1e16, 0.2, 0.3, 0.7]
+        expected = 0.0
+        for loss in losses:
+            expected += loss
+
+        results = []
+        for rank in range(2):
+            indices = shard(losses, rank, 2)
+            results.append({
+                'batch_losses': [(i, losses[i]) for i in indices],
+                'total_tokens': len(indices),
+                'real_tokens': 10,
+                'computed_tokens': 20,
+                'pipeline': _pipeline(len(indices)),
+            })
+
+        reduced = reduce_stats(results)
+        assert reduced['total_loss'] == expected
+        assert reduced['total_tokens'] == len(losses)
+        assert reduced['padding_efficiency'] == 0.5
+        assert reduced['pipeline']['batches'] == len(losses)
+        assert reduced['workers'] == 2
+
+
+def test_cpu_sockets_cover_available_cpus():
+    """Socket groups contain each usable CPU once."""
+    cpus = [cpu for socket in cpu_sockets() for cpu in socket]
+    assert len(cpus) == len(set(cpus)) > 0
+
+
+class TestRunWorkers:
+    """Test spawning worker processes."""
+
+    def test_results_ordered_by_rank(self):
+        """Each worker's return value comes back in rank order."""
+        results = run_workers(_square, 3, offset=1)
+        assert [r['value'] for r in results] == [1, 2, 5]
+        assert all(r['world_size'] == 3 for r in results)
+
+    def test_worker_error_raised(self):
+        """A failing worker raises with its traceback in the parent."""
+        with pytest.raises(RuntimeError, match="worker exploded"):
+            run_workers(_fail, 2)
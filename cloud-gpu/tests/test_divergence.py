@@ -0,0 +1,108 @@
+"""Tests for the base/instruct divergence engine."""
+import copy
+
+import numpy as np
+import pytest
+
+try:
+    import torch
+    import divergence as dv
+except ImportError as e:
+    pytest.skip(f"divergence engine not available: {e}", allow_module_level=True)
+
+TOKEN_IDS = [list(range(5, 5 + length)) for length in (40, 3, 1, 25, 60, 12)]
+
+
+@pytest.fixture(scope="module")
+def instruct(tiny_model):
+    """A perturbed copy of the base model standing in for its fine-tune."""
+    instruct = copy.deepcopy(tiny_model)
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        for parameter in instruct.parameters():
+            parameter.add_(torch.randn(parameter.shape, generator=generator) * 0.05)
+    return instruct
+
+
+def _score(base, instruct, tokenizer, path, **kwargs):
+    offsets = dv.offsets_from_lengths([len(ids) for ids in TOKEN_IDS])
+    with dv.DivergenceWriter(str(path), offsets) as writer:
+        results = dv.score_divergence(base, instruct, tokenizer, TOKEN_IDS, "cpu", writer, max_tokens=64, **kwargs)
+    return results, dv.Divergence(str(path))
+
+
+@pytest.mark.pytorch
+def test_matches_full_logits(tiny_model, instruct, tiny_tokenizer, tmp_path):
+    results, out = _score(tiny_model, instruct, tiny_tokenizer, tmp_path / "div", max_length=32)
+    document = out.document(0)
+    with torch.no_grad():
+        ids = torch.tensor([TOKEN_IDS[0][:32]])
+        base_logp = torch.log_softmax(tiny_model(ids).logits[0, :-1].float(), -1)
+        instruct_logp = torch.log_softmax(instruct(ids).logits[0, :-1].float(), -1)
+    targets = ids[0, 1:]
+    kl = (instruct_logp.exp() * (instruct_logp - base_logp)).sum(-1)
+    base_loss = -base_logp.gather(-1, targets[:, None])[:, 0]
+    instruct_loss = -instruct_logp.gather(-1, targets[:, None])[:, 0]
+
+    # Position 0 predicts nothing, positions past max_length are not scored
+    assert np.isnan(document['kl'][0]) and document['base_rank'][0] == -1
+    assert np.isnan(document['kl'][32:]).all()
+    np.testing.assert_allclose(document['kl'][1:32], kl.numpy(), rtol=1e-2, atol=1e-3)
+    np.testing.assert_allclose(document['base_loss'][1:32], base_loss.numpy(), rtol=1e-2)
+    np.testing.assert_allclose(document['loss_delta'][1:32], (instruct_loss - base_loss).numpy(), rtol=1e-2, atol=1e-2)
+    expected_rank = (base_logp > base_logp.gather(-1, targets[:, None])).sum(-1)
+    assert document['base_rank'][1:32].tolist() == expected_rank.tolist()
+
+    # Documents with fewer than two tokens are skipped
+    assert (out.document(2)['base_rank'] == -1).all()
+    assert results['scored_tokens'] == out.metadata['scored_tokens'] == 31 + 2 + 24 + 31 + 11
+    assert out.summary()['tokens'] == results['scored_tokens']
+    assert out.summary()['mean_kl'] == pytest.approx(results['mean_kl'], rel=1e-2)
+
+
+@pytest.mark.pytorch
+def test_alternating_matches_resident(tiny_model, instruct, tiny_tokenizer, tmp_path):
+    resident, resident_out = _score(tiny_model, instruct, tiny_tokenizer, tmp_path / "resident")
+    alternating, alternating_out = _score(
+        tiny_model, instruct, tiny_tokenizer, tmp_path / "alternating", alternate=True, chunk_batches=2
+    )
+    for field in dv.FIELDS:
+        np.testing.assert_array_equal(resident_out.fields[field], alternating_out.fields[field])
+    assert alternating['mean_kl'] == pytest.approx(resident['mean_kl'])
+    # One move per chunk, plus the first model of the first chunk
+    assert alternating['swaps'] == alternating['chunks'] + 1
+    assert alternating['chunks'] == -(-alternating['batches'] // 2)
+
+
+@pytest.mark.pytorch
+def test_identical_models(tiny_model, tiny_tokenizer, tmp_path):
+    results, out = _score(tiny_model, tiny_model, tiny_tokenizer, tmp_path / "same")
+    assert results['mean_kl'] == pytest.approx(0.0, abs=1e-6)
+    assert results['argmax_agreement'] == 1.0
+    summary = out.summary()
+    assert summary['rank_improved'] == summary['rank_worsened'] == 0.0
+    assert summary['base_perplexity'] == pytest.approx(summary['instruct_perplexity'])
+
+
+def test_resolve_instruct_model():
+    assert dv.resolve_instruct_model("my/base", "my/instruct") == "my/instruct"
+    if dv.get_instruct_model is None:
+        pytest.skip("model-library not available")
+    assert dv.resolve_instruct_model("Qwen/Qwen2.5-7B") == "Qwen/Qwen2.5-7B-Instruct"
+    with pytest.raises(ValueError):
+        dv.resolve_instruct_model("unknown/model")
+
+
+@pytest.mark.pytorch
+def test_calculate_divergence(tiny_model_dir, tmp_path, monkeypatch):
+    """End to end with the model as its own partner, forced to alternate."""
+    import calculate_perplexity as cp
+    texts = ["the quick brown fox jumps over the lazy dog", "", "perplexity is the exponential of the loss"]
+    monkeypatch.setattr(cp, "load_texts", lambda *args: texts)
+    results = dv.calculate_divergence(
+        tiny_model_dir, str(tmp_path / "out"), instruct_name=tiny_model_dir,
+        alternate=True, token_cache_dir=None, report_path=str(tmp_path / "report.json"),
+    )
+    assert results['alternate']
+    assert results['mean_kl'] == pytest.approx(0.0, abs=1e-6)
+    assert dv.Divergence(str(tmp_path / "out")).metadata['instruct_model'] == tiny_model_dir
@@ -0,0 +1,95 @@
+"""Tests for meta-device model loading from safetensors."""
+import pytest
+
+try:
+    import torch
+    from fast_loader import LOAD_STAGES, format_load_timings, load_model_fast, read_header
+except ImportError as e:
+    pytest.skip(f"fast loader not available: {e}", allow_module_level=True)
+
+INPUT_IDS = [[5, 9, 33, 100, 7, 12]]
+
+
+def _logits(model):
+    with torch.no_grad():
+        return model(torch.tensor(INPUT_IDS)).logits
+
+
+@pytest.mark.pytorch
+def test_matches_from_pretrained(tiny_model_dir, tiny_model):
+    model, timings = load_model_fast(tiny_model_dir)
+    assert not any(param.is_meta for param in model.parameters())
+    assert torch.equal(_logits(model), _logits(tiny_model))
+
+    for stage in LOAD_STAGES:
+        assert timings[stage] >= 0
+    assert timings['bytes_read'] == sum(p.numel() * p.element_size() for p in tiny_model.parameters())
+    assert timings['total_seconds'] >= timings['read']
+    assert "GB read" in format_load_timings(timings)
+
+
+@pytest.mark.pytorch
+def test_tied_weights_and_cast(tmp_path, tiny_model):
+    """A bf16 checkpoint with tied embeddings loads as fp32 with the LM head still tied."""
+    from transformers import AutoModelForCausalLM
+    config = tiny_model.config.to_dict()
+    config['tie_word_embeddings'] = True
+    tied = AutoModelForCausalLM.from_config(type(tiny_model.config).from_dict(config)).to(torch.bfloat16)
+    tied.save_pretrained(tmp_path)
+    assert 'lm_head.weight' not in read_header(str(tmp_path / "model.safetensors"))[0]
+
+    model, _ = load_model_fast(str(tmp_path))
+    assert model.lm_head.weight.dtype == torch.float32
+    assert model.lm_head.weight.data_ptr() == model.model.embed_tokens.weight.data_ptr()
+    expected = AutoModelForCausalLM.from_pretrained(tmp_path, torch_dtype=torch.float32).eval()
+    assert torch.equal(_logits(model), _logits(expected))
+
+
+@pytest.mark.pytorch
+def test_no_safetensors(tmp_path, tiny_model):
+    tiny_model.config.save_pretrained(tmp_path)
+    with pytest.raises(ValueError, match="no safetensors"):
+        load_model_fast(str(tmp_path))
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("device", [
+    "auto",
+    {"model.embed_tokens": "cpu", "model.layers.0": "cpu", "model": "cpu", "lm_head": "cpu"},
+])
+def test_device_map(tiny_model_dir, tiny_model, device):
+    model, _ = load_model_fast(tiny_model_dir, device)
+    assert all(param.device.type == "cpu" for param in model.parameters())
+    assert torch.equal(_logits(model), _logits(tiny_model))
+
+
+@pytest.mark.pytorch
+def test_device_map_rejects_disk_and_gaps(tiny_model_dir):
+    with pytest.raises(ValueError, match="disk"):
+        load_model_fast(tiny_model_dir, {"model": "cpu", "lm_head": "disk"})
+    with pytest.raises(ValueError, match="not covered"):
+        load_model_fast(tiny_model_dir, {"model": "cpu"})
+
+
+@pytest.mark.pytorch
+def test_load_model_fast_load(tiny_model_dir, tiny_model):
+    from calculate_perplexity import load_model
+    from report import PerfReport
+    report = PerfReport('test')
+    model, _, device = load_model(tiny_model_dir, device="cpu", fast_load=True, report=report)
+    assert device == "cpu"
+    assert torch.equal(_logits(model), _logits(tiny_model))
+    assert all(f"load_{stage}" in report.stages for stage in LOAD_STAGES)
+
+
+@pytest.mark.pytorch
+def test_load_model_falls_back_on_oom(tiny_model_dir, tiny_model, monkeypatch):
+    import calculate_perplexity as cp
+    import fast_loader
+
+    def _oom(*args, **kwargs):
+        raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+    monkeypatch.setattr(fast_loader, "load_model_fast", _oom)
+    model, _, _ = cp.load_model(tiny_model_dir, device="cpu", fast_load=True)
+    assert torch.equal(_logits(model), _logits(tiny_model))
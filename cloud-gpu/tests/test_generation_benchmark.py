@@ -0,0 +1,89 @@
+"""Tests for the batched generation benchmark."""
+import copy
+import json
+
+import pytest
+
+try:
+    import torch
+    from generation_benchmark import benchmark_generation, generate_batch, latency_percentiles, load_prompts
+    from report import PerfReport
+except ImportError as e:
+    pytest.skip(f"generation benchmark not available: {e}", allow_module_level=True)
+
+PROMPTS = ["Hello there", "The quick brown fox jumps over", "A", "One two three four five six seven"]
+
+
+@pytest.fixture(scope="module")
+def model_and_tokenizer(tiny_model, tiny_tokenizer):
+    model = copy.deepcopy(tiny_model)
+    # Never stop early, so token counts are exact
+    model.generation_config.eos_token_id = None
+    # test_left_padded_batch_matches_single changes the padding side
+    return model, copy.deepcopy(tiny_tokenizer)
+
+
+class TestLoadPrompts:
+    """Test reading prompt files."""
+
+    def test_text_lines(self, tmp_path):
+        path = tmp_path / "prompts.txt"
+        path.write_text("first prompt\n\nsecond prompt\n")
+        assert load_prompts(str(path)) == ["first prompt", "second prompt"]
+
+    def test_jsonl_fields(self, tmp_path):
+        path = tmp_path / "prompts.jsonl"
+        path.write_text(json.dumps({"prompt": "a"}) + "\n" + json.dumps({"text": "b"}) + "\n")
+        assert load_prompts(str(path)) == ["a", "b"]
+
+    def test_max_prompts(self, tmp_path):
+        path = tmp_path / "prompts.txt"
+        path.write_text("a\nb\nc\n")
+        assert load_prompts(str(path), max_prompts=2) == ["a", "b"]
+
+
+def test_latency_percentiles():
+    summary = latency_percentiles([i / 1000 for i in range(1, 101)])
+    assert summary['mean'] == pytest.approx(50.5)
+    assert summary['p50'] == pytest.approx(50.5)
+    assert summary['p99'] == pytest.approx(99.01)
+    assert latency_percentiles([])['p50'] is None
+
+
+@pytest.mark.pytorch
+def test_left_padded_batch_matches_single(model_and_tokenizer):
+    """Left padding gives every prompt the same continuation as generating it alone."""
+    model, tokenizer = model_and_tokenizer
+    tokenizer.padding_side = 'left'
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id
+
+    batched = generate_batch(model, tokenizer, PROMPTS, "cpu", max_new_tokens=6)
+    assert batched['generated'].shape == (len(PROMPTS), 6)
+    assert len(batched['step_latencies']) == 5
+    assert batched['ttft'] > 0
+    for row, prompt in enumerate(PROMPTS):
+        single = generate_batch(model, tokenizer, [prompt], "cpu", max_new_tokens=6)
+        assert torch.equal(batched['generated'][row], single['generated'][0])
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_benchmark_generation(model_and_tokenizer, batch_size):
+    model, tokenizer = model_and_tokenizer
+    report = PerfReport('test', emit=False)
+    result = benchmark_generation(model, tokenizer, PROMPTS, "cpu", batch_size, max_new_tokens=5, report=report)
+
+    batches = -(-len(PROMPTS) // batch_size)
+    assert result['batches'] == batches
+    assert result['output_tokens'] == len(PROMPTS) * 5
+    assert result['output_tokens_per_second'] > 0
+    assert result['ttft_ms']['p50'] > 0
+    assert result['itl_ms']['p50'] > 0
+    assert len(report.throughput) == batches
+
+
+def test_benchmark_rejects_bad_batch_size(model_and_tokenizer):
+    model, tokenizer = model_and_tokenizer
+    with pytest.raises(ValueError):
+        benchmark_generation(model, tokenizer, PROMPTS, "cpu", 0)
@@ -0,0 +1,175 @@
+"""Tests for the warm-model server and its client."""
+import math
+import socket
+import threading
+
+import pytest
+
+try:
+    import torch
+    from model_server import ModelRegistry, ModelServer, RequestError
+    from model_client import ModelClient, ModelServerError, start_remote_server
+except ImportError as e:
+    pytest.skip(f"model server not available: {e}", allow_module_level=True)
+
+
+class _TunnelExecutor:
+    """Stands in for RemoteExecutor, opening channels as plain local sockets."""
+
+    def __init__(self):
+        self.channels = 0
+        self.commands = []
+
+    def open_channel(self, remote_port, remote_host="127.0.0.1"):
+        self.channels += 1
+        return socket.create_connection((remote_host, remote_port))
+
+    def execute_command(self, command, timeout=None):
+        self.commands.append(command)
+        return "", "", 0
+
+
+@pytest.fixture(scope="module")
+def server(tiny_model_dir):
+    server = ModelServer(("127.0.0.1", 0), ModelRegistry())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope="module")
+def client(server):
+    return ModelClient(port=server.server_address[1], timeout=60)
+
+
+@pytest.mark.pytorch
+def test_load_and_health(client, tiny_model_dir):
+    info = client.load(tiny_model_dir)
+    assert info['device'] == "cpu"
+    assert info['model_bytes'] > 0
+    # Loading again reuses the resident model
+    assert client.load(tiny_model_dir)['load_seconds'] == info['load_seconds']
+    health = client.health()
+    assert health['status'] == "ok"
+    assert [m['model'] for m in health['models']] == [tiny_model_dir]
+
+
+@pytest.mark.pytorch
+def test_generate(client, tiny_model_dir):
+    result = client.generate(tiny_model_dir, ["Hello there", "A"], max_new_tokens=4)
+    assert len(result['texts']) == 2
+    assert 0 < result['output_tokens'] <= 8
+    # Greedy decoding is deterministic across warm requests
+    assert client.generate(tiny_model_dir, "A", max_new_tokens=4)['texts'] == result['texts'][1:]
+
+
+@pytest.mark.pytorch
+def test_score(client, tiny_model_dir):
+    result = client.score(tiny_model_dir, ["The quick brown fox", "jumps over the lazy dog"])
+    texts = result['texts']
+    assert sum(t['tokens'] for t in texts) == result['total_tokens']
+    expected = math.exp(sum(t['loss'] for t in texts) / result['total_tokens'])
+    assert result['perplexity'] == pytest.approx(expected)
+
+
+@pytest.mark.pytorch
+def test_errors(client, tiny_model_dir):
+    with pytest.raises(ModelServerError) as e:
+        client.request('POST', '/nothing', {})
+    assert e.value.status == 404
+    with pytest.raises(ModelServerError) as e:
+        client.request('POST', '/generate', {'model': tiny_model_dir})
+    assert e.value.status == 400
+    with pytest.raises(ModelServerError) as e:
+        client.load(tiny_model_dir + "-missing")
+    assert e.value.status == 500
+    # The server keeps serving after failed requests
+    assert client.is_alive()
+
+
+@pytest.mark.pytorch
+def test_tunnel_through_executor(server, tiny_model_dir):
+    executor = _TunnelExecutor()
+    client = ModelClient(port=server.server_address[1], executor=executor, timeout=60)
+    assert client.generate(tiny_model_dir, "Hello", max_new_tokens=2)['texts']
+    assert executor.channels == 1
+
+
+@pytest.mark.pytorch
+def test_start_remote_server_reuses_running_server(server):
+    executor = _TunnelExecutor()
+    client = start_remote_server(executor, "/remote/scripts", port=server.server_address[1])
+    assert client.is_alive()
+    assert executor.commands == []
+
+
+def test_start_remote_server_quotes_arguments():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    executor = _TunnelExecutor()
+    with pytest.raises(ModelServerError):
+        start_remote_server(
+            executor, "/remote/my scripts", port=port, preload=["org/model; rm -rf ~"],
+            log_path="/tmp/server log.txt", timeout=0.2,
+        )
+    assert executor.commands[0] == (
+        f"cd '/remote/my scripts' && nohup python3 model_server.py --port {port} "
+        "--preload 'org/model; rm -rf ~' > '/tmp/server log.txt' 2>&1 &"
+    )
+    assert executor.commands[1] == "tail -n 20 '/tmp/server log.txt'"
+
+
+def test_unreachable_server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    client = ModelClient(port=port, timeout=5)
+    assert not client.is_alive()
+    assert not client.wait_until_ready(timeout=0.2, interval=0.1)
+
+
+@pytest.mark.pytorch
+def test_unload(client, tiny_model_dir):
+    client.load(tiny_model_dir)
+    assert client.unload(tiny_model_dir)
+    assert not client.unload(tiny_model_dir)
+    assert client.health()['models'] == []
+
+
+@pytest.mark.pytorch
+def test_requests_to_unloaded_model(tiny_model_dir):
+    """A request that got the model before it was unloaded fails instead of using freed weights."""
+    from model_server import generate, score
+    registry = ModelRegistry(prefix_cache_bytes=10 ** 6)
+    loaded = registry.load(tiny_model_dir)
+    with loaded.lock:
+        # As if a request were in flight: unload marks the model, then waits for it
+        unloader = threading.Thread(target=registry.unload, args=(tiny_model_dir,))
+        unloader.start()
+        while not loaded.unloaded:
+            pass
+        assert loaded.model is not None
+    unloader.join()
+    assert loaded.model is None
+    for request in (lambda: generate(loaded, ["Hello"]), lambda: generate(loaded, ["a", "b"]),
+                    lambda: score(loaded, ["Hello"])):
+        with pytest.raises(RequestError, match="unloaded") as excinfo:
+            request()
+        assert excinfo.value.status == 409
+
+
+@pytest.mark.pytorch
+def test_generate_reuses_prefix_cache(tiny_model_dir):
+    from model_server import generate
+    registry = ModelRegistry(prefix_cache_bytes=10 ** 7)
+    loaded = registry.load(tiny_model_dir)
+    preamble = "You are a careful assistant. Answer briefly. " * 4
+    first = generate(loaded, [preamble + "What is a cat?"], max_new_tokens=4)
+    second = generate(loaded, [preamble + "What is a dog?"], max_new_tokens=4)
+    assert first['cached_tokens'] == 0 and second['cached_tokens'] > 0
+    uncached = generate(ModelRegistry().load(tiny_model_dir), [preamble + "What is a dog?"], max_new_tokens=4)
+    assert second['texts'] == uncached['texts'] and 'cached_tokens' not in uncached
+    assert loaded.info()['prefix_cache']['hits'] >= 1
@@ -0,0 +1,80 @@
+"""Tests for the background batch preparation pipeline."""
+import threading
+import time
+
+import pytest
+
+try:
+    import torch
+    from prefetch import Prefetcher, PipelineStats
+except ImportError as e:
+    pytest.skip(f"prefetch not available: {e}", allow_module_level=True)
+
+
+def _collate(item):
+    return {'ids': torch.full((2, 3), item), 'index': item}
+
+
+@pytest.mark.pytorch
+class TestPrefetcher:
+    """Test ordering, error handling and stall counters."""
+
+    @pytest.mark.parametrize("num_workers", [0, 1, 4])
+    def test_batches_in_order(self, num_workers):
+        """Batches come back in item order whatever the worker count."""
+        batches = list(Prefetcher(range(20), _collate, "cpu", num_workers=num_workers, depth=2))
+        assert [b['index'] for b in batches] == list(range(20))
+        assert all(b['ids'].eq(b['index']).all() for b in batches)
+
+    def test_collate_error_reraised(self):
+        """An exception in a worker surfaces in the consumer."""
+        def _fail(item):
+            if item == 3:
+                raise KeyError("bad item")
+            return torch.zeros(1)
+
+        with pytest.raises(KeyError):
+            list(Prefetcher(range(10), _fail, "cpu", num_workers=2))
+
+    def test_early_exit_stops_producer(self):
+        """Leaving the loop early shuts the background thread down."""
+        before = threading.active_count()
+        prefetcher = Prefetcher(range(1000), _collate, "cpu", num_workers=2, depth=2)
+        for index, _ in enumerate(prefetcher):
+            if index == 3:
+                break
+        time.sleep(0.5)
+        assert threading.active_count() <= before
+
+    def test_slow_collate_is_producer_bound(self):
+        """When collation is slower than the consumer, the consumer stalls."""
+        def _slow(item):
+            time.sleep(0.02)
+            return torch.zeros(1)
+
+        prefetcher = Prefetcher(range(10), _slow, "cpu", num_workers=1, depth=2)
+        list(prefetcher)
+        assert prefetcher.stats.batches == 10
+        assert prefetcher.stats.bottleneck == 'producer'
+
+    def test_slow_consumer_fills_queue(self):
+        """When the consumer is slower, the queue stays full and the producer waits."""
+        prefetcher = Prefetcher(range(10), _collate, "cpu", num_workers=2, depth=3)
+        for _ in prefetcher:
+            time.sleep(0.02)
+        stats = prefetcher.stats
+        assert stats.bottleneck == 'consumer'
+        assert stats.max_queue_depth == 3
+        assert stats.producer_stall_seconds > 0
+
+
+def test_stats_summary():
+    """The summary reports averages over recorded batches."""
+    stats = PipelineStats()
+    stats.record_get(2, 0.5)
+    stats.record_get(4, 0.0)
+    summary = stats.as_dict()
+    assert summary['batches'] == 2
+    assert summary['mean_queue_depth'] == 3.0
+    assert summary['max_queue_depth'] == 4
+    assert summary['consumer_stall_seconds'] == 0.5
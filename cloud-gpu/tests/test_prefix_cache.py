@@ -0,0 +1,81 @@
+"""Tests for the prompt prefix KV cache."""
+import pytest
+
+try:
+    import torch
+    from prefix_cache import PrefixCache, benchmark_prefix_cache, generate_cached
+except ImportError as e:
+    pytest.skip(f"prefix cache not available: {e}", allow_module_level=True)
+
+PREFIX = list(range(10, 50))
+
+
+@pytest.mark.pytorch
+def test_shared_prefix_reused(tiny_model):
+    cache = PrefixCache(max_bytes=10 ** 7, block_size=8)
+    first = PREFIX + [60, 61, 62]
+    second = PREFIX + [70, 71]
+
+    assert generate_cached(tiny_model, first, "cpu", 6, cache)['cached_tokens'] == 0
+    result = generate_cached(tiny_model, second, "cpu", 6, cache)
+    # 40 shared tokens are 5 complete blocks
+    assert result['cached_tokens'] == 40
+    assert result['tokens'] == generate_cached(tiny_model, second, "cpu", 6)['tokens']
+    assert cache.summary()['hit_rate'] == 0.5
+
+
+@pytest.mark.pytorch
+def test_repeated_prompt_keeps_one_token(tiny_model):
+    """A fully cached prompt still computes its last token."""
+    cache = PrefixCache(max_bytes=10 ** 7, block_size=8)
+    prompt = PREFIX[:16]
+    generate_cached(tiny_model, prompt, "cpu", 4, cache)
+    result = generate_cached(tiny_model, prompt, "cpu", 4, cache)
+    assert result['cached_tokens'] == 8
+    assert result['tokens'] == generate_cached(tiny_model, prompt, "cpu", 4)['tokens']
+
+
+@pytest.mark.pytorch
+def test_prefix_must_match_from_start(tiny_model):
+    cache = PrefixCache(max_bytes=10 ** 7, block_size=8)
+    generate_cached(tiny_model, PREFIX, "cpu", 2, cache)
+    assert cache.lookup([1] + PREFIX[1:])[0] == 0
+
+
+@pytest.mark.pytorch
+def test_lru_eviction(tiny_model):
+    cache = PrefixCache(max_bytes=10 ** 7, block_size=8)
+    generate_cached(tiny_model, PREFIX, "cpu", 2, cache)
+    block_bytes = cache.bytes // len(cache)
+
+    cache = PrefixCache(max_bytes=3 * block_bytes, block_size=8)
+    generate_cached(tiny_model, PREFIX, "cpu", 2, cache)
+    assert len(cache) == 3
+    assert cache.bytes <= cache.max_bytes
+    assert cache.stats['evictions'] == 2
+    # The tail of the prefix is evicted, so the blocks kept are all reachable
+    assert cache.lookup(PREFIX)[0] == 3 * 8
+
+
+@pytest.mark.pytorch
+def test_shared_prefix_outlives_branches(tiny_model):
+    """A block used by several prompts is evicted after the blocks that extend it."""
+    cache = PrefixCache(max_bytes=10 ** 7, block_size=8)
+    generate_cached(tiny_model, PREFIX[:8], "cpu", 2, cache)
+    block_bytes = cache.bytes
+
+    cache = PrefixCache(max_bytes=3 * block_bytes, block_size=8)
+    for branch in (list(range(100, 108)), list(range(200, 208)), list(range(300, 308))):
+        generate_cached(tiny_model, PREFIX[:8] + branch + [5], "cpu", 2, cache)
+    assert cache.lookup(PREFIX[:8] + [7])[0] == 8
+    assert cache.lookup(PREFIX[:8] + list(range(300, 308)) + [5])[0] == 16
+
+
+@pytest.mark.pytorch
+def test_benchmark(tiny_model, tiny_tokenizer):
+    preamble = "You are a careful assistant. Answer briefly and cite facts. " * 3
+    prompts = [preamble + f"Question {i}?" for i in range(4)]
+    result = benchmark_prefix_cache(tiny_model, tiny_tokenizer, prompts, "cpu", 10 ** 7, block_size=8, max_new_tokens=4)
+    assert result['identical']
+    assert result['hit_rate'] == 0.75
+    assert result['cached_token_fraction'] > 0.5
@@ -0,0 +1,87 @@
+"""Tests for quantized CPU inference."""
+import copy
+
+import pytest
+
+try:
+    import torch
+    from quantization import Int4Linear, model_size_bytes, quantize_model
+except ImportError as e:
+    pytest.skip(f"quantization not available: {e}", allow_module_level=True)
+
+pytestmark = pytest.mark.filterwarnings("ignore::DeprecationWarning", "ignore::UserWarning")
+
+
+@pytest.mark.pytorch
+class TestInt4Linear:
+    """Test the packed int4 layer against its dequantized weights."""
+
+    def test_close_to_fp32(self):
+        torch.manual_seed(0)
+        linear = torch.nn.Linear(64, 32)
+        quantized = Int4Linear(linear, group_size=32)
+        x = torch.randn(2, 5, 64)
+        with torch.no_grad():
+            out = quantized(x)
+            expected = linear(x)
+        assert out.shape == (2, 5, 32)
+        assert out.dtype == torch.float32
+        assert (out - expected).abs().max() < 0.1 * expected.abs().max()
+
+    def test_supported_shapes(self):
+        assert Int4Linear.supports(torch.nn.Linear(64, 32), 32)
+        assert not Int4Linear.supports(torch.nn.Linear(48, 32), 32)
+        assert not Int4Linear.supports(torch.nn.Linear(64, 8), 32)
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("mode", ["int8", "int4"])
+def test_quantized_model_close_to_fp32(tiny_model, mode):
+    """Quantized logits stay close to fp32 and the weights shrink."""
+    quantized = quantize_model(copy.deepcopy(tiny_model), mode, group_size=32)
+    input_ids = torch.arange(3, 23).unsqueeze(0)
+    with torch.no_grad():
+        expected = tiny_model(input_ids=input_ids).logits
+        logits = quantized(input_ids=input_ids).logits
+    assert torch.allclose(logits, expected, atol=0.1)
+    assert model_size_bytes(quantized) < model_size_bytes(tiny_model)
+
+
+@pytest.mark.pytorch
+def test_int4_keeps_lm_head(tiny_model):
+    quantized = quantize_model(copy.deepcopy(tiny_model), "int4", group_size=32)
+    assert isinstance(quantized.get_output_embeddings(), torch.nn.Linear)
+    assert isinstance(quantized.model.layers[0].mlp.up_proj, Int4Linear)
+
+
+@pytest.mark.pytorch
+def test_invalid_mode(tiny_model):
+    with pytest.raises(ValueError):
+        quantize_model(tiny_model, "int2")
+    with pytest.raises(ValueError):
+        quantize_model(copy.deepcopy(tiny_model), "int4", group_size=256)
+
+
+@pytest.mark.pytorch
+def test_model_size_counts_tied_weights_once(tiny_model):
+    tied = copy.deepcopy(tiny_model)
+    tied.lm_head.weight = tied.model.embed_tokens.weight
+    untied = model_size_bytes(tiny_model)
+    embedding = tiny_model.model.embed_tokens.weight
+    assert model_size_bytes(tied) == untied - embedding.numel() * embedding.element_size()
+
+
+@pytest.mark.pytorch
+def test_benchmark_reports_every_mode(tiny_model, tiny_tokenizer):
+    from benchmark_quantization import benchmark_quantization
+
+    token_ids = [tiny_tokenizer("the quick brown fox jumps over the lazy dog")['input_ids']] * 3
+    results = benchmark_quantization(tiny_model, tiny_tokenizer, token_ids, max_length=32, new_tokens=4, group_size=32)
+    assert list(results) == ['fp32', 'int8', 'int4']
+    assert results['fp32']['perplexity_delta'] == 0.0
+    for mode in ('int8', 'int4'):
+        result = results[mode]
+        assert result['model_bytes'] < results['fp32']['model_bytes']
+        assert result['perplexity_delta'] == pytest.approx(result['perplexity'] - results['fp32']['perplexity'])
+        assert result['score_tokens_per_second'] > 0
+        assert result['decode_tokens_per_second'] > 0
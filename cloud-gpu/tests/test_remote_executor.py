@@ -2,7 +2,7 @@
 import pytest
 
 try:
-    from remote_executor import RemoteExecutor
+    from remote_executor import RemoteExecutor, parse_report_line
 except ImportError as e:
     pytest.skip(f"remote_executor not available: {e}", allow_module_level=True)
 
@@ -93,3 +93,63 @@ class TestRemoteExecutor:
     # Note: We can't test actual SSH connections without a real server,
     # but we can test the structure and error handling
 
+
+    def test_execute_command_streaming(self):
+        """Test that output lines reach the callback as they are read."""
+        class _Channel:
+            def recv_exit_status(self):
+                return 0
+        
+        class _Stdout:
+            channel = _Channel()
+            
+            def __iter__(self):
+                return iter(["Loading model...\n", '[REPORT] {"event": "progress", "done": 10}\n'])
+        
+        class _Stderr:
+            def read(self):
+                return b""
+        
+        class _Client:
+            def exec_command(self, command, timeout=None):
+                self.command = command
+                return None, _Stdout(), _Stderr()
+        
+        executor = RemoteExecutor(host="192.168.1.100")
+        executor._ssh_client = _Client()
+        seen = []
+        output, error, status = executor.execute_command_streaming("python script.py", seen.append)
+        assert status == 0
+        assert seen == ["Loading model...", '[REPORT] {"event": "progress", "done": 10}']
+        assert output == "\n".join(seen)
+        assert executor._ssh_client.command.endswith("python script.py")
+    
+    def test_open_channel(self):
+        """Test forwarding a connection to a remote loopback port."""
+        class _Transport:
+            def open_channel(self, kind, dest_addr, src_addr):
+                self.opened = (kind, dest_addr)
+                return "channel"
+        
+        class _Client:
+            transport = _Transport()
+            
+            def get_transport(self):
+                return self.transport
+        
+        executor = RemoteExecutor(host="192.168.1.100")
+        executor._ssh_client = _Client()
+        assert executor.open_channel(8765) == "channel"
+        assert executor._ssh_client.transport.opened == ("direct-tcpip", ("127.0.0.1", 8765))
+
+
+class TestParseReportLine:
+    """Test parsing [REPORT] lines from remote scripts."""
+    
+    def test_report_line(self):
+        event = parse_report_line('[REPORT] {"event": "summary", "total_seconds": 1.5}\n')
+        assert event == {"event": "summary", "total_seconds": 1.5}
+    
+    def test_other_lines(self):
+        assert parse_report_line("  [OK] Model loaded") is None
+        assert parse_report_line("[REPORT] not json") is None
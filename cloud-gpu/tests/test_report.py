@@ -0,0 +1,85 @@
+"""Tests for structured performance reports."""
+import json
+
+import pytest
+
+try:
+    import report as report_module
+    from report import REPORT_PREFIX, PerfReport
+except ImportError as e:
+    pytest.skip(f"report not available: {e}", allow_module_level=True)
+
+
+class _Clock:
+    """Stand-in for time.perf_counter that only moves when told to."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(report_module.time, "perf_counter", clock)
+    return clock
+
+
+def _report_lines(output):
+    return [json.loads(line[len(REPORT_PREFIX):]) for line in output.splitlines() if line.startswith(REPORT_PREFIX)]
+
+
+def test_stages_accumulate(clock):
+    report = PerfReport("test")
+    with report.stage("model_load"):
+        clock.now += 2.0
+    with report.stage("model_load"):
+        clock.now += 1.0
+    assert report.stages == {"model_load": 3.0}
+
+
+def test_progress_rates_and_eta(clock):
+    report = PerfReport("test")
+    report.start_progress(done=5, tokens=500)
+    clock.now += 10.0
+    report.progress(15, 25, 1500)
+    clock.now += 5.0
+    report.progress(20, 25, 2500)
+
+    first, second = report.throughput
+    assert first["tokens_per_second"] == 100.0
+    assert first["eta_seconds"] == 10.0
+    assert second["tokens_per_second"] == 200.0
+    assert second["mean_tokens_per_second"] == pytest.approx(2000 / 15, abs=0.1)
+    assert second["eta_seconds"] == 5.0
+
+
+def test_lines_only_when_enabled(clock, capsys):
+    PerfReport("quiet").progress(1, 2, 10)
+    assert _report_lines(capsys.readouterr().out) == []
+
+    PerfReport("loud", emit=True).progress(1, 2, 10)
+    (event,) = _report_lines(capsys.readouterr().out)
+    assert event["event"] == "progress"
+    assert event["script"] == "loud"
+
+
+def test_finish_writes_summary(clock, tmp_path, capsys):
+    path = tmp_path / "reports" / "run.json"
+    report = PerfReport("test", str(path))
+    with report.stage("forward"):
+        clock.now += 4.0
+    report.progress(1, 1, 10)
+    summary = report.finish(perplexity=12.5, padding_efficiency=0.9)
+
+    assert json.loads(path.read_text()) == summary
+    assert summary["stages"] == {"forward": 4.0}
+    assert summary["metrics"] == {"perplexity": 12.5, "padding_efficiency": 0.9}
+    assert summary["peak_host_bytes"] > 0
+    assert len(summary["throughput"]) == 1
+
+    events = _report_lines(capsys.readouterr().out)
+    assert [event["event"] for event in events] == ["progress", "summary"]
+    assert "throughput" not in events[-1]
@@ -0,0 +1,98 @@
+"""Tests for the evaluation result cache."""
+import os
+
+import pytest
+
+from result_cache import HUB_TIMEOUT_SECONDS, ResultCache, model_revision, source_fingerprint
+
+INPUTS = {'model': 'tiny', 'revision': 'abc', 'max_length': 512, 'stride': None}
+METRICS = {'perplexity': 12.5, 'avg_loss': 2.5257, 'total_tokens': 1000, 'elapsed_seconds': 3.0}
+
+
+class TestResultCache:
+    """Test storing and looking up results."""
+
+    def test_key_depends_on_every_input(self):
+        cache = ResultCache("unused")
+        assert cache.key(INPUTS) == cache.key(dict(reversed(list(INPUTS.items()))))
+        for name in INPUTS:
+            assert cache.key(dict(INPUTS, **{name: 'changed'})) != cache.key(INPUTS)
+
+    def test_round_trip(self, tmp_path):
+        cache = ResultCache(str(tmp_path))
+        key = cache.key(INPUTS)
+        assert cache.load(key) is None
+        cache.store(key, METRICS, INPUTS)
+        entry = cache.load(key)
+        assert entry['metrics'] == METRICS
+        assert entry['inputs'] == INPUTS
+        assert not [name for name in os.listdir(tmp_path) if '.tmp' in name]
+
+    def test_token_losses_restored(self, tmp_path):
+        source = tmp_path / "run"
+        for suffix, data in (('.f16', b'\x01\x02'), ('.idx.npy', b'idx'), ('.json', b'{}')):
+            (tmp_path / f"run{suffix}").write_bytes(data)
+        cache = ResultCache(str(tmp_path / "cache"))
+        key = cache.key(INPUTS)
+        cache.store(key, METRICS, INPUTS, token_losses_path=str(source))
+
+        target = tmp_path / "out" / "restored"
+        assert cache.load(key, token_losses_path=str(target)) is not None
+        assert (tmp_path / "out" / "restored.f16").read_bytes() == b'\x01\x02'
+
+    def test_missing_token_losses_is_a_miss(self, tmp_path):
+        cache = ResultCache(str(tmp_path))
+        key = cache.key(INPUTS)
+        cache.store(key, METRICS, INPUTS)
+        assert cache.load(key, token_losses_path=str(tmp_path / "losses")) is None
+
+
+def test_local_model_revision_tracks_files(tmp_path):
+    (tmp_path / "config.json").write_text("{}")
+    first = model_revision(str(tmp_path))
+    assert first == model_revision(str(tmp_path))
+    (tmp_path / "model.safetensors").write_bytes(b'weights')
+    assert model_revision(str(tmp_path)) != first
+
+
+def test_hub_model_revision_offline(tmp_path, monkeypatch):
+    """Offline, the revision comes from the local HF cache without asking the Hub."""
+    huggingface_hub = pytest.importorskip("huggingface_hub")
+    from huggingface_hub import constants
+    calls = []
+    monkeypatch.setattr(huggingface_hub.HfApi, "model_info", lambda self, *args, **kwargs: calls.append(args))
+    monkeypatch.setattr(constants, "HF_HUB_CACHE", str(tmp_path))
+    monkeypatch.setattr(constants, "HF_HUB_OFFLINE", True)
+    ref = tmp_path / "models--org--model" / "refs" / "main"
+    ref.parent.mkdir(parents=True)
+    ref.write_text("abc123\n")
+    assert model_revision("org/model") == "abc123"
+    assert model_revision("org/other") is None
+    assert calls == []
+
+
+def test_hub_model_revision_falls_back_to_cache(tmp_path, monkeypatch):
+    """The Hub is asked with a short timeout; when it does not answer, the local cache is used."""
+    huggingface_hub = pytest.importorskip("huggingface_hub")
+    from huggingface_hub import constants
+    timeouts = []
+
+    def _unreachable(self, repo_id, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        raise TimeoutError(repo_id)
+
+    monkeypatch.setattr(huggingface_hub.HfApi, "model_info", _unreachable)
+    monkeypatch.setattr(constants, "HF_HUB_CACHE", str(tmp_path))
+    monkeypatch.setattr(constants, "HF_HUB_OFFLINE", False)
+    ref = tmp_path / "models--org--model" / "refs" / "main"
+    ref.parent.mkdir(parents=True)
+    ref.write_text("abc123")
+    assert model_revision("org/model") == "abc123"
+    assert timeouts == [HUB_TIMEOUT_SECONDS]
+
+
+def test_source_fingerprint_tracks_scripts(tmp_path):
+    (tmp_path / "script.py").write_text("x = 1\n")
+    first = source_fingerprint(str(tmp_path))
+    (tmp_path / "script.py").write_text("x = 2\n")
+    assert source_fingerprint(str(tmp_path)) != first
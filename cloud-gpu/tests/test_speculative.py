@@ -0,0 +1,89 @@
+"""Tests for speculative decoding."""
+import copy
+
+import pytest
+
+try:
+    import torch
+    import speculative as sp
+except ImportError as e:
+    pytest.skip(f"speculative decoding not available: {e}", allow_module_level=True)
+
+PROMPT = [5, 9, 33, 100, 7]
+
+
+@pytest.fixture(scope="module")
+def draft(tiny_model):
+    """A perturbed copy of the target model: agrees on some tokens, not all."""
+    draft = copy.deepcopy(tiny_model)
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        for parameter in draft.parameters():
+            parameter.add_(torch.randn(parameter.shape, generator=generator) * 0.01)
+    return draft
+
+
+def _reference(model, new_tokens):
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([PROMPT]), max_new_tokens=new_tokens, min_new_tokens=new_tokens,
+            do_sample=False, pad_token_id=0,
+        )
+    return output[0, len(PROMPT):].tolist()
+
+
+@pytest.mark.pytorch
+@pytest.mark.parametrize("num_draft_tokens", [1, 4])
+@pytest.mark.parametrize("new_tokens", [1, 25])
+def test_identical_to_greedy(tiny_model, draft, num_draft_tokens, new_tokens):
+    result = sp.speculative_generate(tiny_model, draft, PROMPT, new_tokens, "cpu", num_draft_tokens)
+    assert result['tokens'] == _reference(tiny_model, new_tokens)
+    assert 0.0 <= result['acceptance_rate'] <= 1.0
+
+
+@pytest.mark.pytorch
+def test_perfect_draft(tiny_model):
+    """A draft that always agrees is fully accepted, k + 1 tokens per target step."""
+    result = sp.speculative_generate(tiny_model, tiny_model, PROMPT, 25, "cpu", num_draft_tokens=4)
+    assert result['acceptance_rate'] == 1.0
+    assert result['target_steps'] == 5
+
+
+@pytest.mark.pytorch
+def test_stops_at_eos(tiny_model, draft):
+    expected = _reference(tiny_model, 25)
+    eos = expected[10]
+    result = sp.speculative_generate(tiny_model, draft, PROMPT, 25, "cpu", 4, eos_token_ids=[eos])
+    assert result['tokens'] == expected[:expected.index(eos) + 1]
+
+
+@pytest.mark.pytorch
+def test_compare_speculative(tiny_model, draft):
+    result = sp.compare_speculative(tiny_model, draft, PROMPT, 12, "cpu", num_draft_tokens=3)
+    assert result['identical']
+    assert result['speedup'] > 0
+
+
+def test_truncate_cache():
+    from transformers import DynamicCache
+    keys = torch.randn(1, 2, 6, 4)
+    cache = DynamicCache(ddp_cache_data=[(keys, -keys)])
+    sp.truncate_cache(cache, 4)
+    assert cache.get_seq_length() == 4
+    assert torch.equal(cache.layers[0].keys, keys[..., :4, :])
+
+
+class TestResolveDraftModel:
+    """Test picking draft models from MODEL_PAIRS."""
+
+    def test_explicit(self):
+        assert sp.resolve_draft_model("Qwen/Qwen2.5-7B", "my/draft") == "my/draft"
+
+    def test_auto(self):
+        if sp.get_draft_model is None:
+            pytest.skip("model-library not available")
+        assert sp.resolve_draft_model("Qwen/Qwen2.5-7B") == "Qwen/Qwen2.5-0.5B"
+        assert sp.resolve_draft_model("Qwen/Qwen2.5-7B-Instruct") == "Qwen/Qwen2.5-0.5B-Instruct"
+        assert sp.resolve_draft_model("meta-llama/Llama-3.1-70B") == "meta-llama/Llama-3.1-8B"
+        with pytest.raises(ValueError):
+            sp.resolve_draft_model("Qwen/Qwen2.5-0.5B")
@@ -0,0 +1,70 @@
+"""Tests for streaming dataset input."""
+import json
+
+import pytest
+
+try:
+    from streaming import iter_file_texts, iter_token_chunks
+except ImportError as e:
+    pytest.skip(f"streaming not available: {e}", allow_module_level=True)
+
+
+class _CharTokenizer:
+    """One token per character."""
+
+    def __call__(self, texts):
+        return {'input_ids': [[ord(c) for c in text] for text in texts]}
+
+
+def _counting(texts, consumed):
+    for text in texts:
+        consumed.append(text)
+        yield text
+
+
+class TestIterFileTexts:
+    """Test reading documents from local files."""
+
+    def test_plain_text_one_document_per_line(self, tmp_path):
+        """Every line is a document, empty lines included."""
+        path = tmp_path / "data.txt"
+        path.write_text("first\n\nthird\n")
+        assert list(iter_file_texts(str(path))) == ["first", "", "third"]
+
+    def test_jsonl_text_or_content(self, tmp_path):
+        """JSON lines use the text field, falling back to content."""
+        path = tmp_path / "data.jsonl"
+        path.write_text(json.dumps({'text': "a"}) + "\n\n" + json.dumps({'content': "b"}) + "\n")
+        assert list(iter_file_texts(str(path))) == ["a", "b"]
+
+
+class TestIterTokenChunks:
+    """Test lazy chunked tokenization with budgets."""
+
+    def test_chunks_cover_all_documents(self):
+        """Without budgets every document is yielded once, in order."""
+        texts = [f"doc{i}" for i in range(7)]
+        chunks = list(iter_token_chunks(_CharTokenizer(), iter(texts), chunk_size=3))
+        assert [len(c) for c in chunks] == [3, 3, 1]
+        assert [ids for c in chunks for ids in c] == _CharTokenizer()(texts)['input_ids']
+
+    def test_sample_budget_stops_reading(self):
+        """The source is not read past the sample budget."""
+        consumed = []
+        source = _counting((f"doc{i}" for i in range(10 ** 6)), consumed)
+        chunks = list(iter_token_chunks(_CharTokenizer(), source, chunk_size=4, max_samples=6))
+        assert sum(len(c) for c in chunks) == 6
+        assert len(consumed) == 6
+
+    def test_token_budget_cuts_at_document(self):
+        """Reading stops with the document that reaches the token budget."""
+        consumed = []
+        source = _counting(("abcd" for _ in range(10 ** 6)), consumed)
+        chunks = list(iter_token_chunks(_CharTokenizer(), source, chunk_size=4, max_tokens=10))
+        assert sum(len(ids) for c in chunks for ids in c) == 12
+        assert len(consumed) <= 8
+
+    def test_invalid_chunk_size(self):
+        """Chunk size must be positive."""
+        with pytest.raises(ValueError):
+            next(iter_token_chunks(_CharTokenizer(), iter(["a"]), chunk_size=0))
@@ -0,0 +1,88 @@
+"""Tests for the multi-model perplexity sweep."""
+import pytest
+
+try:
+    import torch
+    import sweep
+except ImportError as e:
+    pytest.skip(f"sweep not available: {e}", allow_module_level=True)
+
+TEXTS = [
+    "the quick brown fox jumps over the lazy dog",
+    "",
+    "perplexity is the exponential of the average negative log likelihood",
+]
+DATASET = {'dataset_name': 'tiny', 'dataset_config': 'tiny', 'split': 'test', 'max_samples': 10}
+
+
+@pytest.fixture
+def tokenizations(monkeypatch):
+    """Count dataset loads (one per tokenization)."""
+    import calculate_perplexity as cp
+    calls = []
+
+    def _load_texts(*args):
+        calls.append(args)
+        return TEXTS
+    monkeypatch.setattr(cp, "load_texts", _load_texts)
+    return calls
+
+
+@pytest.mark.pytorch
+def test_shared_tokenizer_tokenized_once(tiny_model_dir, tokenizations):
+    rows = sweep.run_sweep([tiny_model_dir, tiny_model_dir], DATASET, device="cpu", token_cache_dir=None)
+    assert len(tokenizations) == 1
+    assert rows[0]['tokenizer'] == rows[1]['tokenizer']
+    assert rows[0]['perplexity'] == pytest.approx(rows[1]['perplexity'])
+    assert not rows[0]['prefetched'] and rows[1]['prefetched']
+    for row in rows:
+        assert 'error' not in row
+        assert row['tokens'] > 0 and row['eval_seconds'] > 0
+
+
+@pytest.mark.pytorch
+def test_large_model_loaded_by_load_model(tiny_model_dir, tokenizations, monkeypatch):
+    """A model that does not fit for prefetching is loaded by load_model once the previous one is freed."""
+    loads = []
+    original = sweep.load_model
+
+    def _load_model(model_name, device=None):
+        loads.append(device)
+        return original(model_name, device=device)
+
+    monkeypatch.setattr(sweep, "load_model", _load_model)
+    monkeypatch.setattr(sweep, "estimate_model_bytes", lambda *args: 10 ** 15)
+    rows = sweep.run_sweep([tiny_model_dir, tiny_model_dir], DATASET, token_cache_dir=None)
+    assert loads == [None, None]
+    assert not rows[1]['prefetched'] and 'error' not in rows[1]
+
+
+@pytest.mark.pytorch
+def test_failed_model_does_not_stop_sweep(tiny_model_dir, tmp_path, tokenizations):
+    missing = str(tmp_path / "missing")
+    rows = sweep.run_sweep([missing, tiny_model_dir], DATASET, device="cpu", token_cache_dir=None, prefetch=False)
+    assert rows[0]['error'].startswith("model:")
+    assert 'error' not in rows[1] and not rows[1]['prefetched']
+    table = sweep.format_table(rows)
+    assert "[ERROR]" in table.splitlines()[1]
+    assert f"{rows[1]['perplexity']:.4f}" in table.splitlines()[2]
+
+
+def test_estimate_model_bytes(tiny_model_dir):
+    import os
+    assert sweep.estimate_model_bytes(tiny_model_dir, 4) == os.path.getsize(os.path.join(tiny_model_dir, "model.safetensors"))
+    if sweep.estimate_memory_requirements is None:
+        pytest.skip("model-library not available")
+    assert sweep.estimate_model_bytes("Qwen/Qwen2.5-7B", 2) == 14 * 10 ** 9
+    assert sweep.estimate_model_bytes("unknown/model", 2) is None
+
+
+def test_select_models():
+    if sweep.filter_by_family is None:
+        pytest.skip("model-library not available")
+    models = sweep.select_models("Qwen", max_size="1.5B", include_instruct=True)
+    assert models == [
+        "Qwen/Qwen2.5-0.5B", "Qwen/Qwen2.5-0.5B-Instruct",
+        "Qwen/Qwen2.5-1.5B", "Qwen/Qwen2.5-1.5B-Instruct",
+        "Qwen/Qwen2.5-Math-1.5B", "Qwen/Qwen2.5-Math-1.5B-Instruct",
+    ]
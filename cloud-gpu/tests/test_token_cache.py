@@ -0,0 +1,83 @@
+"""Tests for the pre-tokenized dataset cache."""
+import copy
+
+import pytest
+
+try:
+    import numpy as np
+    from transformers import AutoTokenizer
+    from token_cache import TokenCache, tokenizer_fingerprint
+except ImportError as e:
+    pytest.skip(f"token_cache dependencies not available: {e}", allow_module_level=True)
+
+
+TEXTS = ["the quick brown fox", "", "jumps over the lazy dog"]
+IDENTITY = {'dataset_name': 'wikitext', 'dataset_config': 'wikitext-2-raw-v1', 'split': 'test', 'max_samples': 3}
+
+
+@pytest.fixture
+def tokenizer(tiny_tokenizer):
+    """Tiny test tokenizer, copied as tests set padding on it."""
+    return copy.deepcopy(tiny_tokenizer)
+
+
+class TestTokenCache:
+    """Test TokenCache store/load behaviour."""
+
+    def test_roundtrip(self, tokenizer, tmp_path):
+        """Cached documents match a fresh tokenization."""
+        cache = TokenCache(str(tmp_path))
+        dataset = cache.get_or_create(tokenizer, IDENTITY, lambda: TEXTS)
+
+        expected = tokenizer(TEXTS)['input_ids']
+        assert len(dataset) == len(TEXTS)
+        assert [doc.tolist() for doc in dataset] == expected
+        assert dataset.num_tokens == sum(len(ids) for ids in expected)
+        assert dataset.lengths().tolist() == [len(ids) for ids in expected]
+
+    def test_hit_skips_loading(self, tokenizer, tmp_path):
+        """A second lookup is served from disk without loading texts."""
+        cache = TokenCache(str(tmp_path))
+        cache.get_or_create(tokenizer, IDENTITY, lambda: TEXTS)
+
+        def _fail():
+            raise AssertionError("texts should not be reloaded on a cache hit")
+
+        dataset = cache.get_or_create(tokenizer, IDENTITY, _fail)
+        assert isinstance(dataset.tokens, np.memmap)
+        assert dataset[0].tolist() == tokenizer(TEXTS[0])['input_ids']
+
+    def test_dataset_identity_in_key(self, tokenizer, tmp_path):
+        """Different datasets get different entries."""
+        cache = TokenCache(str(tmp_path))
+        other = dict(IDENTITY, split='validation')
+        assert cache.key(tokenizer, IDENTITY) != cache.key(tokenizer, other)
+
+    def test_failed_load_not_cached(self, tokenizer, tmp_path):
+        """A dataset that fails to load is not cached."""
+        cache = TokenCache(str(tmp_path))
+        assert cache.get_or_create(tokenizer, IDENTITY, lambda: None) is None
+        assert cache.load(cache.key(tokenizer, IDENTITY)) is None
+
+
+class TestTokenizerFingerprint:
+    """Test tokenizer fingerprinting."""
+
+    def test_stable_across_loads(self, tiny_model_dir):
+        """Reloading the same tokenizer gives the same fingerprint."""
+        first = AutoTokenizer.from_pretrained(tiny_model_dir)
+        second = AutoTokenizer.from_pretrained(tiny_model_dir)
+        assert tokenizer_fingerprint(first) == tokenizer_fingerprint(second)
+
+    def test_ignores_runtime_padding(self, tokenizer):
+        """Padding/truncation state set while batching does not change the fingerprint."""
+        before = tokenizer_fingerprint(tokenizer)
+        tokenizer.pad_token = tokenizer.eos_token
+        tokenizer(TEXTS, padding=True, truncation=True, max_length=4)
+        assert tokenizer_fingerprint(tokenizer) == before
+
+    def test_vocabulary_change(self, tokenizer):
+        """Adding a token changes the fingerprint."""
+        before = tokenizer_fingerprint(tokenizer)
+        tokenizer.add_tokens(["<new_token>"])
+        assert tokenizer_fingerprint(tokenizer) != before
@@ -0,0 +1,60 @@
+"""Tests for per-token loss files."""
+import math
+import pytest
+
+try:
+    import numpy as np
+    from token_losses import TokenLosses, TokenLossWriter, offsets_from_lengths
+except ImportError as e:
+    pytest.skip(f"token_losses dependencies not available: {e}", allow_module_level=True)
+
+
+def _write(path, lengths=(3, 0, 4)):
+    """Write a small loss file: doc 0 scores positions 1-2, doc 2 positions 1-3."""
+    offsets = offsets_from_lengths(lengths)
+    with TokenLossWriter(path, offsets, metadata={'model': 'tiny'}) as writer:
+        writer.write_document(0, 1, np.array([1.0, 2.0]))
+        writer.write(np.array([2, 2, 2]), np.array([1, 2, 3]), np.array([3.0, 4.0, 5.0]))
+    return offsets
+
+
+class TestTokenLosses:
+    """Test writing and reading per-token losses."""
+
+    def test_offsets_from_lengths(self):
+        """Offsets are the running sum of document lengths."""
+        assert offsets_from_lengths([3, 0, 4]).tolist() == [0, 3, 3, 7]
+
+    def test_layout_matches_offsets(self, tmp_path):
+        """Losses land at offsets[doc] + position; unscored tokens are NaN."""
+        path = str(tmp_path / "losses")
+        _write(path)
+        losses = TokenLosses(path)
+
+        assert len(losses) == 3
+        assert np.isnan(losses.document(0)[0])
+        assert losses.document(0)[1:].tolist() == [1.0, 2.0]
+        assert len(losses.document(1)) == 0
+        assert losses.document(2)[1:].tolist() == [3.0, 4.0, 5.0]
+        assert losses.metadata['model'] == 'tiny'
+        assert losses.metadata['scored_tokens'] == 5
+
+    def test_perplexity_subsets(self, tmp_path):
+        """Perplexity can be recomputed for documents and position ranges."""
+        path = str(tmp_path / "losses")
+        _write(path)
+        losses = TokenLosses(path)
+
+        overall = losses.perplexity(chunk_size=2)
+        assert overall['tokens'] == 5
+        assert overall['avg_loss'] == pytest.approx(3.0)
+        assert overall['perplexity'] == pytest.approx(math.exp(3.0))
+
+        assert losses.perplexity(documents=[2])['avg_loss'] == pytest.approx(4.0)
+        assert losses.perplexity(positions=(2, 3))['avg_loss'] == pytest.approx(3.0)
+
+    def test_empty_selection(self, tmp_path):
+        """Selecting no scored tokens gives infinite perplexity."""
+        path = str(tmp_path / "losses")
+        _write(path)
+        assert TokenLosses(path).perplexity(documents=[1])['tokens'] == 0
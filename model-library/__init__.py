@@ -6,6 +6,7 @@ from .models import (
     get_instruct_model,
     get_base_model,
     get_model_pair,
+    get_draft_model,
     filter_by_size,
     filter_by_family,
     get_model_info,
@@ -18,6 +19,7 @@ __all__ = [
     'get_instruct_model',
     'get_base_model',
     'get_model_pair',
+    'get_draft_model',
     'filter_by_size',
     'filter_by_family',
     'get_model_info',
@@ -66,6 +66,37 @@ def get_model_pair(base_model: str) -> tuple:
     return None
 
 
+def get_draft_model(model_name: str) -> str:
+    """
+    Get the smallest same-series model to draft tokens for speculative decoding.
+    
+    Models of a series differ only in size (e.g. Qwen/Qwen2.5-0.5B and
+    Qwen/Qwen2.5-7B) and share a tokenizer. Instruct models are drafted by
+    instruct models and base models by base models.
+    
+    Returns:
+        Draft model name, or None if the series has no smaller model
+    """
+    import re
+    size_pattern = r'(\d+\.?\d*)[Bb]'
+    match = re.search(size_pattern, model_name)
+    if not match:
+        return None
+    series = re.sub(size_pattern, '{size}', model_name, count=1)
+    
+    candidates = []
+    for name in get_base_models() + get_instruct_models():
+        candidate = re.search(size_pattern, name)
+        if candidate and re.sub(size_pattern, '{size}', name, count=1) == series:
+            candidates.append((float(candidate.group(1)), name))
+    if not candidates:
+        return None
+    smallest_size, smallest = min(candidates)
+    if smallest_size >= float(match.group(1)):
+        return None
+    return smallest
+
+
 def filter_by_size(max_size: str = None, min_size: str = None):
     """
     Filter models by size.
@@ -7,13 +7,125 @@ Perplexity calculation requires:
 2. Running inference on evaluation dataset
 3. Calculating log probabilities
 4. Aggregating results
+
+Estimates are rules of thumb unless a calibration file measured on the
+target hardware exists (written by
+``cloud-gpu/remote_scripts/benchmark_requirements.py``). Then its
+per-hardware, per-dtype coefficients replace the tokens/sec tiers and
+correct the memory totals for the hardware asked for, or for the
+hardware of this machine; see load_calibration.
 """
+import functools
+import json
+import platform
+import subprocess
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from models import MODEL_PAIRS, get_model_info
 
-def estimate_memory_requirements(model_name: str, batch_size: int = 8, seq_length: int = 512):
+DEFAULT_CALIBRATION_PATH = os.environ.get(
+    "PERPLEXITY_CALIBRATION",
+    os.path.expanduser("~/.cache/transformer-questions/calibration.json")
+)
+
+def cpu_hardware_name():
+    """
+    Name CPU calibrations are stored under: the CPU model and core count,
+    as benchmark_requirements.hardware_name writes it.
+    """
+    processor = platform.processor() or platform.machine()
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    processor = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"CPU {processor} x{os.cpu_count()}"
+
+@functools.lru_cache(maxsize=None)
+def local_hardware_names():
+    """
+    Names of this machine's hardware, as calibrations are stored: the GPU
+    models if there are GPUs, otherwise the CPU.
+    
+    GPUs are found through torch when it is already imported, and through
+    nvidia-smi otherwise, so the estimator does not import torch itself.
+    The hardware does not change while the process runs, so the names are
+    looked up once.
+    """
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        if torch.cuda.is_available():
+            return tuple(torch.cuda.get_device_name(i) for i in range(torch.cuda.device_count()))
+    else:
+        try:
+            result = subprocess.run(
+                ['nvidia-smi', '--query-gpu=name', '--format=csv,noheader'],
+                capture_output=True, text=True, timeout=10
+            )
+            gpus = [line.strip() for line in result.stdout.splitlines() if line.strip()]
+            if result.returncode == 0 and gpus:
+                return tuple(gpus)
+        except (OSError, subprocess.SubprocessError):
+            pass
+    return (cpu_hardware_name(),)
+
+@functools.lru_cache(maxsize=8)
+def _read_calibration(path: str, mtime_ns: int):
+    """Parsed calibration file; the modification time keys out stale copies once it is rewritten."""
+    with open(path) as f:
+        return json.load(f)
+
+def load_calibration(hardware: str = None, path: str = None):
+    """
+    Load measured correction coefficients for one hardware.
+    
+    The calibration file maps hardware names (e.g. "NVIDIA A100-SXM4-80GB")
+    to per-dtype coefficients:
+    - forward_overhead_seconds, seconds_per_token_per_b: seconds per
+      batch = overhead + tokens in the batch * billions of parameters * rate
+    - weights_scale, activation_scale, overhead_gb: peak memory =
+      weights * weights_scale + (activations + KV cache) * activation_scale
+      + overhead_gb
+    
+    Args:
+        hardware: Hardware name, or a case-insensitive part of one (e.g.
+            "A100"); None uses the calibration of this machine's hardware
+            (see local_hardware_names), if there is one
+        path: Calibration file (default: DEFAULT_CALIBRATION_PATH)
+    
+    Returns:
+        Tuple of (hardware name, {dtype: coefficients}), or (None, {}) if
+        no calibration applies
+    """
+    path = path or DEFAULT_CALIBRATION_PATH
+    try:
+        calibration = _read_calibration(path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        return None, {}
+    
+    if hardware is None:
+        matches = [name for name in local_hardware_names() if name in calibration][:1]
+    elif hardware in calibration:
+        matches = [hardware]
+    else:
+        matches = [name for name in calibration if hardware.lower() in name.lower()]
+    if len(matches) != 1:
+        return None, {}
+    return matches[0], calibration[matches[0]]
+
+def _dtype_coefficients(coefficients: dict, dtypes):
+    """Coefficients of the first calibrated dtype among `dtypes`."""
+    for dtype in dtypes:
+        if dtype in coefficients:
+            return coefficients[dtype]
+    return None
+
+def estimate_memory_requirements(model_name: str, batch_size: int = 8, seq_length: int = 512,
+                                 size_b: float = None, hardware: str = None, calibration_path: str = None):
     """
     Estimate memory requirements for perplexity evaluation.
     
@@ -24,17 +136,26 @@ def estimate_memory_requirements(model_name: str, batch_size: int = 8, seq_lengt
     - Activations: batch_size * seq_length * hidden_size * num_layers * 2 bytes
     - KV cache: batch_size * seq_length * hidden_size * num_layers * 2 * 2 bytes
     - Batch data: batch_size * seq_length * 4 bytes (tokens)
+    
+    With a calibration for `hardware` (see load_calibration), the totals
+    are corrected with coefficients fitted to measured peak memory. The
+    fits_a100_* flags only use corrected totals when the calibration is
+    for an A100; otherwise they stay on the rules of thumb.
+    
+    Args:
+        size_b: Billions of parameters, if not in the model name
     """
     info = get_model_info(model_name)
     
-    if not info['size']:
+    if not size_b and not info['size']:
         return {
             'model': model_name,
             'size': 'Unknown',
             'note': 'Cannot estimate - check HuggingFace for model size'
         }
     
-    size_b = info['size']  # Billions of parameters
+    size_b = size_b or info['size']  # Billions of parameters
+    size_str = info['size_str'] or f"{size_b:g}B"
     
     # Memory estimates (in GB)
     # Using FP16/BF16 (common for inference)
@@ -61,10 +182,27 @@ def estimate_memory_requirements(model_name: str, batch_size: int = 8, seq_lengt
     # Total memory estimates
     total_fp16 = model_memory_fp16 + activation_memory + kv_cache_memory + batch_data_memory + 2  # +2GB overhead
     total_fp32 = model_memory_fp32 + activation_memory + kv_cache_memory + batch_data_memory + 2
+    rule_fp16, rule_fp32 = total_fp16, total_fp32
+    
+    # Measured corrections replace the rule-of-thumb totals
+    calibrated, coefficients = load_calibration(hardware, calibration_path)
+    fp16 = _dtype_coefficients(coefficients, ('float16', 'bfloat16'))
+    if fp16:
+        total_fp16 = (model_memory_fp16 * fp16['weights_scale']
+                      + (activation_memory + kv_cache_memory) * fp16['activation_scale'] + fp16['overhead_gb'])
+    fp32 = _dtype_coefficients(coefficients, ('float32',))
+    if fp32:
+        total_fp32 = (model_memory_fp32 * fp32['weights_scale']
+                      + (activation_memory + kv_cache_memory) * fp32['activation_scale'] + fp32['overhead_gb'])
+    
+    # Measurements on other hardware say nothing about what fits an A100
+    a100_fp16, a100_fp32 = rule_fp16, rule_fp32
+    if calibrated and 'a100' in calibrated.lower():
+        a100_fp16, a100_fp32 = total_fp16, total_fp32
     
     return {
         'model': model_name,
-        'size': f"{info['size_str']} ({size_b}B params)",
+        'size': f"{size_str} ({size_b}B params)",
         'family': info['family'],
         'batch_size': batch_size,
         'seq_length': seq_length,
@@ -74,13 +212,16 @@ def estimate_memory_requirements(model_name: str, batch_size: int = 8, seq_lengt
         'kv_cache_memory_gb': round(kv_cache_memory, 2),
         'total_fp16_gb': round(total_fp16, 2),
         'total_fp32_gb': round(total_fp32, 2),
-        'fits_a100_40gb_fp16': total_fp16 <= 40,
-        'fits_a100_80gb_fp16': total_fp16 <= 80,
-        'fits_a100_40gb_fp32': total_fp32 <= 40,
-        'fits_a100_80gb_fp32': total_fp32 <= 80,
+        'fits_a100_40gb_fp16': a100_fp16 <= 40,
+        'fits_a100_80gb_fp16': a100_fp16 <= 80,
+        'fits_a100_40gb_fp32': a100_fp32 <= 40,
+        'fits_a100_80gb_fp32': a100_fp32 <= 80,
+        'calibrated': calibrated if (fp16 or fp32) else None,
     }
 
-def estimate_compute_time(model_name: str, dataset_size: int = 1000, batch_size: int = 8, seq_length: int = 512):
+def estimate_compute_time(model_name: str, dataset_size: int = 1000, batch_size: int = 8, seq_length: int = 512,
+                          size_b: float = None, hardware: str = None, dtype: str = 'float16',
+                          calibration_path: str = None):
     """
     Estimate compute time for perplexity evaluation.
     
@@ -88,16 +229,23 @@ def estimate_compute_time(model_name: str, dataset_size: int = 1000, batch_size:
     - Small models (0.5-3B): ~50-100 tokens/sec on A100
     - Medium models (7-14B): ~20-50 tokens/sec on A100
     - Large models (32B+): ~5-20 tokens/sec on A100
+    
+    With a calibration for `hardware` and `dtype` (see load_calibration),
+    the time per batch is predicted from measured throughput instead.
+    
+    Args:
+        size_b: Billions of parameters, if not in the model name
     """
     info = get_model_info(model_name)
     
-    if not info['size']:
+    if not size_b and not info['size']:
         return {
             'model': model_name,
             'note': 'Cannot estimate - check HuggingFace for model size'
         }
     
-    size_b = info['size']
+    size_b = size_b or info['size']
+    size_str = info['size_str'] or f"{size_b:g}B"
     
     # Rough tokens/sec estimates for A100
     if size_b <= 1:
@@ -118,12 +266,21 @@ def estimate_compute_time(model_name: str, dataset_size: int = 1000, batch_size:
     
     # Time estimates
     total_seconds = total_tokens / (tokens_per_sec * batch_size)
+    calibrated, coefficients = load_calibration(hardware, calibration_path)
+    measured = coefficients.get(dtype)
+    if measured:
+        num_batches = -(-dataset_size // batch_size)
+        seconds_per_batch = (measured['forward_overhead_seconds']
+                             + measured['seconds_per_token_per_b'] * batch_size * seq_length * size_b)
+        total_seconds = num_batches * seconds_per_batch
+        # Same convention as the tiers: tokens/sec per sequence in the batch
+        tokens_per_sec = total_tokens / total_seconds / batch_size
     total_minutes = total_seconds / 60
     total_hours = total_minutes / 60
     
     return {
         'model': model_name,
-        'size': f"{info['size_str']} ({size_b}B params)",
+        'size': f"{size_str} ({size_b}B params)",
         'dataset_size': dataset_size,
         'batch_size': batch_size,
         'seq_length': seq_length,
@@ -132,6 +289,7 @@ def estimate_compute_time(model_name: str, dataset_size: int = 1000, batch_size:
         'estimated_time_seconds': round(total_seconds, 1),
         'estimated_time_minutes': round(total_minutes, 1),
         'estimated_time_hours': round(total_hours, 2),
+        'calibrated': calibrated if measured else None,
     }
 
 if __name__ == '__main__':